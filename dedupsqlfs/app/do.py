@@ -10,11 +10,12 @@ Snapshot:
     statistic
 
 Data:
-    verify hashes
-    rehash with new hash alg @todo
+    verify hashes of stored blocks (scrub)
+    rehash with new hash alg
     defragment (gc, vacuum)
-    (de)compress file(s) and director(y|ies) @todo
-    change block size (need double free space) @todo
+    (de)compress file(s) and director(y|ies), or whole data store
+    change block size of file(s) and director(y|ies)
+    rebalance block data store into shard files
     statistic
 
 FS tune:
@@ -452,6 +453,176 @@ def data_defragment(options, _fuse):
     return 0
 
 
+def data_rebalance_blocks(options, _fuse):
+    """
+    @param options: Commandline options
+    @type  options: object
+
+    @param _fuse: FUSE wrapper
+    @type  _fuse: dedupsqlfs.fuse.dedupfs.DedupFS
+    """
+    _fuse.setOption("gc_umount_enabled", False)
+    _fuse.setOption("gc_vacuum_enabled", False)
+    _fuse.setOption("gc_enabled", False)
+    _fuse.setReadonly(True)
+
+    manager = _fuse.operations.getManager()
+    if manager.TYPE != 'sqlite':
+        _fuse.getLogger().error("Block store sharding is supported only by sqlite storage engine.")
+        _fuse.operations.destroy()
+        return 1
+
+    lvl = _fuse.getLogger().getEffectiveLevel()
+    _fuse.getLogger().setLevel(logging.INFO)
+    start_time = time()
+    moved = manager.rebalanceBlocks(options.rebalance_blocks)
+    _fuse.getLogger().info("Moved %d blocks into %d shard(s) in %.2f sec." % (
+        moved, options.rebalance_blocks, time() - start_time,))
+    _fuse.getLogger().setLevel(lvl)
+
+    _fuse.operations.destroy()
+    return 0
+
+
+def data_recompress(options, _fuse):
+    """
+    @param options: Commandline options
+    @type  options: object
+
+    @param _fuse: FUSE wrapper
+    @type  _fuse: dedupsqlfs.fuse.dedupfs.DedupFS
+    """
+    _fuse.setOption("gc_umount_enabled", False)
+    _fuse.setOption("gc_vacuum_enabled", False)
+    _fuse.setOption("gc_enabled", False)
+    _fuse.setOption("use_transactions", True)
+    _fuse.setReadonly(False)
+
+    lvl = _fuse.getLogger().getEffectiveLevel()
+    _fuse.getLogger().setLevel(logging.INFO)
+
+    from dedupsqlfs.fuse.recompress import Recompress
+    rc = Recompress(_fuse.operations, options.data_batch)
+    if options.recompress_all:
+        count = rc.recompressStore()
+    else:
+        subvol = constants.ROOT_SUBVOLUME_NAME
+        if options.subvol_selected:
+            subvol = options.subvol_selected.encode('utf8')
+        count = rc.recompressPath(subvol, options.recompress_path.encode('utf8'))
+
+    ret = 0
+    if count is False or rc.getErrorsCount():
+        ret = 1
+    elif count:
+        _fuse.getLogger().info("Run --vacuum to return space freed by recompression to filesystem.")
+    _fuse.getLogger().setLevel(lvl)
+
+    _fuse.operations.destroy()
+    return ret
+
+
+def data_verify(options, _fuse):
+    """
+    @param options: Commandline options
+    @type  options: object
+
+    @param _fuse: FUSE wrapper
+    @type  _fuse: dedupsqlfs.fuse.dedupfs.DedupFS
+    """
+    _fuse.setOption("gc_umount_enabled", False)
+    _fuse.setOption("gc_vacuum_enabled", False)
+    _fuse.setOption("gc_enabled", False)
+    _fuse.setReadonly(True)
+
+    lvl = _fuse.getLogger().getEffectiveLevel()
+    _fuse.getLogger().setLevel(logging.INFO)
+
+    from dedupsqlfs.fuse.verify import Verify
+    rate = None
+    if options.verify_rate:
+        rate = options.verify_rate * 1024 * 1024
+    v = Verify(_fuse.operations, options.data_batch, rate)
+    v.verifyStore()
+
+    ret = 0
+    if v.getCorruptedCount():
+        ret = 1
+    _fuse.getLogger().setLevel(lvl)
+
+    _fuse.operations.destroy()
+    return ret
+
+
+def data_rehash(options, _fuse):
+    """
+    @param options: Commandline options
+    @type  options: object
+
+    @param _fuse: FUSE wrapper
+    @type  _fuse: dedupsqlfs.fuse.dedupfs.DedupFS
+    """
+    _fuse.setOption("gc_umount_enabled", False)
+    _fuse.setOption("gc_vacuum_enabled", False)
+    _fuse.setOption("gc_enabled", False)
+    _fuse.setOption("use_transactions", True)
+    _fuse.setReadonly(False)
+
+    lvl = _fuse.getLogger().getEffectiveLevel()
+    _fuse.getLogger().setLevel(logging.INFO)
+
+    from dedupsqlfs.fuse.rehash import Rehash
+    rh = Rehash(_fuse.operations, options.data_batch)
+    count = rh.rehashStore(options.rehash_function)
+
+    ret = 0
+    if count is False or rh.getErrorsCount():
+        ret = 1
+    _fuse.getLogger().setLevel(lvl)
+
+    _fuse.operations.destroy()
+    return ret
+
+
+def data_rechunk(options, _fuse):
+    """
+    @param options: Commandline options
+    @type  options: object
+
+    @param _fuse: FUSE wrapper
+    @type  _fuse: dedupsqlfs.fuse.dedupfs.DedupFS
+    """
+    maximum = min(options.maximum_block_size, constants.BLOCK_SIZE_MAX)
+    if options.new_block_size < constants.BLOCK_SIZE_MIN or options.new_block_size > maximum:
+        _fuse.getLogger().error("New block size must be from %d to %d bytes!" % (constants.BLOCK_SIZE_MIN, maximum,))
+        return 1
+
+    _fuse.setOption("gc_umount_enabled", False)
+    _fuse.setOption("gc_vacuum_enabled", False)
+    _fuse.setOption("gc_enabled", False)
+    _fuse.setOption("use_transactions", True)
+    _fuse.setReadonly(False)
+
+    lvl = _fuse.getLogger().getEffectiveLevel()
+    _fuse.getLogger().setLevel(logging.INFO)
+
+    from dedupsqlfs.fuse.rechunk import Rechunk
+    rc = Rechunk(_fuse.operations, options.data_batch)
+
+    subvol = constants.ROOT_SUBVOLUME_NAME
+    if options.subvol_selected:
+        subvol = options.subvol_selected.encode('utf8')
+    count = rc.rechunkPath(subvol, options.rechunk_path.encode('utf8'), options.new_block_size)
+
+    ret = 0
+    if count is False or rc.getErrorsCount():
+        ret = 1
+    _fuse.getLogger().setLevel(lvl)
+
+    _fuse.operations.destroy()
+    return ret
+
+
 def do(options, compression_methods=None):
     from dedupsqlfs.fuse.dedupfs import DedupFS
     from dedupsqlfs.fuse.operations import DedupOperations
@@ -465,6 +636,10 @@ def do(options, compression_methods=None):
             options,
             use_ino=True, default_permissions=True, fsname="dedupsqlfs")
 
+        # Compressors must exist before preInit sets their levels
+        for modname in compression_methods:
+            _fuse.appendCompression(modname)
+
         _fuse.preInit()
 
         basePath = os.path.expanduser(_fuse.getOption("data"))
@@ -474,8 +649,7 @@ def do(options, compression_methods=None):
 
         _fuse.saveCompressionMethods(compression_methods)
 
-        for modname in compression_methods:
-            _fuse.appendCompression(modname)
+        ret = 0
 
         # Actions
 
@@ -545,10 +719,24 @@ def do(options, compression_methods=None):
         if options.vacuum:
             data_vacuum(options, _fuse)
 
+        if options.rebalance_blocks:
+            ret = data_rebalance_blocks(options, _fuse)
+
+        if options.recompress_path or options.recompress_all:
+            ret = data_recompress(options, _fuse)
+
+        if options.verify:
+            ret = data_verify(options, _fuse)
+
+        if options.rehash_function:
+            ret = data_rehash(options, _fuse)
+
+        if options.new_block_size:
+            ret = data_rechunk(options, _fuse)
+
         if options.print_stats:
             print_fs_stats(options, _fuse)
 
-        ret = 0
     except Exception:
         import traceback
         traceback.print_exc()
@@ -636,20 +824,24 @@ def main(): # {{{1
     data.add_argument('--check-tree-inodes', dest='check_tree_inodes', action='store_true', help="Check if inodes exists in fs tree on fs usage calculation. Applies to subvolume and snapshot stats calculation too.")
     data.add_argument('--defragment', dest='defragment', action='store_true', help="Defragment all stored data, do garbage collection.")
     data.add_argument('--vacuum', dest='vacuum', action='store_true', help="Like defragment, but force SQLite to 'vacuum' databases, MySQL to run OPTIMIZE on tables.")
-    data.add_argument('--new-block-size', dest='new_block_size', metavar='BYTES', default=constants.BLOCK_SIZE_DEFAULT, type=int, help="Specify the new block size in bytes. Defaults to 128kB. (@todo)")
+    data.add_argument('--new-block-size', dest='new_block_size', metavar='BYTES', type=int, help="Rewrite files under --rechunk-path with new block size in bytes. Block size is stored for every file which differs from filesystem one. Interrupted run continues on next call with same arguments, don't mount filesystem until it is finished.")
+    data.add_argument('--rechunk-path', dest='rechunk_path', metavar='PATH', default="/", help="File or directory to rewrite with --new-block-size. Path is inside subvolume selected by --select-subvol, @root by default. Defaults to '/' - whole subvolume.")
     data.add_argument('--maximum-block-size', dest='maximum_block_size', metavar='BYTES', default=constants.BLOCK_SIZE_MAX, type=int,
-                      help="R|Specify the maximum block size in bytes for defragmentation.\n Defaults to %dMB. (@todo)" % (constants.BLOCK_SIZE_MAX/1024/1024,))
+                      help="R|Specify the maximum block size in bytes allowed for --new-block-size.\n Defaults to %dMB." % (constants.BLOCK_SIZE_MAX/1024/1024,))
 
-    data.add_argument('--verify', dest='verify', action='store_true', help="Verify all stored data hashes. (@todo)")
+    data.add_argument('--rebalance-blocks', dest='rebalance_blocks', metavar='N', type=int, help="Move SQLite block data store into N shard files by ranges of hash ids. N=1 moves all data back into one file. Needs free space for copy of all block data.")
+    data.add_argument('--verify', dest='verify', action='store_true', help="Verify all stored blocks: decompress, hash again and compare with stored hash. Corrupted blocks are written to block_corrupted table. Interrupted run continues on next call. Use --multi-cpu to work on all CPUs.")
+    data.add_argument('--verify-rate', dest='verify_rate', metavar='MB', type=float, default=0, help="Limit reading of stored data by --verify to MB megabytes per second, to not slow down mounted filesystem. Defaults to 0 - no limit.")
+    data.add_argument('--data-batch', dest='data_batch', metavar='N', type=int, default=1024, help="Read and process N blocks at once on recompression, verification and rehash, N blocks of default size on change of block size. Defaults to 1024.")
 
     # Dynamically check for supported hashing algorithms.
-    msg = "Specify the hashing algorithm that will be used to recognize duplicate data blocks: one of %s"
     hash_functions = list({}.fromkeys([h.lower() for h in hashlib.algorithms_available]).keys())
     hash_functions.sort()
     work_hash_funcs = set(hash_functions) & constants.WANTED_HASH_FUCTIONS
-    msg %= ', '.join('%r' % fun for fun in work_hash_funcs)
-    msg += ". Defaults to 'sha1'. (@todo)"
-    data.add_argument('--rehash', dest='hash_function', metavar='FUNCTION', choices=hash_functions, default='sha1', help=msg)
+    msg = "Compute hashes of all stored blocks with new hashing algorithm and use it for new data: one of %s"
+    msg %= ', '.join('%r' % fun for fun in sorted(work_hash_funcs))
+    msg += ". Interrupted run continues on next call with same algorithm, don't mount filesystem until it is finished. Use --multi-cpu to work on all CPUs."
+    data.add_argument('--rehash', dest='rehash_function', metavar='FUNCTION', choices=sorted(work_hash_funcs), help=msg)
 
     grp_compress = parser.add_argument_group('Compression')
 
@@ -684,6 +876,7 @@ def main(): # {{{1
     grp_compress.add_argument('--force-compress', dest='compression_forced', action="store_true", help="Force compression even if resulting data is bigger than original.")
     grp_compress.add_argument('--minimal-compress-size', dest='compression_minimal_size', metavar='BYTES', type=int, default=1024, help="Minimal block data size for compression. Defaults to 1024 bytes. Value -1 means auto - per method absolute minimum. Do not compress if data size is less than BYTES long. If not forced to.")
     grp_compress.add_argument('--minimal-compress-ratio', dest='compression_minimal_ratio', metavar='RATIO', type=float, default=0.05, help="Minimal data compression ratio. Defaults to 0.05 (5%%). Do not compress if ratio is less than RATIO. If not forced to.")
+    grp_compress.add_argument('--compression-adaptive', dest='compression_adaptive', action="store_true", help="Don't try all compression methods on every block: use method that won on previous blocks of file, retry all only sometimes. Skip compression of data that looks random (jpeg, video, archives) by its entropy.")
 
     levels = (constants.COMPRESSION_LEVEL_DEFAULT, constants.COMPRESSION_LEVEL_FAST, constants.COMPRESSION_LEVEL_NORM, constants.COMPRESSION_LEVEL_BEST)
 
@@ -692,7 +885,8 @@ def main(): # {{{1
                             ', '.join('%r' % lvl for lvl in levels), constants.COMPRESSION_LEVEL_DEFAULT
                         ))
     # Do not want 'best' after help setup
-    grp_compress.add_argument('--recompress-path', dest='recompress_path', metavar='PATH', help="Compress file or entire directory with new compression method. (@todo)")
+    grp_compress.add_argument('--recompress-path', dest='recompress_path', metavar='PATH', help="Recompress blocks of file or entire directory with selected compression methods. Path is inside subvolume selected by --select-subvol, @root by default. '/' - whole subvolume. Only blocks stored with deprecated or not selected methods are processed. Interrupted run continues on next call with same arguments. Use --multi-cpu to work on all CPUs.")
+    grp_compress.add_argument('--recompress-all', dest='recompress_all', action="store_true", help="Like --recompress-path, but for all blocks of filesystem, shared by all subvolumes and snapshots.")
 
     # Dynamically check for supported compression programs
     compression_progs = [constants.COMPRESSION_PROGS_NONE]
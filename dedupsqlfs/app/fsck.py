@@ -44,6 +44,8 @@ def fuse_mount(options, compression_methods=None, hash_functions=None):
             _fuse.appendCompression(modname)
 
         _fuse.operations.init()
+        if options.rebuild_hash_filter:
+            _fuse.operations.rebuildHashFilter()
         _fuse.operations.destroy()
 
         ret = 0
@@ -89,6 +91,8 @@ def main(): # {{{1
     parser.add_argument('--name', dest='name', metavar='DATABASE', default="dedupsqlfs", help="Specify the name for the database directory in which metadata and blocks data is stored. Defaults to dedupsqlfs")
     parser.add_argument('--temp', dest='temp', metavar='DIRECTORY', help="Specify the location for the files in which temporary data is stored. By default honour TMPDIR environment variable value.")
 
+    parser.add_argument('--rebuild-hash-filter', dest='rebuild_hash_filter', action='store_true', help="Rebuild Bloom filter of block hashes from hash table.")
+
     parser.add_argument('--mount-subvolume', dest='subvolume', metavar='NAME', help="Use subvolume as root fs.")
 
     parser.add_argument('--memory-limit', dest='memory_limit', action='store_true', help="Use some lower values for less memory consumption.")
@@ -117,10 +117,16 @@ def main(): # {{{1
     msg = "Specify the hashing algorithm that will be used to recognize duplicate data blocks: one of %s"
     hash_functions = list({}.fromkeys([h.lower() for h in hashlib.algorithms_available]).keys())
     hash_functions.sort()
-    msg %= ', '.join('%r' % fun for fun in hash_functions)
+    work_hash_funcs = set(hash_functions) & constants.WANTED_HASH_FUCTIONS
+    msg %= ', '.join('%r' % fun for fun in sorted(work_hash_funcs))
     msg += ". Defaults to 'sha1'."
     parser.add_argument('--hash', dest='hash_function', metavar='FUNCTION', choices=hash_functions, default='sha1', help=msg)
 
+    parser.add_argument('--chunking', dest='chunking', metavar='METHOD', choices=constants.CHUNKINGS, default=constants.CHUNKING_DEFAULT, help="Split blocks into content-defined chunks before dedup" + option_stored_in_db + ". 'fastcdc' needs C module from lib-dynload/fastcdc, without it writes are limited to ~5 MB/s. Choices are: %s. Defaults to %r." % (", ".join(repr(m) for m in constants.CHUNKINGS), constants.CHUNKING_DEFAULT,))
+    parser.add_argument('--chunk-size', dest='chunk_size', metavar='BYTES', default=0, type=int, help="Average size of content-defined chunk, rounded down to power of 2" + option_stored_in_db + ". Defaults to 0 (1/4 of block size).")
+    parser.add_argument('--block-shards', dest='block_shards', metavar='N', default=constants.BLOCK_SHARDS_DEFAULT, type=int, help="Split SQLite block data store into N files by ranges of hash ids, so no single file grows too big" + option_stored_in_db + ". Use 'do.dedupsqlfs --rebalance-blocks' to change it later. Defaults to %i." % constants.BLOCK_SHARDS_DEFAULT)
+    parser.add_argument('--block-storage', dest='block_storage', metavar='TYPE', choices=constants.BLOCK_STORAGES, default=constants.BLOCK_STORAGE_DEFAULT, help="Where SQLite storage keeps block data: 'db' - rows of block table, 'pack' - appended to big pack files, database keeps only places of data. Pack files are not vacuumed, files with much removed data are rewritten by garbage collector" + option_stored_in_db + ". Defaults to %r." % constants.BLOCK_STORAGE_DEFAULT)
+
     # Dynamically check for supported compression methods.
     compression_methods = [constants.COMPRESSION_TYPE_NONE]
     compression_methods_cmd = [constants.COMPRESSION_TYPE_NONE]
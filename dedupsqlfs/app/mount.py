@@ -96,6 +96,8 @@ def main(): # {{{1
     generic.add_argument('--name', dest='name', metavar='DATABASE', default="dedupsqlfs", help="Specify the name for the database directory in which metadata and blocks data is stored. Defaults to dedupsqlfs")
     generic.add_argument('--temp', dest='temp', metavar='DIRECTORY', help="Specify the location for the files in which temporary data is stored. By default honour TMPDIR environment variable value.")
     generic.add_argument('-b', '--block-size', dest='block_size', metavar='BYTES', default=1024*128, type=int, help="Specify the maximum block size in bytes" + option_stored_in_db + ". Defaults to 128kB.")
+    generic.add_argument('--adaptive-block-size', dest='adaptive_block_size', metavar='BYTES', default=0, type=int, help="Store new files written sequentially from start past --adaptive-block-threshold in blocks of BYTES, 1-4MB is good choice. Small and randomly written files keep --block-size. Block size is stored per file, such files can't be read by versions without this option. Defaults to 0 (off).")
+    generic.add_argument('--adaptive-block-threshold', dest='adaptive_block_threshold', metavar='BYTES', default=4*1024*1024, type=int, help="Size of sequentially written file when it is moved to blocks of --adaptive-block-size. Defaults to 4MB.")
     generic.add_argument('--mount-subvolume', dest='mounted_subvolume', metavar='NAME', default=None, help="Use subvolume NAME as root fs.")
 
     generic.add_argument('--memory-limit', dest='memory_limit', action='store_true', help="Use some lower values for less memory consumption.")
@@ -124,13 +126,19 @@ def main(): # {{{1
         grp_data.add_argument('--table-engine', dest='table_engine', metavar='ENGINE',
                             choices=table_engines, default=table_engines[0],
                             help=msg)
+        grp_data.add_argument('--mysql-keepalive', dest='mysql_keepalive', metavar='SECONDS', type=int, default=0,
+                            help="Ping MySQL server before query if connection was idle for SECONDS, so it is not closed by server timeout. Lost connection is restored on error anyway. Defaults to 0 (off).")
 
     grp_data.add_argument('--no-transactions', dest='use_transactions', action='store_false', help="Don't use transactions when making multiple related changes, this might make the file system faster or slower (?).")
+    grp_data.add_argument('--sqlite-attach', dest='sqlite_attach', action='store_true', help="Open hash, block and index SQLite databases in one shared connection, so writes of cached blocks are commited in one transaction and page cache is shared. Attached databases use rollback journal instead of WAL. Not used with several block shards, they have own connections.")
+    grp_data.add_argument('--sqlite-exclusive-lock', dest='sqlite_exclusive_lock', action='store_true', help="Keep SQLite databases locked by mount process all the time. It saves some file locking calls, but tools like 'do.dedupsqlfs --verify' can't read filesystem while it is mounted.")
     grp_data.add_argument('--nosync', dest='synchronous', action='store_false', help="Disable SQLite's normal synchronous behavior which guarantees that data is written to disk immediately, because it slows down the file system too much (this means you might lose data when the mount point isn't cleanly unmounted).")
 
     grp_data.add_argument('--nogc-on-umount', dest='gc_umount_enabled', action='store_false', help="Disable garbage collection on umount operation (only do this when you've got disk space to waste or you know that nothing will be be deleted from the file system, which means little to no garbage will be produced).")
     grp_data.add_argument('--gc', dest='gc_enabled', action='store_true', help="Enable the periodic garbage collection. It degrades performance. Only do this when you don't have disk space to waste or you know that alot of data will be be deleted from the file system.")
     grp_data.add_argument('--gc-vacuum', dest='gc_vacuum_enabled', action='store_true', help="Enable data vacuum after the periodic garbage collection.")
+    grp_data.add_argument('--vacuum-step-pages', dest='vacuum_step_pages', metavar='N', type=int, default=256, help="Return up to N free pages of SQLite databases to filesystem every flush interval while no written data waits in cache. Works online for databases created with incremental auto-vacuum, older ones need full --gc-vacuum. Value 0 disables it. Defaults to 256.")
+    grp_data.add_argument('--warm-meta-cache', dest='warm_meta_cache', action='store_true', help="Keep names, tree nodes and inodes read in this mount in file on unmount and map it on next mount, so first walk over tree after remount don't wait for database. File is dropped if subvolume was changed in between.")
     grp_data.add_argument('--gc-fast', dest='gc_fast_enabled', action='store_true', help="Enable faster periodic garbage collection. Don't collect hash and block garbage.")
     grp_data.add_argument('--gc-interval', dest='gc_interval', metavar="N", type=int, default=60, help="Call garbage callector after Nth seconds on FUSE operations, if GC enabled. Defaults to 60.")
 
@@ -143,6 +151,12 @@ def main(): # {{{1
     msg += ". Defaults to 'sha1'."
     grp_data.add_argument('--hash', dest='hash_function', metavar='FUNCTION', choices=hash_functions, default='sha1', help=msg)
 
+    grp_data.add_argument('--chunking', dest='chunking', metavar='METHOD', choices=constants.CHUNKINGS, default=constants.CHUNKING_DEFAULT, help="Split blocks into content-defined chunks before dedup" + option_stored_in_db + ". 'fastcdc' needs C module from lib-dynload/fastcdc, without it writes are limited to ~5 MB/s. Choices are: %s. Defaults to %r." % (", ".join(repr(m) for m in constants.CHUNKINGS), constants.CHUNKING_DEFAULT,))
+    grp_data.add_argument('--chunk-size', dest='chunk_size', metavar='BYTES', default=0, type=int, help="Average size of content-defined chunk, rounded down to power of 2" + option_stored_in_db + ". Defaults to 0 (1/4 of block size).")
+    grp_data.add_argument('--block-shards', dest='block_shards', metavar='N', default=constants.BLOCK_SHARDS_DEFAULT, type=int, help="Split SQLite block data store into N files by ranges of hash ids, so no single file grows too big" + option_stored_in_db + ". Use 'do.dedupsqlfs --rebalance-blocks' to change it later. Defaults to %i." % constants.BLOCK_SHARDS_DEFAULT)
+    grp_data.add_argument('--block-storage', dest='block_storage', metavar='TYPE', choices=constants.BLOCK_STORAGES, default=constants.BLOCK_STORAGE_DEFAULT, help="Where SQLite storage keeps block data: 'db' - rows of block table, 'pack' - appended to big pack files, database keeps only places of data. Pack files are not vacuumed, files with much removed data are rewritten by garbage collector" + option_stored_in_db + ". Defaults to %r." % constants.BLOCK_STORAGE_DEFAULT)
+
+    grp_data.add_argument('--hash-filter', dest='use_hash_filter', action='store_true', help="Use Bloom filter, stored near databases, to skip hash table lookups for definitely new blocks. Rebuilt from hash table if missing or out of sync.")
     grp_data.add_argument('--collision-check', dest='collision_check_enabled', action='store_true', help="Check for hash collision on writed data.")
 
 
@@ -159,6 +173,8 @@ def main(): # {{{1
     grp_cache.add_argument('--cache-block-read-size', dest='cache_block_read_size', metavar='BYTES', type=int,
                         default=1024*1024*1024,
                         help="Readed cache for blocks: potential size in BYTES. Set to -1 for infinite. Defaults to 1024 MB.")
+    grp_cache.add_argument('--cache-block-segmented', dest='cache_block_segmented', action='store_true', help="Use segmented LRU for readed blocks: block protected from expire by size only after second access, so sequential reads don't push out hot blocks.")
+    grp_cache.add_argument('--read-ahead', dest='read_ahead_blocks', metavar='BLOCKS', type=int, default=16, help="Load next BLOCKS of sequentially readed file into read cache in one batch. Set to 0 to disable. Defaults to 16.")
     grp_cache.add_argument('--flush-interval', dest='flush_interval', metavar="SECONDS", type=int, default=5, help="Call expired cache callector every Nth seconds on FUSE operations. Defaults to 5.")
 
 
@@ -195,6 +211,7 @@ def main(): # {{{1
     grp_compress.add_argument('--force-compress', dest='compression_forced', action="store_true", help="Force compression even if resulting data is bigger than original.")
     grp_compress.add_argument('--minimal-compress-size', dest='compression_minimal_size', metavar='BYTES', type=int, default=1024, help="Minimal block data size for compression. Defaults to 1024 bytes. Value -1 means auto - per method absolute minimum. Do not compress if data size is less than BYTES long. If not forced to.")
     grp_compress.add_argument('--minimal-compress-ratio', dest='compression_minimal_ratio', metavar='RATIO', type=float, default=0.05, help="Minimal data compression ratio. Defaults to 0.05 (5%%). Do not compress if ratio is less than RATIO. If not forced to.")
+    grp_compress.add_argument('--compression-adaptive', dest='compression_adaptive', action="store_true", help="Don't try all compression methods on every block: use method that won on previous blocks of file, retry all only sometimes. Skip compression of data that looks random (jpeg, video, archives) by its entropy.")
 
     levels = (constants.COMPRESSION_LEVEL_DEFAULT, constants.COMPRESSION_LEVEL_FAST, constants.COMPRESSION_LEVEL_NORM, constants.COMPRESSION_LEVEL_BEST)
 
@@ -241,6 +258,8 @@ def main(): # {{{1
 
     grp_mount = parser.add_argument_group('Mounting')
     grp_mount.add_argument('-o', '--mountoption', help="specify mount option", action="append")
+    grp_mount.add_argument('--fuse-workers', dest='fuse_workers', metavar='NUMBER', type=int, default=1,
+                           help="Specify the number of FUSE worker threads. Blocks read from storage are decompressed in parallel by workers. Defaults to 1 (single thread).")
 
     grp_mount.add_argument('mountpoint', help="specify mount point")
 
@@ -0,0 +1,87 @@
+# -*- coding: utf8 -*-
+#
+# DB migration 001 by 2026-10-18
+#
+# Count references to hashes: index entries of all subvolumes and block chunk lists
+#
+__author__ = 'sergey'
+
+__NUMBER__ = 20261018001
+
+def run(manager):
+    """
+    :param manager: Database manager
+    :type  manager: dedupsqlfs.db.sqlite.manager.DbManager|dedupsqlfs.db.mysql.manager.DbManager
+    :return: bool
+    """
+
+    try:
+        table_rc = manager.getTable("hash_refcount")
+        """
+        :type table_rc: dedupsqlfs.db.sqlite.table.hash_refcount.TableHashRefcount |
+                        dedupsqlfs.db.mysql.table.hash_refcount.TableHashRefcount
+        """
+
+        manager.getLogger().info("Migration #%s" % (__NUMBER__,))
+
+        # Start from scratch if previous run failed
+        cur = table_rc.getCursor()
+        cur.execute("DELETE FROM `%s`" % table_rc.getName())
+
+        table_sv = manager.getTable("subvolume")
+        """
+        :type table_sv: dedupsqlfs.db.sqlite.table.subvolume.TableSubvolume |
+                        dedupsqlfs.db.mysql.table.subvolume.TableSubvolume
+        """
+
+        for subvol_id in table_sv.get_ids():
+
+            subvol = table_sv.get(subvol_id)
+
+            table_idx = manager.getTable("inode_hash_block_%s" % subvol["hash"])
+            """
+            :type table_idx: dedupsqlfs.db.sqlite.table.inode_hash_block.TableInodeHashBlock |
+                            dedupsqlfs.db.mysql.table.inode_hash_block.TableInodeHashBlock
+            """
+
+            table_rc.add_counts(table_idx.get_hash_id_counts())
+            table_idx.close()
+
+        table_chunk = manager.getTable("block_chunk")
+        table_rc.add_counts(table_chunk.get_chunk_id_counts())
+
+        # Hashes without references at all must be there too - they are garbage
+        table_hash = manager.getTable("hash")
+        countHashes = table_hash.get_count()
+        current = 0
+        curBlock = 0
+        maxCnt = 10000
+        while current < countHashes:
+            hashIds = table_hash.get_hash_ids(curBlock, curBlock + maxCnt)
+            curBlock += maxCnt
+            if not hashIds:
+                continue
+            current += len(hashIds)
+            table_rc.add_many((hash_id, 0,) for hash_id in hashIds)
+
+        table_rc.commit()
+
+    except Exception as e:
+        import traceback
+        manager.getLogger().error("Migration #%s error: %s" % (__NUMBER__, e,))
+        manager.getLogger().error("Migration #%s trace:\n%s" % (__NUMBER__, traceback.format_exc(),))
+        return False
+
+    table_opts = manager.getTable("option")
+
+    table_opts.getCursor()
+
+    mignumber = table_opts.get("migration")
+    if not mignumber:
+        table_opts.insert("migration", __NUMBER__)
+    else:
+        table_opts.update("migration", __NUMBER__)
+
+    table_opts.commit()
+
+    return True
@@ -3,14 +3,45 @@
 __author__ = 'sergey'
 
 import os
-from time import sleep
+from time import sleep, time
 from datetime import datetime
 import subprocess
 import pymysql
 import pymysql.err
 import pymysql.cursors
+from dedupsqlfs.lib import constants
 
-cursor_type = pymysql.cursors.DictCursor
+# Errors of lost connection to server: gone away, lost during query, broken pipe
+CONNECTION_LOST_CODES = (2006, 2013, 2055,)
+
+def execute_reconnecting(cursor, execute, query, args):
+    """
+    Reconnect and repeat statement once if connection to server is lost.
+    Only in autocommit mode - changes of open transaction are lost with connection.
+    """
+    try:
+        return execute(cursor, query, args)
+    except (pymysql.err.OperationalError, pymysql.err.InterfaceError) as e:
+        if isinstance(e, pymysql.err.OperationalError) and e.args[0] not in CONNECTION_LOST_CODES:
+            raise
+        conn = cursor.connection
+        if conn is None or not conn.autocommit_mode:
+            raise
+        conn.ping(reconnect=True)
+        return execute(cursor, query, args)
+
+class ReconnectingCursor( pymysql.cursors.DictCursor ):
+
+    def execute(self, query, args=None):
+        return execute_reconnecting(self, pymysql.cursors.DictCursor.execute, query, args)
+
+class ReconnectingTupleCursor( pymysql.cursors.Cursor ):
+
+    def execute(self, query, args=None):
+        return execute_reconnecting(self, pymysql.cursors.Cursor.execute, query, args)
+
+cursor_type = ReconnectingCursor
+tuple_cursor_type = ReconnectingTupleCursor
 
 class DbManager( object ):
 
@@ -30,6 +61,10 @@ class DbManager( object ):
 
     _conn = None
 
+    # Check connection if it was not used for N seconds, 0 - never
+    _keepalive = 0
+    _last_used = 0
+
     _log = None
 
     _mysqld_proc = None
@@ -131,6 +166,34 @@ class DbManager( object ):
         self._base_path = base_path
         return self
 
+    def setKeepalive(self, seconds):
+        self._keepalive = int(seconds or 0)
+        return self
+
+    def getKeepalive(self):
+        return self._keepalive
+
+    def setAttach(self, flag):
+        return self
+
+    def setExclusiveLock(self, flag=True):
+        return self
+
+    def getBlockStorage(self):
+        return constants.BLOCK_STORAGE_DB
+
+    def incrementalVacuum(self, pages):
+        return 0, 0
+
+    def beginWriteBatch(self):
+        return False
+
+    def commitWriteBatch(self, started):
+        return self
+
+    def rollbackWriteBatch(self, started):
+        return self
+
     def setBufferSize(self, in_bytes):
         self._buffer_size = in_bytes
         return self
@@ -201,6 +264,15 @@ class DbManager( object ):
             elif name == "hash_sizes":
                 from dedupsqlfs.db.mysql.table.hash_sizes import TableHashSizes
                 self._table[ name ] = TableHashSizes(self)
+            elif name == "block_chunk":
+                from dedupsqlfs.db.mysql.table.block_chunk import TableBlockChunk
+                self._table[ name ] = TableBlockChunk(self)
+            elif name == "block_corrupted":
+                from dedupsqlfs.db.mysql.table.block_corrupted import TableBlockCorrupted
+                self._table[ name ] = TableBlockCorrupted(self)
+            elif name == "hash_refcount":
+                from dedupsqlfs.db.mysql.table.hash_refcount import TableHashRefcount
+                self._table[ name ] = TableHashRefcount(self)
             elif name == "name_pattern_option":
                 from dedupsqlfs.db.mysql.table.name_pattern_option import TableNamePatternOption
                 self._table[ name ] = TableNamePatternOption(self)
@@ -538,6 +610,11 @@ class DbManager( object ):
 
         if nodb:
             conn = pymysql.connect(unix_socket=self.getSocket(), user=self.getUser(), passwd=self.getPassword())
+
+            cur = conn.cursor()
+            if not self.getAutocommit():
+                cur.execute("SET TRANSACTION ISOLATION LEVEL READ UNCOMMITTED")
+            cur.close()
         else:
 
             if self._conn:
@@ -547,26 +624,40 @@ class DbManager( object ):
             conv[246]=float     # convert decimals to floats
             conv[10]=str        # convert dates to strings
 
+            # Session setup is repeated by reconnect
+            init_command = None
+            if not self.getAutocommit():
+                init_command = "SET SESSION TRANSACTION ISOLATION LEVEL READ UNCOMMITTED"
+
             conn = self._conn = pymysql.connect(
                 unix_socket=self.getSocket(),
                 user=self.getUser(),
                 passwd=self.getPassword(),
                 db=self.getDbName(),
-                conv=conv
+                conv=conv,
+                init_command=init_command
             )
             self._conn.autocommit(self.getAutocommit())
-
-        cur = conn.cursor()
-        if not self.getAutocommit():
-            cur.execute("SET TRANSACTION ISOLATION LEVEL READ UNCOMMITTED")
-        cur.close()
+            self._last_used = time()
 
         return conn
 
-    def getCursor(self, new=False):
-        cur = self.getConnection().cursor(cursor_type)
-        cur = self.pingDb(cur)
-        return cur
+    def getCursor(self, new=False, tuples=False):
+        """
+        Connection is not checked on every call - lost connection
+        is restored by cursor on error, idle one checked by keepalive
+
+        @param tuples: fetch rows as tuples instead of dicts
+        """
+        conn = self.getConnection()
+        if self._keepalive:
+            now = time()
+            if now - self._last_used > self._keepalive:
+                conn.ping(reconnect=True)
+            self._last_used = now
+        if tuples:
+            return conn.cursor(tuple_cursor_type)
+        return conn.cursor(cursor_type)
 
     def pingServer(self):
         result = True
@@ -580,15 +671,6 @@ class DbManager( object ):
             result = False
         return result
 
-    def pingDb(self, cursor):
-        try:
-            cursor.execute('SELECT 1')
-        except BrokenPipeError:
-            self.closeConn()
-            cursor = self.getConnection().cursor(cursor_type)
-            pass
-        return cursor
-
     def hasDb(self, conn):
         cur = conn.cursor(cursor_type)
 
@@ -31,12 +31,16 @@ class Table( object ):
     _time_spent = None
     _op_count = None
 
+    # SQL of statements with table name in place
+    _statements = None
+
     def __init__(self, manager):
         if self._table_name is None:
             raise AttributeError("Define non-empty class variable '_table_name'")
         self._manager = manager
         self._time_spent = {}
         self._op_count = {}
+        self._statements = {}
         self._engine = manager.getTableEngine()
         pass
 
@@ -113,8 +117,22 @@ class Table( object ):
 
     def setName(self, tableName):
         self._table_name = tableName
+        self._statements = {}
         return self
 
+    def getStatement(self, key, sql):
+        """
+        Table name is put into SQL only once, statement is cached
+
+        @param key: statement name
+        @param sql: SQL with {table} in place of table name and %s for parameters
+        @rtype: str
+        """
+        stmt = self._statements.get(key)
+        if stmt is None:
+            stmt = self._statements[ key ] = sql.format(table=self.getName())
+        return stmt
+
     def getManager(self):
         """
         @rtype L{dedupsqlfs.db.mysql.manager.DbManager}
@@ -135,6 +153,12 @@ class Table( object ):
     def getCursor(self, new=False):
         return self.getManager().getCursor(new)
 
+    def getTupleCursor(self):
+        """
+        Rows are fetched as tuples, no dict is built for every row
+        """
+        return self.getManager().getCursor(tuples=True)
+
     def getPageSize(self):
         return 0
 
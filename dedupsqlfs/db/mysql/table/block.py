@@ -31,20 +31,32 @@ class TableBlock( Table ):
         :return: int
         """
         self.startTimer()
-        cur = self.getCursor()
+        cur = self.getTupleCursor()
 
         cur.execute(
-            "INSERT INTO `%s` " % self.getName()+
-            " (`hash_id`, `data`) VALUES (%(hash_id)s, %(data)s)",
-            {
-                'hash_id': hash_id,
-                'data': data,
-            }
+            self.getStatement("insert", "INSERT INTO `{table}` (`hash_id`, `data`) VALUES (%s, %s)"),
+            (hash_id, data,)
         )
         item = cur.lastrowid
         self.stopTimer('insert')
         return item
 
+    def insert_many( self, items ):
+        """
+        :param items: iterable of (hash_id, data)
+        :return: int
+        """
+        self.startTimer()
+        cur = self.getTupleCursor()
+
+        cur.executemany(
+            self.getStatement("insert", "INSERT INTO `{table}` (`hash_id`, `data`) VALUES (%s, %s)"),
+            [(hash_id, data,) for hash_id, data in items]
+        )
+        count = cur.rowcount
+        self.stopTimer('insert_many')
+        return count
+
     def update( self, hash_id, data):
         """
         :param data: bytes
@@ -65,6 +77,26 @@ class TableBlock( Table ):
         self.stopTimer('update')
         return count
 
+    def update_many( self, items ):
+        """
+        :param items: iterable of (hash_id, data)
+        :return: int
+        """
+        self.startTimer()
+        cur = self.getCursor()
+
+        cur.executemany(
+            "UPDATE `%s` " % self.getName()+
+            " SET `data`=%(data)s WHERE `hash_id`=%(hash_id)s",
+            [{
+                'data': data,
+                'hash_id': hash_id,
+            } for hash_id, data in items]
+        )
+        count = cur.rowcount
+        self.stopTimer('update_many')
+        return count
+
     def get( self, hash_id):
         """
         :param hash_id: int
@@ -73,16 +105,29 @@ class TableBlock( Table ):
         self.startTimer()
         cur = self.getCursor()
         cur.execute(
-            "SELECT * FROM `%s` " % self.getName()+
-            " WHERE `hash_id`=%(hash_id)s",
-            {
-                'hash_id': hash_id,
-            }
+            self.getStatement("get", "SELECT * FROM `{table}` WHERE `hash_id`=%s"),
+            (hash_id,)
         )
         item = cur.fetchone()
         self.stopTimer('get')
         return item
 
+    def get_many( self, id_str ):
+        """
+        :param id_str: comma separated hash ids
+        :return: dict { hash_id: data }
+        """
+        self.startTimer()
+        items = {}
+        if id_str:
+            cur = self.getTupleCursor()
+            cur.execute(self.getStatement("get_many", "SELECT `hash_id`, `data` FROM `{table}` WHERE `hash_id` IN ") +
+                        "(%s)" % (id_str,))
+            for hash_id, data in cur:
+                items[ hash_id ] = data
+        self.stopTimer('get_many')
+        return items
+
     def remove_by_ids(self, id_str):
         self.startTimer()
         count = 0
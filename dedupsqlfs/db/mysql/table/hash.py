@@ -25,18 +25,58 @@ class TableHash( Table ):
 
     def insert( self, value):
         self.startTimer()
-        cur = self.getCursor()
+        cur = self.getTupleCursor()
         cur.execute(
-            "INSERT INTO `%s` " %self.getName()+
-            " (`hash`) VALUES (%(value)s)",
-            {
-                'value': value
-            }
+            self.getStatement("insert", "INSERT INTO `{table}` (`hash`) VALUES (%s)"),
+            (value,)
         )
         item = cur.lastrowid
         self.stopTimer('insert')
         return item
 
+    def insert_many( self, values ):
+        """
+        Insert many hashes in one go
+
+        @param values: hash values
+        @type  values: list|tuple|set
+
+        @return: { hash value: hash id }
+        @rtype: dict
+        """
+        self.startTimer()
+        if values:
+            cur = self.getTupleCursor()
+            cur.executemany(
+                self.getStatement("insert", "INSERT INTO `{table}` (`hash`) VALUES (%s)"),
+                [(value,) for value in values]
+            )
+        self.stopTimer('insert_many')
+        return self.find_many(values)
+
+    def insert_many_missing( self, values ):
+        """
+        Insert hashes which are not in table yet, stored ones are skipped
+
+        @param values: hash values
+        @type  values: list|tuple|set
+
+        @return: ( { hash value: hash id }, set of inserted hash values )
+        @rtype: tuple
+        """
+        self.startTimer()
+        inserted = set()
+        cur = self.getTupleCursor()
+        for value in values:
+            cur.execute(
+                self.getStatement("insert_ignore", "INSERT IGNORE INTO `{table}` (`hash`) VALUES (%s)"),
+                (value,)
+            )
+            if cur.rowcount > 0:
+                inserted.add(value)
+        self.stopTimer('insert_many_missing')
+        return self.find_many(values), inserted
+
     def update( self, item_id, value ):
         """
         @return: count updated rows
@@ -58,36 +98,54 @@ class TableHash( Table ):
 
     def get( self, item_id ):
         self.startTimer()
-        cur = self.getCursor()
+        cur = self.getTupleCursor()
         cur.execute(
-            "SELECT `hash` FROM `%s` " % self.getName()+
-            " WHERE `id`=%(id)s",
-            {
-                'id': item_id
-            }
+            self.getStatement("get", "SELECT `hash` FROM `{table}` WHERE `id`=%s"),
+            (item_id,)
         )
         item = cur.fetchone()
         if item:
-            item = item["hash"]
+            item = item[0]
         self.stopTimer('get')
         return item
 
     def find( self, value ):
         self.startTimer()
-        cur = self.getCursor()
+        cur = self.getTupleCursor()
         cur.execute(
-            "SELECT `id` FROM `%s` " %self.getName()+
-            " WHERE `hash`=%(value)s",
-            {
-                'value': value
-            }
+            self.getStatement("find", "SELECT `id` FROM `{table}` WHERE `hash`=%s"),
+            (value,)
         )
         item = cur.fetchone()
         if item:
-            item = item["id"]
+            item = item[0]
         self.stopTimer('find')
         return item
 
+    def find_many( self, values ):
+        """
+        Find ids of many hashes, query by chunks
+
+        @param values: hash values
+        @type  values: list|tuple|set
+
+        @return: { hash value: hash id } - only found hashes
+        @rtype: dict
+        """
+        self.startTimer()
+        items = {}
+        values = tuple(values)
+        cur = self.getTupleCursor()
+        for i in range(0, len(values), 1000):
+            cur.execute(
+                self.getStatement("find_many", "SELECT `id`,`hash` FROM `{table}` WHERE `hash` IN %s"),
+                (values[i:i + 1000],)
+            )
+            for hash_id, hash_value in cur:
+                items[ bytes(hash_value) ] = hash_id
+        self.stopTimer('find_many')
+        return items
+
     def get_count(self):
         self.startTimer()
         cur = self.getCursor()
@@ -109,6 +167,74 @@ class TableHash( Table ):
         self.stopTimer('get_hash_ids')
         return nameIds
 
+    def get_hashes(self):
+        """
+        Iterate over all hash values, uses separate cursor
+
+        @rtype: generator
+        """
+        self.startTimer()
+        cur = self.getCursor(True)
+        cur.execute("SELECT `hash` FROM `%s`" % self.getName())
+        hashes = (bytes(item["hash"]) for item in cur)
+        self.stopTimer('get_hashes')
+        return hashes
+
+    def update_many( self, items ):
+        """
+        :param items: iterable of (id, hash value)
+        :return: int
+        """
+        self.startTimer()
+        cur = self.getCursor()
+        cur.executemany(
+            "UPDATE `%s` " % self.getName()+
+            " SET `hash`=%(value)s WHERE `id`=%(id)s",
+            [{
+                'value': value,
+                'id': item_id,
+            } for item_id, value in items]
+        )
+        count = cur.rowcount
+        self.stopTimer('update_many')
+        return count
+
+    def get_ids_after(self, after_id, limit):
+        """
+        Page of ids in ascending order
+
+        :return: list
+        """
+        self.startTimer()
+        cur = self.getCursor()
+        cur.execute(
+            "SELECT `id` FROM `%s` " % self.getName()+
+            " WHERE `id`>%(after)s ORDER BY `id` LIMIT %(limit)s",
+            {
+                "after": after_id,
+                "limit": limit
+            }
+        )
+        ids = [item["id"] for item in cur]
+        self.stopTimer('get_ids_after')
+        return ids
+
+    def get_many( self, id_str ):
+        """
+        :param id_str: comma separated hash ids
+        :return: dict { hash id: hash value }
+        """
+        self.startTimer()
+        items = {}
+        if id_str:
+            cur = self.getCursor()
+            cur.execute("SELECT `id`, `hash` FROM `%s` " % self.getName()+
+                        " WHERE `id` IN (%s)" % (id_str,))
+            for _i in cur:
+                items[ _i["id"] ] = bytes(_i["hash"])
+        self.stopTimer('get_many')
+        return items
+
     def remove_by_ids(self, id_str):
         self.startTimer()
         count = 0
@@ -0,0 +1,133 @@
+# -*- coding: utf8 -*-
+
+__author__ = 'sergey'
+
+from itertools import islice
+from dedupsqlfs.db.mysql.table import Table
+
+class TableHashRefcount( Table ):
+    """
+    Count of references to hash: index entries of all subvolumes
+    and entries of block chunk lists.
+    Hashes with zero count are garbage.
+    """
+
+    _table_name = "hash_refcount"
+
+    def create( self ):
+        c = self.getCursor()
+
+        # Create table
+        c.execute(
+            "CREATE TABLE IF NOT EXISTS `%s` (" % self.getName()+
+                "`hash_id` BIGINT UNSIGNED PRIMARY KEY, "+
+                "`refcount` BIGINT NOT NULL DEFAULT 0"+
+            ")"+
+            self._getCreationAppendString()
+        )
+
+        self.createIndexIfNotExists("refcount", ("refcount",))
+        return
+
+    def add_many( self, items ):
+        """
+        :param items: iterable of (hash_id, delta)
+        :return: int
+        """
+        self.startTimer()
+        cur = self.getCursor()
+
+        cur.executemany(
+            "INSERT INTO `%s` " % self.getName()+
+            " (`hash_id`, `refcount`) VALUES (%(hash_id)s, %(delta)s) "+
+            " ON DUPLICATE KEY UPDATE `refcount`=`refcount`+VALUES(`refcount`)",
+            [{
+                'hash_id': hash_id,
+                'delta': delta,
+            } for hash_id, delta in items]
+        )
+        count = cur.rowcount
+        self.stopTimer('add_many')
+        return count
+
+    def set_many( self, items ):
+        """
+        :param items: iterable of (hash_id, refcount)
+        :return: int
+        """
+        self.startTimer()
+        cur = self.getCursor()
+
+        cur.executemany(
+            "REPLACE INTO `%s` " % self.getName()+
+            " (`hash_id`, `refcount`) VALUES (%(hash_id)s, %(refcount)s)",
+            [{
+                'hash_id': hash_id,
+                'refcount': refcount,
+            } for hash_id, refcount in items]
+        )
+        count = cur.rowcount
+        self.stopTimer('set_many')
+        return count
+
+    def add_counts( self, counts, sign=1 ):
+        """
+        Add references of whole table in batches
+
+        :param counts: iterator of (hash_id, count)
+        :param sign: 1 - add references, -1 - remove them
+        :return: int
+        """
+        count = 0
+        while True:
+            items = [(hash_id, sign * cnt,) for hash_id, cnt in islice(counts, 10000)]
+            if not items:
+                break
+            count += self.add_many(items)
+        return count
+
+    def get( self, hash_id ):
+        self.startTimer()
+        cur = self.getCursor()
+        cur.execute(
+            "SELECT `refcount` FROM `%s` " % self.getName()+
+            " WHERE `hash_id`=%(hash_id)s",
+            {
+                'hash_id': hash_id,
+            }
+        )
+        item = cur.fetchone()
+        if item:
+            item = item["refcount"]
+        self.stopTimer('get')
+        return item
+
+    def get_unused_ids( self, limit ):
+        """
+        :return: set of hash ids without references
+        """
+        self.startTimer()
+        cur = self.getCursor()
+        cur.execute(
+            "SELECT `hash_id` FROM `%s` " % self.getName()+
+            " WHERE `refcount`<=0 LIMIT %(limit)s",
+            {
+                'limit': limit,
+            }
+        )
+        hashIds = set(item["hash_id"] for item in cur)
+        self.stopTimer('get_unused_ids')
+        return hashIds
+
+    def remove_by_ids(self, id_str):
+        self.startTimer()
+        count = 0
+        if id_str:
+            cur = self.getCursor()
+            cur.execute("DELETE FROM `%s` " % self.getName()+
+                        " WHERE `hash_id` IN (%s)" % (id_str,))
+            count = cur.rowcount
+        self.stopTimer('remove_by_ids')
+        return count
+
+    pass
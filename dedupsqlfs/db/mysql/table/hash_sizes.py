@@ -42,6 +42,27 @@ class TableHashSizes( Table ):
         self.stopTimer('insert')
         return item
 
+    def insert_many( self, items ):
+        """
+        :param items: iterable of (hash_id, writed_size, compressed_size)
+        :return: int
+        """
+        self.startTimer()
+        cur = self.getCursor()
+
+        cur.executemany(
+            "INSERT INTO `%s` " % self.getName()+
+            " (`hash_id`, `writed_size`, `compressed_size`) VALUES (%(id)s, %(ws)s, %(cs)s)",
+            [{
+                "id": hash_id,
+                "ws": writed_size,
+                "cs": compressed_size
+            } for hash_id, writed_size, compressed_size in items]
+        )
+        count = cur.rowcount
+        self.stopTimer('insert_many')
+        return count
+
     def update( self, hash_id, writed_size, compressed_size):
         """
         :return: int
@@ -63,6 +84,27 @@ class TableHashSizes( Table ):
         self.stopTimer('update')
         return count
 
+    def update_many( self, items ):
+        """
+        :param items: iterable of (hash_id, writed_size, compressed_size)
+        :return: int
+        """
+        self.startTimer()
+        cur = self.getCursor()
+
+        cur.executemany(
+            "UPDATE `%s` " % self.getName() +
+            " SET `compressed_size`=%(cs)s, `writed_size`=%(ws)s WHERE `hash_id`=%(id)s",
+            [{
+                "cs": compressed_size,
+                "ws": writed_size,
+                "id": hash_id
+            } for hash_id, writed_size, compressed_size in items]
+        )
+        count = cur.rowcount
+        self.stopTimer('update_many')
+        return count
+
     def get( self, hash_id):
         """
         :param hash_id: int
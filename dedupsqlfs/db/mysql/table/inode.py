@@ -63,24 +63,21 @@ class TableInode( Table ):
             return 0
 
         self.startTimer()
-        cur = self.getCursor()
-
-        query = "UPDATE `%s` SET " % self.getName()
-        params = ()
-        values = ()
-        for key in row_data.keys():
-            if key == "id":
-                continue
-            params += ("`%s`=%%s" % key,)
-            values += (row_data[key],)
+        cur = self.getTupleCursor()
 
-        if not values:
+        keys = tuple(key for key in row_data.keys() if key != "id")
+        if not keys:
+            self.stopTimer('update_data')
             return 0
 
-        query += ", ".join(params)
-        query += " WHERE id=%s"
+        values = tuple(row_data[key] for key in keys) + (inode_id,)
 
-        values += (inode_id,)
+        # Same sets of fields are updated again and again
+        stmt_key = ("update_data",) + keys
+        query = self._statements.get(stmt_key)
+        if query is None:
+            query = self.getStatement(stmt_key,
+                "UPDATE `{table}` SET " + ", ".join("`%s`=%%s" % key for key in keys) + " WHERE id=%s")
 
         cur.execute(query, values)
         item = cur.rowcount
@@ -91,11 +88,8 @@ class TableInode( Table ):
         self.startTimer()
         cur = self.getCursor()
         cur.execute(
-            "SELECT * FROM `%s` " % self.getName()+
-            " WHERE `id`=%(id)s",
-            {
-                "id": inode
-            }
+            self.getStatement("get", "SELECT * FROM `{table}` WHERE `id`=%s"),
+            (inode,)
         )
         item = cur.fetchone()
         self.stopTimer('get')
@@ -103,29 +97,23 @@ class TableInode( Table ):
 
     def get_mode(self, inode):
         self.startTimer()
-        cur = self.getCursor()
+        cur = self.getTupleCursor()
         cur.execute(
-            "SELECT `mode` FROM `%s` " % self.getName()+
-            " WHERE `id`=%(id)s",
-            {
-                "id": inode
-            }
+            self.getStatement("get_mode", "SELECT `mode` FROM `{table}` WHERE `id`=%s"),
+            (inode,)
         )
-        item = int(cur.fetchone()["mode"])
+        item = int(cur.fetchone()[0])
         self.stopTimer('get_mode')
         return item
 
     def get_size(self, inode):
         self.startTimer()
-        cur = self.getCursor()
+        cur = self.getTupleCursor()
         cur.execute(
-            "SELECT `size` FROM `%s` " % self.getName()+
-            " WHERE `id`=%(id)s",
-            {
-                "id": inode
-            }
+            self.getStatement("get_size", "SELECT `size` FROM `{table}` WHERE `id`=%s"),
+            (inode,)
         )
-        item = int(cur.fetchone()["size"])
+        item = int(cur.fetchone()[0])
         self.stopTimer('get_size')
         return item
 
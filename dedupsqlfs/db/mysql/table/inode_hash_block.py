@@ -32,40 +32,56 @@ class TableInodeHashBlock(Table):
 
     def insert(self, inode, block_number, hash_id, real_size=0):
         self.startTimer()
-        cur = self.getCursor()
+        cur = self.getTupleCursor()
         cur.execute(
-            "INSERT INTO `%s` " % self.getName() +
-            " (`inode_id`,`block_number`,`hash_id`,`real_size`) " +
-            " VALUES (%(inode)s, %(block)s, %(hash)s), %(size)s",
-            {
-                "inode": inode,
-                "block": block_number,
-                "hash": hash_id,
-                "size": real_size
-            }
+            self.getStatement("insert", "INSERT INTO `{table}` (`inode_id`,`block_number`,`hash_id`,`real_size`) VALUES (%s, %s, %s, %s)"),
+            (inode, block_number, hash_id, real_size,)
         )
         item = cur.lastrowid
         self.stopTimer('insert')
         return item
 
+    def insert_many(self, items):
+        """
+        :param items: iterable of (inode, block_number, hash_id, real_size)
+        :return: int
+        """
+        self.startTimer()
+        cur = self.getTupleCursor()
+        cur.executemany(
+            self.getStatement("insert", "INSERT INTO `{table}` (`inode_id`,`block_number`,`hash_id`,`real_size`) VALUES (%s, %s, %s, %s)"),
+            [(inode, block_number, hash_id, real_size,) for inode, block_number, hash_id, real_size in items]
+        )
+        count = cur.rowcount
+        self.stopTimer('insert_many')
+        return count
+
     def update(self, inode, block_number, new_hash_id, new_size):
         self.startTimer()
-        cur = self.getCursor()
+        cur = self.getTupleCursor()
         cur.execute(
-            "UPDATE `%s` " % self.getName() +
-            " SET `hash_id`=%(hash)s, `real_size`=%(size)s " +
-            " WHERE `inode_id`=%(inode)s AND `block_number`=%(block)s",
-            {
-                "hash": new_hash_id,
-                "size": new_size,
-                "inode": inode,
-                "block": block_number
-            }
+            self.getStatement("update", "UPDATE `{table}` SET `hash_id`=%s, `real_size`=%s WHERE `inode_id`=%s AND `block_number`=%s"),
+            (new_hash_id, new_size, inode, block_number,)
         )
         item = cur.rowcount
         self.stopTimer('update')
         return item
 
+    def update_many(self, items):
+        """
+        :param items: iterable of (inode, block_number, new_hash_id, new_size)
+        :return: int
+        """
+        self.startTimer()
+        cur = self.getTupleCursor()
+        cur.executemany(
+            self.getStatement("update", "UPDATE `{table}` SET `hash_id`=%s, `real_size`=%s WHERE `inode_id`=%s AND `block_number`=%s"),
+            [(new_hash_id, new_size, inode, block_number,) for inode, block_number, new_hash_id, new_size in items]
+        )
+        item = cur.rowcount
+        self.stopTimer('update_many')
+        return item
+
     def update_hash(self, inode, block_number, new_hash_id):
         self.startTimer()
         cur = self.getCursor()
@@ -118,31 +134,40 @@ class TableInodeHashBlock(Table):
         self.startTimer()
         cur = self.getCursor()
         cur.execute(
-            "SELECT `hash_id`,`real_size` FROM `%s` " % self.getName() +
-            " WHERE `inode_id`=%(inode)s AND `block_number`=%(block)s",
-            {
-                "inode": inode,
-                "block": block_number
-            }
+            self.getStatement("get", "SELECT `hash_id`,`real_size` FROM `{table}` WHERE `inode_id`=%s AND `block_number`=%s"),
+            (inode, block_number,)
         )
         item = cur.fetchone()
         self.stopTimer('get')
         return item
 
+    def get_by_inode_range(self, inode, first_block, last_block):
+        """
+        :return: dict { block_number: Row }
+        """
+        self.startTimer()
+        cur = self.getTupleCursor()
+        cur.execute(
+            self.getStatement("get_by_inode_range", "SELECT `block_number`,`hash_id`,`real_size` FROM `{table}` " +
+                              " WHERE `inode_id`=%s AND `block_number`>=%s AND `block_number`<=%s"),
+            (inode, first_block, last_block,)
+        )
+        items = {}
+        for block_number, hash_id, real_size in cur:
+            items[ block_number ] = {"hash_id": hash_id, "real_size": real_size}
+        self.stopTimer('get_by_inode_range')
+        return items
+
     def hash_by_inode_number(self, inode, block_number):
         self.startTimer()
-        cur = self.getCursor()
+        cur = self.getTupleCursor()
         cur.execute(
-            "SELECT `hash_id` FROM `%s` " % self.getName() +
-            " WHERE `inode_id`=%(inode)s AND `block_number`=%(block)s",
-            {
-                "inode": inode,
-                "block": block_number
-            }
+            self.getStatement("hash_by_inode_number", "SELECT `hash_id` FROM `{table}` WHERE `inode_id`=%s AND `block_number`=%s"),
+            (inode, block_number,)
         )
         item = cur.fetchone()
         if item:
-            item = item["hash_id"]
+            item = item[0]
         self.stopTimer('hash_by_inode_number')
         return item
 
@@ -165,7 +190,7 @@ class TableInodeHashBlock(Table):
         self.startTimer()
         cur = self.getCursor()
         cur.execute(
-            "SELECT block_number FROM `%s` " % self.getName() +
+            "SELECT block_number, hash_id FROM `%s` " % self.getName() +
             " WHERE `inode_id`=%(inode)s AND `block_number`>%(block)s",
             {
                 "inode": inode,
@@ -185,6 +210,26 @@ class TableInodeHashBlock(Table):
         self.stopTimer('delete_by_inode_number_more')
         return items
 
+    def get_hash_ids_after(self, after_id, limit):
+        """
+        Page of used ids in ascending order
+
+        :return: list
+        """
+        self.startTimer()
+        cur = self.getCursor()
+        cur.execute(
+            "SELECT DISTINCT `hash_id` FROM `%s` " % self.getName()+
+            " WHERE `hash_id`>%(after)s ORDER BY `hash_id` LIMIT %(limit)s",
+            {
+                "after": after_id,
+                "limit": limit
+            }
+        )
+        ids = [item["hash_id"] for item in cur]
+        self.stopTimer('get_hash_ids_after')
+        return ids
+
     def get_count_uniq_inodes(self):
         self.startTimer()
         cur = self.getCursor()
@@ -255,6 +300,63 @@ class TableInodeHashBlock(Table):
         self.stopTimer('remove_by_inodes')
         return count
 
+    def get_hash_ids_by_inodes(self, inode_ids):
+        """
+        :return: list of hash ids, one for every index entry
+        """
+        self.startTimer()
+        hashIds = []
+        id_str = ",".join(str(_id) for _id in inode_ids)
+        if id_str:
+            cur = self.getCursor()
+            cur.execute("SELECT `hash_id` FROM `%s` " % self.getName() +
+                        " WHERE `inode_id` IN (%s)" % (id_str,))
+            hashIds = [item["hash_id"] for item in cur]
+        self.stopTimer('get_hash_ids_by_inodes')
+        return hashIds
+
+    def count_by_hash_ids(self, id_str):
+        """
+        :return: dict { hash_id: count of entries }
+        """
+        self.startTimer()
+        counts = {}
+        if id_str:
+            cur = self.getCursor()
+            cur.execute("SELECT `hash_id`, COUNT(1) as `cnt` FROM `%s` " % self.getName()+
+                        " WHERE `hash_id` IN (%s) GROUP BY `hash_id`" % (id_str,))
+            for item in cur:
+                counts[ item["hash_id"] ] = item["cnt"]
+        self.stopTimer('count_by_hash_ids')
+        return counts
+
+    def remove_by_hash_ids(self, id_str):
+        """
+        :return: count of removed entries
+        """
+        self.startTimer()
+        count = 0
+        if id_str:
+            cur = self.getCursor()
+            cur.execute("DELETE FROM `%s` " % self.getName()+
+                        " WHERE `hash_id` IN (%s)" % (id_str,))
+            count = cur.rowcount
+        self.stopTimer('remove_by_hash_ids')
+        return count
+
+    def get_hash_id_counts(self):
+        """
+        Iterate over count of entries for every hash, uses separate cursor
+
+        :return: generator of (hash_id, count)
+        """
+        self.startTimer()
+        cur = self.getCursor(True)
+        cur.execute("SELECT `hash_id`, COUNT(1) as `cnt` FROM `%s` GROUP BY `hash_id`" % self.getName())
+        counts = ((item["hash_id"], item["cnt"],) for item in cur)
+        self.stopTimer('get_hash_id_counts')
+        return counts
+
     def get_hash_inode_ids(self):
         self.startTimer()
         cur = self.getCursor()
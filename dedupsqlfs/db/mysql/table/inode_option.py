@@ -96,6 +96,51 @@ class TableInodeOption( Table ):
         self.stopTimer('update_blockSize')
         return count
 
+    def set_block_size( self, inode, block_size ):
+        """
+        Insert or update block size of inode, compression is kept
+
+        @return: count changed rows
+        @rtype: int
+        """
+        self.startTimer()
+        cur = self.getCursor()
+        cur.execute(
+            "INSERT INTO `%s` " % self.getName()+
+            "(`inode`, `block_size`, `compression`) VALUES (%(inode)s, %(size)s, '') "+
+            " ON DUPLICATE KEY UPDATE `block_size`=VALUES(`block_size`)",
+            {
+                "inode": inode,
+                "size": block_size
+            }
+        )
+        count = cur.rowcount
+        self.stopTimer('set_block_size')
+        return count
+
+    def get_block_sizes( self ):
+        """
+        @return: dict {inode: block size}
+        """
+        self.startTimer()
+        cur = self.getCursor()
+        cur.execute("SELECT `inode`, `block_size` FROM `%s`" % self.getName())
+        sizes = dict((item["inode"], item["block_size"],) for item in cur)
+        self.stopTimer('get_block_sizes')
+        return sizes
+
+    def remove_by_inodes(self, inode_ids):
+        self.startTimer()
+        count = 0
+        id_str = ",".join(str(_id) for _id in inode_ids)
+        if id_str:
+            cur = self.getCursor()
+            cur.execute("DELETE FROM `%s` " % self.getName()+
+                        " WHERE `inode` IN (%s)" % (id_str,))
+            count = cur.rowcount
+        self.stopTimer('remove_by_inodes')
+        return count
+
     def get( self, inode ):
         """
         @param inode: int
@@ -164,6 +164,26 @@ class TableTree( Table ):
         self.stopTimer('get_children')
         return items
 
+    def get_name_ids_after(self, after_id, limit):
+        """
+        Page of used ids in ascending order
+
+        :return: list
+        """
+        self.startTimer()
+        cur = self.getCursor()
+        cur.execute(
+            "SELECT DISTINCT `name_id` FROM `%s` " % self.getName()+
+            " WHERE `name_id`>%(after)s ORDER BY `name_id` LIMIT %(limit)s",
+            {
+                "after": after_id,
+                "limit": limit
+            }
+        )
+        ids = [item["name_id"] for item in cur]
+        self.stopTimer('get_name_ids_after')
+        return ids
+
     def get_inodes_by_inodes(self, inode_ids):
         self.startTimer()
 
@@ -3,8 +3,10 @@
 __author__ = 'sergey'
 
 import os
+import json
 import shutil
 from dedupsqlfs.lib import constants
+from dedupsqlfs.lib.reflink import clone_file
 
 class DbManager( object ):
 
@@ -15,11 +17,36 @@ class DbManager( object ):
     _base_path = "/dev/shm/db"
     _autocommit = True
     _synchronous = True
+    # Hold file locks while connection is open, other processes can't read
+    _exclusive_lock = False
 
     _log = None
 
     _compression_prog = None
 
+    # Tables written together on flush of cached blocks,
+    # their databases can be attached to one shared connection
+    ATTACH_TABLES = (
+        "hash",
+        "block",
+        "hash_compression_type",
+        "hash_sizes",
+        "hash_refcount",
+        "block_chunk",
+        "inode_hash_block",
+        "inode_option",
+    )
+
+    # SQLITE_MAX_ATTACHED, can't be raised at runtime
+    ATTACH_LIMIT = 10
+
+    # Page cache for all attached databases
+    ATTACH_CACHE_SIZE = 256*1024*1024
+
+    _attach = False
+    _shared_conn = None
+    _attached = None
+
     tables = (
         "option",
         "tree",
@@ -47,6 +74,7 @@ class DbManager( object ):
         if not (synchronous is None):
             self._synchronous = synchronous == True
         self._table = {}
+        self._attached = {}
         pass
 
     def setLogger(self, logger):
@@ -63,6 +91,13 @@ class DbManager( object ):
     def getSynchronous(self):
         return self._synchronous
 
+    def setExclusiveLock(self, flag=True):
+        self._exclusive_lock = flag == True
+        return self
+
+    def getExclusiveLock(self):
+        return self._exclusive_lock
+
     def setAutocommit(self, flag=True):
         self._autocommit = flag == True
         return self
@@ -76,6 +111,16 @@ class DbManager( object ):
     def getTableEngine(self):
         return self
 
+    def setKeepalive(self, seconds):
+        return self
+
+    def setAttach(self, flag):
+        self._attach = flag == True
+        return self
+
+    def getAttach(self):
+        return self._attach
+
     def setBasepath(self, base_path):
         self._base_path = base_path
         return self
@@ -118,8 +163,17 @@ class DbManager( object ):
                 self._table[ name ] = TableLink(self)
                 self._table[ name ].setFileName(name)
             elif name == "block":
-                from dedupsqlfs.db.sqlite.table.block import TableBlock
-                self._table[ name ] = TableBlock(self)
+                self._recoverRebalance()
+                count, shardRange = self.getBlockShards()
+                if self.getBlockStorage() == constants.BLOCK_STORAGE_PACK:
+                    from dedupsqlfs.db.sqlite.table.block_pack import TableBlockPack
+                    self._table[ name ] = TableBlockPack(self)
+                elif count > 1:
+                    from dedupsqlfs.db.sqlite.table.block_shards import TableBlockShards
+                    self._table[ name ] = TableBlockShards(self, count, shardRange)
+                else:
+                    from dedupsqlfs.db.sqlite.table.block import TableBlock
+                    self._table[ name ] = TableBlock(self)
             elif name == "xattr":
                 from dedupsqlfs.db.sqlite.table.xattr import TableInodeXattr
                 self._table[ name ] = TableInodeXattr(self)
@@ -136,6 +190,15 @@ class DbManager( object ):
             elif name == "hash_sizes":
                 from dedupsqlfs.db.sqlite.table.hash_sizes import TableHashSizes
                 self._table[ name ] = TableHashSizes(self)
+            elif name == "block_chunk":
+                from dedupsqlfs.db.sqlite.table.block_chunk import TableBlockChunk
+                self._table[ name ] = TableBlockChunk(self)
+            elif name == "block_corrupted":
+                from dedupsqlfs.db.sqlite.table.block_corrupted import TableBlockCorrupted
+                self._table[ name ] = TableBlockCorrupted(self)
+            elif name == "hash_refcount":
+                from dedupsqlfs.db.sqlite.table.hash_refcount import TableHashRefcount
+                self._table[ name ] = TableHashRefcount(self)
             elif name == "name_pattern_option":
                 from dedupsqlfs.db.sqlite.table.name_pattern_option import TableNamePatternOption
                 self._table[ name ] = TableNamePatternOption(self)
@@ -175,6 +238,325 @@ class DbManager( object ):
         return self._table[ name ]
 
 
+    def canAttach(self, table):
+        """
+        Can table database be attached to shared connection?
+
+        Queries use unqualified table names, so only one database
+        with same table name can be attached.
+
+        @param table: Table object
+        @rtype: bool
+        """
+        if not self._attach:
+            return False
+        if table.getName() not in self.ATTACH_TABLES:
+            return False
+        if table.getName() in self._attached.values():
+            return False
+        if len(self._attached) >= self.ATTACH_LIMIT:
+            return False
+        # ATTACH is not allowed inside transaction
+        if self._shared_conn is not None and self._shared_conn.in_transaction:
+            return False
+        return True
+
+    def getSharedConnection(self):
+        if self._shared_conn is None:
+            import sqlite3
+            from dedupsqlfs.db.sqlite.row import dict_factory
+
+            db_dir = os.path.join(self.getBasePath(), self.getDbName())
+            if not os.path.exists(db_dir):
+                os.makedirs(db_dir)
+
+            # Main database must be a file with rollback journal,
+            # only then commit is atomic for all attached databases
+            conn = sqlite3.connect(os.path.join(db_dir, "shared.sqlite3"), check_same_thread=False)
+
+            conn.row_factory = dict_factory
+            conn.text_factory = bytes
+
+            # Applies to attached databases too
+            if self.getExclusiveLock():
+                conn.execute('PRAGMA locking_mode=EXCLUSIVE')
+            conn.execute("PRAGMA temp_store=FILE")
+            conn.execute("PRAGMA journal_mode=TRUNCATE")
+
+            if not self.getAutocommit():
+                conn.execute("PRAGMA read_uncommitted=ON")
+                conn.isolation_level = "DEFERRED"
+            else:
+                conn.isolation_level = None
+
+            self._shared_conn = conn
+        return self._shared_conn
+
+    def attach(self, table):
+        """
+        Attach table database to shared connection
+
+        @param table: Table object
+        @return: shared connection
+        """
+        conn = self.getSharedConnection()
+
+        schema = table.getFileName()
+        conn.execute("ATTACH DATABASE ? AS `%s`" % schema, (table.getDbFilePath(),))
+
+        # WAL makes transactions atomic only for each database file
+        conn.execute("PRAGMA `%s`.journal_mode=TRUNCATE" % schema)
+        if not self.getSynchronous():
+            conn.execute("PRAGMA `%s`.synchronous=OFF" % schema)
+        else:
+            conn.execute("PRAGMA `%s`.synchronous=NORMAL" % schema)
+        conn.execute("PRAGMA `%s`.max_page_count=2147483646" % schema)
+        # Negative value is in KiB
+        conn.execute("PRAGMA `%s`.cache_size=%i" % (schema, -(self.ATTACH_CACHE_SIZE / 1024 / self.ATTACH_LIMIT)))
+
+        self._attached[ schema ] = table.getName()
+        return conn
+
+    def detach(self, table):
+        """
+        Detach table database, shared connection is closed after last one
+
+        @param table: Table object
+        """
+        schema = table.getFileName()
+        conn = self._shared_conn
+        if conn is None or schema not in self._attached:
+            return self
+
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute("DETACH DATABASE `%s`" % schema)
+        del self._attached[ schema ]
+
+        if not self._attached:
+            conn.close()
+            self._shared_conn = None
+        return self
+
+    def beginWriteBatch(self):
+        """
+        Start one transaction for all attached databases
+
+        @return: transaction is started here and must be commited by commitWriteBatch
+        @rtype: bool
+        """
+        conn = self._shared_conn
+        if conn is None or conn.in_transaction:
+            return False
+        conn.execute("BEGIN")
+        return True
+
+    def commitWriteBatch(self, started):
+        if started and self._shared_conn is not None:
+            self._shared_conn.commit()
+        return self
+
+    def rollbackWriteBatch(self, started):
+        if started and self._shared_conn is not None:
+            self._shared_conn.rollback()
+        return self
+
+    def _getStoredOption(self, name, default):
+        # Don't create storage files by check of layout
+        tableOption = self.getTable("option", True)
+        if not os.path.isfile(tableOption.getDbFilePath()):
+            return default
+        if not tableOption.hasTable():
+            return default
+        value = tableOption.get(name)
+        if value is None:
+            return default
+        return value
+
+    def _setBlockOptions(self, options):
+        tableOption = self.getTable("option")
+        for name, value in options:
+            if tableOption.get(name) is None:
+                tableOption.insert(name, value)
+            else:
+                tableOption.update(name, value)
+        tableOption.commit()
+
+        # Table is opened with new layout on next use
+        if "block" in self._table:
+            self._table.pop("block").close(True)
+        return self
+
+    def getBlockShards(self):
+        """
+        Layout of block data store, saved in option table
+
+        @return: (count of shard files, range of hash ids in one shard)
+        @rtype: tuple
+        """
+        count = self._getStoredOption("block_shards", constants.BLOCK_SHARDS_DEFAULT)
+        shardRange = self._getStoredOption("block_shard_range", constants.BLOCK_SHARD_RANGE_DEFAULT)
+        return int(count), int(shardRange)
+
+    def setBlockShards(self, count, shardRange):
+        return self._setBlockOptions((
+            ("block_shards", "%i" % count,),
+            ("block_shard_range", "%i" % shardRange,),
+        ))
+
+    def getBlockStorage(self):
+        """
+        @return: one of constants.BLOCK_STORAGES
+        @rtype: str
+        """
+        return self._getStoredOption("block_storage", constants.BLOCK_STORAGE_DEFAULT)
+
+    def setBlockStorage(self, storage):
+        if storage not in constants.BLOCK_STORAGES:
+            raise ValueError("Unknown block storage %r" % storage)
+        return self._setBlockOptions((("block_storage", storage,),))
+
+    def _getBlockFiles(self, count, shardRange, fileName=None):
+        """
+        Tables of block store layout, used for paths of their files
+
+        @rtype: list
+        """
+        from dedupsqlfs.db.sqlite.table.block import TableBlock
+        from dedupsqlfs.db.sqlite.table.block_shards import TableBlockShards
+
+        if count > 1:
+            return TableBlockShards(self, count, shardRange, fileName).getShards()
+        t = TableBlock(self)
+        if fileName:
+            t.setFileName(fileName)
+        return [t]
+
+    def _recoverRebalance(self):
+        """
+        Finish swap of block files interrupted by crash
+        """
+        value = self._getStoredOption("block_rebalance", "")
+        if not value:
+            return self
+        self.getLogger().warning("Rebalance of block store was interrupted, finish it.")
+        return self._finishRebalance(json.loads(value))
+
+    def _finishRebalance(self, state):
+        """
+        Put copied block files in place of old ones.
+        Copy is complete when state is saved, so every step can be repeated:
+        old files are renamed only while no new file is in place,
+        new layout is saved last, after old files are removed.
+
+        @param state: dict with old and new count and range of shards
+        """
+        oldPaths = [t.getDbFilePath() for t in self._getBlockFiles(state["old_count"], state["old_range"])]
+        newPaths = [t.getDbFilePath() for t in self._getBlockFiles(state["count"], state["range"], "block_new")]
+        finalPaths = [t.getDbFilePath() for t in self._getBlockFiles(state["count"], state["range"])]
+
+        # Old and new shard names may be same
+        if all(os.path.isfile(path) for path in newPaths):
+            for path in oldPaths:
+                if os.path.isfile(path):
+                    os.rename(path, path + ".old")
+
+        for path, finalPath in zip(newPaths, finalPaths):
+            if os.path.isfile(path):
+                os.rename(path, finalPath)
+
+        for path in oldPaths:
+            if os.path.isfile(path + ".old"):
+                os.unlink(path + ".old")
+
+        return self._setBlockOptions((
+            ("block_shards", "%i" % state["count"],),
+            ("block_shard_range", "%i" % state["range"],),
+            ("block_rebalance", "",),
+        ))
+
+    def rebalanceBlocks(self, count, shardRange=None):
+        """
+        Move block data into new set of shard files.
+        Needs free space for copy of all data, old files are removed
+        only after everything is copied. Swap of files interrupted
+        by crash is finished on next open of block store.
+
+        @param count: New count of shard files, 1 - one block file
+        @param shardRange: Count of sequential hash ids in one shard
+        @return: count of moved blocks
+        """
+        from dedupsqlfs.db.sqlite.table.block import TableBlock
+        from dedupsqlfs.db.sqlite.table.block_shards import TableBlockShards
+
+        if shardRange is None:
+            shardRange = constants.BLOCK_SHARD_RANGE_DEFAULT
+        if count < 1 or count > constants.BLOCK_SHARDS_MAX:
+            raise ValueError("Count of block shards must be in range 1..%d!" % constants.BLOCK_SHARDS_MAX)
+
+        if self.getBlockStorage() != constants.BLOCK_STORAGE_DB:
+            raise ValueError("Only block store in database can be sharded!")
+
+        tableOld = self.getTable("block")
+
+        oldCount, oldRange = self.getBlockShards()
+        if (oldCount, oldRange,) == (count, shardRange,) or (oldCount == count == 1):
+            self.getLogger().info("Block store already has %d shard(s), nothing to do." % count)
+            return 0
+
+        if oldCount > 1:
+            sources = tableOld.getShards()
+        else:
+            sources = [tableOld]
+
+        # New files get temporary names - old and new shard names may be same
+        if count > 1:
+            tableNew = TableBlockShards(self, count, shardRange, "block_new")
+            targets = tableNew.getShards()
+        else:
+            tableNew = TableBlock(self)
+            tableNew.setFileName("block_new")
+            targets = [tableNew]
+
+        # Copy is commited by pages, not by every row
+        autocommit = self._autocommit
+        self._autocommit = False
+        try:
+            for t in targets:
+                t.drop()
+            tableNew.create()
+
+            moved = 0
+            pageSize = 1000
+            for t in sources:
+                last_id = -1
+                while True:
+                    items = t.get_items_after(last_id, pageSize)
+                    if not items:
+                        break
+                    tableNew.insert_many(items)
+                    tableNew.commit()
+                    moved += len(items)
+                    last_id = items[-1][0]
+                    self.getLogger().debug("Rebalance blocks: moved %d" % moved)
+        except:
+            # Old files are not changed, partial copy is removed
+            tableNew.drop()
+            raise
+        finally:
+            tableNew.close(True)
+            self._autocommit = autocommit
+
+        state = {
+            "old_count": oldCount, "old_range": oldRange,
+            "count": count, "range": shardRange,
+        }
+        # From here interrupted swap is finished on next open
+        self._setBlockOptions((("block_rebalance", json.dumps(state),),))
+        self._finishRebalance(state)
+
+        return moved
+
     def begin(self):
         for name, t in self._table.items():
             t.begin()
@@ -196,6 +578,22 @@ class DbManager( object ):
             sz += t.vacuum()
         return sz
 
+    def incrementalVacuum(self, pages):
+        """
+        Reclaim free pages of opened tables, a few at a time
+
+        @param pages: Maximum count of pages to reclaim
+        @return: (reclaimed pages, reclaimable pages left)
+        @rtype: tuple
+        """
+        freed = 0
+        left = 0
+        for name, t in self._table.items():
+            if freed < pages:
+                freed += t.incrementalVacuum(pages - freed)
+            left += t.getReclaimablePages()
+        return freed, left
+
     def close(self):
         for name, t in self._table.items():
             t.close()
@@ -253,7 +651,8 @@ class DbManager( object ):
 
     def copy(self, oldTableName, newTableName, compress=False):
         """
-        Copy table file for subvolume
+        Copy table file for subvolume.
+        File is cloned if filesystem can do copy-on-write, data is copied otherwise.
 
         @param oldTableName:    Old table name
         @param newTableName:    New table name
@@ -264,10 +663,15 @@ class DbManager( object ):
         t1 = self.getTable(oldTableName, True)
         t2 = self.getTable(newTableName, True)
 
-        t1.create()
+        if not t1.hasTable():
+            t1.create()
         t1.close()
 
-        shutil.copyfile(t1.getDbFilePath(), t2.getDbFilePath())
+        if clone_file(t1.getDbFilePath(), t2.getDbFilePath()):
+            # Compressed copy would not share data with source
+            compress = False
+        else:
+            shutil.copyfile(t1.getDbFilePath(), t2.getDbFilePath())
 
         if compress:
             if os.path.getsize(t2.getDbFilePath()) > 1024*1024:
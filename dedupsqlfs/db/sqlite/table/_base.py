@@ -6,6 +6,7 @@ from time import time
 import os
 import sys
 import subprocess
+import sqlite3
 
 from dedupsqlfs.db.sqlite.row import dict_factory
 from dedupsqlfs.log import logging
@@ -18,6 +19,9 @@ class Table( object ):
     _conn = None
     _curr = None
 
+    # Name of database in shared connection if attached
+    _schema = None
+
     _db_file_path = None
     _table_name = None
     _table_file_name = None
@@ -33,6 +37,17 @@ class Table( object ):
     # default start page size for SQLite db file
     _page_size = 512
 
+    # SQLITE_MAX_VARIABLE_NUMBER is 999 on older builds
+    _max_vars = 500
+
+    # INSERT ... ON CONFLICT DO UPDATE is supported since SQLite 3.24
+    _has_upsert = sqlite3.sqlite_version_info >= (3, 24, 0)
+
+    # PRAGMA auto_vacuum values
+    AUTO_VACUUM_NONE = 0
+    AUTO_VACUUM_FULL = 1
+    AUTO_VACUUM_INCREMENTAL = 2
+
     _compressed = False
 
     _compressed_prog = None
@@ -213,6 +228,25 @@ class Table( object ):
         return True
 
     def connect( self ):
+        self._connectFile()
+
+        manager = self.getManager()
+        if manager.canAttach(self):
+            # Unqualified CREATE on shared connection goes to its main database,
+            # so table is created in own file before attach
+            if not self.hasTable():
+                self.create()
+            if self._curr:
+                self._curr.close()
+                self._curr = None
+            self._conn.commit()
+            self._conn.close()
+
+            self._conn = manager.attach(self)
+            self._schema = self.getFileName()
+        return
+
+    def _connectFile( self ):
         import sqlite3
 
         db_path = self.getDbFilePath()
@@ -231,13 +265,15 @@ class Table( object ):
 
         cacheSize = 64*1024*1024 / pageSize
 
-        conn = sqlite3.connect(db_path)
+        # FUSE worker threads use connection in turn, under llfuse global lock
+        conn = sqlite3.connect(db_path, check_same_thread=False)
 
         conn.row_factory = dict_factory
         conn.text_factory = bytes
 
-        # We don't expect many connections here
-        conn.execute('PRAGMA locking_mode=EXCLUSIVE')
+        # Other processes, like do --verify, can't read file with exclusive lock
+        if self.getManager().getExclusiveLock():
+            conn.execute('PRAGMA locking_mode=EXCLUSIVE')
         if not self.getManager().getSynchronous():
             conn.execute("PRAGMA synchronous=OFF")
         else:
@@ -246,6 +282,9 @@ class Table( object ):
         conn.execute("PRAGMA temp_store=FILE")
         conn.execute("PRAGMA max_page_count=2147483646")
         conn.execute("PRAGMA page_size=%i" % pageSize)
+        if isNew:
+            # Free pages can be reclaimed online, only before first table is created
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
         conn.execute("PRAGMA cache_size=%i" % cacheSize)
         conn.execute("PRAGMA journal_mode=WAL")
 
@@ -275,18 +314,60 @@ class Table( object ):
             cur = self._curr = self.getConnection().cursor()
         return cur
 
+    def _schemaPrefix(self):
+        if self._schema:
+            return "`%s`." % self._schema
+        return ""
+
     def getPageSize(self):
-        result = self.getConnection().execute('PRAGMA page_size').fetchone()
+        result = self.getConnection().execute('PRAGMA %spage_size' % self._schemaPrefix()).fetchone()
         # print("%s::getPageSize()=%r" % (self.getName(), result,))
         return result["page_size"]
 
     def getPageCount(self):
-        result = self.getConnection().execute('PRAGMA page_count').fetchone()
+        result = self.getConnection().execute('PRAGMA %spage_count' % self._schemaPrefix()).fetchone()
         # print("%s::getPageCount()=%r" % (self.getName(), result,))
         return result["page_count"]
 
+    def getAutoVacuum(self):
+        result = self.getConnection().execute('PRAGMA %sauto_vacuum' % self._schemaPrefix()).fetchone()
+        return result["auto_vacuum"]
+
+    def getReclaimablePages(self):
+        """
+        Count of free pages which incremental vacuum can return to filesystem.
+        Tables not opened yet are not touched.
+
+        :return: int
+        """
+        if self._conn is None:
+            return 0
+        if self.getAutoVacuum() != self.AUTO_VACUUM_INCREMENTAL:
+            return 0
+        result = self._conn.execute('PRAGMA %sfreelist_count' % self._schemaPrefix()).fetchone()
+        return result["freelist_count"]
+
+    def incrementalVacuum(self, pages=0):
+        """
+        Reclaim free pages without rewrite of database file, table stays usable
+
+        :param pages: int - how many pages to reclaim, 0 - all
+        :return: int - count of reclaimed pages
+        """
+        before = self.getReclaimablePages()
+        if not before:
+            return 0
+        # Changes of open transaction would be commited
+        if self._conn.in_transaction:
+            return 0
+        self.startTimer()
+        # Page is freed on every step of pragma, execute() does only one
+        self._conn.executescript('PRAGMA %sincremental_vacuum(%i);' % (self._schemaPrefix(), pages,))
+        self.stopTimer("incremental_vacuum")
+        return before - self.getReclaimablePages()
+
     def hasTable(self):
-        result = self.getConnection().execute("SELECT name FROM sqlite_master WHERE type = 'table';").fetchall()
+        result = self.getConnection().execute("SELECT name FROM %ssqlite_master WHERE type = 'table';" % self._schemaPrefix()).fetchall()
         has = False
         for item in result:
             if item["name"].decode() == self.getName():
@@ -301,7 +382,7 @@ class Table( object ):
         :type  fname: str
         :return: bool
         """
-        result = self.getConnection().execute("PRAGMA table_info('%s');" % self.getName()).fetchall()
+        result = self.getConnection().execute("PRAGMA %stable_info('%s');" % (self._schemaPrefix(), self.getName(),)).fetchall()
         has = False
         for item in result:
             if item["name"].decode() == fname:
@@ -334,6 +415,9 @@ class Table( object ):
 
     def begin( self ):
         if not self.getManager().getAutocommit():
+            # Shared connection may be in transaction already
+            if self.getConnection().in_transaction:
+                return self
             cur = self.getCursor()
             cur.execute("BEGIN")
         return self
@@ -383,7 +467,7 @@ class Table( object ):
         p2 = subprocess.Popen([
             "sqlite3",
             "-cmd",
-            "PRAGMA page_size=%i; PRAGMA synchronous=OFF; PRAGMA max_page_count=2147483646;" % pageSize,
+            "PRAGMA page_size=%i; PRAGMA auto_vacuum=INCREMENTAL; PRAGMA synchronous=OFF; PRAGMA max_page_count=2147483646;" % pageSize,
             fn
         ], stdin=p1.stdout, stdout=open(os.devnull,"w"))
 
@@ -422,7 +506,11 @@ class Table( object ):
             self._curr.close()
             self._curr = None
         if self._conn:
-            self._conn.close()
+            if self._schema:
+                self.getManager().detach(self)
+                self._schema = None
+            else:
+                self._conn.close()
             self._conn = None
         if not nocompress:
             self._compress()
@@ -446,8 +534,8 @@ class Table( object ):
         cur = self.getCursor()
 
         cur.execute(
-            "PRAGMA index_info(`%s`);" %
-            (self.getName()+"_" + indexName,)
+            "PRAGMA %sindex_info(`%s`);" %
+            (self._schemaPrefix(), self.getName()+"_" + indexName,)
         )
         row = cur.fetchone()
 
@@ -475,7 +563,7 @@ class Table( object ):
             _f = ",".join(_f)
 
             cur.execute(
-                "CREATE "+_u+" INDEX `%s` " % (self.getName() + "_" + indexName)+
+                "CREATE "+_u+" INDEX %s`%s` " % (self._schemaPrefix(), self.getName() + "_" + indexName,)+
                 " ON `%s` " % self.getName()+
                 "("+_f+")")
 
@@ -40,6 +40,19 @@ class TableBlock( Table ):
         self.stopTimer('insert')
         return item
 
+    def insert_many( self, items ):
+        """
+        :param items: iterable of (hash_id, data)
+        :return: int
+        """
+        self.startTimer()
+        cur = self.getCursor()
+        cur.executemany("INSERT INTO `%s`(hash_id, data) VALUES (?,?)" % self._table_name,
+                        ((hash_id, sqlite3.Binary(data),) for hash_id, data in items))
+        count = cur.rowcount
+        self.stopTimer('insert_many')
+        return count
+
     def update( self, hash_id, data):
         """
         :param data: bytes
@@ -56,6 +69,19 @@ class TableBlock( Table ):
         self.stopTimer('update')
         return count
 
+    def update_many( self, items ):
+        """
+        :param items: iterable of (hash_id, data)
+        :return: int
+        """
+        self.startTimer()
+        cur = self.getCursor()
+        cur.executemany("UPDATE `%s` SET data=? WHERE hash_id=?" % self._table_name,
+                        ((sqlite3.Binary(data), hash_id,) for hash_id, data in items))
+        count = cur.rowcount
+        self.stopTimer('update_many')
+        return count
+
     def get( self, hash_id):
         """
         :param hash_id: int
@@ -68,6 +94,38 @@ class TableBlock( Table ):
         self.stopTimer('get')
         return item
 
+    def get_many( self, id_str ):
+        """
+        :param id_str: comma separated hash ids
+        :return: dict { hash_id: data }
+        """
+        self.startTimer()
+        items = {}
+        if id_str:
+            cur = self.getCursor()
+            cur.execute("SELECT * FROM `%s` " % self.getName()+
+                        " WHERE `hash_id` IN (%s)" % (id_str,))
+            for _i in iter(cur.fetchone, None):
+                items[ _i["hash_id"] ] = _i["data"]
+        self.stopTimer('get_many')
+        return items
+
+    def get_items_after( self, after_id, limit ):
+        """
+        Page of blocks in hash id order, for copy of whole table
+
+        :param after_id: int - last hash id of previous page
+        :param limit: int
+        :return: list of (hash_id, data)
+        """
+        self.startTimer()
+        cur = self.getCursor()
+        cur.execute("SELECT hash_id, data FROM `%s` " % self.getName()+
+                    " WHERE hash_id>? ORDER BY hash_id LIMIT ?", (after_id, limit,))
+        items = [(_i["hash_id"], _i["data"],) for _i in iter(cur.fetchone, None)]
+        self.stopTimer('get_items_after')
+        return items
+
     def remove_by_ids(self, id_str):
         self.startTimer()
         count = 0
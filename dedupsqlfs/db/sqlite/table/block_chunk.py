@@ -0,0 +1,117 @@
+# -*- coding: utf8 -*-
+
+__author__ = 'sergey'
+
+from dedupsqlfs.db.sqlite.table import Table
+
+class TableBlockChunk( Table ):
+    """
+    Content-defined chunks of block: block hash -> ordered chunk hashes
+    Block with chunks has no own data in `block` table
+    """
+
+    _table_name = "block_chunk"
+
+    def create( self ):
+        c = self.getCursor()
+
+        # Create table
+        c.execute(
+            "CREATE TABLE IF NOT EXISTS `%s` (" % self.getName()+
+                "hash_id INTEGER NOT NULL, "+
+                "chunk_number INTEGER NOT NULL, "+
+                "chunk_hash_id INTEGER NOT NULL, "+
+                "PRIMARY KEY (hash_id, chunk_number)"+
+            ")"
+        )
+
+        self.createIndexIfNotExists('chunk', ("chunk_hash_id",))
+        return
+
+    def insert_many( self, items ):
+        """
+        :param items: iterable of (hash_id, chunk_number, chunk_hash_id)
+        :return: int
+        """
+        self.startTimer()
+        cur = self.getCursor()
+        cur.executemany("INSERT INTO `%s`(hash_id, chunk_number, chunk_hash_id) VALUES (?,?,?)" % self.getName(),
+                        items)
+        count = cur.rowcount
+        self.stopTimer('insert_many')
+        return count
+
+    def get_chunks( self, hash_id ):
+        """
+        :return: list of chunk hash ids in order
+        """
+        self.startTimer()
+        cur = self.getCursor()
+        cur.execute("SELECT chunk_hash_id FROM `%s` WHERE hash_id=? ORDER BY chunk_number" % self.getName(),
+                    (hash_id,))
+        items = [item["chunk_hash_id"] for item in iter(cur.fetchone, None)]
+        self.stopTimer('get_chunks')
+        return items
+
+    def get_hash_ids(self):
+        self.startTimer()
+        cur = self.getCursor()
+        cur.execute("SELECT DISTINCT `hash_id` FROM `%s`" % self.getName())
+        hashIds = set(item["hash_id"] for item in iter(cur.fetchone, None))
+        self.stopTimer('get_hash_ids')
+        return hashIds
+
+    def get_chunk_ids_by_hash_ids(self, id_str):
+        """
+        :return: list of chunk hash ids, one for every list entry
+        """
+        self.startTimer()
+        chunkIds = []
+        if id_str:
+            cur = self.getCursor()
+            cur.execute("SELECT `chunk_hash_id` FROM `%s` " % self.getName()+
+                        " WHERE `hash_id` IN (%s)" % (id_str,))
+            chunkIds = [item["chunk_hash_id"] for item in iter(cur.fetchone, None)]
+        self.stopTimer('get_chunk_ids_by_hash_ids')
+        return chunkIds
+
+    def count_by_chunk_ids(self, id_str):
+        """
+        :return: dict { chunk_hash_id: count of list entries }
+        """
+        self.startTimer()
+        counts = {}
+        if id_str:
+            cur = self.getCursor()
+            cur.execute("SELECT `chunk_hash_id`, COUNT(1) as `cnt` FROM `%s` " % self.getName()+
+                        " WHERE `chunk_hash_id` IN (%s) GROUP BY `chunk_hash_id`" % (id_str,))
+            for item in iter(cur.fetchone, None):
+                counts[ item["chunk_hash_id"] ] = item["cnt"]
+        self.stopTimer('count_by_chunk_ids')
+        return counts
+
+    def get_chunk_id_counts(self):
+        """
+        Iterate over count of list entries for every chunk hash, uses separate cursor
+
+        :return: generator of (chunk_hash_id, count)
+        """
+        self.startTimer()
+        cur = self.getCursor(True)
+        cur.execute("SELECT `chunk_hash_id`, COUNT(1) as `cnt` FROM `%s` GROUP BY `chunk_hash_id`" % self.getName())
+        counts = ((item["chunk_hash_id"], item["cnt"],) for item in iter(cur.fetchone, None))
+        self.stopTimer('get_chunk_id_counts')
+        return counts
+
+    def remove_by_ids(self, id_str):
+        self.startTimer()
+        count = 0
+        if id_str:
+            cur = self.getCursor()
+            cur.execute("DELETE FROM `%s` " % self.getName()+
+                        " WHERE `hash_id` IN (%s)" % (id_str,))
+            count = cur.rowcount
+        self.stopTimer('remove_by_ids')
+        return count
+
+    pass
@@ -0,0 +1,78 @@
+# -*- coding: utf8 -*-
+
+__author__ = 'sergey'
+
+from dedupsqlfs.db.sqlite.table import Table
+
+class TableBlockCorrupted( Table ):
+    """
+    Report of block verification: blocks which data can't be
+    decompressed or don't match stored hash.
+    """
+
+    _table_name = "block_corrupted"
+
+    def create( self ):
+        c = self.getCursor()
+
+        # Create table
+        c.execute(
+            "CREATE TABLE IF NOT EXISTS `%s` (" % self.getName()+
+                "hash_id INTEGER PRIMARY KEY, "+
+                "reason TEXT NOT NULL, "+
+                "found_at INTEGER NOT NULL"+
+            ")"
+        )
+        return
+
+    def insert_many( self, items ):
+        """
+        :param items: iterable of (hash_id, reason, found_at)
+        :return: int
+        """
+        self.startTimer()
+        cur = self.getCursor()
+        cur.executemany("INSERT OR REPLACE INTO `%s`(hash_id, reason, found_at) VALUES (?,?,?)" % self.getName(),
+                        items)
+        count = cur.rowcount
+        self.stopTimer('insert_many')
+        return count
+
+    def get_all( self ):
+        """
+        :return: list of Row ordered by hash_id
+        """
+        self.startTimer()
+        cur = self.getCursor()
+        cur.execute("SELECT * FROM `%s` ORDER BY hash_id" % self.getName())
+        items = cur.fetchall()
+        self.stopTimer('get_all')
+        return items
+
+    def get_count( self ):
+        self.startTimer()
+        cur = self.getCursor()
+        cur.execute("SELECT COUNT(1) AS `cnt` FROM `%s`" % self.getName())
+        item = cur.fetchone()
+        self.stopTimer('get_count')
+        return item["cnt"]
+
+    def remove_by_ids(self, id_str):
+        self.startTimer()
+        count = 0
+        if id_str:
+            cur = self.getCursor()
+            cur.execute("DELETE FROM `%s` " % self.getName()+
+                        " WHERE `hash_id` IN (%s)" % (id_str,))
+            count = cur.rowcount
+        self.stopTimer('remove_by_ids')
+        return count
+
+    def clean( self ):
+        self.startTimer()
+        cur = self.getCursor()
+        cur.execute("DELETE FROM `%s`" % self.getName())
+        self.stopTimer("clean")
+        return self
+
+    pass
@@ -0,0 +1,319 @@
+# -*- coding: utf8 -*-
+
+__author__ = 'sergey'
+
+import os
+from dedupsqlfs.db.sqlite.table import Table
+from dedupsqlfs.lib import constants
+
+class TableBlockPack( Table ):
+    """
+    Block data appended to big pack files: packs/pack_00000001.dat, ...
+    Database keeps only place of data: (pack_id, offset, length).
+
+    Updated and removed blocks leave garbage in packs.
+    Files with much garbage are rewritten by compact().
+    """
+
+    _table_name = "block_pack"
+
+    _pack_size = constants.BLOCK_PACK_SIZE
+
+    _write_file = None
+    _write_pack_id = None
+    # pack_id -> file descriptor
+    _read_fds = None
+
+    def __init__(self, manager):
+        Table.__init__(self, manager)
+        self._read_fds = {}
+        pass
+
+    def create( self ):
+        c = self.getCursor()
+
+        # Create table
+        c.execute(
+            "CREATE TABLE IF NOT EXISTS `%s` (" % self.getName()+
+                "hash_id INTEGER PRIMARY KEY, "+
+                "pack_id INTEGER NOT NULL, "+
+                "`offset` INTEGER NOT NULL, "+
+                "`length` INTEGER NOT NULL"+
+            ");"
+        )
+        self.createIndexIfNotExists("pack", ("pack_id", "offset",))
+        return
+
+    # Pack files
+
+    def getPackDir(self):
+        return os.path.join(os.path.dirname(self.getDbFilePath()), "packs")
+
+    def getPackPath(self, pack_id):
+        return os.path.join(self.getPackDir(), "pack_%08d.dat" % pack_id)
+
+    def getPackIds(self):
+        ids = []
+        pack_dir = self.getPackDir()
+        if os.path.isdir(pack_dir):
+            for fn in os.listdir(pack_dir):
+                if fn.startswith("pack_") and fn.endswith(".dat"):
+                    ids.append(int(fn[5:-4]))
+        ids.sort()
+        return ids
+
+    def _openWritePack(self, pack_id):
+        if self._write_file is not None:
+            self._write_file.close()
+        pack_dir = self.getPackDir()
+        if not os.path.isdir(pack_dir):
+            os.makedirs(pack_dir)
+        self._write_pack_id = pack_id
+        self._write_file = open(self.getPackPath(pack_id), "ab")
+        return self._write_file
+
+    def _getWriteFile(self):
+        if self._write_file is None:
+            ids = self.getPackIds()
+            if ids:
+                self._openWritePack(ids[-1])
+            else:
+                self._openWritePack(1)
+        if self._write_file.tell() >= self._pack_size:
+            self._openWritePack(self._write_pack_id + 1)
+        return self._write_file
+
+    def _appendData(self, items):
+        """
+        Write data at end of pack before rows point to it
+
+        :param items: iterable of (hash_id, data)
+        :return: list of (pack_id, offset, length, hash_id)
+        """
+        places = []
+        for hash_id, data in items:
+            f = self._getWriteFile()
+            places.append((self._write_pack_id, f.tell(), len(data), hash_id,))
+            f.write(data)
+        if places:
+            self._write_file.flush()
+            if self.getManager().getSynchronous():
+                os.fsync(self._write_file.fileno())
+        return places
+
+    def _readData(self, pack_id, offset, length):
+        fd = self._read_fds.get(pack_id)
+        if fd is None:
+            fd = self._read_fds[ pack_id ] = os.open(self.getPackPath(pack_id), os.O_RDONLY)
+        return os.pread(fd, length, offset)
+
+    def _closePack(self, pack_id):
+        fd = self._read_fds.pop(pack_id, None)
+        if fd is not None:
+            os.close(fd)
+        return
+
+    # Data
+
+    def insert( self, hash_id, data):
+        """
+        :param data: bytes
+        :return: int
+        """
+        return self.insert_many(((hash_id, data,),))
+
+    def insert_many( self, items ):
+        """
+        :param items: iterable of (hash_id, data)
+        :return: int
+        """
+        self.startTimer()
+        places = self._appendData(items)
+        cur = self.getCursor()
+        cur.executemany("INSERT INTO `%s`(pack_id, `offset`, `length`, hash_id) VALUES (?,?,?,?)" % self.getName(),
+                        places)
+        count = cur.rowcount
+        self.stopTimer('insert_many')
+        return count
+
+    def update( self, hash_id, data):
+        """
+        :param data: bytes
+        :return: int
+        """
+        return self.update_many(((hash_id, data,),))
+
+    def update_many( self, items ):
+        """
+        Data is not overwritten - new copy is appended
+
+        :param items: iterable of (hash_id, data)
+        :return: int
+        """
+        self.startTimer()
+        places = self._appendData(items)
+        cur = self.getCursor()
+        cur.executemany("UPDATE `%s` SET pack_id=?, `offset`=?, `length`=? WHERE hash_id=?" % self.getName(),
+                        places)
+        count = cur.rowcount
+        self.stopTimer('update_many')
+        return count
+
+    def get( self, hash_id):
+        """
+        :param hash_id: int
+        :return: Row
+        """
+        self.startTimer()
+        cur = self.getCursor()
+        cur.execute("SELECT * FROM `%s` WHERE hash_id=?" % self.getName(), (hash_id,))
+        item = cur.fetchone()
+        if item:
+            item = {
+                "hash_id": item["hash_id"],
+                "data": self._readData(item["pack_id"], item["offset"], item["length"]),
+            }
+        self.stopTimer('get')
+        return item
+
+    def get_many( self, id_str ):
+        """
+        :param id_str: comma separated hash ids
+        :return: dict { hash_id: data }
+        """
+        self.startTimer()
+        items = {}
+        if id_str:
+            cur = self.getCursor()
+            # Read packs sequentially
+            cur.execute("SELECT * FROM `%s` " % self.getName()+
+                        " WHERE `hash_id` IN (%s) ORDER BY pack_id, `offset`" % (id_str,))
+            for _i in cur.fetchall():
+                items[ _i["hash_id"] ] = self._readData(_i["pack_id"], _i["offset"], _i["length"])
+        self.stopTimer('get_many')
+        return items
+
+    def get_items_after( self, after_id, limit ):
+        """
+        :param after_id: int - last hash id of previous page
+        :param limit: int
+        :return: list of (hash_id, data)
+        """
+        self.startTimer()
+        cur = self.getCursor()
+        cur.execute("SELECT * FROM `%s` " % self.getName()+
+                    " WHERE hash_id>? ORDER BY hash_id LIMIT ?", (after_id, limit,))
+        items = [(_i["hash_id"], self._readData(_i["pack_id"], _i["offset"], _i["length"]),)
+                 for _i in cur.fetchall()]
+        self.stopTimer('get_items_after')
+        return items
+
+    def remove_by_ids(self, id_str):
+        """
+        Data stays in pack as garbage until compact()
+        """
+        self.startTimer()
+        count = 0
+        if id_str:
+            cur = self.getCursor()
+            cur.execute("DELETE FROM `%s` " % self.getName()+
+                        " WHERE `hash_id` IN (%s)" % (id_str,))
+            count = cur.rowcount
+        self.stopTimer('remove_by_ids')
+        return count
+
+    # Garbage
+
+    def get_live_sizes(self):
+        """
+        :return: dict { pack_id: bytes of used data }
+        """
+        self.startTimer()
+        cur = self.getCursor()
+        cur.execute("SELECT pack_id, SUM(`length`) AS live FROM `%s` GROUP BY pack_id" % self.getName())
+        sizes = dict((_i["pack_id"], _i["live"],) for _i in iter(cur.fetchone, None))
+        self.stopTimer('get_live_sizes')
+        return sizes
+
+    def compact(self, garbageRatio=None):
+        """
+        Move used data out of packs with garbage ratio above limit,
+        remove these packs. Pack that is written now is not touched.
+
+        :param garbageRatio: float - 0 means repack every file with garbage
+        :return: int - freed bytes
+        """
+        if garbageRatio is None:
+            garbageRatio = constants.BLOCK_PACK_GARBAGE_RATIO
+
+        self._getWriteFile()
+        live = self.get_live_sizes()
+
+        freed = 0
+        for pack_id in self.getPackIds():
+            if pack_id >= self._write_pack_id:
+                continue
+
+            size = os.path.getsize(self.getPackPath(pack_id))
+            garbage = size - live.get(pack_id, 0)
+            if garbage <= 0 or garbage < size * garbageRatio:
+                continue
+
+            self.getLogger().debug("Compact pack %d: %d of %d bytes are garbage" % (pack_id, garbage, size,))
+
+            cur = self.getCursor(True)
+            last_offset = -1
+            while True:
+                cur.execute("SELECT * FROM `%s` " % self.getName()+
+                            " WHERE pack_id=? AND `offset`>? ORDER BY `offset` LIMIT 1000",
+                            (pack_id, last_offset,))
+                rows = cur.fetchall()
+                if not rows:
+                    break
+                self.update_many((_i["hash_id"], self._readData(pack_id, _i["offset"], _i["length"]),)
+                                 for _i in rows)
+                last_offset = rows[-1]["offset"]
+            cur.close()
+
+            # Rows must point to new places before old file is gone
+            self.commit()
+            self._closePack(pack_id)
+            os.unlink(self.getPackPath(pack_id))
+            freed += garbage
+
+        return freed
+
+    def vacuum(self):
+        freed = self.compact()
+        return Table.vacuum(self) - freed
+
+    # Table
+
+    def getPackFilesSize(self):
+        s = 0
+        for pack_id in self.getPackIds():
+            s += os.path.getsize(self.getPackPath(pack_id))
+        return s
+
+    def getFileSize(self):
+        return Table.getFileSize(self) + self.getPackFilesSize()
+
+    def getSize(self):
+        return Table.getSize(self) + self.getPackFilesSize()
+
+    def close(self, nocompress=False):
+        if self._write_file is not None:
+            self._write_file.close()
+            self._write_file = None
+            self._write_pack_id = None
+        for pack_id in list(self._read_fds.keys()):
+            self._closePack(pack_id)
+        return Table.close(self, nocompress)
+
+    def drop(self):
+        Table.drop(self)
+        for pack_id in self.getPackIds():
+            os.unlink(self.getPackPath(pack_id))
+        return self
+
+    pass
@@ -0,0 +1,232 @@
+# -*- coding: utf8 -*-
+
+__author__ = 'sergey'
+
+from concurrent.futures import ThreadPoolExecutor
+from dedupsqlfs.db.sqlite.table.block import TableBlock
+
+class TableBlockShards( object ):
+    """
+    Block data stored in several database files: block_000, block_001, ...
+
+    Hash ids are routed by ranges: range N goes to shard N % count,
+    so blocks written one after another stay in one file,
+    while whole store grows evenly in all files.
+
+    Each shard has own connection. Writes and reads touching
+    several shards are done in parallel threads, one per shard.
+    """
+
+    _table_name = "block"
+    _file_name = "block"
+
+    _manager = None
+    _shards = None
+    _range = 1
+
+    _executor = None
+
+    def __init__(self, manager, count, shardRange, fileName=None):
+        """
+        @param manager: DB manager
+        @param count: Count of shard files
+        @param shardRange: Count of sequential hash ids in one shard
+        @param fileName: Base of shard file names
+        """
+        if count < 1:
+            raise ValueError("Count of block shards must be positive!")
+        if shardRange < 1:
+            raise ValueError("Range of block shard must be positive!")
+        self._manager = manager
+        if fileName:
+            self._file_name = fileName
+        self._range = shardRange
+        self._shards = []
+        for n in range(count):
+            t = TableBlock(manager)
+            t.setFileName("%s_%03d" % (self._file_name, n,))
+            self._shards.append(t)
+        pass
+
+    def getShards(self):
+        return self._shards
+
+    def getShardCount(self):
+        return len(self._shards)
+
+    def getShardRange(self):
+        return self._range
+
+    def getShard(self, hash_id):
+        return self._shards[ (int(hash_id) // self._range) % len(self._shards) ]
+
+    def _groupIds(self, id_str):
+        """
+        @param id_str: comma separated hash ids
+        @return: dict { shard: id_str }
+        """
+        groups = {}
+        for _id in id_str.split(","):
+            _id = _id.strip()
+            if not _id:
+                continue
+            groups.setdefault(self.getShard(_id), []).append(_id)
+        return dict((t, ",".join(ids),) for t, ids in groups.items())
+
+    def _groupItems(self, items):
+        """
+        @param items: iterable of (hash_id, data)
+        @return: dict { shard: list of items }
+        """
+        groups = {}
+        for item in items:
+            groups.setdefault(self.getShard(item[0]), []).append(item)
+        return groups
+
+    def _getExecutor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=len(self._shards))
+        return self._executor
+
+    def _callGroups(self, method, groups):
+        """
+        Call method of every shard with own arguments
+
+        @param method: Name of TableBlock method
+        @param groups: dict { shard: argument }
+        @return: list of results
+        """
+        if len(groups) == 1:
+            for t, arg in groups.items():
+                return [getattr(t, method)(arg)]
+        if not groups:
+            return []
+
+        executor = self._getExecutor()
+        futures = [executor.submit(getattr(t, method), arg) for t, arg in groups.items()]
+        return [f.result() for f in futures]
+
+    def _callAll(self, method, *args):
+        return [getattr(t, method)(*args) for t in self._shards]
+
+    # Data
+
+    def insert( self, hash_id, data):
+        return self.getShard(hash_id).insert(hash_id, data)
+
+    def insert_many( self, items ):
+        return sum(self._callGroups("insert_many", self._groupItems(items)))
+
+    def update( self, hash_id, data):
+        return self.getShard(hash_id).update(hash_id, data)
+
+    def update_many( self, items ):
+        return sum(self._callGroups("update_many", self._groupItems(items)))
+
+    def get( self, hash_id):
+        return self.getShard(hash_id).get(hash_id)
+
+    def get_many( self, id_str ):
+        items = {}
+        if id_str:
+            for found in self._callGroups("get_many", self._groupIds(id_str)):
+                items.update(found)
+        return items
+
+    def remove_by_ids(self, id_str):
+        count = 0
+        if id_str:
+            count = sum(self._callGroups("remove_by_ids", self._groupIds(id_str)))
+        return count
+
+    # Table
+
+    def getName(self):
+        return self._table_name
+
+    def getFileName(self):
+        return self._file_name
+
+    def getManager(self):
+        return self._manager
+
+    def getDbFilePath(self):
+        return self._shards[0].getDbFilePath()
+
+    def hasTable(self):
+        for t in self._shards:
+            if not t.hasTable():
+                return False
+        return True
+
+    def create( self ):
+        for t in self._shards:
+            if not t.hasTable():
+                t.create()
+        return
+
+    def begin(self):
+        self._callAll("begin")
+        return self
+
+    def commit(self):
+        self._callAll("commit")
+        return self
+
+    def rollback(self):
+        self._callAll("rollback")
+        return self
+
+    def vacuum(self):
+        return sum(self._callAll("vacuum"))
+
+    def getReclaimablePages(self):
+        return sum(self._callAll("getReclaimablePages"))
+
+    def incrementalVacuum(self, pages=0):
+        freed = 0
+        for t in self._shards:
+            if pages and freed >= pages:
+                break
+            freed += t.incrementalVacuum(pages and pages - freed)
+        return freed
+
+    def close(self, nocompress=False):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self._callAll("close", nocompress)
+        return self
+
+    def drop(self):
+        self.close()
+        self._callAll("drop")
+        return self
+
+    def getSize(self):
+        return sum(self._callAll("getSize"))
+
+    def getFileSize(self):
+        return sum(self._callAll("getFileSize"))
+
+    def getOperationsCount(self):
+        counts = {}
+        for t in self._shards:
+            for op, c in t.getOperationsCount().items():
+                counts[ op ] = counts.get(op, 0) + c
+        return counts
+
+    def getAllOperationsCount(self):
+        return sum(self._callAll("getAllOperationsCount"))
+
+    def getTimeSpent(self):
+        times = {}
+        for t in self._shards:
+            for op, s in t.getTimeSpent().items():
+                times[ op ] = times.get(op, 0) + s
+        return times
+
+    def getAllTimeSpent(self):
+        return sum(self._callAll("getAllTimeSpent"))
+
+    pass
@@ -32,6 +32,45 @@ class TableHash( Table ):
         self.stopTimer('insert')
         return item
 
+    def insert_many( self, values ):
+        """
+        Insert many hashes in one go
+
+        @param values: hash values
+        @type  values: list|tuple|set
+
+        @return: { hash value: hash id }
+        @rtype: dict
+        """
+        self.startTimer()
+        if values:
+            cur = self.getCursor()
+            cur.executemany("INSERT INTO `%s`(hash) VALUES (?)" % self.getName(),
+                        ((sqlite3.Binary(value),) for value in values))
+        self.stopTimer('insert_many')
+        return self.find_many(values)
+
+    def insert_many_missing( self, values ):
+        """
+        Insert hashes which are not in table yet, stored ones are skipped
+
+        @param values: hash values
+        @type  values: list|tuple|set
+
+        @return: ( { hash value: hash id }, set of inserted hash values )
+        @rtype: tuple
+        """
+        self.startTimer()
+        inserted = set()
+        cur = self.getCursor()
+        for value in values:
+            cur.execute("INSERT OR IGNORE INTO `%s`(hash) VALUES (?)" % self.getName(),
+                        (sqlite3.Binary(value),))
+            if cur.rowcount > 0:
+                inserted.add(value)
+        self.stopTimer('insert_many_missing')
+        return self.find_many(values), inserted
+
     def update( self, item_id, value ):
         """
         @return: count updated rows
@@ -67,6 +106,30 @@ class TableHash( Table ):
         self.stopTimer('find')
         return item
 
+    def find_many( self, values ):
+        """
+        Find ids of many hashes, query by chunks
+
+        @param values: hash values
+        @type  values: list|tuple|set
+
+        @return: { hash value: hash id } - only found hashes
+        @rtype: dict
+        """
+        self.startTimer()
+        items = {}
+        values = tuple(values)
+        cur = self.getCursor()
+        for i in range(0, len(values), self._max_vars):
+            chunk = values[i:i + self._max_vars]
+            cur.execute("SELECT id, hash FROM `%s` " % self.getName()+
+                        " WHERE hash IN (%s)" % ",".join("?" * len(chunk)),
+                        tuple(sqlite3.Binary(value) for value in chunk))
+            for _i in iter(cur.fetchone, None):
+                items[ bytes(_i["hash"]) ] = _i["id"]
+        self.stopTimer('find_many')
+        return items
+
     def get_count(self):
         self.startTimer()
         cur = self.getCursor()
@@ -88,6 +151,62 @@ class TableHash( Table ):
         self.stopTimer('get_hash_ids')
         return nameIds
 
+    def get_hashes(self):
+        """
+        Iterate over all hash values, uses separate cursor
+
+        @rtype: generator
+        """
+        self.startTimer()
+        cur = self.getCursor(True)
+        cur.execute("SELECT `hash` FROM `%s`" % self.getName())
+        hashes = (item["hash"] for item in iter(cur.fetchone, None))
+        self.stopTimer('get_hashes')
+        return hashes
+
+    def update_many( self, items ):
+        """
+        :param items: iterable of (id, hash value)
+        :return: int
+        """
+        self.startTimer()
+        cur = self.getCursor()
+        cur.executemany("UPDATE `%s` SET hash=? WHERE id=?" % self.getName(),
+                        ((sqlite3.Binary(value), item_id,) for item_id, value in items))
+        count = cur.rowcount
+        self.stopTimer('update_many')
+        return count
+
+    def get_ids_after(self, after_id, limit):
+        """
+        Page of ids in ascending order
+
+        :return: list
+        """
+        self.startTimer()
+        cur = self.getCursor()
+        cur.execute("SELECT `id` FROM `%s` " % self.getName()+
+                    " WHERE `id`>? ORDER BY `id` LIMIT ?", (after_id, limit,))
+        ids = [item["id"] for item in iter(cur.fetchone, None)]
+        self.stopTimer('get_ids_after')
+        return ids
+
+    def get_many( self, id_str ):
+        """
+        :param id_str: comma separated hash ids
+        :return: dict { hash id: hash value }
+        """
+        self.startTimer()
+        items = {}
+        if id_str:
+            cur = self.getCursor()
+            cur.execute("SELECT `id`, `hash` FROM `%s` " % self.getName()+
+                        " WHERE `id` IN (%s)" % (id_str,))
+            for _i in iter(cur.fetchone, None):
+                items[ _i["id"] ] = bytes(_i["hash"])
+        self.stopTimer('get_many')
+        return items
+
     def remove_by_ids(self, id_str):
         self.startTimer()
         count = 0
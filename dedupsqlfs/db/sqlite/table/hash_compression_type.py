@@ -38,6 +38,19 @@ class TableHashCompressionType( Table ):
         self.stopTimer('insert')
         return item
 
+    def insert_many( self, items ):
+        """
+        :param items: iterable of (hash_id, type_id)
+        :return: int
+        """
+        self.startTimer()
+        cur = self.getCursor()
+        cur.executemany("INSERT INTO `%s`(hash_id, type_id) VALUES (?,?)" % self._table_name,
+                        items)
+        count = cur.rowcount
+        self.stopTimer('insert_many')
+        return count
+
     def update( self, hash_id, type_id):
         """
         :return: int
@@ -51,6 +64,19 @@ class TableHashCompressionType( Table ):
         self.stopTimer('update')
         return count
 
+    def update_many( self, items ):
+        """
+        :param items: iterable of (hash_id, type_id)
+        :return: int
+        """
+        self.startTimer()
+        cur = self.getCursor()
+        cur.executemany("UPDATE `%s` SET type_id=? WHERE hash_id=?" % self._table_name,
+                        ((type_id, hash_id,) for hash_id, type_id in items))
+        count = cur.rowcount
+        self.stopTimer('update_many')
+        return count
+
     def get( self, hash_id):
         """
         :param hash_id: int
@@ -95,4 +121,24 @@ class TableHashCompressionType( Table ):
         self.stopTimer('get_types_by_hash_ids')
         return items
 
+    def get_items_after(self, after_id, limit, type_ids=None):
+        """
+        Page of rows in hash id order
+
+        :param after_id: int - last hash id of previous page
+        :param limit: int
+        :param type_ids: iterable of compression type ids to select, None - all
+        :return: list of (hash_id, type_id)
+        """
+        self.startTimer()
+        where = ""
+        if type_ids is not None:
+            where = " AND `type_id` IN (%s)" % ",".join(str(int(_id)) for _id in type_ids)
+        cur = self.getCursor()
+        cur.execute("SELECT `hash_id`, `type_id` FROM `%s` " % self.getName()+
+                    " WHERE `hash_id`>?%s ORDER BY `hash_id` LIMIT ?" % where, (after_id, limit,))
+        items = [(_i["hash_id"], _i["type_id"],) for _i in iter(cur.fetchone, None)]
+        self.stopTimer('get_items_after')
+        return items
+
     pass
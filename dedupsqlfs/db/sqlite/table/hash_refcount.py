@@ -0,0 +1,114 @@
+# -*- coding: utf8 -*-
+
+__author__ = 'sergey'
+
+from itertools import islice
+from dedupsqlfs.db.sqlite.table import Table
+
+class TableHashRefcount( Table ):
+    """
+    Count of references to hash: index entries of all subvolumes
+    and entries of block chunk lists.
+    Hashes with zero count are garbage.
+    """
+
+    _table_name = "hash_refcount"
+
+    def create( self ):
+        c = self.getCursor()
+
+        # Create table
+        c.execute(
+            "CREATE TABLE IF NOT EXISTS `%s` (" % self.getName()+
+                "hash_id INTEGER PRIMARY KEY, "+
+                "refcount INTEGER NOT NULL DEFAULT 0"+
+            ")"
+        )
+
+        self.createIndexIfNotExists('refcount', ("refcount",))
+        return
+
+    def add_many( self, items ):
+        """
+        :param items: iterable of (hash_id, delta)
+        :return: int
+        """
+        self.startTimer()
+        cur = self.getCursor()
+        if self._has_upsert:
+            cur.executemany("INSERT INTO `%s`(hash_id, refcount) VALUES (?,?) " % self.getName()+
+                            " ON CONFLICT(hash_id) DO UPDATE SET refcount=refcount+excluded.refcount",
+                            items)
+            count = cur.rowcount
+        else:
+            items = tuple(items)
+            cur.executemany("INSERT OR IGNORE INTO `%s`(hash_id, refcount) VALUES (?,0)" % self.getName(),
+                            ((hash_id,) for hash_id, delta in items))
+            cur.executemany("UPDATE `%s` SET refcount=refcount+? WHERE hash_id=?" % self.getName(),
+                            ((delta, hash_id,) for hash_id, delta in items))
+            count = cur.rowcount
+        self.stopTimer('add_many')
+        return count
+
+    def set_many( self, items ):
+        """
+        :param items: iterable of (hash_id, refcount)
+        :return: int
+        """
+        self.startTimer()
+        cur = self.getCursor()
+        cur.executemany("INSERT OR REPLACE INTO `%s`(hash_id, refcount) VALUES (?,?)" % self.getName(),
+                        items)
+        count = cur.rowcount
+        self.stopTimer('set_many')
+        return count
+
+    def add_counts( self, counts, sign=1 ):
+        """
+        Add references of whole table in batches
+
+        :param counts: iterator of (hash_id, count)
+        :param sign: 1 - add references, -1 - remove them
+        :return: int
+        """
+        count = 0
+        while True:
+            items = [(hash_id, sign * cnt,) for hash_id, cnt in islice(counts, 10000)]
+            if not items:
+                break
+            count += self.add_many(items)
+        return count
+
+    def get( self, hash_id ):
+        self.startTimer()
+        cur = self.getCursor()
+        cur.execute("SELECT refcount FROM `%s` WHERE hash_id=?" % self.getName(), (hash_id,))
+        item = cur.fetchone()
+        if item:
+            item = item["refcount"]
+        self.stopTimer('get')
+        return item
+
+    def get_unused_ids( self, limit ):
+        """
+        :return: set of hash ids without references
+        """
+        self.startTimer()
+        cur = self.getCursor()
+        cur.execute("SELECT hash_id FROM `%s` WHERE refcount<=0 LIMIT ?" % self.getName(), (limit,))
+        hashIds = set(item["hash_id"] for item in iter(cur.fetchone, None))
+        self.stopTimer('get_unused_ids')
+        return hashIds
+
+    def remove_by_ids(self, id_str):
+        self.startTimer()
+        count = 0
+        if id_str:
+            cur = self.getCursor()
+            cur.execute("DELETE FROM `%s` " % self.getName()+
+                        " WHERE `hash_id` IN (%s)" % (id_str,))
+            count = cur.rowcount
+        self.stopTimer('remove_by_ids')
+        return count
+
+    pass
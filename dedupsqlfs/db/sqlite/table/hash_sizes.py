@@ -34,6 +34,19 @@ class TableHashSizes( Table ):
         self.stopTimer('insert')
         return item
 
+    def insert_many( self, items ):
+        """
+        :param items: iterable of (hash_id, writed_size, compressed_size)
+        :return: int
+        """
+        self.startTimer()
+        cur = self.getCursor()
+        cur.executemany("INSERT INTO `%s`(hash_id, `writed_size`, `compressed_size`) VALUES (?,?,?)" % self.getName(),
+                        items)
+        count = cur.rowcount
+        self.stopTimer('insert_many')
+        return count
+
     def update( self, hash_id, writed_size, compressed_size):
         """
         :return: int
@@ -47,6 +60,19 @@ class TableHashSizes( Table ):
         self.stopTimer('update')
         return count
 
+    def update_many( self, items ):
+        """
+        :param items: iterable of (hash_id, writed_size, compressed_size)
+        :return: int
+        """
+        self.startTimer()
+        cur = self.getCursor()
+        cur.executemany("UPDATE `%s` SET writed_size=?, compressed_size=? WHERE hash_id=?" % self.getName(),
+                        ((writed_size, compressed_size, hash_id,) for hash_id, writed_size, compressed_size in items))
+        count = cur.rowcount
+        self.stopTimer('update_many')
+        return count
+
     def get( self, hash_id):
         """
         :param hash_id: int
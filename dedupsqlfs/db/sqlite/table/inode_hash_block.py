@@ -36,6 +36,19 @@ class TableInodeHashBlock( Table ):
         self.stopTimer('insert')
         return item
 
+    def insert_many( self, items ):
+        """
+        :param items: iterable of (inode, block_number, hash_id, real_size)
+        :return: int
+        """
+        self.startTimer()
+        cur = self.getCursor()
+        cur.executemany("INSERT INTO `%s`(inode_id, block_number, hash_id, real_size) VALUES (?,?,?,?)" % self.getName(),
+                        items)
+        count = cur.rowcount
+        self.stopTimer('insert_many')
+        return count
+
     def update( self, inode, block_number, new_hash_id, new_size):
         self.startTimer()
         cur = self.getCursor()
@@ -45,6 +58,19 @@ class TableInodeHashBlock( Table ):
         self.stopTimer('update')
         return item
 
+    def update_many( self, items ):
+        """
+        :param items: iterable of (inode, block_number, new_hash_id, new_size)
+        :return: int
+        """
+        self.startTimer()
+        cur = self.getCursor()
+        cur.executemany("UPDATE `%s` SET hash_id=?, real_size=? WHERE inode_id=? AND block_number=?" % self.getName(),
+                        ((new_hash_id, new_size, inode, block_number,) for inode, block_number, new_hash_id, new_size in items))
+        count = cur.rowcount
+        self.stopTimer('update_many')
+        return count
+
     def update_hash( self, inode, block_number, new_hash_id):
         self.startTimer()
         cur = self.getCursor()
@@ -83,6 +109,23 @@ class TableInodeHashBlock( Table ):
         self.stopTimer('get')
         return item
 
+    def get_by_inode_range( self, inode, first_block, last_block ):
+        """
+        :return: dict { block_number: Row }
+        """
+        self.startTimer()
+        cur = self.getCursor()
+        cur.execute(
+            "SELECT `block_number`,`hash_id`,`real_size` FROM `%s` " % self.getName()+
+            " WHERE `inode_id`=? AND `block_number`>=? AND `block_number`<=?",
+            (inode, first_block, last_block,)
+        )
+        items = {}
+        for item in iter(cur.fetchone, None):
+            items[ item.pop("block_number") ] = item
+        self.stopTimer('get_by_inode_range')
+        return items
+
     def hash_by_inode_number( self, inode, block_number ):
         self.startTimer()
         cur = self.getCursor()
@@ -108,13 +151,27 @@ class TableInodeHashBlock( Table ):
     def delete_by_inode_number_more( self, inode, block_number ):
         self.startTimer()
         cur = self.getCursor()
-        cur.execute("SELECT block_number FROM `%s` WHERE inode_id=? AND block_number>?" % self.getName(), (inode, block_number,))
+        cur.execute("SELECT block_number, hash_id FROM `%s` WHERE inode_id=? AND block_number>?" % self.getName(), (inode, block_number,))
         items = cur.fetchall()
         if items:
             cur.execute("DELETE FROM `%s` WHERE inode_id=? AND block_number>?" % self.getName(), (inode, block_number,))
         self.stopTimer('delete_by_inode_number_more')
         return items
 
+    def get_hash_ids_after(self, after_id, limit):
+        """
+        Page of used ids in ascending order
+
+        :return: list
+        """
+        self.startTimer()
+        cur = self.getCursor()
+        cur.execute("SELECT DISTINCT `hash_id` FROM `%s` " % self.getName()+
+                    " WHERE `hash_id`>? ORDER BY `hash_id` LIMIT ?", (after_id, limit,))
+        ids = [item["hash_id"] for item in iter(cur.fetchone, None)]
+        self.stopTimer('get_hash_ids_after')
+        return ids
+
     def get_count_uniq_inodes(self):
         self.startTimer()
         cur = self.getCursor()
@@ -184,6 +241,63 @@ class TableInodeHashBlock( Table ):
         self.stopTimer('remove_by_inodes')
         return count
 
+    def get_hash_ids_by_inodes(self, inode_ids):
+        """
+        :return: list of hash ids, one for every index entry
+        """
+        self.startTimer()
+        hashIds = []
+        id_str = ",".join(str(_id) for _id in inode_ids)
+        if id_str:
+            cur = self.getCursor()
+            cur.execute("SELECT `hash_id` FROM `%s` " % self.getName()+
+                        " WHERE `inode_id` IN (%s)" % (id_str,))
+            hashIds = [item["hash_id"] for item in iter(cur.fetchone,None)]
+        self.stopTimer('get_hash_ids_by_inodes')
+        return hashIds
+
+    def count_by_hash_ids(self, id_str):
+        """
+        :return: dict { hash_id: count of entries }
+        """
+        self.startTimer()
+        counts = {}
+        if id_str:
+            cur = self.getCursor()
+            cur.execute("SELECT `hash_id`, COUNT(1) as `cnt` FROM `%s` " % self.getName()+
+                        " WHERE `hash_id` IN (%s) GROUP BY `hash_id`" % (id_str,))
+            for item in iter(cur.fetchone, None):
+                counts[ item["hash_id"] ] = item["cnt"]
+        self.stopTimer('count_by_hash_ids')
+        return counts
+
+    def remove_by_hash_ids(self, id_str):
+        """
+        :return: count of removed entries
+        """
+        self.startTimer()
+        count = 0
+        if id_str:
+            cur = self.getCursor()
+            cur.execute("DELETE FROM `%s` " % self.getName()+
+                        " WHERE `hash_id` IN (%s)" % (id_str,))
+            count = cur.rowcount
+        self.stopTimer('remove_by_hash_ids')
+        return count
+
+    def get_hash_id_counts(self):
+        """
+        Iterate over count of entries for every hash, uses separate cursor
+
+        :return: generator of (hash_id, count)
+        """
+        self.startTimer()
+        cur = self.getCursor(True)
+        cur.execute("SELECT `hash_id`, COUNT(1) as `cnt` FROM `%s` GROUP BY `hash_id`" % self.getName())
+        counts = ((item["hash_id"], item["cnt"],) for item in iter(cur.fetchone,None))
+        self.stopTimer('get_hash_id_counts')
+        return counts
+
     def get_hash_inode_ids(self):
         self.startTimer()
         cur = self.getCursor()
@@ -0,0 +1,308 @@
+# -*- coding: utf8 -*-
+
+__author__ = 'sergey'
+
+import json
+import hashlib
+from time import time
+from concurrent.futures import ThreadPoolExecutor
+from dedupsqlfs.my_formats import format_size, format_timespan
+
+class BlockJob(object):
+    """
+    Base of offline jobs over stored blocks
+
+    Blocks are taken in hash id order by batches. Last done hash id
+    is kept in option table, so interrupted job continues from it
+    when started again with same target.
+    """
+
+    # Option name of checkpoint, defined by job
+    CHECKPOINT_OPTION = None
+
+    _manager = None
+    _batch_size = 1024
+    _report_interval = 10
+
+    # Reasons of failed decompression in last batch
+    _decompress_errors = None
+
+    _executor = None
+
+    def __init__(self, manager, batchSize=None):
+        """
+        @param manager: FUSE wrapper
+        @type  manager: dedupsqlfs.fuse.operations.DedupOperations
+
+        @param batchSize: Count of blocks processed at once
+        @type  batchSize: int
+        """
+        self._manager = manager
+        if batchSize:
+            self._batch_size = int(batchSize)
+        self._decompress_errors = {}
+        pass
+
+    def getManager(self):
+        return self._manager
+
+    def getTable(self, name):
+        return self.getManager().getManager().getTable(name)
+
+    def getLogger(self):
+        return self.getManager().getLogger()
+
+    def getApplication(self):
+        return self.getManager().getApplication()
+
+    def getHashFunction(self):
+        hash_function = self.getTable("option").get("hash_function")
+        if not hash_function:
+            hash_function = self.getManager().hash_function
+        return hash_function
+
+    def getBlockSize(self):
+        """
+        Default block size of filesystem files
+        """
+        block_size = self.getTable("option").get("block_size")
+        if not block_size:
+            return self.getManager().block_size
+        return int(block_size)
+
+    # -----------------------------------------------
+
+    def _getCheckpointTarget(self):
+        value = self.getTable("option").get(self.CHECKPOINT_OPTION)
+        if value:
+            try:
+                return json.loads(value).get("target")
+            except ValueError:
+                pass
+        return None
+
+    def _loadCheckpoint(self, target):
+        value = self.getTable("option").get(self.CHECKPOINT_OPTION)
+        if value:
+            try:
+                checkpoint = json.loads(value)
+            except ValueError:
+                return 0
+            if checkpoint.get("target") == target:
+                return int(checkpoint["last"])
+        return 0
+
+    def _saveCheckpoint(self, target, last_id):
+        tableOption = self.getTable("option")
+        value = json.dumps({"target": target, "last": last_id})
+        if tableOption.get(self.CHECKPOINT_OPTION) is None:
+            tableOption.insert(self.CHECKPOINT_OPTION, value)
+        else:
+            tableOption.update(self.CHECKPOINT_OPTION, value)
+        tableOption.commit()
+        return
+
+    def _dropCheckpoint(self):
+        tableOption = self.getTable("option")
+        if tableOption.get(self.CHECKPOINT_OPTION) is not None:
+            tableOption.update(self.CHECKPOINT_OPTION, "")
+            tableOption.commit()
+        return
+
+    # -----------------------------------------------
+
+    def findPathNode(self, subvolItem, path):
+        """
+        @param path: Path inside subvolume, '/' - subvolume root
+        @type  path: bytes
+
+        @return: tree node or None
+        """
+        tableTree = self.getTable("tree_" + subvolItem["hash"])
+        tableName = self.getTable("name")
+
+        # Root directory has first inode
+        node = tableTree.find_by_inode(1)
+        for part in path.split(b"/"):
+            if not node:
+                break
+            if not part or part == b".":
+                continue
+            name_id = tableName.find(part)
+            if not name_id:
+                return None
+            node = tableTree.find_by_parent_name(node["id"], name_id)
+        return node
+
+    def collectPathInodes(self, subvolItem, node):
+        """
+        Inodes of node and all nodes under it
+
+        @rtype: set
+        """
+        tableTree = self.getTable("tree_" + subvolItem["hash"])
+
+        inodes = set((node["inode_id"],))
+        parents = [node["id"]]
+        while parents:
+            for child in list(tableTree.get_children(parents.pop())):
+                if child["inode_id"] not in inodes:
+                    inodes.add(child["inode_id"])
+                    parents.append(child["id"])
+        return inodes
+
+    # -----------------------------------------------
+
+    def _iterStoreBatches(self, type_ids, after_id):
+        """
+        All blocks of store with selected compression types
+
+        @param type_ids: compression type ids, None - all
+        @return: generator of lists of (hash_id, type_id)
+        """
+        tableHCT = self.getTable("hash_compression_type")
+        while True:
+            items = tableHCT.get_items_after(after_id, self._batch_size, type_ids)
+            if not items:
+                return
+            yield items
+            after_id = items[-1][0]
+
+    def _decompressMany(self, toDecompress):
+        """
+        Blocks which can't be decompressed are left out,
+        their errors are in _decompress_errors
+
+        @param toDecompress: dict { hash_id: (method, compressed data) }
+        @return: dict { hash_id: data }
+        """
+        app = self.getApplication()
+        self._decompress_errors = {}
+        try:
+            return dict(app.decompressDataMany(toDecompress))
+        except Exception as e:
+            self.getLogger().warning("Batch decompression failed, retry blocks one by one: %s" % e)
+
+        blocks = {}
+        for hash_id, cItem in toDecompress.items():
+            method, cdata = cItem
+            try:
+                blocks[ hash_id ] = app.decompressData(method, cdata)
+            except Exception as e:
+                self.getLogger().error("Can't decompress block %d with %s: %s" % (hash_id, method, e,))
+                self._decompress_errors[ hash_id ] = "decompress %s: %s" % (method, e,)
+        return blocks
+
+    def _readStored(self, hash_ids):
+        """
+        @param hash_ids: list of hash ids
+        @return: tuple (dict { hash_id: data }, dict { hash_id: error })
+                 ids without stored data are not in both
+        """
+        if not hash_ids:
+            return {}, {}
+
+        ops = self.getManager()
+
+        id_str = ",".join(str(hash_id) for hash_id in hash_ids)
+        stored = self.getTable("block").get_many(id_str)
+        types = self.getTable("hash_compression_type").get_types_by_hash_ids(id_str)
+
+        toDecompress = {}
+        for hash_id in hash_ids:
+            if hash_id in stored and hash_id in types:
+                toDecompress[ hash_id ] = (ops.getCompressionTypeName(types[ hash_id ]), stored[ hash_id ],)
+        del stored
+
+        blocks = self._decompressMany(toDecompress)
+        return blocks, dict(self._decompress_errors)
+
+    def _readBlocks(self, hash_ids):
+        """
+        Data of blocks, chunked ones are assembled
+
+        @param hash_ids: list of hash ids
+        @return: tuple (dict { hash_id: data }, dict { hash_id: error })
+        """
+        if not hash_ids:
+            return {}, {}
+
+        blocks, errors = self._readStored(hash_ids)
+
+        rest = [hash_id for hash_id in hash_ids if hash_id not in blocks and hash_id not in errors]
+        if not rest:
+            return blocks, errors
+
+        tableChunk = self.getTable("block_chunk")
+
+        recipes = {}
+        need = set()
+        for hash_id in rest:
+            chunks = tableChunk.get_chunks(hash_id)
+            if chunks:
+                recipes[ hash_id ] = chunks
+                need.update(chunks)
+            else:
+                errors[ hash_id ] = "no data"
+
+        # Chunk may be whole other chunked block
+        chunks_data = self._readBlocks(sorted(need - set(blocks.keys())))[0]
+        for chunk_id in need:
+            if chunk_id in blocks:
+                chunks_data[ chunk_id ] = blocks[ chunk_id ]
+
+        for hash_id, chunks in recipes.items():
+            missing = [chunk_id for chunk_id in chunks if chunk_id not in chunks_data]
+            if missing:
+                errors[ hash_id ] = "no data of chunks %s" % ",".join(str(chunk_id) for chunk_id in missing)
+            else:
+                blocks[ hash_id ] = b"".join(chunks_data[ chunk_id ] for chunk_id in chunks)
+
+        return blocks, errors
+
+    def _getExecutor(self):
+        if self._executor is None:
+            np = self.getApplication().getCompressTool().checkCpuLimit()
+            if np > 1:
+                self._executor = ThreadPoolExecutor(max_workers=np)
+        return self._executor
+
+    def _stopExecutor(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        return
+
+    def _hashMany(self, blocks, hash_function):
+        """
+        Hashing of big data releases GIL, so it is done in threads
+
+        @param blocks: dict { hash_id: data }
+        @return: dict { hash_id: digest }
+        """
+        def digest(data):
+            context = hashlib.new(hash_function)
+            context.update(data)
+            return context.digest()
+
+        executor = self._getExecutor()
+        keys = list(blocks.keys())
+        if executor is None:
+            return dict((key, digest(blocks[ key ]),) for key in keys)
+        return dict(zip(keys, executor.map(digest, (blocks[ key ] for key in keys))))
+
+    def _report(self, action, count, total, bytes_in, bytes_out, start_time):
+        elapsed = max(time() - start_time, 0.001)
+        msg = "%s %d" % (action, count,)
+        if total:
+            msg += " of %d" % total
+        msg += " blocks: %s" % format_size(bytes_in)
+        if bytes_out is not None:
+            msg += " -> %s" % format_size(bytes_out)
+        msg += ", %s/s" % format_size(bytes_in / elapsed)
+        if 0 < count < total:
+            msg += ", left ~%s" % format_timespan(elapsed * (total - count) / count)
+        self.getLogger().info(msg)
+        return
+
+    pass
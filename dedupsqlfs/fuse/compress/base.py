@@ -8,31 +8,51 @@ Used in single or multi process compression classes
 __author__ = 'sergey'
 
 from time import time
+from math import log
+from collections import OrderedDict
+from threading import Lock
+from queue import Empty
 from dedupsqlfs.lib import constants
 
 class Task(object):
     """
     @ivar key: int|str          - task primary key
-    @ivar data: bytes           - data to compress
+    @ivar call: int             - id of call which put task, results are returned to it
+    @ivar data: bytes           - data to compress or decompress
+    @ivar method: str           - compression method to decompress data, None - compress data
+    @ivar buffer: tuple         - (shared memory name, offset, length) of data, if not passed in task
+    @ivar methods: tuple        - compression methods to try, None - all selected
     """
 
     key = None
+    call = None
 
     data = None
+    method = None
+    buffer = None
+    methods = None
 
     pass
 
 class Result(object):
     """
     @ivar key: int|str          - task primary key
+    @ivar call: int             - id of call which put task
     @ivar method: str           - compression method used
     @ivar cdata: bytes          - compressed data
+    @ivar data: bytes           - decompressed data
+    @ivar error: str            - compression or decompression error
+    @ivar size: int             - compressed data length, if it is placed in shared memory instead of cdata
     """
 
     key = None
+    call = None
 
     method = None
     cdata = None
+    data = None
+    error = None
+    size = None
 
     pass
 
@@ -63,11 +83,47 @@ class BaseCompressTool(object):
     """
 
     time_spent_compressing = 0
+    time_spent_decompressing = 0
+
+    _stats = None
+    """
+    @ivar _stats: Adaptive selection - which methods won for data of hint (inode):
+                  { hint: [ compressed blocks count, { method: wins } ] }
+    @type _stats: OrderedDict
+    """
+
+    # Try all methods for first blocks of hint
+    _adaptive_sample = 4
+    # Then try all methods only for every Nth block
+    _adaptive_retry = 32
+    # Maximum hints in stats
+    _adaptive_max_hints = 10000
+
+    # Sample size and entropy (bits per byte) there data is counted as incompressible
+    _entropy_sample_size = 4096
+    _entropy_max = 7.9
+
+    _result_queue = None
+
+    _results = None
+    """
+    @ivar _results: Results taken from shared queue for other calls: { call id: [ Result, ... ] }
+    @type _results: dict
+    """
+
+    _results_lock = None
+    _last_call = 0
+
+    # Seconds to wait result before workers are checked
+    _result_timeout = 1
 
     def __init__(self):
         self._compressors = {}
         self._options = {}
         self._methods = set()
+        self._stats = OrderedDict()
+        self._results = {}
+        self._results_lock = Lock()
         pass
 
     def checkCpuLimit(self):
@@ -184,10 +240,96 @@ class BaseCompressTool(object):
     def isMethodSelected(self, name):
         return name in self._methods
 
-    def _compressData(self, data):
+    def getSelectedMethods(self):
+        """
+        Methods used to compress new data, without 'none'
+
+        @rtype: set
+        """
+        return set(self._methods)
+
+    def _isDataIncompressible(self, data, data_length):
+        """
+        Cheap check by entropy of data sample: jpeg, video, archives
+        have nearly 8 bits of information per byte
+
+        @rtype: bool
+        """
+        size = self._entropy_sample_size
+        if data_length > size:
+            # Sample from four parts of data
+            step = data_length // 4
+            part = size // 4
+            sample = b"".join(data[i*step:i*step + part] for i in range(4))
+        else:
+            sample = data
+            size = data_length
+
+        if not size:
+            return False
+
+        entropy = 0.0
+        for b in range(256):
+            count = sample.count(b)
+            if count:
+                p = 1.0 * count / size
+                entropy -= p * log(p, 2)
+
+        # Small sample can't show high entropy - max is log2(size)
+        return entropy >= min(self._entropy_max, log(size, 2) - 0.1)
+
+    def _selectMethods(self, hint):
+        """
+        Adaptive selection of methods to try for data
+
+        @param hint: data source key - inode
+        @return: tuple of methods or None - try all
+        """
+        if not self.getOption("compression_adaptive") or len(self._methods) < 2:
+            return None
+
+        stat = self._stats.get(hint)
+        if stat is None:
+            return None
+
+        self._stats.move_to_end(hint)
+
+        count, wins = stat
+        if count < self._adaptive_sample or count % self._adaptive_retry == 0:
+            return None
+
+        best = max(wins, key=wins.get)
+        if best == constants.COMPRESSION_TYPE_NONE:
+            # Incompressible data - don't try at all
+            return ()
+        return (best,)
+
+    def _updateStats(self, hint, method):
+        """
+        Count method that won
+
+        @param hint: data source key - inode
+        @param method: compression method used
+        """
+        if not self.getOption("compression_adaptive") or len(self._methods) < 2:
+            return
+
+        stat = self._stats.get(hint)
+        if stat is None:
+            stat = self._stats[ hint ] = [0, {}]
+            if len(self._stats) > self._adaptive_max_hints:
+                self._stats.popitem(last=False)
+
+        stat[0] += 1
+        stat[1][ method ] = stat[1].get(method, 0) + 1
+        return
+
+    def _compressData(self, data, methods=None):
         """
         Compress data and returns back
 
+        @param methods: methods to try, None - all selected
+
         @return tuple (compressed data (bytes), compresion method (string) )
         """
 
@@ -203,12 +345,23 @@ class BaseCompressTool(object):
         if data_length <= self.getOption("compression_minimal_size") and not forced:
             return cdata, cmethod
 
+        if methods is None:
+            methods = self._methods
+
+        if not methods and not forced:
+            return cdata, cmethod
+
+        if self.getOption("compression_adaptive") and not forced:
+            if self._isDataIncompressible(data, data_length):
+                self.getLogger().debug("BaseCompressTool::_compressData - data looks incompressible")
+                return cdata, cmethod
+
         cdata_length = data_length
         min_len = data_length
 
         self.getLogger().debug("BaseCompressTool::_compressData - data length = %r" % data_length)
 
-        for m in self._methods:
+        for m in methods:
             comp = self._compressors[ m ]
             self.getLogger().debug("BaseCompressTool::_compressData - try method = %r" % m)
             if comp.isDataMayBeCompressed(data, data_length):
@@ -239,19 +392,26 @@ class BaseCompressTool(object):
 
         return cdata, cmethod
 
-    def compressData(self, dataToCompress):
+    def compressData(self, dataToCompress, hints=None):
         """
         Compress data and returns back
 
         @param dataToCompress: dict { hash id: bytes data }
+        @param hints: dict { hash id: data source key (inode) } for adaptive method selection
 
         @return tuple ( hash id, (compressed data (bytes), compresion method (string) ) )
         """
 
         start_time = time()
 
+        if hints is None:
+            hints = {}
+
         for hash_id, data in dataToCompress.items():
-            yield  hash_id, self._compressData(data)
+            hint = hints.get(hash_id)
+            result = self._compressData(data, self._selectMethods(hint))
+            self._updateStats(hint, result[1])
+            yield  hash_id, result
 
         self.time_spent_compressing = time() - start_time
 
@@ -266,6 +426,108 @@ class BaseCompressTool(object):
         comp = self._compressors[ method ]
         return comp.decompressData(data)
 
+    def _doTask(self, task):
+        """
+        Process task in worker
+
+        @type task: Task
+        @rtype: Result
+        """
+        result = Result()
+        result.key = task.key
+        result.call = task.call
+        try:
+            if task.method is None:
+                result.cdata, result.method = self._compressData(task.data, task.methods)
+            else:
+                result.method = task.method
+                result.data = self.decompressData(task.method, task.data)
+        except Exception as e:
+            result.error = "%s: %s" % (e.__class__.__name__, e,)
+        return result
+
+    def _beginCall(self):
+        """
+        Workers put results of all callers in one queue,
+        every call gets id to find own ones
+
+        @rtype: int
+        """
+        with self._results_lock:
+            self._last_call += 1
+            self._results[ self._last_call ] = []
+            return self._last_call
+
+    def _endCall(self, call, outstanding):
+        """
+        Wait results not taken by caller - stopped iteration or error,
+        so workers don't use call data anymore.
+        Results of ended call are dropped by other callers.
+
+        @param call: call id
+        @param outstanding: count of tasks which results are not taken
+        """
+        try:
+            for n in range(outstanding):
+                self._getResult(call)
+        finally:
+            with self._results_lock:
+                self._results.pop(call, None)
+        return
+
+    def _checkWorkers(self):
+        """
+        Raise error if result can't come
+        """
+        return
+
+    def _getResult(self, call):
+        """
+        Wait for next result of call.
+        Results of other calls are kept for them.
+
+        @param call: call id
+        @rtype: Result
+        """
+        while True:
+            with self._results_lock:
+                results = self._results.get(call)
+                if results:
+                    return results.pop(0)
+
+                try:
+                    res = self._result_queue.get(True, self._result_timeout)
+                except Empty:
+                    res = None
+
+                if res is not None:
+                    if res.call == call:
+                        return res
+                    if res.call in self._results:
+                        self._results[ res.call ].append(res)
+                    continue
+
+            self._checkWorkers()
+
+    def decompressDataMany(self, dataToDecompress):
+        """
+        deCompress many data blocks and returns back
+
+        @param dataToDecompress: dict { key: (compression method (string), compressed data (bytes) ) }
+
+        @return tuple ( key, data (bytes) )
+        """
+
+        start_time = time()
+
+        for key, cItem in dataToDecompress.items():
+            method, cdata = cItem
+            yield key, self.decompressData(method, cdata)
+
+        self.time_spent_decompressing = time() - start_time
+
+        return
+
     def isDeprecated(self, method):
         """
         Is (de)compression method deprecated and should not be used
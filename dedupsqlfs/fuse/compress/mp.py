@@ -1,25 +1,33 @@
 # -*- coding: utf8 -*-
 """
-Base class for compression tool
-Some base methods, properties...
-Used in single or multi process compression classes
+Class for multi-process compression tool
+
+Workers block on shared task queue, results are waited on result queue.
+Results are tagged with id of call, so concurrent or abandoned calls don't mix them.
+Block data passed to workers through shared memory if it is available,
+so it is not pickled on the way in and compressed data on the way back.
 """
 
 __author__ = 'sergey'
 
-from time import sleep, time
+from time import time
 from .base import BaseCompressTool, Task, Result
-from multiprocessing import JoinableQueue, Process, cpu_count
+from multiprocessing import Queue, Process, cpu_count
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python < 3.8
+    shared_memory = None
 
 class MultiProcCompressTool(BaseCompressTool):
 
     _procs = None
     _np = 0
     _np_limit = 0
-    _task_queues = None
+    _task_queue = None
     _result_queue = None
 
-
     def checkCpuLimit(self):
         if self.getOption("cpu_limit"):
             self._np_limit = int(self.getOption("cpu_limit"))
@@ -29,19 +37,25 @@ class MultiProcCompressTool(BaseCompressTool):
                 self._np = self._np_limit
         return self._np
 
-    def init(self):
+    def init(self, logger):
+
+        BaseCompressTool.init(self, logger)
 
         self._procs = []
-        self._task_queues = []
 
         self._np = self.checkCpuLimit()
 
-        self._result_queue = JoinableQueue()
+        self._task_queue = Queue()
+        self._result_queue = Queue()
+
+        if shared_memory is not None:
+            # Workers must share tracker of shared memory with main process,
+            # own tracker would unlink blocks on worker exit
+            from multiprocessing import resource_tracker
+            resource_tracker.ensure_running()
 
         for n in range(self._np):
-            tq = JoinableQueue()
-            self._task_queues.append(tq)
-            p = Process(target=self._worker, name="Compressor-%s" % n, args=(tq, self._result_queue,))
+            p = Process(target=self._worker, name="Compressor-%s" % n, args=(self._task_queue, self._result_queue,))
             p.start()
             self._procs.append(p)
 
@@ -49,23 +63,11 @@ class MultiProcCompressTool(BaseCompressTool):
 
     def stop(self):
 
-        count = 50
-        alive = True
-        while alive:
-            for n in range(self._np):
-                tq = self._task_queues[ n ]
-                tq.put_nowait("stop")
-
-            sleep(0.1)
-
-            alive = False
-            for n in range(self._np):
-                if self._procs[n].is_alive():
-                    alive = True
+        for n in range(self._np):
+            self._task_queue.put("stop")
 
-            count -= 1
-            if count <= 0:
-                break
+        for n in range(self._np):
+            self._procs[n].join(5)
 
         for n in range(self._np):
             if self._procs[n].is_alive():
@@ -76,51 +78,110 @@ class MultiProcCompressTool(BaseCompressTool):
     def _worker(self, in_queue, out_queue):
         """
 
-        @param in_queue: {multiprocessing.JoinableQueue}
-        @param out_queue: {multiprocessing.JoinableQueue}
+        @param in_queue: {multiprocessing.Queue}
+        @param out_queue: {multiprocessing.Queue}
 
         @var task: Task
 
         @return:
         """
 
-        sleep_wait = 0.01
-
         while True:
 
-            try:
-                task = in_queue.get_nowait()
-            except:
-                task = None
-
-            if task is None:
-                sleep(sleep_wait)
-                continue
-
-            if type(task) is float:
-                sleep_wait = task
-                in_queue.task_done()
-                sleep(sleep_wait)
-                continue
+            task = in_queue.get()
 
             if type(task) is str and task == "stop":
-                in_queue.task_done()
                 break
 
             if type(task) is Task:
-                result = Result()
-                result.cdata, result.method = self._compressData(task.data)
-                result.key = task.key
-                out_queue.put_nowait(result)
-                in_queue.task_done()
+                out_queue.put(self._doTask(task))
 
         return
 
-    def compressData(self, dataToCompress):
+    def _doTask(self, task):
+        """
+        Read task data from shared memory, put compressed data back in place
+
+        @type task: Task
+        @rtype: Result
+        """
+        if task.buffer is None:
+            return BaseCompressTool._doTask(self, task)
+
+        name, offset, length = task.buffer
+
+        shm = None
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+            task.data = bytes(shm.buf[offset:offset + length])
+
+            result = BaseCompressTool._doTask(self, task)
+
+            # Compressed data is never longer than source
+            if result.cdata is not None and len(result.cdata) <= length:
+                result.size = len(result.cdata)
+                shm.buf[offset:offset + result.size] = result.cdata
+                result.cdata = None
+        except Exception as e:
+            # Caller waits result anyway
+            result = Result()
+            result.key = task.key
+            result.call = task.call
+            result.method = task.method
+            result.error = "%s: %s" % (e.__class__.__name__, e,)
+        finally:
+            if shm is not None:
+                shm.close()
+
+        return result
+
+    def _putTasks(self, tasks):
+        """
+        Send tasks to workers
+
+        @param tasks: list of Task with data
+        @return: SharedMemory or None
+        """
+        shm = None
+        if shared_memory is not None:
+            total = sum(len(task.data) for task in tasks)
+            try:
+                shm = shared_memory.SharedMemory(create=True, size=max(total, 1))
+            except OSError as e:
+                # /dev/shm may be too small - pass data in tasks
+                self.getLogger().debug("MultiProcCompressTool::_putTasks - no shared memory: %s" % e)
+                shm = None
+
+        offset = 0
+        for task in tasks:
+            if shm is not None:
+                length = len(task.data)
+                shm.buf[offset:offset + length] = task.data
+                task.buffer = (shm.name, offset, length,)
+                task.data = None
+                offset += length
+            self._task_queue.put(task)
+
+        return shm
+
+    def _checkWorkers(self):
+        for p in self._procs:
+            if not p.is_alive():
+                raise RuntimeError("Compression worker %s died!" % p.name)
+        return
+
+    def _freeSharedMemory(self, shm):
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+        return
+
+    def compressData(self, dataToCompress, hints=None):
         """
         Compress data and returns back
 
         @param dataToCompress: dict { hash id: bytes data }
+        @param hints: dict { hash id: data source key (inode) } for adaptive method selection
 
         @return dict { hash id: (compressed data (bytes), compresion method (string) ) }
         """
@@ -128,41 +189,109 @@ class MultiProcCompressTool(BaseCompressTool):
 
         nkeys = len(dataToCompress.keys())
 
-        for n in range(self._np):
-            tq = self._task_queues[n]
-            tq.put_nowait(0.001)
+        tasks = []
+        if hints is None:
+            hints = {}
+
+        call = self._beginCall()
 
-        i = 0
         for key, data in dataToCompress.items():
             task = Task()
             task.key = key
+            task.call = call
             task.data = data
-            nq = i % self._np
-            tq = self._task_queues[ nq ]
-            tq.put_nowait(task)
-            i += 1
+            task.methods = self._selectMethods(hints.get(key))
+            tasks.append(task)
+
+        shm = self._putTasks(tasks)
+
+        buffers = {}
+        for task in tasks:
+            buffers[ task.key ] = task.buffer
+        del tasks
+
+        # All results must be taken from queue, even after error
+        error = None
+        taken = 0
+
+        try:
+            while taken < nkeys:
+                res = self._getResult(call)
+                taken += 1
+
+                if res.error is not None:
+                    if error is None:
+                        error = "Can't compress data block %r! %s" % (res.key, res.error,)
+                    continue
+                if error is not None:
+                    continue
+
+                cdata = res.cdata
+                if cdata is None:
+                    name, offset, length = buffers[ res.key ]
+                    cdata = bytes(shm.buf[offset:offset + res.size])
+
+                self._updateStats(hints.get(res.key), res.method)
+                yield res.key, (cdata, res.method,)
+        finally:
+            self._endCall(call, nkeys - taken)
+            self._freeSharedMemory(shm)
 
-        gotKeys = 0
-        while gotKeys < nkeys:
-            try:
-                res = self._result_queue.get_nowait()
-            except:
-                res = None
+        self.time_spent_compressing = time() - start_time
 
-            if res is None:
-                sleep(0.001)
-                continue
+        if error is not None:
+            raise OSError(error)
 
-            if type(res) is Result:
-                self._result_queue.task_done()
-                yield res.key, (res.cdata, res.method,)
-                gotKeys += 1
+        return
 
-        for n in range(self._np):
-            tq = self._task_queues[n]
-            tq.put_nowait(0.01)
+    def decompressDataMany(self, dataToDecompress):
+        """
+        deCompress many data blocks in workers and returns back
 
-        self.time_spent_compressing = time() - start_time
+        @param dataToDecompress: dict { key: (compression method (string), compressed data (bytes) ) }
+
+        @return tuple ( key, data (bytes) )
+        """
+        start_time = time()
+
+        nkeys = len(dataToDecompress.keys())
+
+        call = self._beginCall()
+
+        tasks = []
+        for key, cItem in dataToDecompress.items():
+            task = Task()
+            task.key = key
+            task.call = call
+            task.method, task.data = cItem
+            tasks.append(task)
+
+        shm = self._putTasks(tasks)
+        del tasks
+
+        # All results must be taken from queue, even after error
+        error = None
+        taken = 0
+
+        try:
+            while taken < nkeys:
+                res = self._getResult(call)
+                taken += 1
+
+                if res.error is not None:
+                    if error is None:
+                        error = "Can't decompress data block %r with %s! %s" % (res.key, res.method, res.error,)
+                    continue
+                if error is None:
+                    yield res.key, res.data
+        finally:
+            self._endCall(call, nkeys - taken)
+            self._freeSharedMemory(shm)
+
+        self.time_spent_decompressing = time() - start_time
+
+        if error is not None:
+            raise OSError(error)
 
         return
 
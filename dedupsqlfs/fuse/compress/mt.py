@@ -1,12 +1,15 @@
 # -*- coding: utf8 -*-
 """
 Class for multi-threaded compression tool
+
+Workers block on shared task queue, results are waited on result queue.
+Results are tagged with id of call, so concurrent or abandoned calls don't mix them.
 """
 
 __author__ = 'sergey'
 
-from time import sleep, time
-from .base import BaseCompressTool, Task, Result
+from time import time
+from .base import BaseCompressTool, Task
 from threading import Thread
 from queue import Queue
 from multiprocessing import cpu_count
@@ -22,7 +25,7 @@ class MultiThreadCompressTool(BaseCompressTool):
 
     _np = 0
     _np_limit = 0
-    _task_queues = None
+    _task_queue = None
     _result_queue = None
 
 
@@ -35,19 +38,20 @@ class MultiThreadCompressTool(BaseCompressTool):
                 self._np = self._np_limit
         return self._np
 
-    def init(self):
+    def init(self, logger):
+
+        BaseCompressTool.init(self, logger)
 
         self._threads = []
-        self._task_queues = []
 
         self._np = self.checkCpuLimit()
 
+        self._task_queue = Queue()
         self._result_queue = Queue()
 
         for n in range(self._np):
-            tq = Queue()
-            self._task_queues.append(tq)
-            p = Thread(target=self._worker, name="Compressor-%s" % n, args=(tq, self._result_queue,))
+            p = Thread(target=self._worker, name="Compressor-%s" % n, args=(self._task_queue, self._result_queue,))
+            p.daemon = True
             p.start()
             self._threads.append(p)
 
@@ -55,86 +59,49 @@ class MultiThreadCompressTool(BaseCompressTool):
 
     def stop(self):
 
-        count = 50
-        alive = True
-        while alive:
-            for n in range(self._np):
-                tq = self._task_queues[ n ]
-                tq.put_nowait("stop")
-
-            sleep(0.1)
-
-            alive = False
-            for n in range(self._np):
-                t = self._threads[n]
-                """
-                @type t: StoppableThread
-                """
-                if t.is_alive():
-                    alive = True
-
-            count -= 1
-            if count <= 0:
-                break
+        for n in range(self._np):
+            self._task_queue.put("stop")
 
         for n in range(self._np):
-            t = self._threads[n]
-            """
-            @type t: Thread
-            """
-            if t.is_alive():
-                t._stop()
+            self._threads[n].join(5)
 
         return self
 
+    def _checkWorkers(self):
+        for p in self._threads:
+            if not p.is_alive():
+                raise RuntimeError("Compression worker %s died!" % p.name)
+        return
+
     def _worker(self, in_queue, out_queue):
         """
 
-        @param in_queue: {multiprocessing.JoinableQueue}
-        @param out_queue: {multiprocessing.JoinableQueue}
+        @param in_queue: {queue.Queue}
+        @param out_queue: {queue.Queue}
 
         @var task: Task
 
         @return:
         """
 
-        sleep_wait = 0.01
-
         while True:
 
-            try:
-                task = in_queue.get_nowait()
-            except:
-                task = None
-
-            if task is None:
-                sleep(sleep_wait)
-                continue
-
-            if type(task) is float:
-                sleep_wait = task
-                in_queue.task_done()
-                sleep(sleep_wait)
-                continue
+            task = in_queue.get()
 
             if type(task) is str and task == "stop":
-                in_queue.task_done()
                 break
 
             if type(task) is Task:
-                result = Result()
-                result.cdata, result.method = self._compressData(task.data)
-                result.key = task.key
-                out_queue.put_nowait(result)
-                in_queue.task_done()
+                out_queue.put(self._doTask(task))
 
         return
 
-    def compressData(self, dataToCompress):
+    def compressData(self, dataToCompress, hints=None):
         """
         Compress data and returns back
 
         @param dataToCompress: dict { hash id: bytes data }
+        @param hints: dict { hash id: data source key (inode) } for adaptive method selection
 
         @return dict { hash id: (compressed data (bytes), compresion method (string) ) }
         """
@@ -142,42 +109,87 @@ class MultiThreadCompressTool(BaseCompressTool):
 
         nkeys = len(dataToCompress.keys())
 
-        for n in range(self._np):
-            tq = self._task_queues[n]
-            tq.put_nowait(0.001)
+        if hints is None:
+            hints = {}
+
+        call = self._beginCall()
 
-        i = 0
         for key, data in dataToCompress.items():
             task = Task()
             task.key = key
+            task.call = call
             task.data = data
-            nq = i % self._np
-            tq = self._task_queues[ nq ]
-            tq.put_nowait(task)
-            i += 1
-
-        gotKeys = 0
-        while gotKeys < nkeys:
-            try:
-                res = self._result_queue.get_nowait()
-            except:
-                res = None
-
-            if res is None:
-                sleep(0.001)
-                continue
-
-            if type(res) is Result:
-                self._result_queue.task_done()
-                yield res.key, (res.cdata, res.method,)
-                gotKeys += 1
-
-        for n in range(self._np):
-            tq = self._task_queues[n]
-            tq.put_nowait(0.01)
+            task.methods = self._selectMethods(hints.get(key))
+            self._task_queue.put(task)
+
+        # All results must be taken from queue, even after error
+        error = None
+        taken = 0
+
+        try:
+            while taken < nkeys:
+                res = self._getResult(call)
+                taken += 1
+                if res.error is not None:
+                    if error is None:
+                        error = "Can't compress data block %r! %s" % (res.key, res.error,)
+                    continue
+                if error is None:
+                    self._updateStats(hints.get(res.key), res.method)
+                    yield res.key, (res.cdata, res.method,)
+        finally:
+            self._endCall(call, nkeys - taken)
 
         self.time_spent_compressing = time() - start_time
 
+        if error is not None:
+            raise OSError(error)
+
+        return
+
+    def decompressDataMany(self, dataToDecompress):
+        """
+        deCompress many data blocks in workers and returns back
+
+        @param dataToDecompress: dict { key: (compression method (string), compressed data (bytes) ) }
+
+        @return tuple ( key, data (bytes) )
+        """
+        start_time = time()
+
+        nkeys = len(dataToDecompress.keys())
+
+        call = self._beginCall()
+
+        for key, cItem in dataToDecompress.items():
+            task = Task()
+            task.key = key
+            task.call = call
+            task.method, task.data = cItem
+            self._task_queue.put(task)
+
+        # All results must be taken from queue, even after error
+        error = None
+        taken = 0
+
+        try:
+            while taken < nkeys:
+                res = self._getResult(call)
+                taken += 1
+                if res.error is not None:
+                    if error is None:
+                        error = "Can't decompress data block %r with %s! %s" % (res.key, res.method, res.error,)
+                    continue
+                if error is None:
+                    yield res.key, res.data
+        finally:
+            self._endCall(call, nkeys - taken)
+
+        self.time_spent_decompressing = time() - start_time
+
+        if error is not None:
+            raise OSError(error)
+
         return
 
     pass
@@ -250,7 +250,16 @@ class DedupFS(object): # {{{1
         ex = None
         try:
             fuse.init(self.operations, self.mountpoint, self._opts)
-            fuse.main(single=True)
+
+            workers = self.getOption("fuse_workers") or 1
+            if workers > 1:
+                self.getLogger().info("Start FUSE main loop with %i worker threads" % workers)
+                self.operations.setMultiThreaded(True)
+
+            if int(fv[0]) >= 1:
+                fuse.main(workers=workers)
+            else:
+                fuse.main(single=workers <= 1)
         except Exception as e:
             error = True
             ex = e
@@ -326,6 +335,7 @@ class DedupFS(object): # {{{1
         self._compressTool.setOption("compression_minimal_size", self.getOption("compression_minimal_size"))
         self._compressTool.setOption("compression_level", self.getOption("compression_level"))
         self._compressTool.setOption("compression_forced", self.getOption("compression_forced"))
+        self._compressTool.setOption("compression_adaptive", self.getOption("compression_adaptive"))
 
         return
 
@@ -333,12 +343,15 @@ class DedupFS(object): # {{{1
     def getCompressTool(self):
         return self._compressTool
 
-    def compressData(self, dataBlocks):
-        return self._compressTool.compressData(dataBlocks)
+    def compressData(self, dataBlocks, hints=None):
+        return self._compressTool.compressData(dataBlocks, hints)
 
     def decompressData(self, method, compressedBlock):
         return self._compressTool.decompressData(method, compressedBlock)
 
+    def decompressDataMany(self, compressedBlocks):
+        return self._compressTool.decompressDataMany(compressedBlocks)
+
     def isDeprecated(self, method):
         return self._compressTool.isDeprecated(method)
 
@@ -6,7 +6,6 @@ import sys
 # Try to load the required modules from Python's standard library.
 
 try:
-    from io import BytesIO
     import errno
     import hashlib
     from math import floor, ceil, modf
@@ -37,6 +36,7 @@ from dedupsqlfs.lib.cache.simple import CacheTTLseconds
 from dedupsqlfs.lib.cache.storage import StorageTimeSize
 from dedupsqlfs.lib.cache.index import IndexTime
 from dedupsqlfs.lib.cache.inodes import InodesTime
+from dedupsqlfs.lib.cache.warm import WarmMetaCache
 from dedupsqlfs.fuse.subvolume import Subvolume
 from dedupsqlfs import __fsversion__
 
@@ -48,6 +48,8 @@ class DedupOperations(llfuse.Operations): # {{{1
 
         # Initialize instance attributes.
         self.block_size = 1024 * 128
+        # Stored in database, tools without --hash option use it
+        self.hash_function = 'sha1'
 
         self.bytes_read = 0
         self.bytes_written = 0
@@ -77,8 +79,13 @@ class DedupOperations(llfuse.Operations): # {{{1
         self.cached_name_ids = CacheTTLseconds()
         self.cached_nodes = CacheTTLseconds()
         self.cached_attrs = InodesTime()
+        # Names, tree nodes and inodes from previous mount
+        self.warm_meta_cache = None
         self.cached_xattrs = CacheTTLseconds()
 
+        # Block sizes of inodes which differ from filesystem one
+        self.inode_block_sizes = None
+
         self.cached_blocks = StorageTimeSize()
         self.cached_indexes = IndexTime()
 
@@ -94,6 +101,11 @@ class DedupOperations(llfuse.Operations): # {{{1
         self.gc_hook_last_run = time()
         self.gc_interval = 60
 
+        # Pages reclaimed by online incremental vacuum on one tick
+        self.vacuum_step_pages = 0
+        self.vacuum_hook_last_run = time()
+        self.vacuum_pages_reclaimed = 0
+
         self.link_mode = stat.S_IFLNK | 0o777
 
         self.memory_usage = 0
@@ -131,6 +143,32 @@ class DedupOperations(llfuse.Operations): # {{{1
 
         self.manager = None
 
+        # FUSE main loop runs with several worker threads
+        self.multithreaded = False
+
+        # Bloom filter in front of hash table lookups
+        self.hash_filter = None
+        # Filter file is removed once then hash table changed without it
+        self.hash_filter_dropped = False
+        # Ids of hashes inserted by current flush, list while flush runs
+        self.flush_hash_ids = None
+
+        # Sequential read detection: { fh: [next offset, last prefetched block number] }
+        self.read_ahead_blocks = 0
+        self.read_ahead_state = {}
+        self.time_spent_prefetching = 0
+
+        # Large blocks for files written sequentially past threshold, 0 - off
+        # Sequential write detection: { fh: next offset or False }
+        self.adaptive_block_size = 0
+        self.adaptive_block_threshold = 4 * 1024 * 1024
+        self.write_seq_state = {}
+
+        # Content-defined chunking inside blocks
+        self.chunking = constants.CHUNKING_DEFAULT
+        self.chunk_size = 0
+        self.chunker = None
+
     # FUSE API implementation: {{{2
 
     def setApplication(self, application):
@@ -140,6 +178,18 @@ class DedupOperations(llfuse.Operations): # {{{1
         self.application = application
         return self
 
+    def setMultiThreaded(self, flag=True):
+        """
+        Workers share llfuse global lock. It is released only while
+        block is decompressed on read, then block cache, index and
+        block size of inode are checked again. All DB queries, cache
+        changes and batch compression stay under lock.
+
+        @type flag: bool
+        """
+        self.multithreaded = flag == True
+        return self
+
     def getManager(self):
         """
         @return: DbManager
@@ -174,9 +224,21 @@ class DedupOperations(llfuse.Operations): # {{{1
 
             self.manager.setLogger(self.getLogger())
             self.manager.setTableEngine(self.getOption('table_engine'))
+            self.manager.setKeepalive(self.getOption('mysql_keepalive'))
+            self.manager.setAttach(self.getOption('sqlite_attach'))
+            self.manager.setExclusiveLock(self.getOption('sqlite_exclusive_lock'))
             self.manager.setSynchronous(self.getOption("synchronous"))
             self.manager.setAutocommit(self.getOption("use_transactions"))
             self.manager.setBasepath(os.path.expanduser(self.getOption("data")))
+
+            if self.manager.getAttach() and self.manager.TYPE == "sqlite":
+                # New filesystem gets count of shards from option
+                shards = max(self.manager.getBlockShards()[0], self.getOption("block_shards") or 1)
+                if shards > 1:
+                    # Every shard has own connection, flush can't be commited at once
+                    self.getLogger().warning("Ignoring --sqlite-attach argument, block store has %d shards." % shards)
+                    self.manager.setAttach(False)
+
             self.manager.begin()
 
             from dedupsqlfs.db.migration import DbMigration
@@ -357,6 +419,9 @@ class DedupOperations(llfuse.Operations): # {{{1
             if self.getOption("verbosity") > 1:
                 self.__print_stats()
 
+            self.__save_warm_meta_cache()
+            self.__close_hash_filter()
+
             self.getManager().getTable('option').update('mounted', 0)
             self.getManager().commit()
 
@@ -383,7 +448,7 @@ class DedupOperations(llfuse.Operations): # {{{1
             self.__log_call('flush', '-- inode(%i) size=%i', fh, attr["size"])
             if not attr["size"]:
                 self.__log_call('flush', '-- inode(%i) zero sized! remove all blocks', fh)
-                self.getTable("inode_hash_block").delete(fh)
+                self.__remove_inode_blocks(fh)
                 self.cached_blocks.forget(fh)
             else:
                 self.cached_blocks.flush(fh)
@@ -433,7 +498,7 @@ class DedupOperations(llfuse.Operations): # {{{1
             self.__log_call('fsync', '-- inode(%i) size=%i', fh, attr["size"])
             if not attr["size"]:
                 self.__log_call('fsync', '-- inode(%i) zero sized! remove all blocks', fh)
-                self.getTable("inode_hash_block").delete(fh)
+                self.__remove_inode_blocks(fh)
                 self.cached_blocks.forget(fh)
                 self.cached_indexes.expire(fh)
             else:
@@ -500,6 +565,10 @@ class DedupOperations(llfuse.Operations): # {{{1
                 self.compression_method = self.getOption("compression_method")
             if self.getOption("hash_function") is not None:
                 self.hash_function = self.getOption("hash_function")
+            if self.getOption("chunking") is not None:
+                self.chunking = self.getOption("chunking")
+            if self.getOption("chunk_size"):
+                self.chunk_size = self.getOption("chunk_size")
 
             if self.getOption("use_cache") is not None:
                 self.cache_enabled = self.getOption("use_cache")
@@ -515,6 +584,12 @@ class DedupOperations(llfuse.Operations): # {{{1
                 self.cache_meta_timeout = self.getOption("cache_meta_timeout")
             if self.getOption("flush_interval") is not None:
                 self.flush_interval = self.getOption("flush_interval")
+            if self.getOption("read_ahead_blocks") is not None:
+                self.read_ahead_blocks = self.getOption("read_ahead_blocks")
+            if self.getOption("adaptive_block_size") is not None:
+                self.adaptive_block_size = self.getOption("adaptive_block_size")
+            if self.getOption("adaptive_block_threshold") is not None:
+                self.adaptive_block_threshold = self.getOption("adaptive_block_threshold")
 
             if self.getOption("gc_enabled") is not None:
                 self.gc_enabled = self.getOption("gc_enabled")
@@ -524,6 +599,8 @@ class DedupOperations(llfuse.Operations): # {{{1
                 self.gc_vacuum_enabled = self.getOption("gc_vacuum_enabled")
             if self.getOption("gc_interval") is not None:
                 self.gc_interval = self.getOption("gc_interval")
+            if self.getOption("vacuum_step_pages") is not None:
+                self.vacuum_step_pages = self.getOption("vacuum_step_pages")
 
             if not self.cache_enabled:
                 self.cached_blocks.setMaxReadTtl(0)
@@ -552,6 +629,9 @@ class DedupOperations(llfuse.Operations): # {{{1
                             self.cache_block_read_size = 256*self.block_size
                     self.cached_blocks.setMaxReadCacheSize(self.cache_block_read_size)
 
+                if self.getOption("cache_block_segmented"):
+                    self.cached_blocks.setSegmented(True)
+
                 self.cached_nodes.set_max_ttl(self.cache_meta_timeout)
                 self.cached_names.set_max_ttl(self.cache_meta_timeout)
                 self.cached_name_ids.set_max_ttl(self.cache_meta_timeout)
@@ -591,8 +671,12 @@ class DedupOperations(llfuse.Operations): # {{{1
 
             self.__select_subvolume()
             self.__get_opts_from_db()
+            self.__init_warm_meta_cache()
             # Make sure the hash function is (still) valid (since the database was created).
 
+            if self.getOption("use_hash_filter") and not self.isReadonly():
+                self.__init_hash_filter()
+
             # NOT READONLY - AND - Mountpoint defined (mount action)
             self.getApplication().startCacheFlusher()
 
@@ -764,6 +848,8 @@ class DedupOperations(llfuse.Operations): # {{{1
                 if row["size"] < offset + size:
                     size = row["size"] - offset
                     self.__log_call('read', '-- oversized! inode(size)=%i, corrected read size: %i', row["size"], size )
+                if self.read_ahead_blocks > 0 and self.cache_enabled:
+                    self.__read_ahead(fh, offset, size)
                 data = self.__get_block_data_by_offset(fh, offset, size)
             lr = len(data)
             self.bytes_read += lr
@@ -816,6 +902,8 @@ class DedupOperations(llfuse.Operations): # {{{1
     def release(self, fh): # {{{3
         self.__log_call('release', '->(fh=%i)', fh)
         #self.__flush_inode_cached_blocks(fh, clean=True)
+        self.read_ahead_state.pop(fh, None)
+        self.write_seq_state.pop(fh, None)
         self.cached_blocks.expire(fh)
         self.cached_attrs.expire(fh)
         self.__cache_block_hook()
@@ -890,6 +978,8 @@ class DedupOperations(llfuse.Operations): # {{{1
             treeTable.rename_inode(node_old["id"], node_parent_new["id"], string_id)
 
             self.cached_nodes.unset((inode_parent_old, name_old))
+            if self.warm_meta_cache is not None:
+                self.warm_meta_cache.forgetNode(inode_parent_old, node_old["name_id"])
             self.cached_names.unset(name_old)
             self.cached_name_ids.unset(node_old['name_id'])
 
@@ -1190,10 +1280,16 @@ class DedupOperations(llfuse.Operations): # {{{1
             #length = len(buf)
             #self.__log_call('write', 'length(buf)=%i', length)
 
+            if self.adaptive_block_size:
+                self.__adapt_block_size(fh, offset, len(buf))
+
             length = self.__write_block_data_by_offset(fh, offset, buf)
 
             self.__log_call('write', 'length(writed)=%i', length)
 
+            if self.write_seq_state.get(fh, False) is not False:
+                self.write_seq_state[fh] = offset + length
+
             attrs = self.__get_inode_row(fh)
             if attrs["size"] < offset + length:
                 # self.getTable("inode").set_size(fh, offset + length)
@@ -1241,11 +1337,18 @@ class DedupOperations(llfuse.Operations): # {{{1
         self.__log_call('__get_id_by_name', '->(name=%r)', name)
 
         name_id = self.cached_names.get(name)
+        if not name_id and self.warm_meta_cache is not None:
+            name_id = self.warm_meta_cache.getNameId(name)
+            if name_id:
+                self.cached_names.set(name, name_id)
+                self.cached_name_ids.set(name_id, name)
         if not name_id:
             name_id = self.getTable("name").find(name)
             if name_id:
                 self.cached_names.set(name, name_id)
                 self.cached_name_ids.set(name_id, name)
+                if self.warm_meta_cache is not None:
+                    self.warm_meta_cache.addName(name, name_id)
         if not name_id:
             self.getLogger().debug("! No name %r found, cant find name.id" % name)
             raise FUSEError(errno.ENOENT)
@@ -1276,15 +1379,22 @@ class DedupOperations(llfuse.Operations): # {{{1
 
             name_id = self.__get_id_by_name(name)
 
-            par_node = self.__get_tree_node_by_inode(parent_inode)
-            if not par_node:
-                self.getLogger().debug("! No parent inode %i found, cant get tree node" % parent_inode)
-                raise FUSEError(errno.ENOENT)
+            if self.warm_meta_cache is not None:
+                node = self.warm_meta_cache.getNode(parent_inode, name_id)
 
-            node = self.getTable("tree").find_by_parent_name(par_node["id"], name_id)
             if not node:
-                self.getLogger().debug("! No node %i and name %i found, cant get tree node" % (par_node["id"], name_id,))
-                raise FUSEError(errno.ENOENT)
+                par_node = self.__get_tree_node_by_inode(parent_inode)
+                if not par_node:
+                    self.getLogger().debug("! No parent inode %i found, cant get tree node" % parent_inode)
+                    raise FUSEError(errno.ENOENT)
+
+                node = self.getTable("tree").find_by_parent_name(par_node["id"], name_id)
+                if not node:
+                    self.getLogger().debug("! No node %i and name %i found, cant get tree node" % (par_node["id"], name_id,))
+                    raise FUSEError(errno.ENOENT)
+
+                if self.warm_meta_cache is not None:
+                    self.warm_meta_cache.addNode(parent_inode, node)
 
             self.cached_nodes.set((parent_inode, name), node)
 
@@ -1318,10 +1428,17 @@ class DedupOperations(llfuse.Operations): # {{{1
         if not row:
             start_time = time()
 
-            row = self.getTable("inode").get(inode_id)
+            if self.warm_meta_cache is not None:
+                row = self.warm_meta_cache.getInode(inode_id)
+
             if not row:
-                self.getLogger().debug("! No inode %i found, cant get row" % inode_id)
-                raise FUSEError(errno.ENOENT)
+                row = self.getTable("inode").get(inode_id)
+                if not row:
+                    self.getLogger().debug("! No inode %i found, cant get row" % inode_id)
+                    raise FUSEError(errno.ENOENT)
+
+                if self.warm_meta_cache is not None:
+                    self.warm_meta_cache.addInode(row)
 
             self.cached_attrs.set(inode_id, row)
 
@@ -1330,6 +1447,14 @@ class DedupOperations(llfuse.Operations): # {{{1
         self.__log_call('__get_inode_row', '<-(row=%r)', row)
         return row
 
+    def __get_inode_block_size(self, inode_id):
+        """
+        Block size of inode data, only inodes with own size are in inode_option
+        """
+        if self.inode_block_sizes is None:
+            self.inode_block_sizes = self.getTable("inode_option").get_block_sizes()
+        return self.inode_block_sizes.get(inode_id, self.block_size)
+
     def __fill_attr_inode_row(self, row): # {{{3
         self.__log_call('__fill_attr_inode_row', '->(row=%r)', row)
 
@@ -1358,8 +1483,9 @@ class DedupOperations(llfuse.Operations): # {{{1
             result.st_mtime_ns  = int(row["mtime"])
         if hasattr(result, "st_ctime_ns"):
             result.st_ctime_ns  = int(row["ctime"])
-        result.st_blksize   = int(self.block_size)
-        result.st_blocks    = int(result.st_size / self.block_size)
+        block_size = self.__get_inode_block_size(result.st_ino)
+        result.st_blksize   = int(block_size)
+        result.st_blocks    = int(result.st_size / block_size)
         return result
 
 
@@ -1389,7 +1515,11 @@ class DedupOperations(llfuse.Operations): # {{{1
                 self.cached_indexes.set(inode, block_number, item)
         return item
 
-    def __get_block_from_cache(self, inode, block_number):
+    def __get_block_from_cache(self, inode, block_number, release=True):
+        """
+        @param release: Release lock of multithreaded loop while block decompressed
+        @type  release: bool
+        """
         self.__log_call('__get_block_from_cache', '->(inode=%i, block_number=%i)', inode, block_number)
 
         block = self.cached_blocks.get(inode, block_number)
@@ -1398,20 +1528,26 @@ class DedupOperations(llfuse.Operations): # {{{1
 
             self.getLogger().debug("get block from DB: inode=%i, number=%i", inode, block_number)
 
+            block_size = self.__get_inode_block_size(inode)
             indexItem = self.__get_index_from_cache(inode, block_number)
+            if indexItem:
+                # Cached item is updated in place on write
+                indexItem = dict(indexItem)
             item = None
 
             recompress = False
 
-            block = BytesIO()
+            # Block size with zero tail, data stored without it
+            size = 0
+            bdata = None
+
             if not indexItem:
                 self.getLogger().debug("-- new block")
 
             else:
-                # Fully allocate block
                 if int(indexItem["real_size"]):
                     # If we have real block size
-                    block.write(b'\x00' * indexItem["real_size"])
+                    size = int(indexItem["real_size"])
                 else:
                     # Missing size
                     # If there was migration
@@ -1423,28 +1559,30 @@ class DedupOperations(llfuse.Operations): # {{{1
                     """
                     # Else - try to calculate
                     irow = self.__get_inode_row(inode)
-                    if irow["size"] <= self.block_size:
+                    if irow["size"] <= block_size:
                         if irow["size"] > 0:
-                            block.write(b'\x00' * irow["size"])
+                            size = irow["size"]
                             tableIndex.update_size(inode, block_number, irow["size"])
                     else:
-                        if irow["size"] <= self.block_size * block_number:
+                        if irow["size"] <= block_size * block_number:
                             # Last block?
-                            sz = irow["size"] % self.block_size
-                            block.write(b'\x00' * sz)
-                            tableIndex.update_size(inode, block_number, sz)
+                            size = irow["size"] % block_size
+                            tableIndex.update_size(inode, block_number, size)
                         else:
                             # Middle block
-                            block.write(b'\x00' * self.block_size)
-                            tableIndex.update_size(inode, block_number, self.block_size)
+                            size = block_size
+                            tableIndex.update_size(inode, block_number, block_size)
 
                 tableBlock = self.getTable("block")
 
                 item = tableBlock.get(indexItem["hash_id"])
                 if not item:
-                    err_str = "get block from DB: block not found! (inode=%i, block_number=%i, hash_id=%s)" % (inode, block_number, indexItem["hash_id"],)
-                    self.getLogger().error(err_str)
-                    raise OSError(err_str)
+                    # Block may be stored as content-defined chunks
+                    bdata = self.__get_chunked_data(indexItem["hash_id"])
+                    if bdata is None:
+                        err_str = "get block from DB: block not found! (inode=%i, block_number=%i, hash_id=%s)" % (inode, block_number, indexItem["hash_id"],)
+                        self.getLogger().error(err_str)
+                        raise OSError(err_str)
 
             # XXX: how block can be defragmented away?
             if item:
@@ -1454,8 +1592,6 @@ class DedupOperations(llfuse.Operations): # {{{1
                 self.getLogger().debug("-- decompress block")
                 self.getLogger().debug("-- in db size: %s" % len(item["data"]))
 
-                block.seek(0)
-
                 compression = self.getCompressionTypeName(compType["type_id"])
 
                 self.getLogger().debug("READ: Hash = %r, method = %r" % (indexItem["hash_id"], compression,))
@@ -1494,11 +1630,10 @@ class DedupOperations(llfuse.Operations): # {{{1
                                 compression, compType["type_id"],)
                             self.getLogger().error(err_str)
                             raise OSError(err_str)
-                    block.write(bdata)
 
                 else:
                     # If it fails - OSError raised
-                    block.write(self.__decompress(item["data"], compType["type_id"]))
+                    bdata = self.__decompress(item["data"], compType["type_id"], release)
 
                 if compression != constants.COMPRESSION_TYPE_NONE:
                     if self.getOption('compression_recompress_now') and self.application.isDeprecated(compression):
@@ -1509,11 +1644,245 @@ class DedupOperations(llfuse.Operations): # {{{1
                 if recompress:
                     self.getLogger().debug("-- will recompress block")
 
-                self.getLogger().debug("-- decomp size: %s" % len(block.getvalue()))
+                self.getLogger().debug("-- decomp size: %s" % len(bdata))
+
+            block = self.__new_block(bdata, size)
+
+            if self.multithreaded and release:
+                # Other worker could load or write this block while lock was released
+                cached = self.cached_blocks.get(inode, block_number)
+                if cached is not None:
+                    return cached
+                # ...or flush new data, truncate file or move it to other block size
+                if indexItem != self.__get_index_from_cache(inode, block_number) or \
+                        block_size != self.__get_inode_block_size(inode):
+                    return self.__get_block_from_cache(inode, block_number, False)
 
             self.cached_blocks.set(inode, block_number, block, writed=recompress)
         return block
 
+    def __new_block(self, bdata, size):
+        """
+        The only copy of data, zero tail appended in place
+
+        @param bdata: decompressed data or None
+        @param size: real size of block
+        @rtype: bytearray
+        """
+        if bdata:
+            block = bytearray(bdata)
+        else:
+            block = bytearray()
+        if len(block) < size:
+            block.extend(bytes(size - len(block)))
+        return block
+
+    def __read_ahead(self, fh, offset, size):
+        """
+        Detect sequential reading of file and load next blocks in batch
+
+        Window of read_ahead_blocks is kept before reading position.
+        Next part loaded then half of window is readed.
+        """
+        state = self.read_ahead_state.get(fh)
+        if state is None or state[0] != offset:
+            # First or random access - start over
+            self.read_ahead_state[fh] = [offset + size, -1]
+            return 0
+        state[0] = offset + size
+
+        block_size = self.__get_inode_block_size(fh)
+        last_block = int((offset + size - 1) // block_size)
+        if state[1] - last_block >= self.read_ahead_blocks // 2:
+            return 0
+
+        first_block = max(state[1] + 1, int(offset // block_size))
+        state[1] = last_block + self.read_ahead_blocks
+
+        return self.__prefetch_blocks(fh, first_block, state[1])
+
+    def __adapt_block_size(self, fh, offset, size):
+        """
+        Detect sequential writing of new file and move it to large blocks
+
+        Only empty file written from start is watched. When it grows past
+        adaptive_block_threshold, data written so far is moved to blocks
+        of adaptive_block_size once. Small files and files written not
+        in order keep filesystem block size.
+        """
+        state = self.write_seq_state.get(fh)
+        if state is None:
+            state = False
+            if offset == 0 and self.__get_inode_block_size(fh) == self.block_size:
+                if self.__get_inode_row(fh)["size"] == 0:
+                    state = 0
+
+        if state is False or state != offset:
+            self.write_seq_state[fh] = False
+            return False
+
+        if offset + size <= self.adaptive_block_threshold:
+            # Next offset is set after write
+            self.write_seq_state[fh] = offset
+            return False
+
+        # Decided, don't watch anymore
+        self.write_seq_state[fh] = False
+
+        if self.__get_inode_row(fh)["size"] != offset:
+            # Truncated between writes
+            return False
+
+        self.__change_inode_block_size(fh, offset, self.adaptive_block_size)
+        return True
+
+    def __change_inode_block_size(self, inode, size, block_size):
+        """
+        Rewrite data of inode to blocks of new size.
+
+        New blocks, replacement of index and block size are written
+        in one batch, old index stays until it is commited.
+        Old blocks lose references and are collected as garbage.
+
+        @param size: size of data in file
+        @type  size: int
+        """
+        self.getLogger().debug("__change_inode_block_size: inode = %s, size = %s, new block size = %s" % (inode, size, block_size,))
+
+        data = self.__get_block_data_by_offset(inode, 0, size)
+        # Not readed by user
+        self.bytes_read -= len(data)
+
+        blocks = []
+        for offset in range(0, len(data), block_size):
+            blocks.append((inode, offset // block_size, data[offset:offset + block_size],))
+
+        manager = self.getManager()
+
+        self.__open_write_tables()
+        self.getTable("inode_option")
+
+        started = manager.beginWriteBatch()
+        try:
+            self.cached_indexes.drop(inode)
+            self.__remove_inode_blocks(inode)
+            self.__store_blocks(blocks)
+            self.getTable("inode_option").set_block_size(inode, block_size)
+        except Exception:
+            manager.rollbackWriteBatch(started)
+            # Index of new blocks is not stored
+            self.cached_indexes.drop(inode)
+            raise
+        manager.commitWriteBatch(started)
+
+        # Unflushed data is in new blocks already
+        self.cached_blocks.drop(inode)
+        self.read_ahead_state.pop(inode, None)
+        # Loaded by __get_inode_block_size on read
+        self.inode_block_sizes[ inode ] = block_size
+        return
+
+    def __prefetch_blocks(self, inode, first_block, last_block):
+        """
+        Load range of file blocks to read cache: one query for indexes,
+        one for data. Blocks that need special care (chunked, to be recompressed,
+        without size) are skipped - they will be loaded on demand.
+
+        @return: count of loaded blocks
+        """
+        start_time = time()
+
+        row = self.__get_inode_row(inode)
+        if row["size"] <= 0:
+            return 0
+        last_block = min(last_block, int((row["size"] - 1) // self.__get_inode_block_size(inode)))
+
+        numbers = [bn for bn in range(first_block, last_block + 1) if not self.cached_blocks.has(inode, bn)]
+        if not numbers:
+            return 0
+
+        tableIndex = self.getTable("inode_hash_block")
+        dbItems = None
+
+        indexItems = {}
+        for bn in numbers:
+            item = self.cached_indexes.get(inode, bn)
+            if item is None:
+                if dbItems is None:
+                    dbItems = tableIndex.get_by_inode_range(inode, numbers[0], numbers[-1])
+                item = dbItems.get(bn)
+                self.cached_indexes.set(inode, bn, item or False)
+            if item and int(item["real_size"]):
+                indexItems[bn] = item
+
+        if not indexItems:
+            return 0
+
+        id_str = ",".join(set(str(item["hash_id"]) for item in indexItems.values()))
+        blocks = self.getTable("block").get_many(id_str)
+        hash_types = self.getTable("hash_compression_type").get_types_by_hash_ids(id_str)
+
+        blocksToDecompress = {}
+        for bn, item in indexItems.items():
+            hash_id = item["hash_id"]
+            if hash_id not in blocks or hash_id not in hash_types:
+                continue
+
+            compression = self.getCompressionTypeName(hash_types[hash_id])
+            if compression != constants.COMPRESSION_TYPE_NONE:
+                if self.getOption('compression_recompress_now') and self.application.isDeprecated(compression):
+                    continue
+                if self.getOption('compression_recompress_current') and not self.application.isMethodSelected(compression):
+                    continue
+
+            blocksToDecompress[ bn ] = (compression, blocks[hash_id],)
+
+        count = 0
+        decomp_time = time()
+        try:
+            # Decompressed on all workers of compression tool,
+            # lock is kept - index and cache used here stay valid
+            for bn, bdata in self.application.decompressDataMany(blocksToDecompress):
+                self.cached_blocks.set(inode, bn, self.__new_block(bdata, int(indexItems[bn]["real_size"])))
+                count += 1
+        except Exception as e:
+            # Leave errors to on demand read
+            self.getLogger().warning("Prefetch of inode %i blocks failed: %s" % (inode, e,))
+        self.time_spent_decompressing += time() - decomp_time
+
+        self.getLogger().debug("-- prefetched %i blocks of inode %i" % (count, inode,))
+
+        self.time_spent_prefetching += time() - start_time
+        return count
+
+    def __get_chunked_data(self, hash_id):
+        """
+        Assemble block data from its chunks
+
+        @return: bytes or None if block has no chunks
+        """
+        chunkIds = self.getTable("block_chunk").get_chunks(hash_id)
+        if not chunkIds:
+            return None
+
+        tableBlock = self.getTable("block")
+        tableHCT = self.getTable("hash_compression_type")
+
+        parts = []
+        for chunk_id in chunkIds:
+            item = tableBlock.get(chunk_id)
+            if item:
+                compType = tableHCT.get(chunk_id)
+                parts.append(self.__decompress(item["data"], compType["type_id"]))
+            else:
+                # Chunk data equal to whole other chunked block
+                data = self.__get_chunked_data(chunk_id)
+                if data is None:
+                    return None
+                parts.append(data)
+
+        return b"".join(parts)
+
     def __get_block_data_by_offset(self, inode, offset, size):
         """
         @type inode: int
@@ -1530,12 +1899,13 @@ class DedupOperations(llfuse.Operations): # {{{1
         if not size:
             return b''
 
-        inblock_offset = offset % self.block_size
-        first_block_number = int(floor(1.0 * (offset - inblock_offset) / self.block_size))
-        raw_data = BytesIO()
+        block_size = self.__get_inode_block_size(inode)
+
+        inblock_offset = offset % block_size
+        first_block_number = int(floor(1.0 * (offset - inblock_offset) / block_size))
 
         # if we in the middle of a block by offset and read blocksize - need to read more then one...
-        read_blocks = int(ceil(1.0 * (size + inblock_offset) / self.block_size))
+        read_blocks = int(ceil(1.0 * (size + inblock_offset) / block_size))
         if not read_blocks:
             read_blocks = 1
 
@@ -1543,25 +1913,36 @@ class DedupOperations(llfuse.Operations): # {{{1
 
         readed_size = 0
 
+        # Load all blocks first: lock may be released while block loaded,
+        # and block can't be resized by other worker while we hold view on it
+        blocks = []
         for n in range(read_blocks):
+            blocks.append(self.__get_block_from_cache(inode, n + first_block_number))
 
-            block = self.__get_block_from_cache(inode, n + first_block_number)
-            block.seek(0)
+        views = []
+        for n in range(read_blocks):
+
+            block_offset = 0
 
             read_size = size - readed_size
-            if read_size > self.block_size:
-                read_size = self.block_size
+            if read_size > block_size:
+                read_size = block_size
             if n == 0:
-                block.seek(inblock_offset)
-                if read_size > (self.block_size - inblock_offset):
-                    read_size = self.block_size - inblock_offset
+                block_offset = inblock_offset
+                if read_size > (block_size - inblock_offset):
+                    read_size = block_size - inblock_offset
 
-            raw_data.write(block.read(read_size))
+            views.append(memoryview(blocks[n])[block_offset:block_offset + read_size])
             readed_size += read_size
 
         self.bytes_read += readed_size
 
-        raw_value = raw_data.getvalue()
+        # Only one copy of data
+        raw_value = b"".join(views)
+
+        for view in views:
+            view.release()
+        del views
 
         self.getLogger().debug("-- readed size = %s" % (readed_size,))
         self.getLogger().debug("-- raw data size = %s" % (len(raw_value),))
@@ -1586,12 +1967,14 @@ class DedupOperations(llfuse.Operations): # {{{1
         if not size:
             return 0
 
-        inblock_offset = offset % self.block_size
-        first_block_number = int(floor(1.0 * (offset - inblock_offset) / self.block_size))
+        block_size = self.__get_inode_block_size(inode)
+
+        inblock_offset = offset % block_size
+        first_block_number = int(floor(1.0 * (offset - inblock_offset) / block_size))
 
-        io_data = BytesIO(block_data)
+        data = memoryview(block_data)
 
-        write_blocks = int(ceil(1.0 * size / self.block_size))
+        write_blocks = int(ceil(1.0 * size / block_size))
         if not write_blocks:
             write_blocks = 1
 
@@ -1602,22 +1985,29 @@ class DedupOperations(llfuse.Operations): # {{{1
         for n in range(write_blocks):
 
             block = self.__get_block_from_cache(inode, n + first_block_number)
-            block.seek(0)
+
+            block_offset = 0
 
             write_size = size - writed_size
-            if write_size > self.block_size:
-                write_size = self.block_size
+            if write_size > block_size:
+                write_size = block_size
             if n == 0:
-                block.seek(inblock_offset)
-                if write_size > (self.block_size - inblock_offset):
-                    write_size = self.block_size - inblock_offset
+                block_offset = inblock_offset
+                if write_size > (block_size - inblock_offset):
+                    write_size = block_size - inblock_offset
+
+            if len(block) < block_offset:
+                # Hole before written data
+                block.extend(bytes(block_offset - len(block)))
 
-            block.write(io_data.read(write_size))
+            block[block_offset:block_offset + write_size] = data[writed_size:writed_size + write_size]
 
             self.cached_blocks.set(inode, n + first_block_number, block, writed=True)
 
             writed_size += write_size
 
+        data.release()
+
         self.getLogger().debug("-- writed size = %s" % (writed_size,))
 
         return writed_size
@@ -1639,6 +2029,13 @@ class DedupOperations(llfuse.Operations): # {{{1
 
             nameRoot = constants.ROOT_SUBVOLUME_NAME
 
+            # Layout of block store must be known before first block is written
+            if self.getManager().TYPE == "sqlite":
+                if self.getOption("block_storage"):
+                    self.getManager().setBlockStorage(self.getOption("block_storage"))
+                if self.getOption("block_shards"):
+                    self.getManager().setBlockShards(self.getOption("block_shards"), constants.BLOCK_SHARD_RANGE_DEFAULT)
+
             subv = Subvolume(self)
             self.mounted_subvolume = subv.create(nameRoot)
 
@@ -1650,6 +2047,12 @@ class DedupOperations(llfuse.Operations): # {{{1
             for name in ("hash_function",):
                 optTable.insert(name, "%s" % self.getOption(name))
 
+            optTable.insert("chunking", "%s" % self.chunking)
+            if self.chunking != constants.CHUNKING_FIXED:
+                if not self.chunk_size:
+                    self.chunk_size = max(self.block_size // 4, constants.CHUNK_SIZE_MIN)
+                optTable.insert("chunk_size", "%i" % self.chunk_size)
+
             optTable.insert("mounted_subvolume", self.mounted_subvolume_name)
 
             optTable.insert("fs_version", __fsversion__)
@@ -1716,6 +2119,9 @@ class DedupOperations(llfuse.Operations): # {{{1
             if self.mounted_subvolume["readonly"]:
                 self.application.setReadonly(True)
 
+            # Read from table of selected subvolume
+            self.inode_block_sizes = None
+
         if self.getApplication().mountpoint:
             subvTable.mount_time(self.mounted_subvolume["id"], int(time()))
 
@@ -1724,6 +2130,44 @@ class DedupOperations(llfuse.Operations): # {{{1
         return
 
 
+    def __get_warm_meta_cache_path(self):
+        return os.path.join(
+            os.path.expanduser(self.getOption("data")), self.getOption("name"),
+            "metacache_%s.bin" % self.mounted_subvolume["hash"]
+        )
+
+    def __init_warm_meta_cache(self):
+        path = self.__get_warm_meta_cache_path()
+        if not os.path.isdir(os.path.dirname(path)):
+            return
+        if not self.getOption("warm_meta_cache") or not self.getApplication().mountpoint:
+            # Subvolume may be changed now, cache of last mount can't be trusted
+            if os.path.isfile(path):
+                os.unlink(path)
+            return
+
+        self.warm_meta_cache = WarmMetaCache()
+        start_time = time()
+        if self.warm_meta_cache.load(path, int(self.mounted_subvolume["updated_at"] or 0)):
+            self.getLogger().info("Warm metadata cache: %d entries mapped in %s",
+                                  len(self.warm_meta_cache), format_timespan(time() - start_time))
+        return
+
+    def __save_warm_meta_cache(self):
+        if self.warm_meta_cache is None:
+            return
+        start_time = time()
+
+        # Cache is valid for this state of subvolume only
+        updated_at = int(time())
+        self.getTable('subvolume').update_time(self.mounted_subvolume["id"], updated_at)
+        self.getManager().commit()
+
+        self.warm_meta_cache.save(self.__get_warm_meta_cache_path(), updated_at)
+        self.getLogger().debug("Warm metadata cache: saved in %s", format_timespan(time() - start_time))
+        self.warm_meta_cache = None
+        return
+
     def __log_call(self, fun, msg, *args): # {{{3
         # To disable all __log_call() invocations:
         #  :%s/^\(\s\+\)\(self\.__log_call\)/\1#\2
@@ -1753,6 +2197,32 @@ class DedupOperations(llfuse.Operations): # {{{1
             self.getLogger().warning("Ignoring --hash=%r argument, using previously chosen hash function %s instead",
                 self.hash_function, hash_function)
             self.hash_function = hash_function
+
+        # Old FS has no option - blocks were never chunked
+        chunking = options.get("chunking", constants.CHUNKING_FIXED)
+        if chunking != self.chunking:
+            self.getLogger().warning("Ignoring --chunking=%r argument, using previously chosen chunking %s instead",
+                self.chunking, chunking)
+            self.chunking = chunking
+
+        if self.chunking == constants.CHUNKING_FASTCDC:
+            from dedupsqlfs.lib.chunker import FastCDC, hasAccelerator
+            self.chunk_size = int(options["chunk_size"])
+            self.chunker = FastCDC(self.chunk_size)
+            if not hasAccelerator():
+                self.getLogger().warning("FastCDC module from lib-dynload/fastcdc is not built, chunking in Python is slow (~5 MB/s).")
+
+        if self.adaptive_block_size:
+            if self.adaptive_block_size > constants.BLOCK_SIZE_MAX:
+                self.getLogger().warning("Adaptive block size more than maximal! (%i>%i) Set to default maximal." % (
+                    self.adaptive_block_size, constants.BLOCK_SIZE_MAX
+                ))
+                self.adaptive_block_size = constants.BLOCK_SIZE_MAX
+            if self.adaptive_block_size <= self.block_size:
+                self.getLogger().warning("Adaptive block size is not more than block size! (%i<=%i) Disabled." % (
+                    self.adaptive_block_size, self.block_size
+                ))
+                self.adaptive_block_size = 0
         pass
 
 
@@ -1839,6 +2309,8 @@ class DedupOperations(llfuse.Operations): # {{{1
         self.cached_xattrs.unset(cur_node["inode_id"])
         self.cached_nodes.unset((parent_inode, name))
         self.cached_nodes.unset(cur_node["inode_id"])
+        if self.warm_meta_cache is not None:
+            self.warm_meta_cache.forgetNode(parent_inode, cur_node["name_id"])
         self.cached_names.unset(name)
         self.cached_name_ids.unset(cur_node["name_id"])
         self.cached_indexes.expire(cur_node["inode_id"])
@@ -1905,16 +2377,23 @@ class DedupOperations(llfuse.Operations): # {{{1
         self.time_spent_hashing += time() - start_time
         return digest
 
-    def __decompress(self, block_data, compression_type_id):
+    def __decompress(self, block_data, compression_type_id, release=False):
         """
         @param block_data: bytes
         @param compression_type_id: int
+        @param release: Release lock of multithreaded loop, caller must check
+                        cache and table state it uses after that
         @return: bytes
         """
         start_time = time()
         compression = self.getCompressionTypeName( compression_type_id )
         self.getLogger().debug("-- decompress block: type = %s" % compression)
-        result = self.application.decompressData(compression, block_data)
+        if release and self.multithreaded:
+            # Let other workers serve requests while block decompressed
+            with llfuse.lock_released:
+                result = self.application.decompressData(compression, block_data)
+        else:
+            result = self.application.decompressData(compression, block_data)
         self.time_spent_decompressing += time() - start_time
         return result
 
@@ -1953,6 +2432,7 @@ class DedupOperations(llfuse.Operations): # {{{1
             (self.time_spent_hashing, 'Hashing data blocks'),
             (self.time_spent_compressing, 'Compressing data blocks'),
             (self.time_spent_decompressing, 'Decompressing data blocks'),
+            (self.time_spent_prefetching, 'Prefetching data blocks (cumulative)'),
             (self.time_spent_querying_tree, 'Querying the tree')
         ]
         maxdescwidth = max([len(l) for t, l in timings]) + 3
@@ -2093,6 +2573,31 @@ class DedupOperations(llfuse.Operations): # {{{1
             self.__collect_garbage()
             self.__timing_report_hook()
             self.gc_hook_last_run = time()
+        self.__vacuum_hook()
+        return
+
+    def __vacuum_hook(self): # {{{3
+        """
+        Return some free pages of databases to filesystem on every tick
+        while nothing is written. Only databases created with
+        auto_vacuum=INCREMENTAL can do it.
+        """
+        if not self.vacuum_step_pages or self.isReadonly():
+            return
+        t_now = time()
+        if t_now - self.vacuum_hook_last_run < self.flush_interval:
+            return
+        self.vacuum_hook_last_run = t_now
+
+        # Not idle - written data waits for flush
+        if self.cached_blocks.hasDirty():
+            return
+
+        reclaimed, left = self.getManager().incrementalVacuum(self.vacuum_step_pages)
+        if reclaimed:
+            self.vacuum_pages_reclaimed += reclaimed
+            self.getLogger().debug("Incremental vacuum: reclaimed %d pages in %s, %d pages left (%d reclaimed since mount)",
+                reclaimed, format_timespan(time() - t_now), left, self.vacuum_pages_reclaimed)
         return
 
     def __timing_report_hook(self): # {{{3
@@ -2103,211 +2608,578 @@ class DedupOperations(llfuse.Operations): # {{{1
         return
 
 
-    def __write_block_data(self, inode, block_number, block):
-        """
-        @param  inode: inode ID
-        @type   inode: int
+    def __new_hash_filter(self):
+        from dedupsqlfs.lib.bloom import BloomFilter
+
+        manager = self.getManager()
+        return BloomFilter(os.path.join(
+            manager.getBasePath(), manager.getDbName(), "hash.bloom"
+        ))
+
+    def __init_hash_filter(self):
+        self.hash_filter = self.__new_hash_filter()
 
-        @param  block_number: block number
-        @type   block_number: int
+        if not self.hash_filter.open(self.getTable("hash").get_count()):
+            self.getLogger().info("Hash filter missing or not in sync with hash table. Rebuild it.")
+            self.rebuildHashFilter()
+
+        # Will be rebuilt on next mount if not closed cleanly
+        self.hash_filter.setClean(False)
+        return
 
-        @param  block: Block data
-        @type   block: BytesIO
+    def rebuildHashFilter(self):
+        """
+        Fill new filter from hash table. Capacity doubled to have room for growth.
         """
         start_time = time()
 
-        tableIndex = self.getTable("inode_hash_block")
+        if not self.hash_filter:
+            self.hash_filter = self.__new_hash_filter()
+
+        tableHash = self.getTable("hash")
+        count = tableHash.get_count()
+
+        self.hash_filter.create(count * 2)
+        self.hash_filter_dropped = False
+        for hash_value in tableHash.get_hashes():
+            self.hash_filter.add(hash_value)
+        self.hash_filter.setRows(count)
+
+        self.getLogger().info("Hash filter rebuilt for %i hashes in %s" % (count, format_timespan(time() - start_time),))
+        return self.hash_filter
+
+    def __close_hash_filter(self):
+        if not self.hash_filter:
+            return
+
+        count = self.getTable("hash").get_count()
+        if self.hash_filter.isStale(count):
+            self.rebuildHashFilter()
+
+        self.hash_filter.setRows(count)
+        self.hash_filter.close()
+        self.hash_filter = None
+        return
+
+    def __find_hashes(self, hash_values):
+        """
+        @return: dict {hash value: hash id} of already stored hashes
+        """
+        if self.hash_filter:
+            # Not in filter - definitely new, don't look in table
+            hash_values = set(hash_value for hash_value in hash_values if hash_value in self.hash_filter)
+        return self.getTable("hash").find_many(hash_values)
+
+    def __insert_hashes(self, hash_values):
+        """
+        Filter says "new" for stored hash if table was changed without it,
+        so with filter stored hashes are skipped on insert.
+
+        @return: tuple (dict {hash value: hash id}, set of really new hash values)
+        """
+        tableHash = self.getTable("hash")
+        if not self.hash_filter:
+            self.dropHashFilter()
+            hash_ids, inserted = tableHash.insert_many(hash_values), hash_values
+        else:
+            hash_ids, inserted = tableHash.insert_many_missing(hash_values)
+            if len(inserted) < len(hash_values):
+                self.getLogger().warning("Hash filter missed %d stored hashes" % (len(hash_values) - len(inserted),))
+            for hash_value in hash_values:
+                self.hash_filter.add(hash_value)
 
-        block.seek(0)
-        data_block = block.getvalue()
+        if self.flush_hash_ids is not None:
+            self.flush_hash_ids.extend(hash_ids[ hash_value ] for hash_value in inserted)
+        return hash_ids, inserted
+
+    def dropHashFilter(self):
+        """
+        Hash table changed without filter - remove its file, it is rebuilt on next mount
+        """
+        if self.hash_filter_dropped:
+            return
+        path = self.__new_hash_filter().getPath()
+        if os.path.isfile(path):
+            self.getLogger().debug("Drop hash filter: %s" % path)
+            os.unlink(path)
+        self.hash_filter_dropped = True
+        return
 
-        block_length = len(data_block)
+    def __update_hash_refs(self, added=(), removed=()):
+        """
+        Count references of hashes, same hash id may repeat
 
-        result = {
-            "hash": None,
-            "data": None,
-            "new": False,
-            "recompress": False,
-            "update": False,
-            "deleted": False,
-            "inode": inode,
-            "block_number": block_number,
-            "real_size": block_length,
-            "writed_size": block_length,
-        }
+        @param added: hash ids of new index or chunk list entries
+        @param removed: hash ids of removed entries
+        """
+        counts = {}
+        for hash_id in added:
+            counts[ hash_id ] = counts.get(hash_id, 0) + 1
+        for hash_id in removed:
+            counts[ hash_id ] = counts.get(hash_id, 0) - 1
+        counts = tuple((hash_id, delta,) for hash_id, delta in counts.items() if delta)
+        if counts:
+            self.getTable("hash_refcount").add_many(counts)
+        return
 
-        self.getLogger().debug("write block: inode=%s, block number=%s, data length=%s" % (inode, block_number, block_length,))
+    def __write_blocks_chunks(self, chunkedBlocks):
+        """
+        Store new blocks as lists of content-defined chunks.
+        Only new chunks need own data.
 
-        indexItem = self.__get_index_from_cache(inode, block_number)
+        @param  chunkedBlocks: dict {hash id: list of chunks data}
+        @type   chunkedBlocks: dict
 
-        # Second sparse files variant = remove zero-bytes tail
-        data_block = data_block.rstrip(b"\x00")
+        @return: dict {chunk hash id: (data, block hash id)} of new chunks
+        @rtype: dict
+        """
+        chunks_data = {}
+        chunks_block = {}
+        recipes = []
+        for hash_id, chunks in chunkedBlocks.items():
+            chunk_values = []
+            for chunk in chunks:
+                hash_value = self.__hash(chunk)
+                chunks_data[ hash_value ] = chunk
+                chunks_block[ hash_value ] = hash_id
+                chunk_values.append(hash_value)
+            recipes.append((hash_id, chunk_values,))
+
+        hash_ids = self.__find_hashes(set(chunks_data.keys()))
+
+        new_values = set(chunks_data.keys()) - set(hash_ids.keys())
+        if new_values:
+            self.getLogger().debug("-- insert %i new chunks hashes" % len(new_values))
+            inserted_ids, new_values = self.__insert_hashes(new_values)
+            hash_ids.update(inserted_ids)
+
+        chunkInsert = []
+        for hash_id, chunk_values in recipes:
+            for chunk_number, hash_value in enumerate(chunk_values):
+                chunkInsert.append((hash_id, chunk_number, hash_ids[ hash_value ],))
+        self.getTable("block_chunk").insert_many(chunkInsert)
+        self.__update_hash_refs(added=(chunk_hash_id for hash_id, chunk_number, chunk_hash_id in chunkInsert))
+
+        # Whole block counted as written, but old chunks are deduped
+        for hash_value, chunk in chunks_data.items():
+            if hash_value not in new_values:
+                self.bytes_written -= len(chunk)
+                self.bytes_deduped += len(chunk)
+
+        return dict((hash_ids[ hash_value ], (chunks_data[ hash_value ], chunks_block[ hash_value ],),) for hash_value in new_values)
+
+    def __write_blocks_data(self, blocks, index=True):
+        """
+        Hash all blocks first, then resolve hashes and store index in batches
 
-        block_length = len(data_block)
+        @param  blocks: list of tuples (inode, block_number, block)
+        @type   blocks: list
 
-        # # First sparse files variant = flush zero-bytes string
-        # sparsed_block = False
-        # if block_length == 0:
-        #     sparsed_block = True
+        @param  index: Insert or update index entries of blocks
+        @type   index: bool
 
-        result["writed_size"] = block_length
+        @return: list of dicts, one for every block
+        @rtype: list
+        """
+        start_time = time()
 
-        # self.getLogger().debug("write block: updated data length=%s, sparse=%r" % (block_length, sparsed_block,))
-        #
-        # if (block_length == 0 and indexItem) or sparsed_block:
-        #     self.getLogger().debug("write block: remove empty or zero-filled block")
-        #     tableIndex.delete_by_inode_number(inode, block_number)
-        #     self.cached_indexes.expireBlock(inode, block_number)
-        #
-        #     result["deleted"] = True
-        #
-        #     self.time_spent_writing_blocks += time() - start_time
-        #     return result
+        if not blocks:
+            return []
 
+        tableIndex = None
+        if index:
+            tableIndex = self.getTable("inode_hash_block")
         tableHash = self.getTable("hash")
         tableHCT = self.getTable("hash_compression_type")
 
-        hash_value = self.__hash(data_block)
-        hash_id = tableHash.find(hash_value)
+        prepared = []
+        for inode, block_number, block in blocks:
+
+            # Snapshot of data, block can be changed while lock released
+            data_block = bytes(block)
+
+            block_length = len(data_block)
+
+            result = {
+                "hash": None,
+                "data": None,
+                "new": False,
+                "recompress": False,
+                "update": False,
+                "deleted": False,
+                "inode": inode,
+                "block_number": block_number,
+                "real_size": block_length,
+                "writed_size": block_length,
+            }
+
+            self.getLogger().debug("write block: inode=%s, block number=%s, data length=%s" % (inode, block_number, block_length,))
+
+            # Second sparse files variant = remove zero-bytes tail
+            data_block = data_block.rstrip(b"\x00")
+
+            result["writed_size"] = len(data_block)
+
+            prepared.append((result, data_block, self.__hash(data_block),))
 
-        result["hash"] = hash_id
+        hash_values = set(hash_value for result, data_block, hash_value in prepared)
 
-        # It is new block now?
-        if not hash_id:
+        hash_ids = self.__find_hashes(hash_values)
 
-            result["new"] = True
-            result["data"] = data_block
+        new_values = hash_values - set(hash_ids.keys())
+        if new_values:
+            self.getLogger().debug("-- insert %i new blocks hashes" % len(new_values))
+            inserted_ids, new_values = self.__insert_hashes(new_values)
+            hash_ids.update(inserted_ids)
 
-            self.getLogger().debug("-- insert new block data")
-            hash_id = tableHash.insert(hash_value)
+        # Compression types needed only to check stored blocks
+        hash_types = {}
+        if self.getOption('compression_recompress_now') or \
+                self.getOption('compression_recompress_current') or \
+                self.getOption('collision_check_enabled'):
+            id_str = ",".join(str(hash_ids[hash_value]) for hash_value in hash_values - new_values)
+            hash_types = tableHCT.get_types_by_hash_ids(id_str)
+
+        indexInsert = []
+        indexUpdate = []
+        # Hash ids replaced in index
+        indexReplaced = []
+
+        for result, data_block, hash_value in prepared:
+
+            inode = result["inode"]
+            block_number = result["block_number"]
+            block_length = result["writed_size"]
+
+            hash_id = hash_ids[ hash_value ]
             result["hash"] = hash_id
 
-            self.bytes_written += block_length
-        else:
-            hash_CT = tableHCT.get(hash_id)
+            # It is new block now? Only first one in batch.
+            if hash_value in new_values:
+                new_values.discard(hash_value)
 
-            # It may not be at this time because at first time only hashes
-            # stored in DB. Compression and indexes are stored later.
-            if hash_CT:
-                compression = self.getCompressionTypeName(hash_CT["type_id"])
+                result["new"] = True
+                result["data"] = data_block
 
-                if self.getOption('compression_recompress_now'):
+                self.bytes_written += block_length
+            else:
+                type_id = hash_types.get(hash_id)
 
-                    if self.application.isDeprecated(compression):
-                        result["recompress"] = True
-                        result["data"] = data_block
+                # It may not be at this time because at first time only hashes
+                # stored in DB. Compression and indexes are stored later.
+                if type_id is not None:
+                    compression = self.getCompressionTypeName(type_id)
 
+                    if self.getOption('compression_recompress_now'):
 
-                if self.getOption('compression_recompress_current'):
+                        if self.application.isDeprecated(compression):
+                            result["recompress"] = True
+                            result["data"] = data_block
 
-                    if not self.application.isMethodSelected(compression):
-                        result["recompress"] = True
-                        result["data"] = data_block
 
-                if self.getOption('collision_check_enabled'):
+                    if self.getOption('compression_recompress_current'):
 
-                    old_block = self.getTable("block").get(hash_id)
+                        if not self.application.isMethodSelected(compression):
+                            result["recompress"] = True
+                            result["data"] = data_block
 
-                    old_data = self.__decompress(old_block["data"], hash_CT["type_id"])
-                    if old_data != data_block:
-                        self.getLogger().error("EEE: weird hashed data collision detected! hash id: %s, value: %r, inode: %s, block-number: %s" % (
-                            hash_id, hash_value, inode, block_number
-                        ))
-                        self.getLogger().warn("Use more strong hashing algo! I'm continue, but you are warned...")
-                    old_hash = self.__hash(old_data)
-                    if old_hash != hash_value:
-                        self.getLogger().error("Decompressed block data hash not equal with stored!")
-                        self.getLogger().error("FS data corruption? Something wrong with db layer? I'm done with that!")
-                        raise RuntimeError("Data corruption!")
+                    if self.getOption('collision_check_enabled'):
 
-            # Old hash found
-            self.bytes_deduped += block_length
+                        old_block = self.getTable("block").get(hash_id)
 
-        if not indexItem:
-            tableIndex.insert(
-                inode, block_number, hash_id, result["real_size"]
-            )
-            indexItem = {
-                "real_size": result["real_size"],
-                "hash_id": hash_id
-            }
-            self.cached_indexes.set(inode, block_number, indexItem)
-        elif indexItem["hash_id"] != hash_id or indexItem["real_size"] != result["real_size"]:
-            tableIndex.update(
-                inode, block_number, hash_id, result["real_size"]
-            )
-            indexItem.update({
-                "real_size": result["real_size"],
-                "hash_id": hash_id
-            })
-            self.cached_indexes.set(inode, block_number, indexItem)
-            result["update"] = True
+                        old_data = self.__decompress(old_block["data"], type_id)
+                        if old_data != data_block:
+                            self.getLogger().error("EEE: weird hashed data collision detected! hash id: %s, value: %r, inode: %s, block-number: %s" % (
+                                hash_id, hash_value, inode, block_number
+                            ))
+                            self.getLogger().warn("Use more strong hashing algo! I'm continue, but you are warned...")
+                        old_hash = self.__hash(old_data)
+                        if old_hash != hash_value:
+                            self.getLogger().error("Decompressed block data hash not equal with stored!")
+                            self.getLogger().error("FS data corruption? Something wrong with db layer? I'm done with that!")
+                            raise RuntimeError("Data corruption!")
 
-        self.time_spent_writing_blocks += time() - start_time
-        return result
+                # Old hash found
+                self.bytes_deduped += block_length
 
+            if not index:
+                continue
+
+            indexItem = self.__get_index_from_cache(inode, block_number)
+
+            if not indexItem:
+                indexInsert.append((inode, block_number, hash_id, result["real_size"],))
+                indexItem = {
+                    "real_size": result["real_size"],
+                    "hash_id": hash_id
+                }
+                self.cached_indexes.set(inode, block_number, indexItem)
+            elif indexItem["hash_id"] != hash_id or indexItem["real_size"] != result["real_size"]:
+                indexUpdate.append((inode, block_number, hash_id, result["real_size"],))
+                indexReplaced.append(indexItem["hash_id"])
+                indexItem.update({
+                    "real_size": result["real_size"],
+                    "hash_id": hash_id
+                })
+                self.cached_indexes.set(inode, block_number, indexItem)
+                result["update"] = True
+
+        if indexInsert:
+            tableIndex.insert_many(indexInsert)
+        if indexUpdate:
+            tableIndex.update_many(indexUpdate)
+        self.__update_hash_refs(
+            added=[item[2] for item in indexInsert] + [item[2] for item in indexUpdate],
+            removed=indexReplaced
+        )
+
+        self.time_spent_writing_blocks += time() - start_time
+        return [result for result, data_block, hash_value in prepared]
+
+
+    def __open_write_tables(self, index=True):
+        # Open tables before transaction starts - attach is not possible inside it
+        for name in ("hash", "hash_refcount", "block", "hash_compression_type", "hash_sizes",):
+            self.getTable(name)
+        if self.chunker:
+            self.getTable("block_chunk")
+        # Tools without mounted subvolume don't have index
+        if index and self.mounted_subvolume:
+            self.getTable("inode_hash_block")
+        return
 
     def __flush_old_cached_blocks(self, cached_blocks, writed=False):
+        if not cached_blocks:
+            return 0
+
+        manager = self.getManager()
+
+        self.__open_write_tables()
+
+        # Hash, block and index writes are commited together if tables share connection
+        started = manager.beginWriteBatch()
+        self.flush_hash_ids = []
+        try:
+            count = self.__write_cached_blocks(cached_blocks, writed)
+        except Exception:
+            manager.rollbackWriteBatch(started)
+            if not started:
+                # Every table commits by itself - new hashes may be stored without data
+                self.__remove_flushed_hashes(self.flush_hash_ids)
+            self.__restore_cached_blocks(cached_blocks)
+            raise
+        finally:
+            self.flush_hash_ids = None
+        manager.commitWriteBatch(started)
+        return count
+
+    def __remove_flushed_hashes(self, hash_ids):
+        """
+        Remove hashes inserted by failed flush with everything stored for them.
+        Otherwise next flush finds them and doesn't write data of their blocks.
+        Index entries pointing to them are written again from restored blocks.
+
+        @param hash_ids: list of hash ids
+        """
+        manager = self.getManager()
+        manager.rollback()
+
+        id_str = ",".join(str(_id) for _id in set(hash_ids))
+        if not id_str:
+            return
+
+        self.getLogger().warning("Remove %d hashes of failed flush" % len(hash_ids))
+
+        if self.mounted_subvolume:
+            self.getTable("inode_hash_block").remove_by_hash_ids(id_str)
+
+        if self.chunker:
+            tableChunk = self.getTable("block_chunk")
+            chunkIds = tableChunk.get_chunk_ids_by_hash_ids(id_str)
+            if chunkIds:
+                tableChunk.remove_by_ids(id_str)
+                self.__update_hash_refs(removed=chunkIds)
+
+        removed = self.getTable("hash").remove_by_ids(id_str)
+        if self.hash_filter:
+            self.hash_filter.removed(removed)
+        self.getTable("block").remove_by_ids(id_str)
+        self.getTable("hash_compression_type").remove_by_ids(id_str)
+        self.getTable("hash_sizes").remove_by_ids(id_str)
+        self.getTable("hash_refcount").remove_by_ids(id_str)
+
+        manager.commit()
+        return
+
+    def __restore_cached_blocks(self, cached_blocks):
+        """
+        Put back blocks of failed flush, they are written on next one.
+        Cached index may point to hashes of rolled back transaction.
+        """
+        for inode, inode_data in cached_blocks.items():
+            self.cached_indexes.drop(inode)
+            for block_number, block_data in inode_data.items():
+                if not block_data[self.cached_blocks.OFFSET_WRITTEN]:
+                    continue
+                if self.cached_blocks.has(inode, block_number):
+                    # Changed again after flush started
+                    continue
+                self.cached_blocks.set(inode, block_number, block_data[self.cached_blocks.OFFSET_BLOCK], writed=True)
+        return
+
+    def storeBlocks(self, blocks):
+        """
+        Store data of blocks without index entries, for offline jobs.
+        New hashes get zero reference counter: they are garbage
+        until caller inserts index entries.
+
+        @param  blocks: list of tuples (inode, block_number, block)
+        @type   blocks: list
+
+        @return: list of dicts, one for every block, with "hash" and "real_size"
+        @rtype: list
+        """
+        manager = self.getManager()
+
+        self.__open_write_tables(False)
+
+        started = manager.beginWriteBatch()
+        try:
+            items = self.__store_blocks(blocks, False)
+            self.getTable("hash_refcount").add_many(tuple((item["hash"], 0,) for item in items if item["new"]))
+        except Exception:
+            manager.rollbackWriteBatch(started)
+            raise
+        manager.commitWriteBatch(started)
+        return items
+
+    def __write_cached_blocks(self, cached_blocks, writed=False):
         count = 0
 
-        blocksToCompress = {}
-        blocksReCompress = {}
-        blockSize = {}
+        writeBlocks = []
 
         for inode, inode_data in cached_blocks.items():
             for block_number, block_data in inode_data.items():
                 if block_data[self.cached_blocks.OFFSET_WRITTEN]:
                     block = block_data[self.cached_blocks.OFFSET_BLOCK]
-                    item = self.__write_block_data(int(inode), int(block_number), block)
-                    if item["hash"] and (item["new"] or item["recompress"]):
-                        blocksToCompress[ item["hash"] ] = item["data"]
-                        blocksReCompress[ item["hash"] ] = item["recompress"]
-                        blockSize[ item["hash"] ] = item["writed_size"]
+                    writeBlocks.append((int(inode), int(block_number), block,))
                     if writed:
                         count += 1
                 else:
                     if not writed:
                         count += 1
 
+        self.__store_blocks(writeBlocks)
+
+        return count
+
+    def __store_blocks(self, writeBlocks, index=True):
+        """
+        Write hashes and compressed data of new blocks
+
+        @param  writeBlocks: list of tuples (inode, block_number, block)
+        @type   writeBlocks: list
+
+        @return: list of dicts, one for every block
+        @rtype: list
+        """
+        blocksToCompress = {}
+        blocksReCompress = {}
+        blockSize = {}
+        # Inode of block data - to select compression by previous blocks
+        blockInode = {}
+
+        chunkedBlocks = {}
+
+        items = self.__write_blocks_data(writeBlocks, index)
+        for item in items:
+            if item["hash"] and (item["new"] or item["recompress"]):
+                blockInode[ item["hash"] ] = item["inode"]
+                if item["new"] and self.chunker:
+                    chunks = self.chunker.split(item["data"])
+                    if len(chunks) > 1:
+                        chunkedBlocks[ item["hash"] ] = chunks
+                        continue
+                blocksToCompress[ item["hash"] ] = item["data"]
+                blocksReCompress[ item["hash"] ] = item["recompress"]
+                blockSize[ item["hash"] ] = item["writed_size"]
+
+        if chunkedBlocks:
+            for hash_id, cItem in self.__write_blocks_chunks(chunkedBlocks).items():
+                data, block_hash_id = cItem
+                blocksToCompress[ hash_id ] = data
+                blocksReCompress[ hash_id ] = False
+                blockSize[ hash_id ] = len(data)
+                blockInode[ hash_id ] = blockInode[ block_hash_id ]
+
+        if not blocksToCompress:
+            return items
+
         tableBlock = self.getTable("block")
         tableHCT = self.getTable("hash_compression_type")
         tableHSZ = self.getTable("hash_sizes")
 
-        for hash_id, cItem in self.application.compressData(blocksToCompress):
+        blockInsert = []
+        blockUpdate = []
+        compressed = {}
+
+        for hash_id, cItem in self.application.compressData(blocksToCompress, blockInode):
             cdata, cmethod = cItem
 
             self.getLogger().debug("WRITE: Hash = %r, method = %r" % (hash_id, cmethod,))
 
-            comp_size = len(cdata)
+            if blocksReCompress.get(hash_id):
+                blockUpdate.append((hash_id, cdata,))
+            else:
+                blockInsert.append((hash_id, cdata,))
 
-            writed_size = blockSize[ hash_id ]
+            compressed[ hash_id ] = (self.getCompressionTypeId(cmethod), len(cdata),)
 
-            cmethod_id = self.getCompressionTypeId(cmethod)
+        if blockInsert:
+            tableBlock.insert_many(blockInsert)
+        if blockUpdate:
+            tableBlock.update_many(blockUpdate)
 
-            if blocksReCompress.get(hash_id):
-                tableBlock.update(hash_id, cdata)
-            else:
-                tableBlock.insert(hash_id, cdata)
+        id_str = ",".join(str(hash_id) for hash_id in compressed.keys())
+        hash_types = tableHCT.get_types_by_hash_ids(id_str)
+        hash_sizes = tableHSZ.get_sizes_by_hash_ids(id_str)
+
+        hctInsert = []
+        hctUpdate = []
+        hszInsert = []
+        hszUpdate = []
+
+        for hash_id, cItem in compressed.items():
+            cmethod_id, comp_size = cItem
+
+            writed_size = blockSize[ hash_id ]
 
-            hash_CT = tableHCT.get(hash_id)
-            if hash_CT:
-                if hash_CT["type_id"] != cmethod_id:
-                    tableHCT.update(hash_id, cmethod_id)
+            if hash_id in hash_types:
+                if hash_types[ hash_id ] != cmethod_id:
+                    hctUpdate.append((hash_id, cmethod_id,))
             else:
-                tableHCT.insert(hash_id, cmethod_id)
+                hctInsert.append((hash_id, cmethod_id,))
 
-            hash_SZ = tableHSZ.get(hash_id)
-            if hash_SZ:
-                if hash_SZ["compressed_size"] != comp_size or hash_SZ["writed_size"] != writed_size:
-                    tableHSZ.update(hash_id, writed_size, comp_size)
+            if hash_id in hash_sizes:
+                if hash_sizes[ hash_id ] != (writed_size, comp_size,):
+                    hszUpdate.append((hash_id, writed_size, comp_size,))
             else:
-                tableHSZ.insert(hash_id, writed_size, comp_size)
+                hszInsert.append((hash_id, writed_size, comp_size,))
 
             self.bytes_written_compressed += comp_size
 
+        if hctInsert:
+            tableHCT.insert_many(hctInsert)
+        if hctUpdate:
+            tableHCT.update_many(hctUpdate)
+        if hszInsert:
+            tableHSZ.insert_many(hszInsert)
+        if hszUpdate:
+            tableHSZ.update_many(hszUpdate)
+
         self.time_spent_compressing += self.application.getCompressTool().time_spent_compressing
 
-        return count
+        return items
 
     def __cache_block_hook(self): # {{{3
 
@@ -2390,26 +3262,39 @@ class DedupOperations(llfuse.Operations): # {{{1
         count = 0
         for inode_id, update_data in inodes.items():
             self.getLogger().debug("flush inode: %i = %r", int(inode_id), update_data)
+            if self.warm_meta_cache is not None:
+                self.warm_meta_cache.forgetInode(inode_id)
             if "truncated" in update_data:
                 del update_data["truncated"]
                 self.__truncate_inode_blocks(inode_id, update_data["size"])
             count += self.getTable("inode").update_data(inode_id, update_data)
         return count
 
+    def __remove_inode_blocks(self, inode_id):
+        tableIndex = self.getTable("inode_hash_block")
+        hashIds = tableIndex.get_hash_ids_by_inodes((inode_id,))
+        if hashIds:
+            tableIndex.delete(inode_id)
+            self.__update_hash_refs(removed=hashIds)
+        return
+
     def __truncate_inode_blocks(self, inode_id, size):
 
-        inblock_offset = size % self.block_size
-        max_block_number = int(floor(1.0 * (size - inblock_offset) / self.block_size))
+        block_size = self.__get_inode_block_size(inode_id)
+
+        inblock_offset = size % block_size
+        max_block_number = int(floor(1.0 * (size - inblock_offset) / block_size))
 
         # 1. Remove blocks that has number more than MAX by size
         tableIndex = self.getTable("inode_hash_block")
         items = tableIndex.delete_by_inode_number_more(inode_id, max_block_number)
         for item in items:
             self.cached_indexes.expireBlock(inode_id, item["block_number"])
+        self.__update_hash_refs(removed=(item["hash_id"] for item in items))
 
         # 2. Truncate last block with zeroes
         block = self.__get_block_from_cache(inode_id, max_block_number)
-        block.truncate(inblock_offset)
+        del block[inblock_offset:]
 
         tableIndex.update_size(inode_id, max_block_number, inblock_offset)
         self.cached_indexes.expireBlock(inode_id, max_block_number)
@@ -2542,11 +3427,15 @@ class DedupOperations(llfuse.Operations): # {{{1
             current += len(nameIds)
 
             curBlock += maxCnt
+
+            # Only used ids of same range are in memory
+            usedNameIds = treeNameIds.takeUntil(curBlock)
+
             if not nameIds:
                 continue
 
             # SET magick
-            to_delete = nameIds - treeNameIds
+            to_delete = nameIds - usedNameIds
 
             id_str = ",".join((str(_id) for _id in to_delete))
             count += tableName.remove_by_ids(id_str)
@@ -2557,6 +3446,9 @@ class DedupOperations(llfuse.Operations): # {{{1
                 self.getLogger().debug("%s (count=%d)", proc, count)
 
         if count > 0:
+            if self.warm_meta_cache is not None:
+                # Ids of removed names can be given to new names
+                self.warm_meta_cache.forgetNames()
             self.should_vacuum = True
             self.getTable("name").commit()
             self.__vacuum_datatable("name")
@@ -2598,6 +3490,11 @@ class DedupOperations(llfuse.Operations): # {{{1
             to_delete = inodeIds - treeInodeIds
 
             count += tableInode.remove_by_ids(to_delete)
+            if to_delete:
+                self.getTable("inode_option").remove_by_inodes(to_delete)
+                if self.inode_block_sizes:
+                    for inode_id in to_delete:
+                        self.inode_block_sizes.pop(int(inode_id), None)
 
             p = "%6.2f%%" % (100.0 * current / countInodes)
             if p != proc:
@@ -2746,7 +3643,9 @@ class DedupOperations(llfuse.Operations): # {{{1
             to_delete = inodeIds - indexInodeIds
             to_trunc = inodeIds - to_delete
 
+            hashIds = tableIndex.get_hash_ids_by_inodes(to_delete)
             count += tableIndex.remove_by_inodes(to_delete)
+            self.__update_hash_refs(removed=hashIds)
 
             # Slow?
             inodeSizes = tableInode.get_sizes_by_id(to_trunc)
@@ -2755,11 +3654,13 @@ class DedupOperations(llfuse.Operations): # {{{1
                 if size < 0:
                     continue
 
-                inblock_offset = size % self.block_size
-                max_block_number = int(floor(1.0 * (size - inblock_offset) / self.block_size))
+                block_size = self.__get_inode_block_size(int(inode_id))
+                inblock_offset = size % block_size
+                max_block_number = int(floor(1.0 * (size - inblock_offset) / block_size))
 
                 trunced = tableIndex.delete_by_inode_number_more(inode_id, max_block_number)
                 countTrunc += len(trunced)
+                self.__update_hash_refs(removed=(item["hash_id"] for item in trunced))
 
             p = "%6.2f%%" % (100.0 * current / countInodes)
             if p != proc:
@@ -2776,56 +3677,82 @@ class DedupOperations(llfuse.Operations): # {{{1
         return
 
     def __collect_blocks(self): # {{{4
+        """
+        Remove hashes without references - data blocks and chunk lists.
+        Chunks of removed lists lose references, they are removed on next pass.
+        Cost depends on count of garbage, not on count of all hashes.
+        """
 
         tableHash = self.getTable("hash")
         tableBlock = self.getTable("block")
         tableHCT = self.getTable("hash_compression_type")
         tableHSZ = self.getTable("hash_sizes")
+        tableRefs = self.getTable("hash_refcount")
+        tableChunk = self.getTable("block_chunk")
 
-        subv = Subvolume(self)
-        indexHashIds = subv.prepareIndexHashIds()
+        # Index tables of all subvolumes, to check candidates
+        tableSubvol = self.getTable("subvolume")
+        indexTables = []
+        for subvol_id in tableSubvol.get_ids():
+            subvol = tableSubvol.get(subvol_id)
+            indexTables.append(self.getManager().getTable("inode_hash_block_" + subvol["hash"]))
 
         self.getLogger().debug("Clean unused data blocks and hashes...")
 
-        countHashes = tableHash.get_count()
-        self.getLogger().debug(" hashes: %d" % countHashes)
-
         count = 0
-        current = 0
-        proc = ""
-
-        _curBlock = 0
+        countFixed = 0
         maxCnt = 10000
 
         while True:
 
-            if current == countHashes:
-                break
-
-            hashIds = tableHash.get_hash_ids(_curBlock, _curBlock+maxCnt)
-
-            current += len(hashIds)
-
-            _curBlock += maxCnt
+            hashIds = tableRefs.get_unused_ids(maxCnt)
             if not hashIds:
-                continue
+                break
 
-            # SET magick
-            to_delete = hashIds - indexHashIds
+            id_str = ",".join((str(_id) for _id in hashIds))
+
+            # Counters live in own database, their update may be lost on crash.
+            # Index lookups by hash are cheap - never remove used blocks.
+            used = tableChunk.count_by_chunk_ids(id_str)
+            for tableIndex in indexTables:
+                for hash_id, cnt in tableIndex.count_by_hash_ids(id_str).items():
+                    used[ hash_id ] = used.get(hash_id, 0) + cnt
+            if used:
+                self.getLogger().warning("Fix reference counters of %d used hashes" % len(used))
+                tableRefs.set_many(used.items())
+                countFixed += len(used)
+                hashIds -= set(used.keys())
+                id_str = ",".join((str(_id) for _id in hashIds))
+                if not hashIds:
+                    continue
 
-            id_str = ",".join((str(_id) for _id in to_delete))
-            count += tableHash.remove_by_ids(id_str)
+            if self.chunker:
+                chunkIds = tableChunk.get_chunk_ids_by_hash_ids(id_str)
+                if chunkIds:
+                    tableChunk.remove_by_ids(id_str)
+                    self.__update_hash_refs(removed=chunkIds)
+
+            removed = tableHash.remove_by_ids(id_str)
+            count += removed
+            if self.hash_filter:
+                self.hash_filter.removed(removed)
+            elif removed:
+                self.dropHashFilter()
             tableBlock.remove_by_ids(id_str)
             tableHCT.remove_by_ids(id_str)
             tableHSZ.remove_by_ids(id_str)
+            tableRefs.remove_by_ids(id_str)
 
-            p = "%6.2f%%" % (100.0 * current / countHashes)
-            if p != proc:
-                proc = p
-                self.getLogger().debug("%s (count=%d)", proc, count)
+            self.getLogger().debug("(count=%d, fixed=%d)", count, countFixed)
 
         self.getManager().commit()
 
+        if count > 0 and self.getManager().getBlockStorage() == constants.BLOCK_STORAGE_PACK:
+            # Only pack files with much garbage are rewritten, no full vacuum
+            freed = tableBlock.compact()
+            if freed:
+                self.getLogger().debug("Compacted block pack files, freed %s" % format_size(freed))
+
         if count > 0:
             self.should_vacuum = True
             self.getTable("hash").commit()
@@ -0,0 +1,247 @@
+# -*- coding: utf8 -*-
+
+__author__ = 'sergey'
+
+import stat
+from time import time
+from dedupsqlfs.lib import constants
+from dedupsqlfs.my_formats import format_size
+from dedupsqlfs.fuse.blockjob import BlockJob
+
+class Rechunk(BlockJob):
+    """
+    Change of block size of files
+
+    Data of every file is streamed from old blocks and split to blocks
+    of new size, which are hashed, deduplicated and compressed like on
+    write. Their index entries are collected in memory and replace old
+    ones in one commit, block size of inode is stored in inode_option.
+
+    Blocks written before index swap have no references, so interrupted
+    job leaves only garbage for collector.
+    """
+
+    CHECKPOINT_OPTION = "rechunk_checkpoint"
+
+    _errors = 0
+
+    # Block size of files without own one
+    _default_block_size = None
+
+    def getErrorsCount(self):
+        return self._errors
+
+    def getBatchBytes(self):
+        """
+        Data kept in memory at once
+        """
+        return self._batch_size * constants.BLOCK_SIZE_DEFAULT
+
+    def _iterInodeData(self, subvolItem, row, old_block_size):
+        """
+        File data by parts, holes filled with zeroes
+
+        @return: generator of bytes or raise ValueError if data is lost
+        """
+        tableIndex = self.getTable("inode_hash_block_" + subvolItem["hash"])
+
+        size = row["size"]
+        last_block = (size - 1) // old_block_size
+        step = max(1, self.getBatchBytes() // old_block_size)
+
+        for first in range(0, last_block + 1, step):
+            last = min(first + step - 1, last_block)
+
+            items = tableIndex.get_by_inode_range(row["id"], first, last)
+            blocks, errors = self._readBlocks(sorted(set(item["hash_id"] for item in items.values())))
+            if errors:
+                hash_id, reason = errors.popitem()
+                raise ValueError("block %d: %s" % (hash_id, reason,))
+
+            parts = []
+            for block_number in range(first, last + 1):
+                length = min(old_block_size, size - block_number * old_block_size)
+                item = items.get(block_number)
+                data = b""
+                if item:
+                    data = blocks[ item["hash_id"] ][:length]
+                parts.append(data)
+                if len(data) < length:
+                    # Zero tail is not stored
+                    parts.append(bytes(length - len(data)))
+            yield b"".join(parts)
+
+    def _storeBlocks(self, blocks):
+        """
+        @param blocks: list of tuples (inode, block_number, data)
+        @return: list of index entries (inode, block_number, hash_id, real_size)
+        """
+        index = []
+        for item in self.getManager().storeBlocks(blocks):
+            index.append((item["inode"], item["block_number"], item["hash"], item["real_size"],))
+        self.getManager().getManager().commit()
+        return index
+
+    def _swapIndex(self, subvolItem, inode_id, index, block_size):
+        tableIndex = self.getTable("inode_hash_block_" + subvolItem["hash"])
+        tableOption = self.getTable("inode_option_" + subvolItem["hash"])
+
+        removed = tableIndex.get_hash_ids_by_inodes((inode_id,))
+        tableIndex.delete(inode_id)
+        tableIndex.insert_many(index)
+
+        counts = {}
+        for item in index:
+            counts[ item[2] ] = counts.get(item[2], 0) + 1
+        for hash_id in removed:
+            counts[ hash_id ] = counts.get(hash_id, 0) - 1
+        counts = tuple((hash_id, delta,) for hash_id, delta in counts.items() if delta)
+        if counts:
+            self.getTable("hash_refcount").add_many(counts)
+
+        # Index first: inode_option is fixed by next run if it is not commited
+        tableIndex.commit()
+        self._setBlockSize(tableOption, inode_id, block_size)
+        self.getManager().getManager().commit()
+        return
+
+    def _setBlockSize(self, tableOption, inode_id, block_size):
+        if block_size == self._default_block_size:
+            tableOption.remove_by_inodes((inode_id,))
+        else:
+            tableOption.set_block_size(inode_id, block_size)
+        tableOption.commit()
+        return
+
+    def _isSwapped(self, subvolItem, row, block_size):
+        """
+        Index of inode already has new block size: first block is full
+        """
+        item = self.getTable("inode_hash_block_" + subvolItem["hash"]).get(row["id"], 0)
+        return item is not None and item["real_size"] == min(block_size, row["size"])
+
+    def _rechunkInode(self, subvolItem, row, old_block_size, block_size):
+        """
+        @return: bytes rewritten
+        """
+        inode_id = row["id"]
+        tableOption = self.getTable("inode_option_" + subvolItem["hash"])
+
+        if row["size"] <= min(old_block_size, block_size) or self._isSwapped(subvolItem, row, block_size):
+            # Data is in one block of both sizes or index was swapped
+            self._setBlockSize(tableOption, inode_id, block_size)
+            return 0
+
+        store_count = max(1, self.getBatchBytes() // block_size)
+
+        index = []
+        blocks = []
+        buf = b""
+        block_number = 0
+        for data in self._iterInodeData(subvolItem, row, old_block_size):
+            buf += data
+            offset = 0
+            while len(buf) - offset >= block_size:
+                blocks.append((inode_id, block_number, buf[offset:offset + block_size],))
+                block_number += 1
+                offset += block_size
+            buf = buf[offset:]
+
+            if len(blocks) >= store_count:
+                index.extend(self._storeBlocks(blocks))
+                blocks = []
+        if buf:
+            blocks.append((inode_id, block_number, buf,))
+        if blocks:
+            index.extend(self._storeBlocks(blocks))
+
+        self._swapIndex(subvolItem, inode_id, index, block_size)
+        return row["size"]
+
+    def _reportFiles(self, count, bytes_in, start_time):
+        elapsed = max(time() - start_time, 0.001)
+        self.getLogger().info("Rechunked %d files: %s, %s/s" % (
+            count, format_size(bytes_in), format_size(bytes_in / elapsed),))
+        return
+
+    def rechunkPath(self, subvolName, path, block_size):
+        """
+        Change block size of file or all files of directory tree
+
+        @param subvolName: Subvolume name
+        @type  subvolName: bytes
+
+        @param path: Path inside subvolume, '/' - whole subvolume
+        @type  path: bytes
+
+        @param block_size: New block size in bytes
+        @type  block_size: int
+
+        @return: count of rewritten files or False
+        """
+        subvolItem = self.getTable("subvolume").find(subvolName)
+        if not subvolItem:
+            self.getLogger().error("Subvolume with name %r not found!" % subvolName)
+            return False
+
+        node = self.findPathNode(subvolItem, path)
+        if not node:
+            self.getLogger().error("Path %r not found in subvolume %r!" % (path, subvolName,))
+            return False
+
+        target = "path:%s:%s:%s" % (subvolItem["hash"], node["id"], block_size,)
+        after_id = self._loadCheckpoint(target)
+        if after_id:
+            self.getLogger().info("Continue from inode %d" % after_id)
+
+        inodes = sorted(_id for _id in self.collectPathInodes(subvolItem, node) if _id > after_id)
+        self.getLogger().info("Found %d inodes under %r" % (len(inodes), path,))
+
+        self._default_block_size = self.getBlockSize()
+
+        tableInode = self.getTable("inode_" + subvolItem["hash"])
+        sizes = self.getTable("inode_option_" + subvolItem["hash"]).get_block_sizes()
+
+        start_time = time()
+        last_report = start_time
+
+        count = 0
+        bytes_in = 0
+
+        try:
+            for inode_id in inodes:
+                row = tableInode.get(inode_id)
+                if not row or not stat.S_ISREG(row["mode"]) or row["size"] <= 0:
+                    continue
+
+                old_block_size = sizes.get(inode_id, self._default_block_size)
+                if old_block_size != block_size:
+                    try:
+                        b_in = self._rechunkInode(subvolItem, row, old_block_size, block_size)
+                    except ValueError as e:
+                        self._errors += 1
+                        self.getLogger().error("Inode %d is not changed, data is lost: %s" % (inode_id, e,))
+                        continue
+                    if b_in:
+                        count += 1
+                        bytes_in += b_in
+
+                self._saveCheckpoint(target, inode_id)
+
+                if time() - last_report >= self._report_interval:
+                    self._reportFiles(count, bytes_in, start_time)
+                    last_report = time()
+        except KeyboardInterrupt:
+            self._reportFiles(count, bytes_in, start_time)
+            self.getLogger().warning("Interrupted. Don't mount filesystem, run same command again to continue.")
+            return count
+        finally:
+            self._stopExecutor()
+
+        self._dropCheckpoint()
+        self._reportFiles(count, bytes_in, start_time)
+        if count:
+            self.getLogger().info("Run --vacuum to return space of old blocks to filesystem.")
+        return count
+
+    pass
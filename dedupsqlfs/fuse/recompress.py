@@ -0,0 +1,277 @@
+# -*- coding: utf8 -*-
+
+__author__ = 'sergey'
+
+from time import time
+from dedupsqlfs.lib import constants
+from dedupsqlfs.fuse.blockjob import BlockJob
+
+class Recompress(BlockJob):
+    """
+    Offline recompression of stored blocks
+
+    Blocks compressed with deprecated or not currently selected methods
+    are read in batches, decompressed and compressed again by workers
+    of compression tool, and written back in one commit per batch.
+    """
+
+    CHECKPOINT_OPTION = "recompress_checkpoint"
+
+    # Fetch inode blocks by pages
+    _inodes_page = 5000
+
+    _errors = 0
+
+    def getErrorsCount(self):
+        return self._errors
+
+    # -----------------------------------------------
+
+    def hasSelectedMethods(self):
+        """
+        At least one selected method can compress data,
+        else all blocks would be stored uncompressed
+
+        @rtype: bool
+        """
+        app = self.getApplication()
+        tool = app.getCompressTool()
+
+        for method in tool.getSelectedMethods():
+            try:
+                tool.getCompressor(method)
+            except ValueError:
+                self.getLogger().warning("Compression method %r is not available." % method)
+                continue
+            if not app.isDeprecated(method):
+                return True
+
+        self.getLogger().error("No usable compression method selected! Use --compress METHOD.")
+        return False
+
+    def getTargetTypeIds(self):
+        """
+        Compression types of blocks which should be recompressed
+
+        @rtype: set
+        """
+        ops = self.getManager()
+        app = self.getApplication()
+        tool = app.getCompressTool()
+
+        type_ids = set()
+        for type_id in ops.getCompressionTypeIds():
+            method = ops.getCompressionTypeName(type_id)
+            if method == constants.COMPRESSION_TYPE_NONE:
+                continue
+            try:
+                tool.getCompressor(method)
+            except ValueError:
+                self.getLogger().warning("Compression method %r is not available, its blocks are skipped." % method)
+                continue
+            if app.isDeprecated(method) or not app.isMethodSelected(method):
+                type_ids.add(type_id)
+        return type_ids
+
+    def _iterIdsBatches(self, hash_ids, type_ids, after_id):
+        """
+        Blocks from sorted list of hash ids with selected compression types
+
+        @return: generator of lists of (hash_id, type_id)
+        """
+        tableHCT = self.getTable("hash_compression_type")
+        hash_ids = [_id for _id in hash_ids if _id > after_id]
+        for n in range(0, len(hash_ids), self._batch_size):
+            page = hash_ids[n:n + self._batch_size]
+            types = tableHCT.get_types_by_hash_ids(",".join(str(_id) for _id in page))
+            yield [(_id, types[_id],) for _id in page if types.get(_id) in type_ids]
+
+    def collectPathHashIds(self, subvolItem, node):
+        """
+        Hash ids of all blocks used by node and nodes under it,
+        chunks of content-defined chunked blocks included
+
+        @return: sorted list of hash ids
+        """
+        tableIndex = self.getTable("inode_hash_block_" + subvolItem["hash"])
+        tableChunk = self.getTable("block_chunk")
+
+        inodes = list(self.collectPathInodes(subvolItem, node))
+        hash_ids = set()
+        for n in range(0, len(inodes), self._inodes_page):
+            hash_ids.update(tableIndex.get_hash_ids_by_inodes(inodes[n:n + self._inodes_page]))
+
+        ids = list(hash_ids)
+        for n in range(0, len(ids), self._inodes_page):
+            hash_ids.update(tableChunk.get_chunk_ids_by_hash_ids(
+                ",".join(str(_id) for _id in ids[n:n + self._inodes_page])))
+
+        return sorted(hash_ids)
+
+    # -----------------------------------------------
+
+    def _recompressBatch(self, items):
+        """
+        @param items: list of (hash_id, type_id)
+        @return: tuple (count of blocks, bytes read, bytes written)
+        """
+        ops = self.getManager()
+        app = self.getApplication()
+
+        tableBlock = self.getTable("block")
+        tableHCT = self.getTable("hash_compression_type")
+        tableHSZ = self.getTable("hash_sizes")
+
+        id_str = ",".join(str(hash_id) for hash_id, type_id in items)
+        stored = tableBlock.get_many(id_str)
+
+        toDecompress = {}
+        bytes_in = 0
+        for hash_id, type_id in items:
+            if hash_id not in stored:
+                continue
+            toDecompress[ hash_id ] = (ops.getCompressionTypeName(type_id), stored[ hash_id ],)
+            bytes_in += len(stored[ hash_id ])
+        del stored
+
+        blocks = self._decompressMany(toDecompress)
+        self._errors += len(self._decompress_errors)
+        del toDecompress
+        if not blocks:
+            return 0, bytes_in, 0
+
+        hash_sizes = tableHSZ.get_sizes_by_hash_ids(id_str)
+
+        blockUpdate = []
+        hctUpdate = []
+        hszInsert = []
+        hszUpdate = []
+        bytes_out = 0
+
+        for hash_id, cItem in app.compressData(blocks):
+            cdata, cmethod = cItem
+
+            blockUpdate.append((hash_id, cdata,))
+            hctUpdate.append((hash_id, ops.getCompressionTypeId(cmethod),))
+            if hash_id in hash_sizes:
+                hszUpdate.append((hash_id, hash_sizes[ hash_id ][0], len(cdata),))
+            else:
+                hszInsert.append((hash_id, len(blocks[ hash_id ]), len(cdata),))
+            bytes_out += len(cdata)
+
+        if blockUpdate:
+            tableBlock.update_many(blockUpdate)
+        if hctUpdate:
+            tableHCT.update_many(hctUpdate)
+        if hszInsert:
+            tableHSZ.insert_many(hszInsert)
+        if hszUpdate:
+            tableHSZ.update_many(hszUpdate)
+
+        self.getManager().getManager().commit()
+
+        return len(blockUpdate), bytes_in, bytes_out
+
+    def _process(self, target, batches, total):
+        """
+        @return: count of recompressed blocks
+        """
+        start_time = time()
+        last_report = start_time
+
+        count = 0
+        bytes_in = 0
+        bytes_out = 0
+
+        try:
+            for items in batches:
+                if not items:
+                    continue
+                c, b_in, b_out = self._recompressBatch(items)
+                count += c
+                bytes_in += b_in
+                bytes_out += b_out
+
+                # After data is commited
+                self._saveCheckpoint(target, items[-1][0])
+
+                if time() - last_report >= self._report_interval:
+                    self._report("Recompressed", count, total, bytes_in, bytes_out, start_time)
+                    last_report = time()
+        except KeyboardInterrupt:
+            self._report("Recompressed", count, total, bytes_in, bytes_out, start_time)
+            self.getLogger().warning("Interrupted. Run same command again to continue.")
+            return count
+
+        self._dropCheckpoint()
+        self._report("Recompressed", count, total, bytes_in, bytes_out, start_time)
+        return count
+
+    def recompressStore(self):
+        """
+        Recompress all blocks of filesystem
+
+        @return: count of recompressed blocks or False
+        """
+        if not self.hasSelectedMethods():
+            return False
+
+        type_ids = self.getTargetTypeIds()
+        if not type_ids:
+            self.getLogger().info("No blocks to recompress: all are stored with selected methods.")
+            return 0
+
+        target = "store:%s" % ",".join(str(_id) for _id in sorted(type_ids))
+        after_id = self._loadCheckpoint(target)
+        if after_id:
+            self.getLogger().info("Continue from hash id %d" % after_id)
+
+        total = 0
+        for item in self.getTable("hash_compression_type").count_compression_type():
+            if item["type_id"] in type_ids:
+                total += item["cnt"]
+
+        return self._process(target, self._iterStoreBatches(type_ids, after_id), total)
+
+    def recompressPath(self, subvolName, path):
+        """
+        Recompress blocks of file or directory tree
+
+        @param subvolName: Subvolume name
+        @type  subvolName: bytes
+
+        @param path: Path inside subvolume, '/' - whole subvolume
+        @type  path: bytes
+
+        @return: count of recompressed blocks or False
+        """
+        if not self.hasSelectedMethods():
+            return False
+
+        subvolItem = self.getTable("subvolume").find(subvolName)
+        if not subvolItem:
+            self.getLogger().error("Subvolume with name %r not found!" % subvolName)
+            return False
+
+        node = self.findPathNode(subvolItem, path)
+        if not node:
+            self.getLogger().error("Path %r not found in subvolume %r!" % (path, subvolName,))
+            return False
+
+        type_ids = self.getTargetTypeIds()
+        if not type_ids:
+            self.getLogger().info("No blocks to recompress: all are stored with selected methods.")
+            return 0
+
+        target = "path:%s:%s:%s" % (
+            subvolItem["hash"], node["id"], ",".join(str(_id) for _id in sorted(type_ids)),)
+        after_id = self._loadCheckpoint(target)
+        if after_id:
+            self.getLogger().info("Continue from hash id %d" % after_id)
+
+        hash_ids = self.collectPathHashIds(subvolItem, node)
+        self.getLogger().info("Found %d blocks used by %r" % (len(hash_ids), path,))
+
+        return self._process(target, self._iterIdsBatches(hash_ids, type_ids, after_id), 0)
+
+    pass
@@ -0,0 +1,144 @@
+# -*- coding: utf8 -*-
+
+__author__ = 'sergey'
+
+import hashlib
+from time import time
+from dedupsqlfs.fuse.blockjob import BlockJob
+
+class Rehash(BlockJob):
+    """
+    Change of filesystem hash function
+
+    Data of every hash is read and decompressed, blocks stored as
+    content-defined chunks are assembled from their chunks. New digests
+    are computed by thread pool and written over old ones by batches.
+
+    Hash function option is switched only when all hashes are rewritten,
+    until then interrupted job must be continued with same function.
+    Filesystem should not be mounted while job is not finished.
+    """
+
+    CHECKPOINT_OPTION = "rehash_checkpoint"
+
+    _errors = 0
+
+    def getErrorsCount(self):
+        return self._errors
+
+    def _rehashBatch(self, hash_ids, hash_function):
+        """
+        @param hash_ids: list of hash ids
+        @return: tuple (count of rehashed, bytes hashed)
+        """
+        blocks, errors = self._readBlocks(hash_ids)
+
+        # Not used hashes have no data until garbage collected
+        unused = [hash_id for hash_id, reason in errors.items() if reason == "no data"]
+        for hash_id in unused:
+            self.getLogger().warning("Hash %d has no data, not changed" % hash_id)
+            del errors[ hash_id ]
+
+        bytes_in = 0
+        for data in blocks.values():
+            bytes_in += len(data)
+
+        digests = self._hashMany(blocks, hash_function)
+        del blocks
+
+        tableHash = self.getTable("hash")
+        if digests:
+            tableHash.update_many(digests.items())
+            # Filter of old hash values is rebuilt on next mount
+            self.getManager().dropHashFilter()
+        tableHash.commit()
+
+        if errors:
+            self._errors += len(errors)
+            for hash_id, reason in errors.items():
+                self.getLogger().error("Hash %d is not changed: %s" % (hash_id, reason,))
+            found_at = int(time())
+            tableCorrupted = self.getTable("block_corrupted")
+            tableCorrupted.insert_many((hash_id, reason, found_at,) for hash_id, reason in errors.items())
+            tableCorrupted.commit()
+
+        return len(digests), bytes_in
+
+    def _switchHashFunction(self, hash_function):
+        tableOption = self.getTable("option")
+        if tableOption.get("hash_function") is None:
+            tableOption.insert("hash_function", hash_function)
+        else:
+            tableOption.update("hash_function", hash_function)
+        tableOption.commit()
+
+        self.getManager().dropHashFilter()
+        return
+
+    def rehashStore(self, hash_function):
+        """
+        Rewrite all hashes of filesystem with new hash function
+
+        @param hash_function: Name of hashlib function
+        @type  hash_function: str
+
+        @return: count of rewritten hashes or False
+        """
+        try:
+            hashlib.new(hash_function)
+        except ValueError:
+            self.getLogger().error("Hash function %r is not supported!" % hash_function)
+            return False
+
+        target = "to:%s" % hash_function
+        unfinished = self._getCheckpointTarget()
+        if unfinished and unfinished != target:
+            self.getLogger().error("Rehash with %r is not finished! Run it again to continue." % unfinished.partition(":")[2])
+            return False
+
+        if not unfinished and self.getHashFunction() == hash_function:
+            self.getLogger().info("Filesystem already uses hash function %r." % hash_function)
+            return 0
+
+        after_id = self._loadCheckpoint(target)
+        if after_id:
+            self.getLogger().info("Continue from hash id %d" % after_id)
+
+        tableHash = self.getTable("hash")
+        total = tableHash.get_count()
+
+        start_time = time()
+        last_report = start_time
+
+        count = 0
+        bytes_in = 0
+
+        try:
+            while True:
+                hash_ids = tableHash.get_ids_after(after_id, self._batch_size)
+                if not hash_ids:
+                    break
+                c, b_in = self._rehashBatch(hash_ids, hash_function)
+                count += c
+                bytes_in += b_in
+
+                after_id = hash_ids[-1]
+                self._saveCheckpoint(target, after_id)
+
+                if time() - last_report >= self._report_interval:
+                    self._report("Rehashed", count, total, bytes_in, None, start_time)
+                    last_report = time()
+        except KeyboardInterrupt:
+            self._report("Rehashed", count, total, bytes_in, None, start_time)
+            self.getLogger().warning("Interrupted. Don't mount filesystem, run same command again to continue.")
+            return count
+        finally:
+            self._stopExecutor()
+
+        self._switchHashFunction(hash_function)
+        self._dropCheckpoint()
+        self._report("Rehashed", count, total, bytes_in, None, start_time)
+        self.getLogger().info("Filesystem now uses hash function %r." % hash_function)
+        return count
+
+    pass
@@ -64,6 +64,13 @@ class Snapshot(Subvolume):
                 True
             )
 
+        self.print_msg("Count references to blocks\n")
+
+        # Copy has same index entries, new table file may be compressed already
+        tableIndex = self.getTable("inode_hash_block_%s" % subvolItemFrom["hash"])
+        self.getTable("hash_refcount").add_counts(tableIndex.get_hash_id_counts())
+        tableIndex.close()
+
         self.print_msg("Done\n")
 
         self.getManager().getManager().commit()
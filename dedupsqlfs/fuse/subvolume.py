@@ -9,6 +9,7 @@ import math
 from datetime import datetime
 from dedupsqlfs.my_formats import format_size
 from dedupsqlfs.lib.constants import ROOT_SUBVOLUME_NAME, COMPRESSION_PROGS_NONE
+from dedupsqlfs.lib.sorted_ids import iterPages, SortedIdsMerge
 import json
 
 class Subvolume(object):
@@ -212,88 +213,52 @@ class Subvolume(object):
         return
 
 
+    def _streamTableIds(self, table, getPage):
+        """
+        Stream sorted ids from table, close it when done
+        """
+        for _id in iterPages(getPage):
+            yield _id
+        table.close()
+
     def prepareTreeNameIds(self):
         """
-        List all subvolumes
-        @rtype: set
+        Name ids used in trees of all subvolumes, streamed in ascending order
+        @rtype: SortedIdsMerge
         """
 
         tableSubvol = self.getTable('subvolume')
 
-        nameIds = set()
-        pageSize = 10000
+        streams = []
 
         for subvol_id in tableSubvol.get_ids():
 
             subvol = tableSubvol.get(subvol_id)
 
             tableTree = self.getTable("tree_" + subvol["hash"])
+            streams.append(self._streamTableIds(tableTree, tableTree.get_name_ids_after))
 
-            curTree = tableTree.getCursor()
-            curTree.execute("SELECT DISTINCT name_id FROM `%s`" % tableTree.getName())
-
-            while True:
-
-                items = curTree.fetchmany(pageSize)
-
-                if not len(items):
-                    break
-
-                for node in items:
-                    nameIds.add(node["name_id"])
-
-            curTree.close()
-            tableTree.close()
-
-        return nameIds
+        return SortedIdsMerge(streams)
 
     def prepareIndexHashIds(self):
         """
-        List all subvolumes
-        @rtype: set
+        Hash ids used in indexes of all subvolumes, streamed in ascending order.
+        Entries of inodes removed from tree are counted too, they are removed by index collection.
+        @rtype: SortedIdsMerge
         """
 
         tableSubvol = self.getTable('subvolume')
 
-        hashIds = set()
-        pageSize = 10000
+        streams = []
 
         for subvol_id in tableSubvol.get_ids():
 
             subvol = tableSubvol.get(subvol_id)
 
             tableIndex = self.getTable("inode_hash_block_" + subvol["hash"])
-            tableTree = self.getTable('tree_' + subvol["hash"])
+            streams.append(self._streamTableIds(tableIndex, tableIndex.get_hash_ids_after))
 
-            curIndex = tableIndex.getCursor()
-            curIndex.execute("SELECT DISTINCT hash_id,inode_id FROM `%s`" % tableIndex.getName())
-
-            while True:
-
-                items = curIndex.fetchmany(pageSize)
-                if not len(items):
-                    break
-
-                inode_ids = ",".join(set(str(item["inode_id"]) for item in items))
-
-                inodes_in_tree = set(tableTree.get_inodes_by_inodes_intgen(inode_ids))
-
-                for item in items:
-
-                    # Check if FS tree has inode
-
-                    inode_id = item["inode_id"]
-                    if inode_id not in inodes_in_tree:
-                        continue
-
-                    hash_id = item["hash_id"]
-                    hashIds.add(hash_id)
-
-            curIndex.close()
-            tableIndex.close()
-            tableTree.close()
-
-        return hashIds
+        return SortedIdsMerge(streams)
 
 
     def prepareIndexHashIdCount(self):
@@ -384,9 +349,13 @@ class Subvolume(object):
             return False
 
         try:
+            tableIndex = self.getTable('inode_hash_block_' + subvolItem["hash"])
+            # Blocks of subvolume become garbage if nobody else uses them
+            self.getTable('hash_refcount').add_counts(tableIndex.get_hash_id_counts(), -1)
+
             self.getTable('tree_' + subvolItem["hash"]).drop()
             self.getTable('inode_' + subvolItem["hash"]).drop()
-            self.getTable('inode_hash_block_' + subvolItem["hash"]).drop()
+            tableIndex.drop()
             self.getTable('inode_option_' + subvolItem["hash"]).drop()
             self.getTable('link_' + subvolItem["hash"]).drop()
             self.getTable('xattr_' + subvolItem["hash"]).drop()
@@ -0,0 +1,153 @@
+# -*- coding: utf8 -*-
+
+__author__ = 'sergey'
+
+from time import time, sleep
+from dedupsqlfs.fuse.blockjob import BlockJob
+
+class Verify(BlockJob):
+    """
+    Scrub of stored blocks
+
+    Every block is decompressed and hashed again, digest is compared
+    with stored hash value. Broken blocks are written to block_corrupted
+    table, it is cleaned when new pass starts.
+
+    Reading can be limited in bytes per second, so scrub can be run
+    on mounted filesystem.
+    """
+
+    CHECKPOINT_OPTION = "verify_checkpoint"
+
+    # Bytes per second, 0 - no limit
+    _rate = 0
+
+    _corrupted = 0
+
+    def __init__(self, manager, batchSize=None, rate=None):
+        """
+        @param rate: Limit of read data, bytes per second
+        @type  rate: int
+        """
+        BlockJob.__init__(self, manager, batchSize)
+        if rate:
+            self._rate = int(rate)
+        pass
+
+    def getCorruptedCount(self):
+        return self._corrupted
+
+    def _verifyBatch(self, items, hash_function):
+        """
+        @param items: list of (hash_id, type_id)
+        @return: tuple (count of blocks, bytes read, count of corrupted)
+        """
+        ops = self.getManager()
+
+        id_str = ",".join(str(hash_id) for hash_id, type_id in items)
+        stored = self.getTable("block").get_many(id_str)
+        hashes = self.getTable("hash").get_many(id_str)
+
+        corrupted = {}
+        missing = {}
+        toDecompress = {}
+        bytes_in = 0
+        for hash_id, type_id in items:
+            if hash_id not in stored:
+                missing[ hash_id ] = "no data"
+                continue
+            if hash_id not in hashes:
+                missing[ hash_id ] = "no hash"
+                continue
+            toDecompress[ hash_id ] = (ops.getCompressionTypeName(type_id), stored[ hash_id ],)
+            bytes_in += len(stored[ hash_id ])
+        del stored
+
+        if missing:
+            # Block may be removed by garbage collector of mounted filesystem
+            exists = self.getTable("hash_compression_type").get_types_by_hash_ids(
+                ",".join(str(hash_id) for hash_id in missing.keys()))
+            for hash_id, reason in missing.items():
+                if hash_id in exists:
+                    corrupted[ hash_id ] = reason
+
+        blocks = self._decompressMany(toDecompress)
+        del toDecompress
+        corrupted.update(self._decompress_errors)
+
+        for hash_id, digest in self._hashMany(blocks, hash_function).items():
+            if digest != hashes[ hash_id ]:
+                corrupted[ hash_id ] = "hash mismatch"
+
+        if corrupted:
+            found_at = int(time())
+            for hash_id, reason in corrupted.items():
+                self.getLogger().error("Block %d is corrupted: %s" % (hash_id, reason,))
+            tableCorrupted = self.getTable("block_corrupted")
+            tableCorrupted.insert_many((hash_id, reason, found_at,) for hash_id, reason in corrupted.items())
+            tableCorrupted.commit()
+
+        return len(items), bytes_in, len(corrupted)
+
+    def verifyStore(self):
+        """
+        Verify all blocks of filesystem, continue last pass if it was interrupted
+
+        @return: count of verified blocks
+        """
+        hash_function = self.getHashFunction()
+
+        target = "store:%s" % hash_function
+        after_id = self._loadCheckpoint(target)
+        if after_id:
+            self.getLogger().info("Continue from hash id %d" % after_id)
+        else:
+            self.getTable("block_corrupted").clean()
+            self.getTable("block_corrupted").commit()
+
+        total = 0
+        for item in self.getTable("hash_compression_type").count_compression_type():
+            total += item["cnt"]
+
+        start_time = time()
+        last_report = start_time
+
+        count = 0
+        bytes_in = 0
+
+        try:
+            for items in self._iterStoreBatches(None, after_id):
+                c, b_in, broken = self._verifyBatch(items, hash_function)
+                count += c
+                bytes_in += b_in
+                self._corrupted += broken
+
+                self._saveCheckpoint(target, items[-1][0])
+
+                if self._rate:
+                    wait = 1.0 * bytes_in / self._rate - (time() - start_time)
+                    if wait > 0:
+                        sleep(wait)
+
+                if time() - last_report >= self._report_interval:
+                    self._report("Verified", count, total, bytes_in, None, start_time)
+                    last_report = time()
+        except KeyboardInterrupt:
+            self._report("Verified", count, total, bytes_in, None, start_time)
+            self.getLogger().warning("Interrupted. Run same command again to continue.")
+            return count
+        finally:
+            self._stopExecutor()
+
+        self._dropCheckpoint()
+        self._report("Verified", count, total, bytes_in, None, start_time)
+
+        broken = self.getTable("block_corrupted").get_count()
+        if broken:
+            self.getLogger().error("Found %d corrupted blocks, see table block_corrupted." % broken)
+        else:
+            self.getLogger().info("No corrupted blocks found.")
+        self._corrupted = broken
+        return count
+
+    pass
@@ -0,0 +1,209 @@
+# -*- coding: utf8 -*-
+"""
+@author Sergey Dryabzhinsky
+"""
+
+import os
+import mmap
+import struct
+import hashlib
+from math import ceil, log
+
+class BloomFilter(object):
+    """
+    Bloom filter over block hashes, stored in mmap'ed sidecar file
+
+    Answers "definitely new" for hash values without touching database.
+    Keys are digests of hash functions, so bit positions are taken
+    from digest bytes directly (double hashing).
+
+    File layout:
+
+        header (64 bytes):
+            magic (4s), version (B), clean (B), hashes (H),
+            bits (Q), capacity (Q), rows (Q)
+        bit array (bits / 8 bytes)
+
+    'rows' - count of rows in hash table then filter was closed.
+    If it differs on open - filter is stale and must be rebuilt.
+    """
+
+    MAGIC = b"DSBF"
+    VERSION = 1
+
+    HEADER_FORMAT = "<4sBBHQQQ"
+    HEADER_SIZE = 64
+
+    _path = None
+    _file = None
+    _mmap = None
+
+    _bits = 0
+    _hashes = 0
+    _capacity = 0
+    _rows = 0
+
+    # Count of hashes removed from table since filter was built
+    _removed = 0
+
+    def __init__(self, path):
+        self._path = path
+        pass
+
+    def getPath(self):
+        return self._path
+
+    def getCapacity(self):
+        return self._capacity
+
+    def getRows(self):
+        return self._rows
+
+    def isOpened(self):
+        return self._mmap is not None
+
+    def open(self, rows):
+        """
+        Open existing filter file
+
+        @param rows: Current count of rows in hash table
+        @type  rows: int
+
+        @return: False if there is no valid filter and it must be rebuilt
+        @rtype: bool
+        """
+        self.close(False)
+
+        if not os.path.isfile(self._path):
+            return False
+
+        if os.path.getsize(self._path) < self.HEADER_SIZE:
+            return False
+
+        self._file = open(self._path, "r+b")
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+
+        magic, version, clean, self._hashes, self._bits, self._capacity, self._rows = struct.unpack_from(
+            self.HEADER_FORMAT, self._mmap, 0)
+
+        valid = magic == self.MAGIC and version == self.VERSION and clean
+        valid = valid and len(self._mmap) == self.HEADER_SIZE + self._bits // 8
+        valid = valid and self._rows == rows and rows < self._capacity
+
+        if not valid:
+            self.close(False)
+            return False
+
+        self._removed = 0
+        return True
+
+    def create(self, capacity, error_rate=0.001):
+        """
+        Create new empty filter file, old one is dropped
+
+        @param capacity: Expected count of hashes
+        @type  capacity: int
+
+        @param error_rate: False positive probability at full capacity
+        @type  error_rate: float
+        """
+        self.close(False)
+
+        capacity = max(int(capacity), 1024)
+
+        bits = int(ceil(-capacity * log(error_rate) / (log(2) ** 2)))
+        # Round up to whole bytes
+        bits = (bits + 7) // 8 * 8
+
+        self._bits = bits
+        self._hashes = max(1, int(round(1.0 * bits / capacity * log(2))))
+        self._capacity = capacity
+        self._rows = 0
+        self._removed = 0
+
+        db_dir = os.path.dirname(self._path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+
+        self._file = open(self._path, "w+b")
+        self._file.truncate(self.HEADER_SIZE + bits // 8)
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+        self._writeHeader(False)
+        return self
+
+    def _writeHeader(self, clean):
+        struct.pack_into(self.HEADER_FORMAT, self._mmap, 0,
+                         self.MAGIC, self.VERSION, 1 if clean else 0,
+                         self._hashes, self._bits, self._capacity, self._rows)
+        return
+
+    def setClean(self, flag=True):
+        """
+        Filter marked dirty while fs mounted. Dirty filter rebuilt on next mount.
+        """
+        if self._mmap is not None:
+            self._writeHeader(flag)
+            self._mmap.flush()
+        return self
+
+    def setRows(self, rows):
+        self._rows = rows
+        return self
+
+    def _positions(self, value):
+        if len(value) < 16:
+            value = hashlib.md5(value).digest()
+        h1 = int.from_bytes(value[:8], "little")
+        h2 = int.from_bytes(value[8:16], "little") | 1
+        bits = self._bits
+        return ((h1 + i * h2) % bits for i in range(self._hashes))
+
+    def add(self, value):
+        """
+        @param value: hash digest
+        @type  value: bytes
+        """
+        m = self._mmap
+        offset = self.HEADER_SIZE
+        for pos in self._positions(value):
+            m[offset + (pos >> 3)] |= 1 << (pos & 7)
+        return self
+
+    def __contains__(self, value):
+        m = self._mmap
+        offset = self.HEADER_SIZE
+        for pos in self._positions(value):
+            if not m[offset + (pos >> 3)] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def removed(self, count):
+        """
+        Bits of removed hashes can't be cleared - they only raise false positives rate
+        """
+        self._removed += count
+        return self
+
+    def isStale(self, rows):
+        """
+        Too many hashes removed or filter filled over capacity
+
+        @param rows: Current count of rows in hash table
+        @type  rows: int
+        """
+        if rows >= self._capacity:
+            return True
+        return self._removed > rows
+
+    def close(self, clean=True):
+        if self._mmap is not None:
+            if clean:
+                self.setClean(True)
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        return self
+
+    pass
@@ -4,6 +4,7 @@
 """
 
 from time import time
+from threading import RLock
 
 class IndexTime(object):
     """
@@ -29,8 +30,12 @@ class IndexTime(object):
 
     _inodes = None
 
+    # Guards storage if FUSE runs with worker threads
+    _lock = None
+
     def __init__(self):
         self._inodes = {}
+        self._lock = RLock()
         pass
 
     def __len__(self):
@@ -38,10 +43,11 @@ class IndexTime(object):
         For clear() count
         @return: int
         """
-        s = 0
-        for inode in self._inodes:
-            s += len(self._inodes[inode])
-        return s
+        with self._lock:
+            s = 0
+            for inode in self._inodes:
+                s += len(self._inodes[inode])
+            return s
 
     def setMaxTtl(self, seconds):
         self._max_ttl = seconds
@@ -54,96 +60,109 @@ class IndexTime(object):
         @type   item: dict
         """
 
-        new = False
-        if inode not in self._inodes:
-            self._inodes[ inode ] = {}
-            new = True
+        with self._lock:
+            new = False
+            if inode not in self._inodes:
+                self._inodes[ inode ] = {}
+                new = True
 
-        inode_data = self._inodes[inode]
+            inode_data = self._inodes[inode]
 
-        if block_number not in inode_data:
-            inode_data[ block_number ] = [0, item,]
-            new = True
+            if block_number not in inode_data:
+                inode_data[ block_number ] = [0, item,]
+                new = True
 
-        hash_data = inode_data[block_number]
+            hash_data = inode_data[block_number]
 
-        # If time not set to 0 (expired)
-        if hash_data[self.OFFSET_TIME]:
-            new = True
+            # If time not set to 0 (expired)
+            if hash_data[self.OFFSET_TIME]:
+                new = True
 
-        if new:
-            hash_data[self.OFFSET_TIME] = time()
-        hash_data[self.OFFSET_HASH] = item
+            if new:
+                hash_data[self.OFFSET_TIME] = time()
+            hash_data[self.OFFSET_HASH] = item
 
-        return self
+            return self
 
     def get(self, inode, block_number, default=None):
 
-        now = time()
+        with self._lock:
+            now = time()
 
-        inode_data = self._inodes.get(inode, {})
+            inode_data = self._inodes.get(inode, {})
 
-        hash_data = inode_data.get(block_number, [0, default])
+            hash_data = inode_data.get(block_number, [0, default])
 
-        val = hash_data[self.OFFSET_HASH]
+            val = hash_data[self.OFFSET_HASH]
 
-        t = hash_data[self.OFFSET_TIME]
-        if now - t > self._max_ttl:
-            return val
+            t = hash_data[self.OFFSET_TIME]
+            if now - t > self._max_ttl:
+                return val
 
-        # update last request time
-        hash_data[self.OFFSET_TIME] = now
+            # update last request time
+            hash_data[self.OFFSET_TIME] = now
 
-        return val
+            return val
 
     def expireBlock(self, inode, block_number):
 
-        removed = False
+        with self._lock:
+            removed = False
 
-        if inode in self._inodes:
-            inode_data = self._inodes.get(inode, {})
+            if inode in self._inodes:
+                inode_data = self._inodes.get(inode, {})
 
-            if block_number in inode_data:
-                block_data = inode_data[block_number]
-                block_data[self.OFFSET_TIME] = 0
-                removed = True
+                if block_number in inode_data:
+                    block_data = inode_data[block_number]
+                    block_data[self.OFFSET_TIME] = 0
+                    removed = True
 
-            if not inode_data:
-                removed = True
+                if not inode_data:
+                    removed = True
 
-        return removed
+            return removed
 
     def expire(self, inode):
-        if inode in self._inodes:
-            inode_data = self._inodes[inode]
-            for bn in inode_data.keys():
-                inode_data[bn][self.OFFSET_TIME] = 0
-        return
+        with self._lock:
+            if inode in self._inodes:
+                inode_data = self._inodes[inode]
+                for bn in inode_data.keys():
+                    inode_data[bn][self.OFFSET_TIME] = 0
+            return
+
+    def drop(self, inode):
+        """
+        Delete inode index from cache at once
+        """
+        with self._lock:
+            return len(self._inodes.pop(inode, {}))
 
     def expired(self):
-        now = time()
+        with self._lock:
+            now = time()
 
-        old_inodes = 0
+            old_inodes = 0
 
-        for inode in tuple(self._inodes.keys()):
+            for inode in tuple(self._inodes.keys()):
 
-            inode_data = self._inodes[inode]
+                inode_data = self._inodes[inode]
 
-            for bn in tuple(inode_data.keys()):
-                block_data = inode_data[bn]
+                for bn in tuple(inode_data.keys()):
+                    block_data = inode_data[bn]
 
-                t = block_data[self.OFFSET_TIME]
-                if now - t > self._max_ttl:
-                    old_inodes += 1
+                    t = block_data[self.OFFSET_TIME]
+                    if now - t > self._max_ttl:
+                        old_inodes += 1
 
-                    del inode_data[bn]
+                        del inode_data[bn]
 
-            if not inode_data and inode in self._inodes:
-                del self._inodes[inode]
+                if not inode_data and inode in self._inodes:
+                    del self._inodes[inode]
 
-        return old_inodes
+            return old_inodes
 
     def clear(self):
-        count = len(self)
-        self._inodes = {}
-        return count
+        with self._lock:
+            count = len(self)
+            self._inodes = {}
+            return count
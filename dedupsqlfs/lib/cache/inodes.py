@@ -4,6 +4,7 @@
 """
 
 from time import time
+from threading import RLock
 
 class InodesTime(object):
     """
@@ -32,15 +33,20 @@ class InodesTime(object):
 
     _inodes = None
 
+    # Guards storage if FUSE runs with worker threads
+    _lock = None
+
     def __init__(self):
         self._inodes = {}
+        self._lock = RLock()
         pass
 
     def __len__(self):
-        s = 0
-        for inode in self._inodes:
-            s += len(self._inodes[inode])
-        return s
+        with self._lock:
+            s = 0
+            for inode in self._inodes:
+                s += len(self._inodes[inode])
+            return s
 
     def set_max_ttl(self, seconds):
         self._max_ttl = seconds
@@ -53,47 +59,49 @@ class InodesTime(object):
         @type   writed: bool
         """
 
-        new = False
-        if inode not in self._inodes:
-            self._inodes[ inode ] = [
-                0, data, writed, writed
-            ]
-            new = True
+        with self._lock:
+            new = False
+            if inode not in self._inodes:
+                self._inodes[ inode ] = [
+                    0, data, writed, writed
+                ]
+                new = True
 
-        inode_data = self._inodes[inode]
+            inode_data = self._inodes[inode]
 
-        # If time not set to 0 (expired)
-        if inode_data[self.OFFSET_TIME]:
-            new = True
+            # If time not set to 0 (expired)
+            if inode_data[self.OFFSET_TIME]:
+                new = True
 
-        if new:
-            inode_data[self.OFFSET_TIME] = time()
-        inode_data[self.OFFSET_DATA] = data
+            if new:
+                inode_data[self.OFFSET_TIME] = time()
+            inode_data[self.OFFSET_DATA] = data
 
-        if writed:
-            inode_data[self.OFFSET_WRITTEN] = True
-            inode_data[self.OFFSET_TOFLUSH] = True
+            if writed:
+                inode_data[self.OFFSET_WRITTEN] = True
+                inode_data[self.OFFSET_TOFLUSH] = True
 
-        return self
+            return self
 
     def get(self, inode, default=None):
 
-        now = time()
+        with self._lock:
+            now = time()
 
-        inode_data = self._inodes.get(inode, [
-                0, default, False, False
-            ])
+            inode_data = self._inodes.get(inode, [
+                    0, default, False, False
+                ])
 
-        val = inode_data[self.OFFSET_DATA]
+            val = inode_data[self.OFFSET_DATA]
 
-        t = inode_data[self.OFFSET_TIME]
-        if now - t > self._max_ttl:
-            return val
+            t = inode_data[self.OFFSET_TIME]
+            if now - t > self._max_ttl:
+                return val
 
-        # update last request time
-        inode_data[self.OFFSET_TIME] = now
+            # update last request time
+            inode_data[self.OFFSET_TIME] = now
 
-        return val
+            return val
 
 
     def expired(self):
@@ -106,62 +114,66 @@ class InodesTime(object):
 
         @return: tuple(int, dict{ inode: data})
         """
-        now = time()
+        with self._lock:
+            now = time()
 
-        write_inodes = {}
-        readed_inodes = 0
+            write_inodes = {}
+            readed_inodes = 0
 
-        for inode in tuple(self._inodes.keys()):
+            for inode in tuple(self._inodes.keys()):
 
-            inode_data = self._inodes[inode]
+                inode_data = self._inodes[inode]
 
-            # Get data to FLUSH (and if requested written attrs)
-            if inode_data[self.OFFSET_TOFLUSH]:
-                write_inodes[inode] = inode_data[self.OFFSET_DATA].copy()
-                inode_data[self.OFFSET_TOFLUSH] = False
+                # Get data to FLUSH (and if requested written attrs)
+                if inode_data[self.OFFSET_TOFLUSH]:
+                    write_inodes[inode] = inode_data[self.OFFSET_DATA].copy()
+                    inode_data[self.OFFSET_TOFLUSH] = False
 
-            t = inode_data[self.OFFSET_TIME]
-            if now - t > self._max_ttl:
-                if inode_data[self.OFFSET_WRITTEN]:
-                    if not write_inodes.get(inode):
-                        write_inodes[inode] = inode_data[self.OFFSET_DATA].copy()
-                else:
-                    readed_inodes += 1
+                t = inode_data[self.OFFSET_TIME]
+                if now - t > self._max_ttl:
+                    if inode_data[self.OFFSET_WRITTEN]:
+                        if not write_inodes.get(inode):
+                            write_inodes[inode] = inode_data[self.OFFSET_DATA].copy()
+                    else:
+                        readed_inodes += 1
 
-                del self._inodes[inode]
+                    del self._inodes[inode]
 
-        return (readed_inodes, write_inodes,)
+            return (readed_inodes, write_inodes,)
 
 
     def flush(self, inode):
         """
         Do not remove but set flush flag
         """
-        if inode in self._inodes:
-            self._inodes[ inode ][self.OFFSET_TOFLUSH] = True
-        return self
+        with self._lock:
+            if inode in self._inodes:
+                self._inodes[ inode ][self.OFFSET_TOFLUSH] = True
+            return self
 
 
     def expire(self, inode):
         """
         Do not remove but expire
         """
-        if inode in self._inodes:
-            self._inodes[ inode ][self.OFFSET_TIME] = 0
-        return self
+        with self._lock:
+            if inode in self._inodes:
+                self._inodes[ inode ][self.OFFSET_TIME] = 0
+            return self
 
 
     def clear(self):
-        write_inodes = {}
+        with self._lock:
+            write_inodes = {}
 
-        for inode in self._inodes.keys():
+            for inode in self._inodes.keys():
 
-            inode_data = self._inodes[inode]
+                inode_data = self._inodes[inode]
 
-            if not inode_data[self.OFFSET_WRITTEN]:
-                continue
+                if not inode_data[self.OFFSET_WRITTEN]:
+                    continue
 
-            write_inodes[inode] = inode_data[self.OFFSET_DATA].copy()
+                write_inodes[inode] = inode_data[self.OFFSET_DATA].copy()
 
-        self._inodes = {}
-        return write_inodes
+            self._inodes = {}
+            return write_inodes
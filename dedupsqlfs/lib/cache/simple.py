@@ -1,6 +1,7 @@
 # -*- coding: utf8 -*-
 
 from time import time
+from threading import RLock
 
 __author__ = 'sergey'
 
@@ -24,48 +25,57 @@ class CacheTTLseconds(object):
 
     _storage = None
 
+    # Guards storage if FUSE runs with worker threads
+    _lock = None
+
     def __init__(self):
         self._storage = {}
+        self._lock = RLock()
         pass
 
     def __len__(self):
-        return len(self._storage)
+        with self._lock:
+            return len(self._storage)
 
     def set_max_ttl(self, seconds):
         self._max_ttl = seconds
         return self
 
     def set(self, key, value):
-        self._storage[ key ] = [time(), value]
-        return self
+        with self._lock:
+            self._storage[ key ] = [time(), value]
+            return self
 
     def get(self, key, default=None):
-        # not setted
-        now = time()
+        with self._lock:
+            # not setted
+            now = time()
 
-        item = self._storage.get(key, [0, default])
-        val = item[self.OFFSET_VALUE]
-        t = item[self.OFFSET_TIME]
+            item = self._storage.get(key, [0, default])
+            val = item[self.OFFSET_VALUE]
+            t = item[self.OFFSET_TIME]
 
-        if now - t > self._max_ttl:
-            return val
+            if now - t > self._max_ttl:
+                return val
 
-        # update time only if value was set
-        if key in self._storage:
-            self._storage[ key ][self.OFFSET_TIME] = now
+            # update time only if value was set
+            if key in self._storage:
+                self._storage[ key ][self.OFFSET_TIME] = now
 
-        return val
+            return val
 
     def unset(self, key):
-        if key in self._storage:
-            del self._storage[ key ]
-        return self
+        with self._lock:
+            if key in self._storage:
+                del self._storage[ key ]
+            return self
 
     def clear(self):
-        now = time()
-        count = 0
-        for key, item in tuple(self._storage.items()):
-            if now - item[self.OFFSET_TIME] > self._max_ttl:
-                del self._storage[key]
-                count += 1
-        return count
+        with self._lock:
+            now = time()
+            count = 0
+            for key, item in tuple(self._storage.items()):
+                if now - item[self.OFFSET_TIME] > self._max_ttl:
+                    del self._storage[key]
+                    count += 1
+            return count
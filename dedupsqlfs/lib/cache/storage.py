@@ -4,7 +4,8 @@
 """
 
 from time import time
-import heapq
+from threading import RLock
+from collections import OrderedDict
 
 class StorageTimeSize(object):
     """
@@ -14,8 +15,8 @@ class StorageTimeSize(object):
         inode (int) : {
             block_number (int) : [
                 timestamp (float),      - then added, updated, set to 0 if expired
-                block (BytesIO),        - block uncompressed data stream-like object
-                size (int),             - size of block data
+                block (bytearray),      - block uncompressed data, changed in place
+                size (int),             - size of block data, then it was set
                 written (bool)          - data was written, updated
                 toflush (bool)          - data must be flushed as soos as possible, but not expired
             ], ...
@@ -23,6 +24,20 @@ class StorageTimeSize(object):
     }
 
     Just to not lookup in SQLdb
+
+    Blocks also linked in LRU lists - one for writed, one for readed blocks:
+
+    {
+        (inode, block_number) : block_data, ...
+    }
+
+    Least recently used first. Expire by size pops from list head.
+
+    With segmented LRU readed blocks first go to probation list,
+    moved to protected list then reused: accessed again after reader
+    of inode moved to other block. Many reads of one block in sequential
+    scan are not reuse, so scan fills only probation list and don't
+    push out hot blocks.
     """
 
     OFFSET_TIME = 0
@@ -51,15 +66,40 @@ class StorageTimeSize(object):
     _inodes = None
     _block_size = 128*1024
 
+    _lru_write = None
+    _lru_read = None
+    # Protected segment of readed blocks
+    _lru_read_hot = None
+
+    _segmented = False
+    # Maximum size of protected segment, % of read cache size
+    _max_hot_size_pct = 80
+    _cur_read_hot_size = 0
+
+    # Probation blocks already used since they were loaded: { (inode, block_number), ... }
+    _read_used = None
+    # Last readed block of inode: { inode: block_number }
+    _last_read = None
+
+    # Guards storage if FUSE runs with worker threads
+    _lock = None
+
     def __init__(self):
         self._inodes = {}
+        self._lru_write = OrderedDict()
+        self._lru_read = OrderedDict()
+        self._lru_read_hot = OrderedDict()
+        self._read_used = set()
+        self._last_read = {}
+        self._lock = RLock()
         pass
 
     def __len__(self):
-        s = 0
-        for inode in self._inodes:
-            s += len(self._inodes[inode])
-        return s
+        with self._lock:
+            s = 0
+            for inode in self._inodes:
+                s += len(self._inodes[inode])
+            return s
 
     def setBlockSize(self, in_bytes):
         self._block_size = in_bytes
@@ -81,100 +121,185 @@ class StorageTimeSize(object):
         self._max_read_ttl = seconds
         return self
 
+    def setSegmented(self, flag=True):
+        self._segmented = flag
+        return self
+
+    def _lru_remove(self, key, block_data):
+        if block_data[self.OFFSET_WRITTEN]:
+            self._lru_write.pop(key, None)
+        elif key in self._lru_read_hot:
+            del self._lru_read_hot[key]
+            self._cur_read_hot_size -= block_data[self.OFFSET_SIZE]
+        else:
+            self._lru_read.pop(key, None)
+            self._read_used.discard(key)
+        return
+
+    def _lru_touch(self, key, block_data, reused=False):
+        """
+        Move block to most recently used end of its list
+
+        @param reused: Block accessed after other block of inode
+        @type  reused: bool
+        """
+        if block_data[self.OFFSET_WRITTEN]:
+            self._lru_write.move_to_end(key)
+        elif key in self._lru_read_hot:
+            self._lru_read_hot.move_to_end(key)
+        elif self._segmented and reused and key in self._read_used:
+            # Used again - block is hot
+            del self._lru_read[key]
+            self._read_used.discard(key)
+            self._lru_read_hot[key] = block_data
+            self._cur_read_hot_size += block_data[self.OFFSET_SIZE]
+            self._lru_demote()
+        else:
+            if self._segmented:
+                self._read_used.add(key)
+            self._lru_read.move_to_end(key)
+        return
+
+    def _lru_demote(self):
+        """
+        Move least used protected blocks back to probation list
+        """
+        if self._max_read_cache_size < 0:
+            return
+        maxHotSize = self._max_read_cache_size * self._max_hot_size_pct / 100.0
+        while self._cur_read_hot_size > maxHotSize and len(self._lru_read_hot) > 1:
+            key, block_data = self._lru_read_hot.popitem(last=False)
+            self._cur_read_hot_size -= block_data[self.OFFSET_SIZE]
+            self._lru_read[key] = block_data
+            self._read_used.add(key)
+        return
+
     def set(self, inode, block_number, block, writed=False):
         """
         @type   inode: int
         @type   block_number: int
-        @type   block: BytesIO
+        @type   block: bytearray
         @type   writed: bool
         """
 
-        new = False
-        if inode not in self._inodes:
-            self._inodes[ inode ] = {}
-            new = True
+        with self._lock:
+            new = False
+            if inode not in self._inodes:
+                self._inodes[ inode ] = {}
+                new = True
 
-        inode_data = self._inodes[inode]
+            inode_data = self._inodes[inode]
+
+            key = (inode, block_number,)
 
-        if block_number not in inode_data:
-            inode_data[ block_number ] = [
-                0, block, 0, writed, writed
-            ]
-            new = True
+            if block_number not in inode_data:
+                inode_data[ block_number ] = [
+                    0, block, 0, writed, writed
+                ]
+                new = True
+                if writed:
+                    self._lru_write[ key ] = inode_data[ block_number ]
+                else:
+                    self._lru_read[ key ] = inode_data[ block_number ]
+            elif writed and not inode_data[block_number][self.OFFSET_WRITTEN]:
+                # Readed block changed - move to writed list
+                self._lru_remove(key, inode_data[block_number])
+                self._lru_write[ key ] = inode_data[ block_number ]
+            else:
+                self._lru_touch(key, inode_data[block_number])
 
-        block_data = inode_data[block_number]
+            block_data = inode_data[block_number]
 
-        blockSize = len(block.getvalue())
+            blockSize = len(block)
 
-        if not new:
-            # Not new block
-            oldBlockSize = block_data[self.OFFSET_SIZE]
-            if writed:
-                # If it now writed
-                if not block_data[self.OFFSET_WRITTEN]:
-                    # But not was
-                    self._cur_read_cache_size -= oldBlockSize
-                else:
+            if not new:
+                # Not new block
+                oldBlockSize = block_data[self.OFFSET_SIZE]
+                if block_data[self.OFFSET_WRITTEN]:
                     self._cur_write_cache_size -= oldBlockSize
-            else:
-                self._cur_read_cache_size -= oldBlockSize
+                else:
+                    self._cur_read_cache_size -= oldBlockSize
+                    if not writed and key in self._lru_read_hot:
+                        self._cur_read_hot_size += blockSize - oldBlockSize
 
-        if writed:
-            self._cur_write_cache_size += blockSize
-        else:
-            self._cur_read_cache_size += blockSize
+            # Writed block stays writed until flush, even if readed again
+            if writed or block_data[self.OFFSET_WRITTEN]:
+                self._cur_write_cache_size += blockSize
+            else:
+                self._cur_read_cache_size += blockSize
 
-        # If time not set to 0 (expired)
-        if block_data[self.OFFSET_TIME]:
-            new = True
+            # If time not set to 0 (expired)
+            if block_data[self.OFFSET_TIME]:
+                new = True
 
-        if new:
-            block_data[self.OFFSET_TIME] = time()
-        block_data[self.OFFSET_BLOCK] = block
-        block_data[self.OFFSET_SIZE] = blockSize
+            if new:
+                block_data[self.OFFSET_TIME] = time()
+            block_data[self.OFFSET_BLOCK] = block
+            block_data[self.OFFSET_SIZE] = blockSize
 
-        if writed:
-            block_data[self.OFFSET_WRITTEN] = True
-            block_data[self.OFFSET_TOFLUSH] = True
+            if writed:
+                block_data[self.OFFSET_WRITTEN] = True
+                block_data[self.OFFSET_TOFLUSH] = True
 
-        return self
+            return self
 
     def get(self, inode, block_number, default=None):
 
-        now = time()
+        with self._lock:
+            now = time()
 
-        inode_data = self._inodes.get(inode, {})
+            inode_data = self._inodes.get(inode, {})
 
-        block_data = inode_data.get(block_number, [
-                0, default, 0, False, False
-            ])
+            block_data = inode_data.get(block_number, [
+                    0, default, 0, False, False
+                ])
 
-        val = block_data[self.OFFSET_BLOCK]
+            val = block_data[self.OFFSET_BLOCK]
 
-        t = block_data[self.OFFSET_TIME]
-        if block_data[self.OFFSET_WRITTEN]:
-            if now - t > self._max_write_ttl:
-                return val
-        else:
-            if now - t > self._max_read_ttl:
-                return val
+            t = block_data[self.OFFSET_TIME]
+            if block_data[self.OFFSET_WRITTEN]:
+                if now - t > self._max_write_ttl:
+                    return val
+            else:
+                if now - t > self._max_read_ttl:
+                    return val
+
+            # update last request time
+            block_data[self.OFFSET_TIME] = now
+            if block_number in inode_data:
+                self._lru_touch((inode, block_number,), block_data, self._last_read.get(inode) != block_number)
+                self._last_read[inode] = block_number
 
-        # update last request time
-        block_data[self.OFFSET_TIME] = now
+            return val
 
-        return val
+    def has(self, inode, block_number):
+        """
+        Check block without access time and LRU update
+        """
+        with self._lock:
+            return block_number in self._inodes.get(inode, {})
 
     def getCachedSize(self, writed=False):
-        size = 0
-        for inode in self._inodes.keys():
-            for block_data in self._inodes[inode].values():
-                if block_data[self.OFFSET_WRITTEN] != writed:
-                    continue
+        with self._lock:
+            size = 0
+            for inode in self._inodes.keys():
+                for block_data in self._inodes[inode].values():
+                    if block_data[self.OFFSET_WRITTEN] != writed:
+                        continue
 
-                size += len(block_data[self.OFFSET_BLOCK].getvalue())
-        return size
+                    size += block_data[self.OFFSET_SIZE]
+            return size
 
 
+    def hasDirty(self):
+        """
+        Are there writed blocks not flushed yet, without walk over all blocks
+
+        @rtype: bool
+        """
+        with self._lock:
+            return self._cur_write_cache_size > 0
+
     def isWritedCacheFull(self):
         if self._max_write_cache_size < 0:
             return False
@@ -199,19 +324,45 @@ class StorageTimeSize(object):
         
         @return: bool 
         """
-        canDel = True
-        if inode in self._inodes:
-            inode_data = self._inodes[inode]
-            for bn in inode_data.keys():
-                block_data = inode_data[bn]
-                block_data[self.OFFSET_TIME] = 0
+        with self._lock:
+            canDel = True
+            if inode in self._inodes:
+                inode_data = self._inodes[inode]
+                for bn in inode_data.keys():
+                    block_data = inode_data[bn]
+                    block_data[self.OFFSET_TIME] = 0
+                    if block_data[self.OFFSET_WRITTEN]:
+                        canDel = False
+                    if block_data[self.OFFSET_TOFLUSH]:
+                        canDel = False
+                if canDel:
+                    for bn in inode_data.keys():
+                        self._lru_remove((inode, bn,), inode_data[bn])
+                        # Only readed blocks here
+                        self._cur_read_cache_size -= inode_data[bn][self.OFFSET_SIZE]
+                    del self._inodes[inode]
+                    self._last_read.pop(inode, None)
+            return canDel
+
+    def drop(self, inode):
+        """
+        Delete inode blocks from cache at once, writed data is not flushed
+
+        @param inode:
+        @type inode: int
+
+        @return: count of dropped blocks
+        """
+        with self._lock:
+            inode_data = self._inodes.pop(inode, {})
+            self._last_read.pop(inode, None)
+            for bn, block_data in inode_data.items():
                 if block_data[self.OFFSET_WRITTEN]:
-                    canDel = False
-                if block_data[self.OFFSET_TOFLUSH]:
-                    canDel = False
-            if canDel:
-                del self._inodes[inode]
-        return canDel
+                    self._cur_write_cache_size -= block_data[self.OFFSET_SIZE]
+                else:
+                    self._cur_read_cache_size -= block_data[self.OFFSET_SIZE]
+                self._lru_remove((inode, bn,), block_data)
+            return len(inode_data)
 
     def expire(self, inode):
         """
@@ -221,11 +372,12 @@ class StorageTimeSize(object):
         @param inode: 
         @return: 
         """
-        if inode in self._inodes:
-            inode_data = self._inodes[inode]
-            for bn in inode_data.keys():
-                inode_data[bn][self.OFFSET_TIME] = 0
-        return
+        with self._lock:
+            if inode in self._inodes:
+                inode_data = self._inodes[inode]
+                for bn in inode_data.keys():
+                    inode_data[bn][self.OFFSET_TIME] = 0
+            return
 
     def flush(self, inode):
         """
@@ -234,163 +386,122 @@ class StorageTimeSize(object):
         @param inode: 
         @return: 
         """
-        if inode in self._inodes:
-            inode_data = self._inodes[inode]
-            for bn in inode_data.keys():
-                inode_data[bn][self.OFFSET_TOFLUSH] = True
-        return
+        with self._lock:
+            if inode in self._inodes:
+                inode_data = self._inodes[inode]
+                for bn in inode_data.keys():
+                    inode_data[bn][self.OFFSET_TOFLUSH] = True
+            return
 
     def expired(self):
-        now = time()
+        with self._lock:
+            now = time()
 
-        write_inodes = {}
-        read_inodes = 0
+            write_inodes = {}
+            read_inodes = 0
 
-        for inode in tuple(self._inodes.keys()):
+            for inode in tuple(self._inodes.keys()):
 
-            inode_data = self._inodes[inode]
-
-            for bn in tuple(inode_data.keys()):
-                block_data = inode_data[bn]
-
-                # Get data to FLUSH (and if requested written blocks)
-                if block_data[self.OFFSET_TOFLUSH]:
-
-                    if inode not in write_inodes:
-                        write_inodes[inode] = {}
+                inode_data = self._inodes[inode]
 
-                    write_inodes[inode][bn] = block_data.copy()
+                for bn in tuple(inode_data.keys()):
+                    block_data = inode_data[bn]
 
-                    block_data[self.OFFSET_TOFLUSH] = False
+                    # Get data to FLUSH (and if requested written blocks)
+                    if block_data[self.OFFSET_TOFLUSH]:
 
-                t = block_data[self.OFFSET_TIME]
-                if now - t > self._max_write_ttl:
-                    if block_data[self.OFFSET_WRITTEN]:
                         if inode not in write_inodes:
                             write_inodes[inode] = {}
 
                         write_inodes[inode][bn] = block_data.copy()
 
-                        self._cur_write_cache_size -= block_data[self.OFFSET_SIZE]
-                    else:
-                        read_inodes += 1
+                        block_data[self.OFFSET_TOFLUSH] = False
 
-                        self._cur_read_cache_size -= block_data[self.OFFSET_SIZE]
+                    t = block_data[self.OFFSET_TIME]
+                    if now - t > self._max_write_ttl:
+                        if block_data[self.OFFSET_WRITTEN]:
+                            if inode not in write_inodes:
+                                write_inodes[inode] = {}
 
-                    del inode_data[bn]
+                            write_inodes[inode][bn] = block_data.copy()
+
+                            self._cur_write_cache_size -= block_data[self.OFFSET_SIZE]
+                        else:
+                            read_inodes += 1
+
+                            self._cur_read_cache_size -= block_data[self.OFFSET_SIZE]
 
-            if not inode_data and inode in self._inodes:
-                del self._inodes[inode]
+                        self._lru_remove((inode, bn,), block_data)
+                        del inode_data[bn]
 
-        return (read_inodes, write_inodes,)
+                if not inode_data and inode in self._inodes:
+                    del self._inodes[inode]
+                    self._last_read.pop(inode, None)
+
+            return (read_inodes, write_inodes,)
 
 
     def expireByCount(self, writed=False):
         """
         Expired inodes data by in-memory bytes size of cache
+        Least recently used blocks go first
         
         @param writed: 
         @return: dict or int 
         """
 
-        now = time()
-
-        # 1. Fill heap
-
-        heap = []
-
-        inodesKeys = tuple(self._inodes.keys())
-
-        for inode in inodesKeys:
-
-            inode_data = self._inodes[inode]
-
-            for bn in inode_data.keys():
-                block_data = inode_data[bn]
-
-                if block_data[self.OFFSET_WRITTEN] != writed:
-                    continue
-
-                t = block_data[self.OFFSET_TIME]
-                heapq.heappush(
-                    heap, (
-                        int((now - t)*10**6),
-                        inode,
-                        bn,
-                        len(block_data[self.OFFSET_BLOCK].getvalue())
-                    )
-                )
-
-        # 2. Sort heap
+        with self._lock:
 
-        if writed:
-            currentSize = self._cur_write_cache_size
-            maxSize = self._max_write_cache_size
-        else:
-            currentSize = self._cur_read_cache_size
-            maxSize = self._max_read_cache_size
-
-        needMaxSize = int(maxSize * (100.0 - self._max_size_trsh) / 100.0)
-
-        nget = int((currentSize - needMaxSize) / self._block_size)
-
-        mostoldest = []
-        while True:
-            needSize = currentSize
-            mostoldest = heapq.nlargest(nget, heap)
-            for dt, inode, bn, bsize in mostoldest:
-                needSize -= bsize
-            if needSize <= needMaxSize:
-                break
-            nget += 1
-
-        # 3. Convert data
-
-        heap_inodes = {}
-        for dt, inode, bn, bsize in mostoldest:
-            if inode not in heap_inodes:
-                heap_inodes[ inode ] = ()
-            heap_inodes[ inode ] += (bn,)
-
-        del heap
-        del mostoldest
-
-        # 4. Expire cache, filter by new data
+            if writed:
+                currentSize = self._cur_write_cache_size
+                maxSize = self._max_write_cache_size
+                lists = (self._lru_write,)
+            else:
+                currentSize = self._cur_read_cache_size
+                maxSize = self._max_read_cache_size
+                # Probation segment first
+                lists = (self._lru_read, self._lru_read_hot,)
 
-        if writed:
-            oversize_inodes = {}
-        else:
-            oversize_inodes = 0
+            needMaxSize = int(maxSize * (100.0 - self._max_size_trsh) / 100.0)
 
-        for inode in heap_inodes.keys():
+            if writed:
+                oversize_inodes = {}
+            else:
+                oversize_inodes = 0
 
-            inode_data = self._inodes[inode]
+            for lru in lists:
 
-            for bn in heap_inodes[inode]:
+                while currentSize > needMaxSize and lru:
 
-                block_data = inode_data[bn]
+                    key, block_data = lru.popitem(last=False)
+                    inode, bn = key
 
-                if block_data[self.OFFSET_WRITTEN] != writed:
-                    continue
+                    currentSize -= block_data[self.OFFSET_SIZE]
 
-                if writed:
-                    if inode not in oversize_inodes:
-                        oversize_inodes[inode] = {}
+                    if writed:
+                        if inode not in oversize_inodes:
+                            oversize_inodes[inode] = {}
 
-                    oversize_inodes[inode][bn] = block_data.copy()
+                        oversize_inodes[inode][bn] = block_data.copy()
 
-                    self._cur_write_cache_size -= block_data[self.OFFSET_SIZE]
-                else:
-                    oversize_inodes += 1
+                        self._cur_write_cache_size -= block_data[self.OFFSET_SIZE]
+                    else:
+                        oversize_inodes += 1
 
-                    self._cur_read_cache_size -= block_data[self.OFFSET_SIZE]
+                        self._cur_read_cache_size -= block_data[self.OFFSET_SIZE]
+                        if lru is self._lru_read_hot:
+                            self._cur_read_hot_size -= block_data[self.OFFSET_SIZE]
+                        else:
+                            self._read_used.discard(key)
 
-                del inode_data[bn]
+                    inode_data = self._inodes[inode]
+                    del inode_data[bn]
 
-            if not inode_data and inode in self._inodes:
-                del self._inodes[inode]
+                    if not inode_data:
+                        del self._inodes[inode]
+                        self._last_read.pop(inode, None)
 
-        return oversize_inodes
+            return oversize_inodes
 
 
     def clear(self):
@@ -401,32 +512,41 @@ class StorageTimeSize(object):
         @return: dict 
         """
 
-        old_inodes = {}
+        with self._lock:
+            old_inodes = {}
 
-        for inode in self._inodes.keys():
+            for inode in self._inodes.keys():
 
-            inode_data = self._inodes[inode]
+                inode_data = self._inodes[inode]
 
-            for bn in inode_data.keys():
-                block_data = inode_data[bn]
+                for bn in inode_data.keys():
+                    block_data = inode_data[bn]
 
-                # Get data to FLUSH (and if requested written blocks)
-                if block_data[self.OFFSET_TOFLUSH]:
+                    # Get data to FLUSH (and if requested written blocks)
+                    if block_data[self.OFFSET_TOFLUSH]:
 
-                    if inode not in old_inodes:
-                        old_inodes[inode] = {}
+                        if inode not in old_inodes:
+                            old_inodes[inode] = {}
 
-                    old_inodes[inode][bn] = block_data.copy()
+                        old_inodes[inode][bn] = block_data.copy()
 
-                    block_data[self.OFFSET_TOFLUSH] = False
+                        block_data[self.OFFSET_TOFLUSH] = False
 
-                if not block_data[self.OFFSET_WRITTEN]:
-                    continue
+                    if not block_data[self.OFFSET_WRITTEN]:
+                        continue
 
-                if inode not in old_inodes:
-                    old_inodes[inode] = {}
+                    if inode not in old_inodes:
+                        old_inodes[inode] = {}
 
-                old_inodes[inode][bn] = block_data.copy()
+                    old_inodes[inode][bn] = block_data.copy()
 
-        self._inodes = {}
-        return old_inodes
+            self._inodes = {}
+            self._lru_write.clear()
+            self._lru_read.clear()
+            self._lru_read_hot.clear()
+            self._read_used.clear()
+            self._last_read.clear()
+            self._cur_write_cache_size = 0
+            self._cur_read_cache_size = 0
+            self._cur_read_hot_size = 0
+            return old_inodes
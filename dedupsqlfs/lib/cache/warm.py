@@ -0,0 +1,294 @@
+# -*- coding: utf8 -*-
+"""
+Metadata cache stored on disk between mounts
+
+File is mapped into memory on mount and searched in place,
+so first traversal of tree after remount don't wait for database.
+
+Layout, all numbers little-endian:
+
+    header:     magic, version, subvolume updated_at,
+                count of names, nodes, inodes, size of names data
+    names:      (hash of name, name_id, offset, length) sorted by hash
+    nodes:      (parent inode, name_id, node_id, inode_id) sorted by (parent inode, name_id)
+    inodes:     (id, nlinks, mode, uid, gid, rdev, size, atime, mtime, ctime) sorted by id
+    names data: name bytes
+
+File is valid only for subvolume state it was written for, it is removed
+right after load, so it can't be used twice or after crash.
+
+@author Sergey Dryabzhinsky
+"""
+
+import os
+import mmap
+import struct
+import hashlib
+
+MAGIC = b"DSQLFSMC"
+VERSION = 1
+
+HEADER = struct.Struct("<8sIqQQQQ")
+NAME = struct.Struct("<QQQI")
+NODE = struct.Struct("<QQQQ")
+INODE = struct.Struct("<10q")
+
+INODE_FIELDS = ("id", "nlinks", "mode", "uid", "gid", "rdev", "size", "atime", "mtime", "ctime",)
+
+
+def name_hash(name):
+    return struct.unpack("<Q", hashlib.blake2b(name, digest_size=8).digest())[0]
+
+
+class WarmMetaCache(object):
+
+    # Stop remembering new entries after
+    _max_entries = 1000000
+
+    _map = None
+    _names_offset = 0
+    _nodes_offset = 0
+    _inodes_offset = 0
+    _data_offset = 0
+    _names_count = 0
+    _nodes_count = 0
+    _inodes_count = 0
+
+    # Read from database in this session: override mapped ones
+    _names = None
+    _nodes = None
+    _inodes = None
+
+    # Changed in this session: mapped ones are stale
+    _names_stale = False
+    _nodes_forgot = None
+    _inodes_forgot = None
+
+    def __init__(self, max_entries=None):
+        if max_entries:
+            self._max_entries = max_entries
+        self._names = {}
+        self._nodes = {}
+        self._inodes = {}
+        self._nodes_forgot = set()
+        self._inodes_forgot = set()
+        pass
+
+    def __len__(self):
+        return len(self._names) + len(self._nodes) + len(self._inodes) + \
+               self._names_count + self._nodes_count + self._inodes_count
+
+    def load(self, path, updated_at):
+        """
+        Map cache file, if it was written for same state of subvolume
+
+        @param path: str
+        @param updated_at: int - subvolume update time from database
+        @return: bool - file is loaded
+        """
+        if not os.path.isfile(path):
+            return False
+
+        loaded = False
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size >= HEADER.size:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                magic, version, file_updated_at, names, nodes, inodes, data_size = HEADER.unpack_from(m, 0)
+                expected = HEADER.size + names * NAME.size + nodes * NODE.size + inodes * INODE.size + data_size
+                if magic == MAGIC and version == VERSION and file_updated_at == updated_at and size == expected:
+                    self._map = m
+                    self._names_count = names
+                    self._nodes_count = nodes
+                    self._inodes_count = inodes
+                    self._names_offset = HEADER.size
+                    self._nodes_offset = self._names_offset + names * NAME.size
+                    self._inodes_offset = self._nodes_offset + nodes * NODE.size
+                    self._data_offset = self._inodes_offset + inodes * INODE.size
+                    loaded = True
+                else:
+                    m.close()
+
+        # Mapping stays valid after unlink
+        os.unlink(path)
+        return loaded
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._names_count = self._nodes_count = self._inodes_count = 0
+        return self
+
+    def _search(self, offset, count, rec, key, keyLen):
+        """
+        Binary search of first record with key prefix not less than key
+
+        @return: index of record
+        """
+        lo = 0
+        hi = count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if rec.unpack_from(self._map, offset + mid * rec.size)[:keyLen] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    # Names
+
+    def getNameId(self, name):
+        name_id = self._names.get(name)
+        if name_id is not None or self._map is None or self._names_stale:
+            return name_id
+
+        h = name_hash(name)
+        i = self._search(self._names_offset, self._names_count, NAME, (h,), 1)
+        while i < self._names_count:
+            rh, name_id, offset, length = NAME.unpack_from(self._map, self._names_offset + i * NAME.size)
+            if rh != h:
+                break
+            start = self._data_offset + offset
+            if self._map[start:start + length] == name:
+                return name_id
+            i += 1
+        return None
+
+    def addName(self, name, name_id):
+        if len(self._names) < self._max_entries:
+            self._names[ name ] = name_id
+        return self
+
+    def forgetNames(self):
+        """
+        Names were removed from database, their ids can be used again
+        """
+        self._names = {}
+        self._names_stale = True
+        return self
+
+    # Tree nodes
+
+    def getNode(self, parent_inode, name_id):
+        key = (parent_inode, name_id,)
+        node = self._nodes.get(key)
+        if node is not None or self._map is None or key in self._nodes_forgot:
+            return node
+
+        i = self._search(self._nodes_offset, self._nodes_count, NODE, key, 2)
+        if i < self._nodes_count:
+            rec = NODE.unpack_from(self._map, self._nodes_offset + i * NODE.size)
+            if rec[:2] == key:
+                return {"id": rec[2], "inode_id": rec[3], "name_id": name_id}
+        return None
+
+    def addNode(self, parent_inode, node):
+        if len(self._nodes) < self._max_entries:
+            self._nodes[ (parent_inode, node["name_id"],) ] = {
+                "id": node["id"], "inode_id": node["inode_id"], "name_id": node["name_id"],
+            }
+        return self
+
+    def forgetNode(self, parent_inode, name_id):
+        key = (parent_inode, name_id,)
+        self._nodes.pop(key, None)
+        self._nodes_forgot.add(key)
+        return self
+
+    # Inodes
+
+    def getInode(self, inode_id):
+        row = self._inodes.get(inode_id)
+        if row is not None:
+            return row.copy()
+        if self._map is None or inode_id in self._inodes_forgot:
+            return None
+
+        i = self._search(self._inodes_offset, self._inodes_count, INODE, (inode_id,), 1)
+        if i < self._inodes_count:
+            rec = INODE.unpack_from(self._map, self._inodes_offset + i * INODE.size)
+            if rec[0] == inode_id:
+                return dict(zip(INODE_FIELDS, rec))
+        return None
+
+    def addInode(self, row):
+        if len(self._inodes) < self._max_entries:
+            self._inodes[ row["id"] ] = dict((f, row[f],) for f in INODE_FIELDS)
+        return self
+
+    def forgetInode(self, inode_id):
+        self._inodes.pop(inode_id, None)
+        self._inodes_forgot.add(inode_id)
+        return self
+
+    # Write back
+
+    def _mappedNames(self):
+        if self._map is None or self._names_stale:
+            return
+        for i in range(self._names_count):
+            h, name_id, offset, length = NAME.unpack_from(self._map, self._names_offset + i * NAME.size)
+            start = self._data_offset + offset
+            yield self._map[start:start + length], name_id
+
+    def _mappedNodes(self):
+        if self._map is None:
+            return
+        for i in range(self._nodes_count):
+            rec = NODE.unpack_from(self._map, self._nodes_offset + i * NODE.size)
+            if rec[:2] not in self._nodes_forgot:
+                yield rec
+
+    def _mappedInodes(self):
+        if self._map is None:
+            return
+        for i in range(self._inodes_count):
+            rec = INODE.unpack_from(self._map, self._inodes_offset + i * INODE.size)
+            if rec[0] not in self._inodes_forgot:
+                yield rec
+
+    def save(self, path, updated_at):
+        """
+        Write mapped entries still valid and entries read in this session
+
+        @param path: str
+        @param updated_at: int - subvolume update time stored in database
+        """
+        names = dict(self._mappedNames())
+        names.update(self._names)
+
+        nodes = dict((rec[:2], rec,) for rec in self._mappedNodes())
+        for key, node in self._nodes.items():
+            nodes[ key ] = key + (node["id"], node["inode_id"],)
+
+        inodes = dict((rec[0], rec,) for rec in self._mappedInodes())
+        for inode_id, row in self._inodes.items():
+            inodes[ inode_id ] = tuple(row[f] for f in INODE_FIELDS)
+
+        nameRecs = []
+        data = []
+        offset = 0
+        for name, name_id in names.items():
+            nameRecs.append((name_hash(name), name_id, offset, len(name),))
+            data.append(name)
+            offset += len(name)
+        nameRecs.sort()
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, updated_at, len(nameRecs), len(nodes), len(inodes), offset))
+            for rec in nameRecs:
+                f.write(NAME.pack(*rec))
+            for key in sorted(nodes.keys()):
+                f.write(NODE.pack(*nodes[ key ]))
+            for inode_id in sorted(inodes.keys()):
+                f.write(INODE.pack(*inodes[ inode_id ]))
+            for name in data:
+                f.write(name)
+
+        self.close()
+        os.rename(tmp_path, path)
+        return self
+
+    pass
@@ -0,0 +1,152 @@
+# -*- coding: utf8 -*-
+"""
+Content-defined chunking
+
+FastCDC: gear rolling hash, normalized chunking with two masks.
+Boundaries depend only on data bytes around them, so inserted or
+removed bytes shift only nearest chunks, others stay the same
+and dedup against previous versions of data.
+
+Module is compiled by Cython with the rest of package (see setup.py).
+Byte loop is done by C module from lib-dynload/fastcdc if it is built,
+pure Python loop is much slower and limits write speed.
+
+@author Sergey Dryabzhinsky
+"""
+
+import hashlib
+from array import array
+
+try:
+    # lib-dynload is in sys.path of programs in bin/
+    from fastcdc import cut_offsets
+except ImportError:
+    cut_offsets = None
+
+# Gear table must never change - chunk boundaries of stored data depend on it
+GEAR = tuple(
+    int.from_bytes(hashlib.md5(b"dedupsqlfs-gear-%d" % i).digest()[:8], "little")
+    for i in range(256)
+)
+
+MASK64 = 0xFFFFFFFFFFFFFFFF
+
+# Same table for C module
+GEAR_BYTES = array("Q", GEAR).tobytes()
+
+
+def hasAccelerator():
+    """
+    Is byte loop done by C module?
+
+    @rtype: bool
+    """
+    return cut_offsets is not None
+
+
+class FastCDC(object):
+    """
+    Split data into variable sized chunks
+
+    min_size - no boundaries before it, bytes are skipped without hashing
+    avg_size - expected chunk size, must be power of 2
+    max_size - forced boundary
+    """
+
+    _min_size = 0
+    _avg_size = 0
+    _max_size = 0
+
+    _mask_s = 0
+    _mask_l = 0
+
+    def __init__(self, avg_size, min_size=None, max_size=None):
+        bits = int(avg_size).bit_length() - 1
+        self._avg_size = 1 << bits
+
+        if min_size is None:
+            min_size = self._avg_size // 4
+        if max_size is None:
+            max_size = self._avg_size * 4
+
+        self._min_size = int(min_size)
+        self._max_size = int(max_size)
+
+        # Harder to match before average size, easier after it.
+        # Upper bits of gear hash depend on more bytes of window.
+        self._mask_s = ((1 << (bits + 2)) - 1) << (64 - bits - 2)
+        self._mask_l = ((1 << (bits - 2)) - 1) << (64 - bits + 2)
+        pass
+
+    def getAvgSize(self):
+        return self._avg_size
+
+    def getMinSize(self):
+        return self._min_size
+
+    def getMaxSize(self):
+        return self._max_size
+
+    def cut(self, data, start=0):
+        """
+        Find end of chunk which starts at 'start'
+
+        @param data: bytes
+        @param start: int
+        @return: int - offset after chunk end
+        """
+        length = len(data)
+        n = length - start
+        if n <= self._min_size:
+            return length
+        if n > self._max_size:
+            n = self._max_size
+
+        normal = self._avg_size
+        if normal > n:
+            normal = n
+
+        gear = GEAR
+        mask = self._mask_s
+        h = 0
+
+        i = start + self._min_size
+        end = start + normal
+        while i < end:
+            h = ((h << 1) + gear[data[i]]) & MASK64
+            i += 1
+            if not h & mask:
+                return i
+
+        mask = self._mask_l
+        end = start + n
+        while i < end:
+            h = ((h << 1) + gear[data[i]]) & MASK64
+            i += 1
+            if not h & mask:
+                return i
+
+        return end
+
+    def split(self, data):
+        """
+        @param data: bytes
+        @return: list of bytes
+        """
+        chunks = []
+        start = 0
+        if cut_offsets is not None:
+            for end in cut_offsets(data, self._min_size, self._avg_size, self._max_size,
+                                   self._mask_s, self._mask_l, GEAR_BYTES):
+                chunks.append(data[start:end])
+                start = end
+            return chunks
+
+        length = len(data)
+        while start < length:
+            end = self.cut(data, start)
+            chunks.append(data[start:end])
+            start = end
+        return chunks
+
+    pass
@@ -24,7 +24,8 @@ COMPRESSION_LEVEL_NORM="normal"
 COMPRESSION_LEVEL_BEST="best"
 
 # Subset of hashlib simple funcs
-WANTED_HASH_FUCTIONS = {'md4', 'md5', 'sha1', 'sha224', 'sha256', 'sha384', 'sha512', 'whirlpool', 'ripemd160'}
+WANTED_HASH_FUCTIONS = {'md4', 'md5', 'sha1', 'sha224', 'sha256', 'sha384', 'sha512', 'whirlpool', 'ripemd160',
+                        'blake2b', 'blake2s', 'sha3_256', 'sha3_512'}
 
 # For .sqlite3 files
 COMPRESSION_PROGS = {
@@ -62,3 +63,25 @@ ROOT_SUBVOLUME_NAME=b"@root"
 BLOCK_SIZE_MIN=512
 BLOCK_SIZE_DEFAULT=128*1024     # 128kb
 BLOCK_SIZE_MAX=16*1024*1024     # 16Mb
+
+# How data of block is splitted before dedup
+CHUNKING_FIXED="fixed"          # whole block
+CHUNKING_FASTCDC="fastcdc"      # content-defined chunks inside block
+CHUNKING_DEFAULT=CHUNKING_FIXED
+CHUNKINGS=(CHUNKING_FIXED, CHUNKING_FASTCDC,)
+
+CHUNK_SIZE_MIN=4*1024           # 4kb, average chunk size
+
+# Block data store split into files by hash id ranges
+BLOCK_SHARDS_DEFAULT=1          # one file
+BLOCK_SHARDS_MAX=256
+BLOCK_SHARD_RANGE_DEFAULT=256   # sequential hash ids in one shard
+
+# Where block data is stored
+BLOCK_STORAGE_DB="db"           # rows of block table
+BLOCK_STORAGE_PACK="pack"       # appended to pack files, only places in database
+BLOCK_STORAGE_DEFAULT=BLOCK_STORAGE_DB
+BLOCK_STORAGES=(BLOCK_STORAGE_DB, BLOCK_STORAGE_PACK,)
+
+BLOCK_PACK_SIZE=256*1024*1024   # 256Mb, new pack file is started after
+BLOCK_PACK_GARBAGE_RATIO=0.3    # pack is rewritten if part of removed data is bigger
@@ -0,0 +1,69 @@
+# -*- coding: utf8 -*-
+"""
+Streams of sorted ids for garbage collection mark phase
+
+Used ids are read from tables page by page in id order and merged,
+so only one page of every table and one range of ids are kept in memory.
+
+@author Sergey Dryabzhinsky
+"""
+
+import heapq
+
+
+def iterPages(getPage, pageSize=10000):
+    """
+    Read sorted ids by pages, next page starts after last id of previous
+
+    @param getPage: function(after_id, limit) -> sorted list of ids
+    @param pageSize: int
+
+    @return: generator of ids
+    """
+    last_id = -1
+    while True:
+        ids = getPage(last_id, pageSize)
+        if not ids:
+            return
+        for _id in ids:
+            yield _id
+        if len(ids) < pageSize:
+            return
+        last_id = ids[-1]
+
+
+class SortedIdsMerge(object):
+    """
+    K-way merge of sorted id streams, ids taken by ascending ranges
+    """
+
+    _merged = None
+    _next = None
+
+    def __init__(self, streams):
+        self._merged = heapq.merge(*streams)
+        self._next = None
+        pass
+
+    def takeUntil(self, end_id):
+        """
+        @param end_id: first id of next range
+        @return: set of ids less than end_id, not taken before
+        """
+        ids = set()
+
+        if self._next is not None:
+            if self._next >= end_id:
+                return ids
+            ids.add(self._next)
+            self._next = None
+
+        for _id in self._merged:
+            if _id >= end_id:
+                self._next = _id
+                break
+            ids.add(_id)
+
+        return ids
+
+    pass
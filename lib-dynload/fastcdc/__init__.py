@@ -0,0 +1,35 @@
+import sys
+import os
+
+p1, p2 = sys.version_info[:2]
+
+cut_offsets = None
+
+curpath = os.path.abspath( sys.argv[0] )
+if os.path.islink(curpath):
+    curpath = os.readlink(curpath)
+currentdir = os.path.dirname( curpath )
+
+build_dir = os.path.abspath( os.path.join(currentdir, "lib-dynload", "fastcdc", "build") )
+if not os.path.isdir(build_dir):
+    build_dir = os.path.abspath( os.path.join(currentdir, "..", "lib-dynload", "fastcdc", "build") )
+if not os.path.isdir(build_dir):
+    build_dir = os.path.abspath( os.path.join(currentdir, "..", "..", "lib-dynload", "fastcdc", "build") )
+
+# Optional - chunker works without it
+dirs = []
+if os.path.isdir(build_dir):
+    dirs = os.listdir(build_dir)
+for d in dirs:
+    # Newer setuptools name build dirs by tag: lib.linux-x86_64-cpython-311
+    if (d.find("-%s.%s" % (p1, p2)) != -1 or d.find("-cpython-%s%s" % (p1, p2)) != -1) and d.find("lib.") != -1:
+        sys.path.insert(0, os.path.join(build_dir, d) )
+
+        import importlib
+        module = importlib.import_module("_fastcdc")
+
+        cut_offsets = module.cut_offsets
+
+        sys.path.pop(0)
+
+        break
@@ -0,0 +1,137 @@
+/**
+    Boundary finder of FastCDC content-defined chunking.
+
+    Python module dedupsqlfs.lib.chunker keeps the algorithm and gear table,
+    this module only runs the byte loop, which is too slow in Python:
+
+        cut_offsets(data, min_size, avg_size, max_size, mask_s, mask_l, gear)
+
+    returns list of chunk end offsets for whole data. Gear table is
+    passed as 256 native unsigned 64-bit integers (array('Q').tobytes()).
+    GIL is released while data is scanned.
+  **/
+#include <Python.h>
+#include <stdint.h>
+#include <string.h>
+
+#define GEAR_SIZE 256
+
+static Py_ssize_t
+fastcdc_cut(const unsigned char *data, Py_ssize_t length, Py_ssize_t start,
+    Py_ssize_t min_size, Py_ssize_t avg_size, Py_ssize_t max_size,
+    uint64_t mask_s, uint64_t mask_l, const uint64_t *gear)
+{
+    Py_ssize_t n = length - start;
+    Py_ssize_t normal, i, end;
+    uint64_t h = 0;
+
+    if (n <= min_size)
+        return length;
+    if (n > max_size)
+        n = max_size;
+
+    normal = avg_size;
+    if (normal > n)
+        normal = n;
+
+    /* Harder to match before average size */
+    i = start + min_size;
+    end = start + normal;
+    while (i < end) {
+        h = (h << 1) + gear[data[i]];
+        i++;
+        if (!(h & mask_s))
+            return i;
+    }
+
+    end = start + n;
+    while (i < end) {
+        h = (h << 1) + gear[data[i]];
+        i++;
+        if (!(h & mask_l))
+            return i;
+    }
+
+    return end;
+}
+
+static PyObject *
+fastcdc_cut_offsets(PyObject *self, PyObject *args)
+{
+    Py_buffer data, gear_buf;
+    Py_ssize_t min_size, avg_size, max_size;
+    unsigned long long mask_s, mask_l;
+    uint64_t gear[GEAR_SIZE];
+    Py_ssize_t *offsets = NULL;
+    Py_ssize_t count = 0, allocated, start, i;
+    PyObject *result = NULL, *item;
+
+    if (!PyArg_ParseTuple(args, "y*nnnKKy*", &data, &min_size, &avg_size, &max_size,
+            &mask_s, &mask_l, &gear_buf))
+        return NULL;
+
+    if (gear_buf.len != sizeof(gear)) {
+        PyErr_SetString(PyExc_ValueError, "gear table must be 256 unsigned 64-bit integers");
+        goto done;
+    }
+    if (min_size < 0 || avg_size < 1 || max_size < 1) {
+        PyErr_SetString(PyExc_ValueError, "chunk sizes must be positive");
+        goto done;
+    }
+    memcpy(gear, gear_buf.buf, sizeof(gear));
+
+    /* Chunks are not smaller than min_size, except the last one */
+    allocated = data.len / (min_size + 1) + 1;
+    offsets = PyMem_Malloc(allocated * sizeof(Py_ssize_t));
+    if (offsets == NULL) {
+        PyErr_NoMemory();
+        goto done;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    start = 0;
+    while (start < data.len) {
+        start = fastcdc_cut((const unsigned char *)data.buf, data.len, start,
+            min_size, avg_size, max_size, (uint64_t)mask_s, (uint64_t)mask_l, gear);
+        offsets[count++] = start;
+    }
+    Py_END_ALLOW_THREADS
+
+    result = PyList_New(count);
+    if (result == NULL)
+        goto done;
+    for (i = 0; i < count; i++) {
+        item = PyLong_FromSsize_t(offsets[i]);
+        if (item == NULL) {
+            Py_CLEAR(result);
+            goto done;
+        }
+        PyList_SET_ITEM(result, i, item);
+    }
+
+done:
+    PyMem_Free(offsets);
+    PyBuffer_Release(&data);
+    PyBuffer_Release(&gear_buf);
+    return result;
+}
+
+static PyMethodDef FastCDCMethods[] = {
+    {"cut_offsets", fastcdc_cut_offsets, METH_VARARGS,
+     "cut_offsets(data, min_size, avg_size, max_size, mask_s, mask_l, gear) -> list of chunk end offsets"},
+    {NULL, NULL, 0, NULL}
+};
+
+static struct PyModuleDef fastcdcmodule = {
+    PyModuleDef_HEAD_INIT,
+    "_fastcdc",
+    "Boundary finder of FastCDC content-defined chunking",
+    -1,
+    FastCDCMethods
+};
+
+PyMODINIT_FUNC
+PyInit__fastcdc(void)
+{
+    return PyModule_Create(&fastcdcmodule);
+}
@@ -0,0 +1,101 @@
+#/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+"""
+Segmented LRU of block cache: sequential scan doesn't promote blocks,
+reused blocks are promoted, cleared and forgotten cache has zero size,
+writed blocks are counted until they expire
+"""
+
+import sys
+import os
+
+dirname = "dedupsqlfs"
+
+# Figure out the directy which is the prefix
+# path-of-current-file/..
+curpath = os.path.abspath( sys.argv[0] )
+if os.path.islink(curpath):
+    curpath = os.readlink(curpath)
+currentdir = os.path.dirname( curpath )
+basedir = os.path.abspath( os.path.join( currentdir, "..", ".." ) )
+
+sys.path.insert( 0, basedir )
+
+from dedupsqlfs.lib.cache.storage import StorageTimeSize
+
+BLOCK_SIZE = 4096
+BLOCKS = 16
+# FUSE reads of one block in sequential scan
+READS_PER_BLOCK = 8
+
+def new_cache():
+    cache = StorageTimeSize()
+    cache.setSegmented(True)
+    cache.setMaxReadCacheSize(BLOCK_SIZE * BLOCKS * 4)
+    return cache
+
+def scan(cache, inode):
+    for bn in range(BLOCKS):
+        if cache.get(inode, bn) is None:
+            cache.set(inode, bn, bytearray(BLOCK_SIZE))
+        for n in range(READS_PER_BLOCK - 1):
+            assert cache.get(inode, bn) is not None
+
+def hot_blocks(cache):
+    return set(cache._lru_read_hot.keys())
+
+# Loaded on demand
+cache = new_cache()
+scan(cache, 1)
+assert not hot_blocks(cache), hot_blocks(cache)
+
+# Prefetched before reading
+cache = new_cache()
+for bn in range(BLOCKS):
+    cache.set(2, bn, bytearray(BLOCK_SIZE))
+scan(cache, 2)
+assert not hot_blocks(cache), hot_blocks(cache)
+
+# File read again - blocks are reused
+scan(cache, 2)
+assert hot_blocks(cache) == set((2, bn,) for bn in range(BLOCKS)), hot_blocks(cache)
+
+# Reader comes back to one block
+cache = new_cache()
+scan(cache, 3)
+cache.get(3, 0)
+assert hot_blocks(cache) == set([(3, 0,)]), hot_blocks(cache)
+
+# Counters of cleared cache
+cache = new_cache()
+scan(cache, 4)
+scan(cache, 4)
+cache.set(5, 0, bytearray(BLOCK_SIZE), writed=True)
+flushed = cache.clear()
+assert list(flushed.keys()) == [5]
+assert cache._cur_read_cache_size == 0 and cache._cur_write_cache_size == 0 and cache._cur_read_hot_size == 0
+
+cache.set(6, 0, bytearray(BLOCK_SIZE))
+cache.set(6, 1, bytearray(BLOCK_SIZE), writed=True)
+assert cache.drop(6) == 2
+assert cache._cur_read_cache_size == 0 and cache._cur_write_cache_size == 0
+assert not cache.isReadCacheFull() and not cache.isWritedCacheFull()
+
+# Forgotten inode
+scan(cache, 8)
+scan(cache, 8)
+assert cache.forget(8)
+assert cache._cur_read_cache_size == 0 and cache._cur_read_hot_size == 0
+assert not hot_blocks(cache)
+
+# Writed block read again stays in writed size until it expires
+cache.set(7, 0, bytearray(BLOCK_SIZE), writed=True)
+assert cache.hasDirty()
+cache.set(7, 0, bytearray(BLOCK_SIZE // 2))
+assert cache._cur_write_cache_size == BLOCK_SIZE // 2 and cache._cur_read_cache_size == 0
+cache.setMaxWriteTtl(-1)
+cache.expired()
+assert cache._cur_write_cache_size == 0 and not cache.hasDirty()
+
+print("OK")
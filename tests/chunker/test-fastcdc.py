@@ -0,0 +1,136 @@
+#/usr/bin/env python3
+
+"""
+Content-defined chunking: chunks join back to data, boundaries
+after inserted bytes stay the same, C module finds same boundaries
+as Python loop, chunked filesystem reads back
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import stat
+import random
+
+dirname = "dedupsqlfs"
+
+# Figure out the directy which is the prefix
+# path-of-current-file/..
+curpath = os.path.abspath( sys.argv[0] )
+if os.path.islink(curpath):
+    curpath = os.readlink(curpath)
+currentdir = os.path.dirname( curpath )
+basedir = os.path.abspath( os.path.join( currentdir, "..", ".." ) )
+
+sys.path.insert( 0, basedir )
+os.chdir(basedir)
+
+# Only C module of chunker, compressors may be not built
+dynloaddir = os.path.abspath( os.path.join( basedir, "lib-dynload" ) )
+sys.path.insert( 0, dynloaddir )
+import dedupsqlfs.lib.chunker
+sys.path.remove( dynloaddir )
+
+import llfuse
+import dedupsqlfs.app.mkfs
+import dedupsqlfs.app.do
+from dedupsqlfs.lib.chunker import FastCDC
+
+CHUNK_SIZE = 4096
+BLOCK_SIZE = 65536
+
+rnd = random.Random(1)
+DATA = bytes(rnd.getrandbits(8) for i in range(BLOCK_SIZE * 2))
+INSERT = b"inserted bytes"
+SHIFTED = DATA[:1000] + INSERT + DATA[1000:]
+
+chunker = FastCDC(CHUNK_SIZE)
+assert chunker.getAvgSize() == CHUNK_SIZE
+
+chunks = chunker.split(DATA)
+assert b"".join(chunks) == DATA
+assert len(chunks) > 1
+for chunk in chunks[:-1]:
+    assert chunker.getMinSize() < len(chunk) <= chunker.getMaxSize(), len(chunk)
+
+assert chunker.split(b"") == []
+assert chunker.split(b"x") == [b"x"]
+assert chunker.split(bytes(CHUNK_SIZE * 8)) == [bytes(chunker.getMaxSize())] * 2
+
+# Only chunk with inserted bytes is changed
+shifted = chunker.split(SHIFTED)
+assert b"".join(shifted) == SHIFTED
+assert shifted[0] != chunks[0]
+assert shifted[1:] == chunks[1:], (len(shifted), len(chunks))
+
+# Stored chunks don't depend on C module
+if dedupsqlfs.lib.chunker.hasAccelerator():
+    cut_offsets = dedupsqlfs.lib.chunker.cut_offsets
+    for avg_size in (CHUNK_SIZE, BLOCK_SIZE,):
+        c = FastCDC(avg_size)
+        for data in (DATA, SHIFTED, DATA[:avg_size], bytes(avg_size * 5) + DATA,):
+            fast = c.split(data)
+            dedupsqlfs.lib.chunker.cut_offsets = None
+            try:
+                slow = c.split(data)
+            finally:
+                dedupsqlfs.lib.chunker.cut_offsets = cut_offsets
+            assert fast == slow, (avg_size, len(data))
+else:
+    print("C module is not built, skip its check")
+
+def run(app, args):
+    # Migrations are found by path of program
+    sys.argv = [os.path.join(basedir, "bin", app.__name__.split(".")[-1] + ".dedupsqlfs"), "--data", datadir] + args
+    return app.main()
+
+FILES = {
+    b"a": DATA,
+    b"b": DATA[BLOCK_SIZE:] + DATA[:BLOCK_SIZE],
+}
+
+def writer(options, _fuse):
+    _fuse.setReadonly(False)
+    ops = _fuse.operations
+    ops.init()
+    assert ops.chunker is not None
+    for name, data in sorted(FILES.items()):
+        fh, attrs = ops.create(1, name, stat.S_IFREG | 0o644, os.O_CREAT | os.O_WRONLY, llfuse.RequestContext())
+        offset = 0
+        while offset < len(data):
+            offset += ops.write(fh, offset, data[offset:])
+        ops.release(fh)
+    ops.destroy()
+    return 0
+
+def reader(options, _fuse):
+    _fuse.setReadonly(True)
+    ops = _fuse.operations
+    ops.init()
+    for name, data in sorted(FILES.items()):
+        attrs = ops.lookup(1, name)
+        assert attrs.st_size == len(data)
+        fh = ops.open(attrs.st_ino, os.O_RDONLY)
+        read = b""
+        while len(read) < attrs.st_size:
+            read += ops.read(fh, len(read), attrs.st_size - len(read))
+        ops.release(fh)
+        assert read == data, name
+    ops.destroy()
+    return 0
+
+datadir = tempfile.mkdtemp(prefix="dedupsqlfs-test-")
+try:
+    assert run(dedupsqlfs.app.mkfs, ["-b", str(BLOCK_SIZE), "--chunking", "fastcdc", "--chunk-size", str(CHUNK_SIZE)]) == 0
+
+    # Actions run inside do with opened filesystem
+    dedupsqlfs.app.do.print_fs_stats = writer
+    assert run(dedupsqlfs.app.do, ["--print-stats"]) == 0
+    dedupsqlfs.app.do.print_fs_stats = reader
+    assert run(dedupsqlfs.app.do, ["--print-stats"]) == 0
+    assert run(dedupsqlfs.app.do, ["--verify"]) == 0
+
+    print("OK")
+finally:
+    shutil.rmtree(datadir, True)
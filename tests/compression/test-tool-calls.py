@@ -0,0 +1,112 @@
+#/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+"""
+Compression tools with workers: results of calls are not mixed
+when iteration is stopped, failed or calls run concurrently
+"""
+
+import sys
+import os
+import zlib
+import logging
+from threading import Thread
+
+dirname = "dedupsqlfs"
+
+# Figure out the directy which is the prefix
+# path-of-current-file/..
+curpath = os.path.abspath( sys.argv[0] )
+if os.path.islink(curpath):
+    curpath = os.readlink(curpath)
+currentdir = os.path.dirname( curpath )
+basedir = os.path.abspath( os.path.join( currentdir, "..", ".." ) )
+
+sys.path.insert( 0, basedir )
+
+from dedupsqlfs.fuse.compress.base import Task
+from dedupsqlfs.fuse.compress.mt import MultiThreadCompressTool
+from dedupsqlfs.fuse.compress.mp import MultiProcCompressTool, shared_memory
+
+def make_tool(cls):
+    tool = cls()
+    tool.setOption("compression", ["zlib"])
+    tool.setOption("compression_minimal_size", 256)
+    tool.setOption("cpu_limit", 2)
+    tool.appendCompression("none")
+    tool.appendCompression("zlib")
+    return tool.init(logging.getLogger("test"))
+
+def blocks(first, count):
+    data = {}
+    for key in range(first, first + count):
+        data[ key ] = (b"block %d " % key) * 1000
+    return data
+
+def check_compress(tool, data):
+    result = dict(tool.compressData(data))
+    assert set(result) == set(data), (sorted(result), sorted(data))
+    for key, (cdata, method) in result.items():
+        assert method == "zlib"
+        assert zlib.decompress(cdata) == data[ key ]
+    return result
+
+def check_decompress(tool, data, compressed):
+    result = dict(tool.decompressDataMany(dict((key, (method, cdata,)) for key, (cdata, method) in compressed.items())))
+    assert result == data
+
+def test_tool(cls):
+    tool = make_tool(cls)
+    try:
+        data = blocks(1, 64)
+        compressed = check_compress(tool, data)
+        check_decompress(tool, data, compressed)
+
+        # Caller takes only part of results
+        for gen in (tool.compressData(blocks(100, 64)), tool.decompressDataMany(dict((key, (m, c,)) for key, (c, m) in compressed.items())),):
+            next(gen)
+            gen.close()
+        check_compress(tool, blocks(200, 64))
+
+        # Broken block fails only own call
+        broken = dict((key, ("zlib", c,)) for key, (c, m) in compressed.items())
+        broken[ 1 ] = ("zlib", b"broken")
+        try:
+            dict(tool.decompressDataMany(broken))
+            assert False, "decompression must fail"
+        except OSError:
+            pass
+        check_decompress(tool, data, compressed)
+
+        # Concurrent calls from threads of filesystem
+        errors = []
+        def flush(first):
+            try:
+                for n in range(10):
+                    check_compress(tool, blocks(first, 32))
+            except Exception as e:
+                errors.append(e)
+        threads = [ Thread(target=flush, args=(1000 * n,)) for n in range(1, 5) ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert not errors, errors
+    finally:
+        tool.stop()
+
+test_tool(MultiThreadCompressTool)
+test_tool(MultiProcCompressTool)
+
+# Shared memory of task is gone - worker returns error
+if shared_memory is not None:
+    tool = MultiProcCompressTool()
+    tool._logger = logging.getLogger("test")
+    task = Task()
+    task.key = 1
+    task.call = 5
+    task.buffer = ("dedupsqlfs-test-no-such-block", 0, 100,)
+    result = tool._doTask(task)
+    assert result.key == 1 and result.call == 5 and result.error, result.error
+
+print("OK")
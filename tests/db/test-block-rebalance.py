@@ -0,0 +1,128 @@
+#/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+"""
+Rebalance of block store into shard files: data is readable after it,
+after crash on any step of file swap and after failed copy
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import logging
+
+dirname = "dedupsqlfs"
+
+# Figure out the directy which is the prefix
+# path-of-current-file/..
+curpath = os.path.abspath( sys.argv[0] )
+if os.path.islink(curpath):
+    curpath = os.readlink(curpath)
+currentdir = os.path.dirname( curpath )
+basedir = os.path.abspath( os.path.join( currentdir, "..", ".." ) )
+
+sys.path.insert( 0, basedir )
+
+from dedupsqlfs.db.sqlite.manager import DbManager
+
+BLOCKS = 50
+SHARD_RANGE = 8
+
+DATA = dict((hash_id, b"block %d" % hash_id,) for hash_id in range(1, BLOCKS + 1))
+
+class Crash(Exception):
+    pass
+
+def open_store(datadir):
+    manager = DbManager("dedupsqlfs")
+    manager.setBasepath(datadir)
+    manager.setLogger(logging.getLogger("test"))
+    return manager
+
+def new_store(datadir, count):
+    manager = open_store(datadir)
+    if count > 1:
+        manager.setBlockShards(count, SHARD_RANGE)
+    manager.getTable("block").insert_many(DATA.items())
+    manager.commit()
+    return manager
+
+def check_store(datadir, count):
+    manager = open_store(datadir)
+    tableBlock = manager.getTable("block")
+    assert manager.getBlockShards()[0] == count, manager.getBlockShards()
+    assert not manager.getTable("option").get("block_rebalance")
+    stored = tableBlock.get_many(",".join(str(hash_id) for hash_id in DATA))
+    assert stored == DATA, sorted(stored.keys())
+    manager.close()
+    files = os.listdir(os.path.join(datadir, "dedupsqlfs"))
+    assert not [name for name in files if name.endswith(".old") or name.startswith("block_new")], files
+    return
+
+def crashed(func, after):
+    calls = []
+    def wrapper(*args):
+        if len(calls) >= after:
+            raise Crash()
+        calls.append(args)
+        return func(*args)
+    return wrapper
+
+rename = os.rename
+unlink = os.unlink
+
+for old, new in ((1, 4,), (4, 1,), (2, 3,),):
+    # Normal run
+    datadir = tempfile.mkdtemp(prefix="dedupsqlfs-test-")
+    try:
+        manager = new_store(datadir, old)
+        assert manager.rebalanceBlocks(new, SHARD_RANGE) == BLOCKS
+        manager.close()
+        check_store(datadir, new)
+    finally:
+        shutil.rmtree(datadir, True)
+
+    # Crash after every rename and unlink of files
+    for name in ("rename", "unlink",):
+        for after in range(old + new + 1):
+            datadir = tempfile.mkdtemp(prefix="dedupsqlfs-test-")
+            try:
+                manager = new_store(datadir, old)
+                if name == "rename":
+                    os.rename = crashed(rename, after)
+                else:
+                    os.unlink = crashed(unlink, after)
+                try:
+                    manager.rebalanceBlocks(new, SHARD_RANGE)
+                except Crash:
+                    pass
+                finally:
+                    os.rename = rename
+                    os.unlink = unlink
+                manager.close()
+                # Swap is finished on open
+                check_store(datadir, new)
+            finally:
+                shutil.rmtree(datadir, True)
+
+    # Copy failed - old store is used
+    datadir = tempfile.mkdtemp(prefix="dedupsqlfs-test-")
+    try:
+        manager = new_store(datadir, old)
+        tableBlock = manager.getTable("block")
+        shards = old > 1 and tableBlock.getShards() or [tableBlock]
+        get_items_after = shards[-1].get_items_after
+        shards[-1].get_items_after = crashed(get_items_after, 0)
+        try:
+            manager.rebalanceBlocks(new, SHARD_RANGE)
+            assert False, "copy must fail"
+        except Crash:
+            pass
+        assert manager.getAutocommit()
+        manager.close()
+        check_store(datadir, old)
+    finally:
+        shutil.rmtree(datadir, True)
+
+print("OK")
@@ -0,0 +1,59 @@
+#/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+"""
+Reference counters and inode block sizes are same with
+upsert of SQLite >= 3.24 and without it
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import logging
+
+dirname = "dedupsqlfs"
+
+# Figure out the directy which is the prefix
+# path-of-current-file/..
+curpath = os.path.abspath( sys.argv[0] )
+if os.path.islink(curpath):
+    curpath = os.readlink(curpath)
+currentdir = os.path.dirname( curpath )
+basedir = os.path.abspath( os.path.join( currentdir, "..", ".." ) )
+
+sys.path.insert( 0, basedir )
+
+from dedupsqlfs.db.sqlite.manager import DbManager
+from dedupsqlfs.db.sqlite.table import Table
+
+def check(datadir):
+    manager = DbManager("dedupsqlfs")
+    manager.setBasepath(datadir)
+    manager.setLogger(logging.getLogger("test"))
+
+    tableRefs = manager.getTable("hash_refcount")
+    tableRefs.add_many(((1, 1,), (2, 2,),))
+    tableRefs.add_many((hash_id, delta,) for hash_id, delta in ((1, 2,), (2, -2,), (3, 1,),))
+    assert [tableRefs.get(hash_id) for hash_id in (1, 2, 3, 4,)] == [3, 0, 1, None]
+    assert tableRefs.get_unused_ids(10) == set([2])
+
+    tableOption = manager.getTable("inode_option")
+    tableOption.insert(10, 4096, "zlib")
+    tableOption.set_block_size(10, 65536)
+    tableOption.set_block_size(11, 131072)
+    assert tableOption.get_block_sizes() == {10: 65536, 11: 131072}
+    assert tableOption.get(10)["compression"] == b"zlib"
+
+    manager.close()
+    return
+
+for upsert in (True, False,):
+    Table._has_upsert = upsert
+    datadir = tempfile.mkdtemp(prefix="dedupsqlfs-test-")
+    try:
+        check(datadir)
+    finally:
+        shutil.rmtree(datadir, True)
+
+print("OK")
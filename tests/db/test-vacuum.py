@@ -0,0 +1,71 @@
+#/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+"""
+Incremental vacuum returns free pages in place,
+explicit vacuum still rebuilds database file
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import logging
+
+dirname = "dedupsqlfs"
+
+# Figure out the directy which is the prefix
+# path-of-current-file/..
+curpath = os.path.abspath( sys.argv[0] )
+if os.path.islink(curpath):
+    curpath = os.readlink(curpath)
+currentdir = os.path.dirname( curpath )
+basedir = os.path.abspath( os.path.join( currentdir, "..", ".." ) )
+
+sys.path.insert( 0, basedir )
+
+from dedupsqlfs.db.sqlite.manager import DbManager
+
+ROWS = 20000
+
+def fill(table):
+    table.add_many((hash_id, 1,) for hash_id in range(1, ROWS + 1))
+    table.commit()
+    table.remove_by_ids(",".join(str(hash_id) for hash_id in range(1, ROWS // 2 + 1)))
+    table.commit()
+    return
+
+def check(datadir):
+    manager = DbManager("dedupsqlfs")
+    manager.setBasepath(datadir)
+    manager.setLogger(logging.getLogger("test"))
+
+    table = manager.getTable("hash_refcount")
+    assert table.getAutoVacuum() == table.AUTO_VACUUM_INCREMENTAL
+    fn = table.getDbFilePath()
+
+    fill(table)
+    ino = os.stat(fn).st_ino
+    freed, left = manager.incrementalVacuum(10)
+    assert freed == 10 and left > 0, (freed, left,)
+    assert os.stat(fn).st_ino == ino
+
+    # Full dump/reload, not only free pages
+    fill(table)
+    ino = os.stat(fn).st_ino
+    manager.vacuum()
+    assert os.stat(fn).st_ino != ino
+    table = manager.getTable("hash_refcount")
+    assert table.getAutoVacuum() == table.AUTO_VACUUM_INCREMENTAL
+    assert table.get(ROWS) == 2 and table.get(1) is None
+
+    manager.close()
+    return
+
+datadir = tempfile.mkdtemp(prefix="dedupsqlfs-test-")
+try:
+    check(datadir)
+finally:
+    shutil.rmtree(datadir, True)
+
+print("OK")
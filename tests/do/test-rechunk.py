@@ -0,0 +1,150 @@
+#/usr/bin/env python3
+
+"""
+do --new-block-size: interrupted job continues from checkpoint,
+file with swapped index but without stored block size is fixed
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import stat
+import json
+
+dirname = "dedupsqlfs"
+
+# Figure out the directy which is the prefix
+# path-of-current-file/..
+curpath = os.path.abspath( sys.argv[0] )
+if os.path.islink(curpath):
+    curpath = os.readlink(curpath)
+currentdir = os.path.dirname( curpath )
+basedir = os.path.abspath( os.path.join( currentdir, "..", ".." ) )
+
+sys.path.insert( 0, basedir )
+os.chdir(basedir)
+
+import llfuse
+import dedupsqlfs.app.mkfs
+import dedupsqlfs.app.do
+from dedupsqlfs.fuse.rechunk import Rechunk
+
+BLOCK_SIZE = 4096
+NEW_BLOCK_SIZE = 16384
+
+def content(n):
+    # Tail is not full block of any size
+    return b"".join((b"%04d%04d" % (n, i)) * (BLOCK_SIZE // 8) for i in range(10)) + b"tail %d" % n
+
+FILES = dict((b"file%d" % n, content(n),) for n in range(4))
+
+def run(app, args):
+    # Migrations are found by path of program
+    sys.argv = [os.path.join(basedir, "bin", app.__name__.split(".")[-1] + ".dedupsqlfs"), "--data", datadir] + args
+    return app.main()
+
+def rechunk():
+    return run(dedupsqlfs.app.do, ["--new-block-size", str(NEW_BLOCK_SIZE), "--rechunk-path", "/", "--data-batch", "1"])
+
+STATE = {}
+
+def writer(options, _fuse):
+    _fuse.setReadonly(False)
+    ops = _fuse.operations
+    ops.init()
+    inodes = []
+    for name, data in sorted(FILES.items()):
+        fh, attrs = ops.create(1, name, stat.S_IFREG | 0o644, os.O_CREAT | os.O_WRONLY, llfuse.RequestContext())
+        assert ops.write(fh, 0, data) == len(data)
+        ops.release(fh)
+        inodes.append(attrs.st_ino)
+    STATE["inodes"] = inodes
+    ops.destroy()
+    return 0
+
+def get_state(options, _fuse):
+    _fuse.setReadonly(True)
+    ops = _fuse.operations
+    ops.init()
+    STATE["checkpoint"] = ops.getTable("option").get(Rechunk.CHECKPOINT_OPTION)
+    STATE["sizes"] = ops.getTable("inode_option").get_block_sizes()
+    ops.destroy()
+    return 0
+
+def check_state():
+    dedupsqlfs.app.do.print_fs_stats = get_state
+    assert run(dedupsqlfs.app.do, ["--print-stats"]) == 0
+
+def reader(options, _fuse):
+    _fuse.setReadonly(True)
+    ops = _fuse.operations
+    ops.init()
+    tableIndex = ops.getTable("inode_hash_block")
+    for name, data in sorted(FILES.items()):
+        attrs = ops.lookup(1, name)
+        assert len(tableIndex.get_hash_ids_by_inodes((attrs.st_ino,))) == (len(data) - 1) // NEW_BLOCK_SIZE + 1
+        fh = ops.open(attrs.st_ino, os.O_RDONLY)
+        read = b""
+        while len(read) < attrs.st_size:
+            read += ops.read(fh, len(read), attrs.st_size - len(read))
+        ops.release(fh)
+        assert read == data, name
+    ops.destroy()
+    return 0
+
+INODES = []
+
+rechunkInode = Rechunk._rechunkInode
+setBlockSize = Rechunk._setBlockSize
+
+def counted(self, subvolItem, row, old_block_size, block_size):
+    INODES.append(row["id"])
+    return rechunkInode(self, subvolItem, row, old_block_size, block_size)
+
+def interrupted(self, tableOption, inode_id, block_size):
+    # Second file: index is swapped, block size is not stored
+    if inode_id == STATE["inodes"][1]:
+        raise KeyboardInterrupt()
+    return setBlockSize(self, tableOption, inode_id, block_size)
+
+datadir = tempfile.mkdtemp(prefix="dedupsqlfs-test-")
+try:
+    assert run(dedupsqlfs.app.mkfs, ["-b", str(BLOCK_SIZE)]) == 0
+
+    # Actions run inside do with opened filesystem
+    dedupsqlfs.app.do.print_fs_stats = writer
+    assert run(dedupsqlfs.app.do, ["--print-stats"]) == 0
+    inodes = STATE["inodes"]
+
+    Rechunk._rechunkInode = counted
+    Rechunk._setBlockSize = interrupted
+    assert rechunk() == 0
+    assert INODES == inodes[:2], INODES
+    Rechunk._setBlockSize = setBlockSize
+    check_state()
+    assert json.loads(STATE["checkpoint"])["last"] == inodes[0], STATE["checkpoint"]
+    assert STATE["sizes"] == {inodes[0]: NEW_BLOCK_SIZE}, STATE["sizes"]
+
+    # Continued from second file
+    del INODES[:]
+    assert rechunk() == 0
+    assert INODES == inodes[1:], INODES
+    check_state()
+    assert not STATE["checkpoint"], STATE["checkpoint"]
+    assert STATE["sizes"] == dict((inode, NEW_BLOCK_SIZE,) for inode in inodes), STATE["sizes"]
+
+    # Nothing left to do
+    del INODES[:]
+    assert rechunk() == 0
+    assert not INODES, INODES
+
+    dedupsqlfs.app.do.print_fs_stats = reader
+    assert run(dedupsqlfs.app.do, ["--print-stats"]) == 0
+    assert run(dedupsqlfs.app.do, ["--verify"]) == 0
+
+    print("OK")
+finally:
+    Rechunk._rechunkInode = rechunkInode
+    Rechunk._setBlockSize = setBlockSize
+    shutil.rmtree(datadir, True)
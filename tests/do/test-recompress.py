@@ -0,0 +1,126 @@
+#/usr/bin/env python3
+
+"""
+do --recompress-all: blocks are compressed with methods from --compress,
+without them the store is left as is, interrupted job continues
+from checkpoint
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import zlib
+import bz2
+import json
+
+dirname = "dedupsqlfs"
+
+# Figure out the directy which is the prefix
+# path-of-current-file/..
+curpath = os.path.abspath( sys.argv[0] )
+if os.path.islink(curpath):
+    curpath = os.readlink(curpath)
+currentdir = os.path.dirname( curpath )
+basedir = os.path.abspath( os.path.join( currentdir, "..", ".." ) )
+
+sys.path.insert( 0, basedir )
+os.chdir(basedir)
+
+import logging
+from dedupsqlfs.db.sqlite.manager import DbManager
+import dedupsqlfs.app.mkfs
+import dedupsqlfs.app.do
+from dedupsqlfs.fuse.recompress import Recompress
+
+BLOCKS = 200
+BATCH = 50
+
+def run(app, args):
+    # Migrations are found by path of program
+    sys.argv = [os.path.join(basedir, "bin", app.__name__.split(".")[-1] + ".dedupsqlfs"), "--data", datadir] + args
+    return app.main()
+
+def open_store():
+    manager = DbManager("dedupsqlfs")
+    manager.setBasepath(datadir)
+    manager.setLogger(logging.getLogger("test"))
+    return manager
+
+def count_types(manager):
+    types = manager.getTable("compression_type").getAll()
+    counts = {}
+    for item in manager.getTable("hash_compression_type").count_compression_type():
+        counts[ types[ item["type_id"] ] ] = item["cnt"]
+    return counts
+
+BATCHES = []
+
+recompressBatch = Recompress._recompressBatch
+
+def interrupted(self, items):
+    BATCHES.append([hash_id for hash_id, type_id in items])
+    if len(BATCHES) == 2:
+        raise KeyboardInterrupt()
+    return recompressBatch(self, items)
+
+def counted(self, items):
+    BATCHES.append([hash_id for hash_id, type_id in items])
+    return recompressBatch(self, items)
+
+datadir = tempfile.mkdtemp(prefix="dedupsqlfs-test-")
+try:
+    assert run(dedupsqlfs.app.mkfs, ["--compress", "none"]) == 0
+
+    # Blocks compressed with zlib
+    manager = open_store()
+    tableType = manager.getTable("compression_type")
+    if not tableType.find("zlib"):
+        tableType.insert("zlib")
+    zlib_id = tableType.find("zlib")
+    data = {}
+    for hash_id in range(1, BLOCKS + 1):
+        data[ hash_id ] = (b"block %d " % hash_id) * 200
+    manager.getTable("block").insert_many((hash_id, zlib.compress(d),) for hash_id, d in data.items())
+    manager.getTable("hash_compression_type").insert_many((hash_id, zlib_id,) for hash_id in data)
+    manager.getTable("hash_sizes").insert_many((hash_id, len(d), len(zlib.compress(d)),) for hash_id, d in data.items())
+    manager.commit()
+    manager.close()
+
+    # No method selected - blocks are not stored uncompressed
+    assert run(dedupsqlfs.app.do, ["--recompress-all"]) == 1
+    manager = open_store()
+    assert count_types(manager) == {"zlib": BLOCKS}, count_types(manager)
+    manager.close()
+
+    # Method with level, compressors exist before their options are fixed.
+    # Interrupted after first batch
+    Recompress._recompressBatch = interrupted
+    assert run(dedupsqlfs.app.do, ["--recompress-all", "--compress", "bz2:9", "--data-batch", str(BATCH)]) == 0
+    assert len(BATCHES) == 2, BATCHES
+    manager = open_store()
+    assert count_types(manager) == {"bz2": BATCH, "zlib": BLOCKS - BATCH}, count_types(manager)
+    assert json.loads(manager.getTable("option").get(Recompress.CHECKPOINT_OPTION))["last"] == BATCH
+    manager.close()
+
+    # Continued, first batch is not read again
+    del BATCHES[:]
+    Recompress._recompressBatch = counted
+    assert run(dedupsqlfs.app.do, ["--recompress-all", "--compress", "bz2:9", "--data-batch", str(BATCH)]) == 0
+    assert [hash_id for batch in BATCHES for hash_id in batch] == list(range(BATCH + 1, BLOCKS + 1)), BATCHES
+    manager = open_store()
+    assert not manager.getTable("option").get(Recompress.CHECKPOINT_OPTION)
+    assert count_types(manager) == {"bz2": BLOCKS}, count_types(manager)
+    for hash_id in (1, BLOCKS // 2, BLOCKS):
+        assert bz2.decompress(manager.getTable("block").get(hash_id)["data"]) == data[ hash_id ]
+    manager.close()
+
+    # Nothing left to do
+    del BATCHES[:]
+    assert run(dedupsqlfs.app.do, ["--recompress-all", "--compress", "bz2"]) == 0
+    assert not BATCHES, BATCHES
+
+    print("OK")
+finally:
+    Recompress._recompressBatch = recompressBatch
+    shutil.rmtree(datadir, True)
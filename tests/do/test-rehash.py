@@ -0,0 +1,165 @@
+#/usr/bin/env python3
+
+"""
+do --rehash: interrupted job continues from checkpoint with same
+hash function only, hash function is switched when all hashes are new
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import stat
+import json
+import hashlib
+
+dirname = "dedupsqlfs"
+
+# Figure out the directy which is the prefix
+# path-of-current-file/..
+curpath = os.path.abspath( sys.argv[0] )
+if os.path.islink(curpath):
+    curpath = os.readlink(curpath)
+currentdir = os.path.dirname( curpath )
+basedir = os.path.abspath( os.path.join( currentdir, "..", ".." ) )
+
+sys.path.insert( 0, basedir )
+os.chdir(basedir)
+
+import llfuse
+import dedupsqlfs.app.mkfs
+import dedupsqlfs.app.do
+from dedupsqlfs.fuse.rehash import Rehash
+
+BLOCK_SIZE = 4096
+BLOCKS = 10
+BATCH = 2
+
+def block(n):
+    return (b"%08d" % n) * (BLOCK_SIZE // 8)
+
+DATA = b"".join(block(n) for n in range(BLOCKS))
+
+def run(app, args):
+    # Migrations are found by path of program
+    sys.argv = [os.path.join(basedir, "bin", app.__name__.split(".")[-1] + ".dedupsqlfs"), "--data", datadir] + args
+    return app.main()
+
+def write_file(ops, name):
+    fh, attrs = ops.create(1, name, stat.S_IFREG | 0o644, os.O_CREAT | os.O_WRONLY, llfuse.RequestContext())
+    assert ops.write(fh, 0, DATA) == len(DATA)
+    ops.release(fh)
+
+def read_file(ops, name):
+    attrs = ops.lookup(1, name)
+    fh = ops.open(attrs.st_ino, os.O_RDONLY)
+    data = ops.read(fh, 0, attrs.st_size)
+    ops.release(fh)
+    return data
+
+STATE = {}
+
+def writer(options, _fuse):
+    _fuse.setReadonly(False)
+    ops = _fuse.operations
+    ops.init()
+    write_file(ops, b"a")
+    ops.destroy()
+    return 0
+
+def get_state(options, _fuse):
+    _fuse.setReadonly(True)
+    ops = _fuse.operations
+    ops.init()
+    tableOption = ops.getTable("option")
+    STATE["checkpoint"] = tableOption.get(Rehash.CHECKPOINT_OPTION)
+    STATE["hash_function"] = tableOption.get("hash_function")
+    STATE["hash_ids"] = sorted(ops.getTable("hash").get_hash_ids(0, 1 << 62))
+    STATE["hashes"] = set(ops.getTable("hash").get_hashes())
+    ops.destroy()
+    return 0
+
+def check_state():
+    dedupsqlfs.app.do.print_fs_stats = get_state
+    assert run(dedupsqlfs.app.do, ["--print-stats"]) == 0
+
+def digests(hash_function):
+    return set(hashlib.new(hash_function, block(n)).digest() for n in range(BLOCKS))
+
+def check_written(options, _fuse):
+    # Same data is found by new hashes
+    _fuse.setReadonly(False)
+    ops = _fuse.operations
+    ops.init()
+    assert ops.hash_function == "sha256"
+    write_file(ops, b"b")
+    assert ops.getTable("hash").get_count() == BLOCKS
+    for name in (b"a", b"b",):
+        assert read_file(ops, name) == DATA, name
+    ops.destroy()
+    return 0
+
+BATCHES = []
+
+rehashBatch = Rehash._rehashBatch
+
+def interrupted(self, hash_ids, hash_function):
+    BATCHES.append(list(hash_ids))
+    if len(BATCHES) == 2:
+        raise KeyboardInterrupt()
+    return rehashBatch(self, hash_ids, hash_function)
+
+def counted(self, hash_ids, hash_function):
+    BATCHES.append(list(hash_ids))
+    return rehashBatch(self, hash_ids, hash_function)
+
+datadir = tempfile.mkdtemp(prefix="dedupsqlfs-test-")
+try:
+    assert run(dedupsqlfs.app.mkfs, ["-b", str(BLOCK_SIZE), "--hash", "sha1"]) == 0
+
+    # Actions run inside do with opened filesystem
+    dedupsqlfs.app.do.print_fs_stats = writer
+    assert run(dedupsqlfs.app.do, ["--print-stats"]) == 0
+    check_state()
+    hash_ids = STATE["hash_ids"]
+    assert len(hash_ids) == BLOCKS
+    assert STATE["hashes"] == digests("sha1")
+
+    # Interrupted after first batch
+    Rehash._rehashBatch = interrupted
+    assert run(dedupsqlfs.app.do, ["--rehash", "sha256", "--data-batch", str(BATCH)]) == 0
+    assert BATCHES == [hash_ids[:BATCH], hash_ids[BATCH:BATCH * 2]], BATCHES
+    check_state()
+    assert json.loads(STATE["checkpoint"]) == {"target": "to:sha256", "last": hash_ids[BATCH - 1]}, STATE["checkpoint"]
+    assert STATE["hash_function"] == "sha1"
+    assert len(STATE["hashes"] & digests("sha256")) == BATCH
+
+    # Other hash function is refused until job is finished
+    del BATCHES[:]
+    Rehash._rehashBatch = counted
+    assert run(dedupsqlfs.app.do, ["--rehash", "md5", "--data-batch", str(BATCH)]) == 1
+    assert not BATCHES, BATCHES
+    check_state()
+    assert json.loads(STATE["checkpoint"])["target"] == "to:sha256"
+
+    # Continued, first batch is not hashed again
+    assert run(dedupsqlfs.app.do, ["--rehash", "sha256", "--data-batch", str(BATCH)]) == 0
+    assert [hash_id for batch in BATCHES for hash_id in batch] == hash_ids[BATCH:], BATCHES
+    check_state()
+    assert not STATE["checkpoint"], STATE["checkpoint"]
+    assert STATE["hash_function"] == "sha256"
+    assert STATE["hashes"] == digests("sha256")
+
+    # Nothing left to do
+    del BATCHES[:]
+    assert run(dedupsqlfs.app.do, ["--rehash", "sha256"]) == 0
+    assert not BATCHES, BATCHES
+
+    dedupsqlfs.app.do.print_fs_stats = check_written
+    assert run(dedupsqlfs.app.do, ["--print-stats"]) == 0
+    assert run(dedupsqlfs.app.do, ["--verify"]) == 0
+
+    print("OK")
+finally:
+    Rehash._rehashBatch = rehashBatch
+    shutil.rmtree(datadir, True)
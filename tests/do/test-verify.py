@@ -0,0 +1,139 @@
+#/usr/bin/env python3
+
+"""
+do --verify: interrupted scrub continues from checkpoint,
+corrupted blocks found before and after it are reported
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import stat
+import json
+
+dirname = "dedupsqlfs"
+
+# Figure out the directy which is the prefix
+# path-of-current-file/..
+curpath = os.path.abspath( sys.argv[0] )
+if os.path.islink(curpath):
+    curpath = os.readlink(curpath)
+currentdir = os.path.dirname( curpath )
+basedir = os.path.abspath( os.path.join( currentdir, "..", ".." ) )
+
+sys.path.insert( 0, basedir )
+os.chdir(basedir)
+
+import llfuse
+import dedupsqlfs.app.mkfs
+import dedupsqlfs.app.do
+from dedupsqlfs.fuse.verify import Verify
+
+BLOCK_SIZE = 4096
+BLOCKS = 10
+BATCH = 2
+
+DATA = b"".join((b"%08d" % n) * (BLOCK_SIZE // 8) for n in range(BLOCKS))
+
+def run(app, args):
+    # Migrations are found by path of program
+    sys.argv = [os.path.join(basedir, "bin", app.__name__.split(".")[-1] + ".dedupsqlfs"), "--data", datadir] + args
+    return app.main()
+
+STATE = {}
+
+def writer(options, _fuse):
+    _fuse.setReadonly(False)
+    ops = _fuse.operations
+    ops.init()
+    fh, attrs = ops.create(1, b"file", stat.S_IFREG | 0o644, os.O_CREAT | os.O_WRONLY, llfuse.RequestContext())
+    assert ops.write(fh, 0, DATA) == len(DATA)
+    ops.release(fh)
+    ops.destroy()
+    return 0
+
+def corrupt(options, _fuse):
+    # Blocks of first batch and of last one
+    _fuse.setReadonly(False)
+    ops = _fuse.operations
+    ops.init()
+    tableHash = ops.getTable("hash")
+    hash_ids = sorted(tableHash.get_hash_ids(0, 1 << 62))
+    assert len(hash_ids) == BLOCKS
+    STATE["hash_ids"] = hash_ids
+    STATE["corrupted"] = set((hash_ids[0], hash_ids[-1],))
+    for hash_id in STATE["corrupted"]:
+        assert tableHash.update(hash_id, b"broken %d" % hash_id) == 1
+    tableHash.commit()
+    ops.destroy()
+    return 0
+
+def get_state(options, _fuse):
+    _fuse.setReadonly(True)
+    ops = _fuse.operations
+    ops.init()
+    STATE["checkpoint"] = ops.getTable("option").get(Verify.CHECKPOINT_OPTION)
+    STATE["found"] = set(item["hash_id"] for item in ops.getTable("block_corrupted").get_all())
+    ops.destroy()
+    return 0
+
+def check_state():
+    dedupsqlfs.app.do.print_fs_stats = get_state
+    assert run(dedupsqlfs.app.do, ["--print-stats"]) == 0
+
+BATCHES = []
+
+verifyBatch = Verify._verifyBatch
+
+def interrupted(self, items, hash_function):
+    BATCHES.append([hash_id for hash_id, type_id in items])
+    if len(BATCHES) == 2:
+        raise KeyboardInterrupt()
+    return verifyBatch(self, items, hash_function)
+
+def counted(self, items, hash_function):
+    BATCHES.append([hash_id for hash_id, type_id in items])
+    return verifyBatch(self, items, hash_function)
+
+datadir = tempfile.mkdtemp(prefix="dedupsqlfs-test-")
+try:
+    assert run(dedupsqlfs.app.mkfs, ["-b", str(BLOCK_SIZE), "--compress", "zlib"]) == 0
+
+    # Actions run inside do with opened filesystem
+    dedupsqlfs.app.do.print_fs_stats = writer
+    assert run(dedupsqlfs.app.do, ["--print-stats"]) == 0
+    assert run(dedupsqlfs.app.do, ["--verify"]) == 0
+
+    dedupsqlfs.app.do.print_fs_stats = corrupt
+    assert run(dedupsqlfs.app.do, ["--print-stats"]) == 0
+    hash_ids = STATE["hash_ids"]
+
+    # Interrupted after first batch
+    Verify._verifyBatch = interrupted
+    assert run(dedupsqlfs.app.do, ["--verify", "--data-batch", str(BATCH)]) == 1
+    assert BATCHES == [hash_ids[:BATCH], hash_ids[BATCH:BATCH * 2]], BATCHES
+    check_state()
+    assert json.loads(STATE["checkpoint"])["last"] == hash_ids[BATCH - 1], STATE["checkpoint"]
+    assert STATE["found"] == set((hash_ids[0],)), STATE["found"]
+
+    # Continued, first batch is not read again
+    del BATCHES[:]
+    Verify._verifyBatch = counted
+    assert run(dedupsqlfs.app.do, ["--verify", "--data-batch", str(BATCH)]) == 1
+    assert [hash_id for batch in BATCHES for hash_id in batch] == hash_ids[BATCH:], BATCHES
+    check_state()
+    assert not STATE["checkpoint"], STATE["checkpoint"]
+    assert STATE["found"] == STATE["corrupted"], STATE["found"]
+
+    # New pass starts from beginning
+    del BATCHES[:]
+    assert run(dedupsqlfs.app.do, ["--verify", "--data-batch", str(BATCH)]) == 1
+    assert [hash_id for batch in BATCHES for hash_id in batch] == hash_ids, BATCHES
+    check_state()
+    assert STATE["found"] == STATE["corrupted"], STATE["found"]
+
+    print("OK")
+finally:
+    Verify._verifyBatch = verifyBatch
+    shutil.rmtree(datadir, True)
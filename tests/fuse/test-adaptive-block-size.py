@@ -0,0 +1,145 @@
+#/usr/bin/env python3
+
+"""
+Sequentially written file is moved to large blocks: new blocks,
+index and block size are commited together, failed move
+keeps file in old blocks
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import stat
+
+dirname = "dedupsqlfs"
+
+# Figure out the directy which is the prefix
+# path-of-current-file/..
+curpath = os.path.abspath( sys.argv[0] )
+if os.path.islink(curpath):
+    curpath = os.readlink(curpath)
+currentdir = os.path.dirname( curpath )
+basedir = os.path.abspath( os.path.join( currentdir, "..", ".." ) )
+
+sys.path.insert( 0, basedir )
+os.chdir(basedir)
+
+import llfuse
+import dedupsqlfs.app.mkfs
+import dedupsqlfs.app.do
+
+BLOCK_SIZE = 4096
+LARGE_BLOCK_SIZE = 65536
+THRESHOLD = 32768
+STEP = 4096
+
+def content(n, size):
+    return b"".join((b"%04d%08d" % (n, i)) * (STEP // 12) + bytes(STEP % 12) for i in range(size // STEP))
+
+FILES = {
+    b"failed": content(1, 3 * LARGE_BLOCK_SIZE),
+    b"moved": content(2, 3 * LARGE_BLOCK_SIZE),
+}
+
+def run(app, args):
+    # Migrations are found by path of program
+    sys.argv = [os.path.join(basedir, "bin", app.__name__.split(".")[-1] + ".dedupsqlfs"), "--data", datadir] + args
+    return app.main()
+
+def index_rows(ops, inode):
+    return len(ops.getTable("inode_hash_block").get_by_inode_range(inode, 0, 1000))
+
+def write(ops, fh, offset, data):
+    while data:
+        n = ops.write(fh, offset, data)
+        offset += n
+        data = data[n:]
+
+def writer(options, _fuse):
+    _fuse.setReadonly(False)
+    _fuse.setOption("adaptive_block_size", LARGE_BLOCK_SIZE)
+    _fuse.setOption("adaptive_block_threshold", THRESHOLD)
+    ops = _fuse.operations
+    ops.getManager().setAttach(True)
+    ops.init()
+
+    flush = ops._DedupOperations__flush_old_cached_blocks
+    ctx = llfuse.RequestContext()
+
+    # Part of file is flushed in small blocks before move
+    data = FILES[b"failed"]
+    fh, attrs = ops.create(1, b"failed", stat.S_IFREG | 0o644, os.O_CREAT | os.O_WRONLY, ctx)
+    for offset in range(0, THRESHOLD, STEP):
+        write(ops, fh, offset, data[offset:offset + STEP])
+    ops.cached_blocks.setMaxWriteTtl(-1)
+    flush(ops.cached_blocks.expired()[1], True)
+    ops.cached_blocks.setMaxWriteTtl(10)
+    assert index_rows(ops, fh) == THRESHOLD // BLOCK_SIZE
+
+    # Block size is written last
+    tableOption = ops.getTable("inode_option")
+    set_block_size = tableOption.set_block_size
+    def broken(*args):
+        raise OSError("disk is full")
+    tableOption.set_block_size = broken
+    try:
+        write(ops, fh, THRESHOLD, data[THRESHOLD:THRESHOLD + STEP])
+        assert False, "write must fail"
+    except llfuse.FUSEError:
+        pass
+    tableOption.set_block_size = set_block_size
+
+    assert index_rows(ops, fh) == THRESHOLD // BLOCK_SIZE
+    assert fh not in tableOption.get_block_sizes()
+
+    # Not watched anymore - file stays in small blocks
+    for offset in range(THRESHOLD, len(data), STEP):
+        write(ops, fh, offset, data[offset:offset + STEP])
+    ops.release(fh)
+    failed = fh
+
+    data = FILES[b"moved"]
+    fh, attrs = ops.create(1, b"moved", stat.S_IFREG | 0o644, os.O_CREAT | os.O_WRONLY, ctx)
+    for offset in range(0, len(data), STEP):
+        write(ops, fh, offset, data[offset:offset + STEP])
+    ops.release(fh)
+    moved = fh
+
+    ops.destroy()
+
+    ops = _fuse.operations
+    sizes = ops.getTable("inode_option").get_block_sizes()
+    assert failed not in sizes, sizes
+    assert sizes.get(moved) == LARGE_BLOCK_SIZE, sizes
+    return 0
+
+def reader(options, _fuse):
+    _fuse.setReadonly(True)
+    ops = _fuse.operations
+    ops.init()
+    for name, expected in FILES.items():
+        attrs = ops.lookup(1, name)
+        fh = ops.open(attrs.st_ino, os.O_RDONLY)
+        data = b""
+        while len(data) < attrs.st_size:
+            data += ops.read(fh, len(data), attrs.st_size - len(data))
+        ops.release(fh)
+        assert data == expected, name
+    ops.destroy()
+    return 0
+
+datadir = tempfile.mkdtemp(prefix="dedupsqlfs-test-")
+try:
+    assert run(dedupsqlfs.app.mkfs, ["-b", str(BLOCK_SIZE)]) == 0
+
+    # Actions run inside do with opened filesystem
+    dedupsqlfs.app.do.print_fs_stats = writer
+    assert run(dedupsqlfs.app.do, ["--print-stats"]) == 0
+    dedupsqlfs.app.do.print_fs_stats = reader
+    assert run(dedupsqlfs.app.do, ["--print-stats"]) == 0
+    assert run(dedupsqlfs.app.do, ["--verify"]) == 0
+
+    print("OK")
+finally:
+    shutil.rmtree(datadir, True)
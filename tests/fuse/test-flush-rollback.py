@@ -0,0 +1,131 @@
+#/usr/bin/env python3
+
+"""
+Flush of cached blocks which fails in the middle of batch:
+nothing of batch is kept, with attached databases and without them,
+blocks stay in cache and are written by next flush
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import stat
+import sqlite3
+
+dirname = "dedupsqlfs"
+
+# Figure out the directy which is the prefix
+# path-of-current-file/..
+curpath = os.path.abspath( sys.argv[0] )
+if os.path.islink(curpath):
+    curpath = os.readlink(curpath)
+currentdir = os.path.dirname( curpath )
+basedir = os.path.abspath( os.path.join( currentdir, "..", ".." ) )
+
+sys.path.insert( 0, basedir )
+os.chdir(basedir)
+
+import llfuse
+import dedupsqlfs.app.mkfs
+import dedupsqlfs.app.do
+
+BLOCK_SIZE = 4096
+DATA = b"".join((b"%08d" % n) * (BLOCK_SIZE // 8) for n in range(16))
+
+def run(app, args):
+    # Migrations are found by path of program
+    sys.argv = [os.path.join(basedir, "bin", app.__name__.split(".")[-1] + ".dedupsqlfs"), "--data", datadir] + args
+    return app.main()
+
+def counts(ops, inode):
+    return ops.getTable("hash").get_count(), len(ops.getTable("inode_hash_block").get_by_inode_range(inode, 0, 1000))
+
+# Attach databases, table and method which fails
+STATE = {}
+
+def writer(options, _fuse):
+    _fuse.setReadonly(False)
+    ops = _fuse.operations
+    manager = ops.getManager()
+    manager.setAttach(STATE["attach"])
+    ops.init()
+
+    flush = ops._DedupOperations__flush_old_cached_blocks
+
+    fh, attrs = ops.create(1, b"file", stat.S_IFREG | 0o644, os.O_CREAT | os.O_WRONLY, llfuse.RequestContext())
+    offset = 0
+    while offset < len(DATA):
+        offset += ops.write(fh, offset, DATA[offset:])
+
+    assert bool(manager.getTable("hash")._schema) == STATE["attach"]
+    before = counts(ops, fh)
+
+    # Index and reference counters are written last in batch
+    table = ops.getTable(STATE["table"])
+    method = getattr(table, STATE["method"])
+    def broken(*args):
+        raise OSError("disk is full")
+    setattr(table, STATE["method"], broken)
+
+    ops.cached_blocks.setMaxWriteTtl(-1)
+    try:
+        flush(ops.cached_blocks.expired()[1], True)
+        assert False, "flush must fail"
+    except OSError:
+        pass
+    assert counts(ops, fh) == before, (counts(ops, fh), before)
+    assert ops.getTable("block").get_many("1,2,3") == {}
+    assert ops.cached_blocks.getCachedSize(True) == len(DATA)
+
+    setattr(table, STATE["method"], method)
+    flush(ops.cached_blocks.expired()[1], True)
+    ops.cached_blocks.setMaxWriteTtl(10)
+    assert counts(ops, fh)[1] == before[1] + len(DATA) // BLOCK_SIZE, counts(ops, fh)
+
+    # Online tools read databases of opened filesystem
+    conn = sqlite3.connect(manager.getTable("hash").getDbFilePath(), timeout=1)
+    assert conn.execute("SELECT COUNT(*) FROM `hash`").fetchone()[0] == counts(ops, fh)[0]
+    conn.close()
+
+    ops.release(fh)
+    ops.destroy()
+    return 0
+
+def reader(options, _fuse):
+    _fuse.setReadonly(True)
+    ops = _fuse.operations
+    ops.init()
+    attrs = ops.lookup(1, b"file")
+    fh = ops.open(attrs.st_ino, os.O_RDONLY)
+    data = b""
+    while len(data) < attrs.st_size:
+        data += ops.read(fh, len(data), attrs.st_size - len(data))
+    ops.release(fh)
+    assert data == DATA
+    ops.destroy()
+    return 0
+
+def check():
+    assert run(dedupsqlfs.app.mkfs, ["-b", str(BLOCK_SIZE)]) == 0
+
+    # Actions run inside do with opened filesystem
+    dedupsqlfs.app.do.print_fs_stats = writer
+    assert run(dedupsqlfs.app.do, ["--print-stats"]) == 0
+    dedupsqlfs.app.do.print_fs_stats = reader
+    assert run(dedupsqlfs.app.do, ["--print-stats"]) == 0
+    assert run(dedupsqlfs.app.do, ["--verify"]) == 0
+
+    # Index tables exist only for subvolumes
+    assert not os.path.exists(os.path.join(datadir, "dedupsqlfs", "inode_hash_block.sqlite3"))
+
+for attach in (True, False,):
+    for table, method in (("inode_hash_block", "insert_many",), ("hash_refcount", "add_many",),):
+        STATE.update(attach=attach, table=table, method=method)
+        datadir = tempfile.mkdtemp(prefix="dedupsqlfs-test-")
+        try:
+            check()
+        finally:
+            shutil.rmtree(datadir, True)
+
+print("OK")
@@ -0,0 +1,144 @@
+#/usr/bin/env python3
+
+"""
+Bloom filter of hashes: removed by writers which change hash table
+without it, stale filter doesn't break writes of stored blocks
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import stat
+
+dirname = "dedupsqlfs"
+
+# Figure out the directy which is the prefix
+# path-of-current-file/..
+curpath = os.path.abspath( sys.argv[0] )
+if os.path.islink(curpath):
+    curpath = os.readlink(curpath)
+currentdir = os.path.dirname( curpath )
+basedir = os.path.abspath( os.path.join( currentdir, "..", ".." ) )
+
+sys.path.insert( 0, basedir )
+os.chdir(basedir)
+
+import llfuse
+import dedupsqlfs.app.mkfs
+import dedupsqlfs.app.do
+
+BLOCK_SIZE = 4096
+BLOCKS = 8
+
+def content(n):
+    return b"".join((b"%04d%08d" % (n, i)) * (BLOCK_SIZE // 12) + bytes(BLOCK_SIZE % 12) for i in range(BLOCKS))
+
+FILES = {
+    b"a": content(1),
+    b"b": content(2),
+}
+
+def run(app, args):
+    # Migrations are found by path of program
+    sys.argv = [os.path.join(basedir, "bin", app.__name__.split(".")[-1] + ".dedupsqlfs"), "--data", datadir] + args
+    return app.main()
+
+def bloom_path():
+    return os.path.join(datadir, "dedupsqlfs", "hash.bloom")
+
+def write_file(ops, name, data):
+    fh, attrs = ops.create(1, name, stat.S_IFREG | 0o644, os.O_CREAT | os.O_WRONLY, llfuse.RequestContext())
+    offset = 0
+    while offset < len(data):
+        offset += ops.write(fh, offset, data[offset:])
+    ops.release(fh)
+    return fh
+
+def open_fs(_fuse, hash_filter):
+    _fuse.setReadonly(False)
+    _fuse.setOption("use_hash_filter", hash_filter)
+    ops = _fuse.operations
+    ops.init()
+    return ops
+
+def writer_a(options, _fuse):
+    ops = open_fs(_fuse, True)
+    write_file(ops, b"a", FILES[b"a"])
+    ops.destroy()
+    return 0
+
+def writer_b(options, _fuse):
+    # Hash table is changed without filter
+    ops = open_fs(_fuse, False)
+    ops.unlink(1, b"a")
+    write_file(ops, b"b", FILES[b"b"])
+    ops.destroy()
+    return 0
+
+def writer_c(options, _fuse):
+    # Filter doesn't know hashes of file "b"
+    ops = open_fs(_fuse, True)
+    assert ops.hash_filter.getRows() == BLOCKS
+    write_file(ops, b"c", FILES[b"b"])
+    assert ops.getTable("hash").get_count() == BLOCKS
+    ops.destroy()
+    return 0
+
+def reader(options, _fuse):
+    _fuse.setReadonly(True)
+    ops = _fuse.operations
+    ops.init()
+    for name in (b"b", b"c",):
+        attrs = ops.lookup(1, name)
+        fh = ops.open(attrs.st_ino, os.O_RDONLY)
+        data = b""
+        while len(data) < attrs.st_size:
+            data += ops.read(fh, len(data), attrs.st_size - len(data))
+        ops.release(fh)
+        assert data == FILES[b"b"], name
+    ops.destroy()
+    return 0
+
+COUNTS = []
+
+def count_hashes(options, _fuse):
+    _fuse.setReadonly(True)
+    ops = _fuse.operations
+    ops.init()
+    COUNTS.append(ops.getTable("hash").get_count())
+    ops.destroy()
+    return 0
+
+datadir = tempfile.mkdtemp(prefix="dedupsqlfs-test-")
+try:
+    assert run(dedupsqlfs.app.mkfs, ["-b", str(BLOCK_SIZE)]) == 0
+
+    # Actions run inside do with opened filesystem
+    dedupsqlfs.app.do.print_fs_stats = writer_a
+    assert run(dedupsqlfs.app.do, ["--print-stats"]) == 0
+    assert os.path.isfile(bloom_path())
+    stale = bloom_path() + ".stale"
+    shutil.copy(bloom_path(), stale)
+
+    dedupsqlfs.app.do.print_fs_stats = writer_b
+    assert run(dedupsqlfs.app.do, ["--print-stats"]) == 0
+    assert not os.path.exists(bloom_path())
+
+    # Same count of rows as in stale filter
+    assert run(dedupsqlfs.app.do, ["--defragment"]) == 0
+    dedupsqlfs.app.do.print_fs_stats = count_hashes
+    assert run(dedupsqlfs.app.do, ["--print-stats"]) == 0
+    assert COUNTS == [BLOCKS], COUNTS
+
+    shutil.copy(stale, bloom_path())
+    dedupsqlfs.app.do.print_fs_stats = writer_c
+    assert run(dedupsqlfs.app.do, ["--print-stats"]) == 0
+
+    dedupsqlfs.app.do.print_fs_stats = reader
+    assert run(dedupsqlfs.app.do, ["--print-stats"]) == 0
+    assert run(dedupsqlfs.app.do, ["--verify"]) == 0
+
+    print("OK")
+finally:
+    shutil.rmtree(datadir, True)
@@ -0,0 +1,189 @@
+#/usr/bin/env python3
+
+"""
+Multithreaded loop: other worker writes block while lock is released
+for decompression - reader gets new data, not stale one.
+Two workers decompress blocks of different files at same time.
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import stat
+import threading
+
+dirname = "dedupsqlfs"
+
+# Figure out the directy which is the prefix
+# path-of-current-file/..
+curpath = os.path.abspath( sys.argv[0] )
+if os.path.islink(curpath):
+    curpath = os.readlink(curpath)
+currentdir = os.path.dirname( curpath )
+basedir = os.path.abspath( os.path.join( currentdir, "..", ".." ) )
+
+sys.path.insert( 0, basedir )
+os.chdir(basedir)
+
+import llfuse
+import dedupsqlfs.app.mkfs
+import dedupsqlfs.app.do
+
+BLOCK_SIZE = 4096
+OLD = b"old data" * (BLOCK_SIZE // 8)
+NEW = b"new data" * (BLOCK_SIZE // 8)
+OTHER = b"2nd file" * (BLOCK_SIZE // 8)
+
+def run(app, args):
+    # Migrations are found by path of program
+    sys.argv = [os.path.join(basedir, "bin", app.__name__.split(".")[-1] + ".dedupsqlfs"), "--data", datadir] + args
+    return app.main()
+
+def writer(options, _fuse):
+    _fuse.setReadonly(False)
+    ops = _fuse.operations
+    ops.init()
+    fh, attrs = ops.create(1, b"file", stat.S_IFREG | 0o644, os.O_CREAT | os.O_WRONLY, llfuse.RequestContext())
+    assert ops.write(fh, 0, OLD) == len(OLD)
+    ops.release(fh)
+    fh, attrs = ops.create(1, b"other", stat.S_IFREG | 0o644, os.O_CREAT | os.O_WRONLY, llfuse.RequestContext())
+    assert ops.write(fh, 0, OTHER) == len(OTHER)
+    ops.release(fh)
+    ops.destroy()
+    return 0
+
+class OtherWorker(object):
+    """
+    Lock released - other worker writes and flushes block,
+    then it is evicted from cache
+    """
+
+    def __init__(self, ops, fh):
+        self.ops = ops
+        self.fh = fh
+        self.done = False
+
+    def __enter__(self):
+        if self.done:
+            return self
+        self.done = True
+        ops = self.ops
+        assert ops.write(self.fh, 0, NEW) == len(NEW)
+        ops.cached_blocks.setMaxWriteTtl(-1)
+        ops._DedupOperations__flush_old_cached_blocks(ops.cached_blocks.expired()[1], True)
+        ops.cached_blocks.setMaxWriteTtl(10)
+        ops.cached_blocks.drop(self.fh)
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+def reader(options, _fuse):
+    _fuse.setReadonly(False)
+    ops = _fuse.operations
+    ops.init()
+    ops.setMultiThreaded(True)
+
+    attrs = ops.lookup(1, b"file")
+    fh = ops.open(attrs.st_ino, os.O_RDWR)
+
+    lock_released = llfuse.lock_released
+    llfuse.lock_released = OtherWorker(ops, fh)
+    try:
+        data = ops.read(fh, 0, BLOCK_SIZE)
+    finally:
+        llfuse.lock_released = lock_released
+    assert llfuse.lock_released is lock_released
+    assert data == NEW, data[:16]
+
+    ops.release(fh)
+    ops.destroy()
+    return 0
+
+class FuseLock(object):
+    """
+    Global lock of workers, as llfuse has
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        self.lock.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.lock.release()
+        return False
+
+class FuseLockReleased(object):
+
+    def __init__(self, lock):
+        self.lock = lock
+
+    def __enter__(self):
+        self.lock.lock.release()
+        return self
+
+    def __exit__(self, *args):
+        self.lock.lock.acquire()
+        return False
+
+def parallel_reader(options, _fuse):
+    _fuse.setReadonly(True)
+    ops = _fuse.operations
+    ops.init()
+    ops.setMultiThreaded(True)
+
+    fuse_lock = FuseLock()
+    # Both workers must be in decompression at once to pass
+    barrier = threading.Barrier(2, timeout=10)
+    decompressData = ops.application.decompressData
+
+    def decompress(*args):
+        barrier.wait()
+        return decompressData(*args)
+
+    results = {}
+
+    def worker(name):
+        with fuse_lock:
+            attrs = ops.lookup(1, name)
+            fh = ops.open(attrs.st_ino, os.O_RDONLY)
+            results[name] = ops.read(fh, 0, BLOCK_SIZE)
+            ops.release(fh)
+
+    lock_released = llfuse.lock_released
+    llfuse.lock_released = FuseLockReleased(fuse_lock)
+    ops.application.decompressData = decompress
+    try:
+        threads = [threading.Thread(target=worker, args=(name,)) for name in (b"file", b"other",)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        llfuse.lock_released = lock_released
+        ops.application.decompressData = decompressData
+    assert not barrier.broken
+    assert results == {b"file": NEW, b"other": OTHER}, dict((k, v[:16],) for k, v in results.items())
+
+    ops.destroy()
+    return 0
+
+datadir = tempfile.mkdtemp(prefix="dedupsqlfs-test-")
+try:
+    assert run(dedupsqlfs.app.mkfs, ["-b", str(BLOCK_SIZE), "--compress", "zlib"]) == 0
+
+    # Actions run inside do with opened filesystem
+    dedupsqlfs.app.do.print_fs_stats = writer
+    assert run(dedupsqlfs.app.do, ["--print-stats"]) == 0
+    dedupsqlfs.app.do.print_fs_stats = reader
+    assert run(dedupsqlfs.app.do, ["--print-stats"]) == 0
+    dedupsqlfs.app.do.print_fs_stats = parallel_reader
+    assert run(dedupsqlfs.app.do, ["--print-stats"]) == 0
+
+    print("OK")
+finally:
+    shutil.rmtree(datadir, True)
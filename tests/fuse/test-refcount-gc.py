@@ -0,0 +1,150 @@
+#/usr/bin/env python3
+
+"""
+Reference counters of hashes: garbage collection removes only
+blocks without references, lost counter updates are fixed
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import stat
+
+dirname = "dedupsqlfs"
+
+# Figure out the directy which is the prefix
+# path-of-current-file/..
+curpath = os.path.abspath( sys.argv[0] )
+if os.path.islink(curpath):
+    curpath = os.readlink(curpath)
+currentdir = os.path.dirname( curpath )
+basedir = os.path.abspath( os.path.join( currentdir, "..", ".." ) )
+
+sys.path.insert( 0, basedir )
+os.chdir(basedir)
+
+import llfuse
+import dedupsqlfs.app.mkfs
+import dedupsqlfs.app.do
+
+BLOCK_SIZE = 4096
+
+def block(n):
+    return (b"%08d" % n) * (BLOCK_SIZE // 8)
+
+# Block 0 shared, block 1 repeated inside of file
+FILES = {
+    b"a": block(0) + block(1) + block(1) + block(2),
+    b"b": block(0) + block(3),
+}
+
+def run(app, args):
+    # Migrations are found by path of program
+    sys.argv = [os.path.join(basedir, "bin", app.__name__.split(".")[-1] + ".dedupsqlfs"), "--data", datadir] + args
+    return app.main()
+
+def open_fs(_fuse, readonly):
+    _fuse.setReadonly(readonly)
+    # Garbage is collected only by --defragment
+    _fuse.setOption("gc_enabled", False)
+    _fuse.setOption("gc_umount_enabled", False)
+    ops = _fuse.operations
+    ops.init()
+    return ops
+
+def write_file(ops, name, data):
+    fh, attrs = ops.create(1, name, stat.S_IFREG | 0o644, os.O_CREAT | os.O_WRONLY, llfuse.RequestContext())
+    assert ops.write(fh, 0, data) == len(data)
+    ops.release(fh)
+
+def read_file(ops, name):
+    attrs = ops.lookup(1, name)
+    fh = ops.open(attrs.st_ino, os.O_RDONLY)
+    data = ops.read(fh, 0, attrs.st_size)
+    ops.release(fh)
+    return data
+
+STATE = {}
+
+def hash_ids(ops):
+    return ops.getTable("hash").get_hash_ids(0, 1 << 62)
+
+def check_refs(ops):
+    """
+    Counters match count of index entries
+    """
+    tableRefs = ops.getTable("hash_refcount")
+    counts = dict(ops.getTable("inode_hash_block").get_hash_id_counts())
+    for hash_id in hash_ids(ops):
+        assert tableRefs.get(hash_id) == counts.get(hash_id, 0), (hash_id, tableRefs.get(hash_id), counts.get(hash_id))
+    return counts
+
+def writer(options, _fuse):
+    ops = open_fs(_fuse, False)
+    for name, data in sorted(FILES.items()):
+        write_file(ops, name, data)
+    ops.destroy()
+    return 0
+
+def remover(options, _fuse):
+    ops = open_fs(_fuse, False)
+    counts = check_refs(ops)
+    assert sorted(counts.values()) == [1, 1, 2, 2]
+    ops.unlink(1, b"a")
+    ops.destroy()
+    return 0
+
+def check_unlinked(options, _fuse):
+    ops = open_fs(_fuse, True)
+    check_refs(ops)
+    # Not collected yet
+    assert len(hash_ids(ops)) == 4
+    attrs = ops.lookup(1, b"b")
+    STATE["used"] = set(ops.getTable("inode_hash_block").get_hash_ids_by_inodes((attrs.st_ino,)))
+    assert len(STATE["used"]) == 2
+    ops.destroy()
+    return 0
+
+def check_collected(options, _fuse):
+    ops = open_fs(_fuse, False)
+    assert hash_ids(ops) == STATE["used"]
+    check_refs(ops)
+    assert read_file(ops, b"b") == FILES[b"b"]
+
+    # Counter update lost on crash
+    for hash_id in STATE["used"]:
+        ops.getTable("hash_refcount").set_many(((hash_id, 0,),))
+    ops.getTable("hash_refcount").commit()
+    ops.destroy()
+    return 0
+
+def check_fixed(options, _fuse):
+    ops = open_fs(_fuse, True)
+    assert hash_ids(ops) == STATE["used"]
+    check_refs(ops)
+    assert read_file(ops, b"b") == FILES[b"b"]
+    ops.destroy()
+    return 0
+
+datadir = tempfile.mkdtemp(prefix="dedupsqlfs-test-")
+try:
+    assert run(dedupsqlfs.app.mkfs, ["-b", str(BLOCK_SIZE)]) == 0
+
+    # Actions run inside do with opened filesystem
+    for action in (writer, remover, check_unlinked,):
+        dedupsqlfs.app.do.print_fs_stats = action
+        assert run(dedupsqlfs.app.do, ["--print-stats"]) == 0
+
+    assert run(dedupsqlfs.app.do, ["--defragment"]) == 0
+    dedupsqlfs.app.do.print_fs_stats = check_collected
+    assert run(dedupsqlfs.app.do, ["--print-stats"]) == 0
+
+    assert run(dedupsqlfs.app.do, ["--defragment"]) == 0
+    dedupsqlfs.app.do.print_fs_stats = check_fixed
+    assert run(dedupsqlfs.app.do, ["--print-stats"]) == 0
+    assert run(dedupsqlfs.app.do, ["--verify"]) == 0
+
+    print("OK")
+finally:
+    shutil.rmtree(datadir, True)
@@ -0,0 +1,191 @@
+#/usr/bin/env python3
+
+"""
+Warm metadata cache: entries read in one mount are found on next mount
+without database, unlinked and renamed entries are forgotten,
+count of entries and file size are checked
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import stat
+import errno
+
+dirname = "dedupsqlfs"
+
+# Figure out the directy which is the prefix
+# path-of-current-file/..
+curpath = os.path.abspath( sys.argv[0] )
+if os.path.islink(curpath):
+    curpath = os.readlink(curpath)
+currentdir = os.path.dirname( curpath )
+basedir = os.path.abspath( os.path.join( currentdir, "..", ".." ) )
+
+sys.path.insert( 0, basedir )
+os.chdir(basedir)
+
+import llfuse
+import dedupsqlfs.app.mkfs
+import dedupsqlfs.app.do
+from dedupsqlfs.lib.cache.warm import WarmMetaCache
+from dedupsqlfs.db.sqlite.table.name import TableName
+from dedupsqlfs.db.sqlite.table.tree import TableTree
+from dedupsqlfs.db.sqlite.table.inode import TableInode
+
+FILES = {
+    b"a": b"a" * 100,
+    b"b": b"b" * 200,
+    b"c": b"c" * 300,
+}
+
+def run(app, args):
+    # Migrations are found by path of program
+    sys.argv = [os.path.join(basedir, "bin", app.__name__.split(".")[-1] + ".dedupsqlfs"), "--data", datadir] + args
+    return app.main()
+
+def open_fs(_fuse):
+    # Cache is used only when filesystem is mounted
+    _fuse.mountpoint = datadir
+    _fuse.setOption("use_cache_flusher", False)
+    _fuse.setOption("warm_meta_cache", True)
+    _fuse.setOption("gc_enabled", False)
+    _fuse.setOption("gc_umount_enabled", False)
+    ops = _fuse.operations
+    ops.init()
+    return ops
+
+STATE = {}
+
+# Database reads of metadata
+DB_READS = []
+
+def count_reads(cls, method):
+    orig = getattr(cls, method)
+    def wrapper(self, *args, **kw):
+        DB_READS.append(method)
+        return orig(self, *args, **kw)
+    setattr(cls, method, wrapper)
+    return orig
+
+def writer(options, _fuse):
+    ops = open_fs(_fuse)
+    for name, data in sorted(FILES.items()):
+        fh, attrs = ops.create(1, name, stat.S_IFREG | 0o644, os.O_CREAT | os.O_WRONLY, llfuse.RequestContext())
+        assert ops.write(fh, 0, data) == len(data)
+        ops.release(fh)
+    ops.destroy()
+    return 0
+
+def reader(options, _fuse):
+    ops = open_fs(_fuse)
+    for name, data in sorted(FILES.items()):
+        attrs = ops.lookup(1, name)
+        assert attrs.st_size == len(data)
+        STATE[name] = (ops.getTable("name").find(name), attrs.st_ino,)
+    assert len(ops.warm_meta_cache) >= 3 * len(FILES)
+    ops.destroy()
+    return 0
+
+def changer(options, _fuse):
+    ops = open_fs(_fuse)
+    assert len(ops.warm_meta_cache) >= 3 * len(FILES)
+
+    # Not in memory after remount, found in mapped file
+    del DB_READS[:]
+    for name, data in sorted(FILES.items()):
+        attrs = ops.lookup(1, name)
+        assert attrs.st_size == len(data) and attrs.st_ino == STATE[name][1]
+    assert not DB_READS, DB_READS
+
+    ops.unlink(1, b"a")
+    ops.rename(1, b"b", 1, b"d")
+    cache = ops.warm_meta_cache
+    assert cache.getNode(1, STATE[b"a"][0]) is None
+    assert cache.getNode(1, STATE[b"b"][0]) is None
+    assert cache.getNode(1, STATE[b"c"][0])["inode_id"] == STATE[b"c"][1]
+    ops.destroy()
+    return 0
+
+def checker(options, _fuse):
+    ops = open_fs(_fuse)
+    cache = ops.warm_meta_cache
+    # Changed entries are not written back
+    assert cache.getNode(1, STATE[b"a"][0]) is None
+    assert cache.getNode(1, STATE[b"b"][0]) is None
+    assert cache.getInode(STATE[b"a"][1]) is None
+    assert cache.getInode(STATE[b"c"][1])["size"] == len(FILES[b"c"])
+
+    for name in (b"a", b"b",):
+        try:
+            ops.lookup(1, name)
+            assert False, name
+        except llfuse.FUSEError as e:
+            assert e.errno == errno.ENOENT
+    assert ops.lookup(1, b"d").st_ino == STATE[b"b"][1]
+    assert ops.lookup(1, b"c").st_ino == STATE[b"c"][1]
+    ops.destroy()
+    return 0
+
+def check_file(path):
+    cache = WarmMetaCache(max_entries=2)
+    for n in range(3):
+        cache.addName(b"n%d" % n, n + 1)
+        cache.addNode(1, {"id": n + 1, "inode_id": n + 2, "name_id": n + 1})
+        cache.addInode(dict((f, n + 2,) for f in ("id", "nlinks", "mode", "uid", "gid", "rdev", "size", "atime", "mtime", "ctime",)))
+    # Not more than limit
+    assert len(cache) == 6
+    cache.save(path, 100)
+
+    # Other state of subvolume
+    cache = WarmMetaCache()
+    assert not cache.load(path, 101)
+    assert not os.path.exists(path)
+
+    cache = WarmMetaCache(max_entries=2)
+    cache.addName(b"n0", 1)
+    cache.save(path, 100)
+    with open(path, "ab") as f:
+        f.write(b"\0")
+    assert not WarmMetaCache().load(path, 100)
+
+    cache = WarmMetaCache()
+    cache.addName(b"n0", 1)
+    cache.addName(b"n1", 2)
+    cache.save(path, 100)
+    cache = WarmMetaCache()
+    assert cache.load(path, 100)
+    assert not os.path.exists(path)
+    assert cache.getNameId(b"n1") == 2
+
+    # Removed names: ids may be given to other names
+    cache.forgetNames()
+    assert cache.getNameId(b"n1") is None
+    cache.addName(b"n2", 2)
+    cache.save(path, 101)
+    cache = WarmMetaCache()
+    assert cache.load(path, 101)
+    assert cache.getNameId(b"n1") is None and cache.getNameId(b"n2") == 2
+    cache.close()
+    return
+
+datadir = tempfile.mkdtemp(prefix="dedupsqlfs-test-")
+origs = [(cls, method, count_reads(cls, method),) for cls, method in (
+    (TableName, "find"), (TableTree, "find_by_parent_name"), (TableInode, "get"),
+)]
+try:
+    check_file(os.path.join(datadir, "metacache.bin"))
+
+    assert run(dedupsqlfs.app.mkfs, []) == 0
+
+    # Actions run inside do with opened filesystem
+    for action in (writer, reader, changer, checker,):
+        dedupsqlfs.app.do.print_fs_stats = action
+        assert run(dedupsqlfs.app.do, ["--print-stats"]) == 0
+
+    print("OK")
+finally:
+    for cls, method, orig in origs:
+        setattr(cls, method, orig)
+    shutil.rmtree(datadir, True)